@@ -2,7 +2,6 @@ from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import FileResponse
 from starlette.middleware.sessions import SessionMiddleware
 from pathlib import Path
 import os
@@ -10,15 +9,15 @@ import os
 from .db import init_db
 from .db import engine as _db_engine
 from .services.ai import AIClient
-from .routers import dashboard, importer, clients, items, orders, payments, reconcile, auth, excel_tracker
-from .routers import reports
+from .services.offload import get_watchdog as _get_watchdog
+from .services import query_profile as _qp
+from .routers import dashboard, clients, items, orders, payments, auth, excel_tracker
 from .routers import inventory, mappings, products, size_charts, magaza_satis, settings_finance
 from .routers import product_qa
 from .routers import instagram
 from .routers import whatsapp
 from .routers import legal
 from .routers import ig
-from .routers import ig_ai
 from .routers import ads
 from .routers import stories
 from .routers import posts
@@ -27,13 +26,12 @@ from .routers import costs
 from .routers import suppliers
 from .routers import accounts
 from .routers import income
-from .routers import ai_orders
-from .routers import soap_test
 from collections import deque
 import time as _time
 from .routers import admin
 from . import i18n as _i18n
 from .routers import i18n as i18n_router
+from .utils.lazy import include_lazy_router
 
 
 def create_app() -> FastAPI:
@@ -220,6 +218,17 @@ def create_app() -> FastAPI:
 		except Exception:
 			app.state.slowlog = deque(maxlen=500)
 
+	@app.on_event("startup")
+	async def _startup_offload() -> None:
+		# Size the sync-route threadpool and start the event-loop stall watchdog
+		try:
+			from .services.offload import configure_threadpool, install_loop_watchdog
+			configure_threadpool()
+			buf = getattr(app.state, "slowlog", None)
+			install_loop_watchdog(sink=(buf.append if buf is not None else None))
+		except Exception:
+			pass
+
 	# Language resolution middleware
 	@app.middleware("http")
 	async def _lang_mw(request: Request, call_next):
@@ -234,26 +243,71 @@ def create_app() -> FastAPI:
 			request.state.lang = "tr"
 		return await call_next(request)
 
+	_http_metrics = _os.getenv("METRICS_HTTP", "1") not in ("0", "false", "False")
+	_HTTP_METRICS_SKIP = ("/static", "/health", "/noc/metrics", "/ws")
+
+	# SQL statement count / DB time per request (see services.query_profile)
+	_query_profile = _qp.enabled()
+	if _query_profile:
+		_qp.install(_db_engine)
+	_server_timing = _os.getenv("SERVER_TIMING", "0") in ("1", "true", "True")
+
 	# Lightweight timing middleware for slow-request diagnostics
 	@app.middleware("http")
 	async def _timing_mw(request: Request, call_next):
 		start = _time.perf_counter()
-		response = await call_next(request)
+		wd = _get_watchdog()
+		if wd is not None:
+			wd.inflight[id(request)] = (request.method, str(request.url.path), _time.monotonic())
+		qstats = None
+		try:
+			if _query_profile:
+				with _qp.profile(str(request.url.path)) as qstats:
+					response = await call_next(request)
+			else:
+				response = await call_next(request)
+		finally:
+			if wd is not None:
+				wd.inflight.pop(id(request), None)
 		dt_ms = int(((_time.perf_counter() - start) * 1000.0))
+		path = str(request.url.path)
+		route = getattr(request.scope.get("route"), "path", None) or path
+		n_plus_one: list = []
+		if qstats is not None:
+			try:
+				_qp.record_route(f"{request.method} {route}", qstats, dt_ms)
+				n_plus_one = qstats.n_plus_one()
+				if _server_timing:
+					k, v = _qp.server_timing(qstats)
+					response.headers[k] = v
+			except Exception:
+				pass
+		if _http_metrics and not path.startswith(_HTTP_METRICS_SKIP):
+			# latency histogram for NOC / Prometheus; the Redis write runs off the event loop
+			try:
+				import asyncio as _asyncio
+				from .services.monitoring import safe_observe as _observe
+
+				_asyncio.get_running_loop().run_in_executor(None, _observe, "http_request_ms", dt_ms)
+			except Exception:
+				pass
 		try:
 			import os as _os
 			thr = int(_os.getenv("APP_SLOW_MS", "800"))
 		except Exception:
 			thr = 800
-		if dt_ms >= thr:
+		if dt_ms >= thr or n_plus_one:
 			try:
 				entry = {
 					"ts": int(_time.time()),
 					"ms": dt_ms,
 					"method": request.method,
 					"path": str(request.url.path),
+					"route": route,
 					"status": getattr(response, "status_code", None),
 				}
+				if qstats is not None:
+					entry["db"] = qstats.summary()
 				buf = getattr(request.app.state, "slowlog", None)
 				if buf is not None:
 					buf.append(entry)
@@ -265,8 +319,9 @@ def create_app() -> FastAPI:
 	app.include_router(dashboard.router)
 	app.include_router(auth.router)
 	app.include_router(admin.router)
-	app.include_router(importer.router, prefix="/import")
-	app.include_router(reconcile.router, prefix="/reconcile")
+	# Rarely used / heavy routers are imported on the first request under their prefix
+	include_lazy_router(app, "app.routers.importer", ["/import"], prefix="/import")
+	include_lazy_router(app, "app.routers.reconcile", ["/reconcile"], prefix="/reconcile")
 	app.include_router(excel_tracker.router)
 	app.include_router(clients.router, prefix="/clients", tags=["clients"]) 
 	app.include_router(items.router, prefix="/items", tags=["items"]) 
@@ -281,7 +336,7 @@ def create_app() -> FastAPI:
 	app.include_router(settings_finance.router)
 	# Route handler for product images
 	@app.get("/products/{folder}/{filename}")
-	async def serve_product_image(folder: str, filename: str):
+	def serve_product_image(request: Request, folder: str, filename: str):
 		"""Serve product images from static/products/{folder}/{filename}"""
 		# Only serve image files (prevents clashes with /products/{id}/...)
 		image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg'}
@@ -294,25 +349,29 @@ def create_app() -> FastAPI:
 		if not file_path.exists() or not file_path.is_file():
 			raise HTTPException(status_code=404, detail="Image not found")
 		
-		return FileResponse(file_path)
+		# Images may be replaced in place under the same name, so revalidate via ETag (size+mtime)
+		from .services.media_serving import serve_file
+		import mimetypes as _mt
+		media_type = _mt.guess_type(filename)[0] or "application/octet-stream"
+		return serve_file(request, file_path, media_type, cache_control="public, max-age=86400")
 
 	app.include_router(product_qa.router)
 	app.include_router(instagram.router)
 	app.include_router(whatsapp.router)
 	app.include_router(legal.router)
 	app.include_router(ig.router)
-	app.include_router(ig_ai.router)
+	include_lazy_router(app, "app.routers.ig_ai", ["/ig/ai"])
 	app.include_router(ads.router)
 	app.include_router(stories.router)
 	app.include_router(posts.router)
-	app.include_router(reports.router, prefix="/reports", tags=["reports"]) 
+	include_lazy_router(app, "app.routers.reports", ["/reports"], prefix="/reports", tags=["reports"])
 	app.include_router(noc.router)
 	app.include_router(costs.router, prefix="/costs", tags=["costs"])
 	app.include_router(suppliers.router, prefix="/suppliers", tags=["suppliers"])
 	app.include_router(accounts.router, prefix="/accounts", tags=["accounts"])
 	app.include_router(income.router, prefix="/income", tags=["income"])
-	app.include_router(ai_orders.router)
-	app.include_router(soap_test.router)
+	include_lazy_router(app, "app.routers.ai_orders", ["/ai/orders"])
+	include_lazy_router(app, "app.routers.soap_test", ["/soap-test"])
 	# i18n endpoints
 	app.include_router(i18n_router.router)
 
@@ -321,16 +380,28 @@ def create_app() -> FastAPI:
 	diag = _AR(prefix="/admin", tags=["admin"])
 
 	@diag.get("/slowlog")
-	def _slowlog_list(limit: int = 100):
+	def _slowlog_list(limit: int = 100, sort: str = "db_ms", n_plus_one: int = 0):
 		buf = getattr(app.state, "slowlog", None) or []
-		rows = list(buf)[-int(max(1, min(limit, 1000))):]
-		return {"slow": rows}
+		rows = list(buf)
+		if n_plus_one:
+			rows = [r for r in rows if (r.get("db") or {}).get("n_plus_one")]
+		rows = rows[-int(max(1, min(limit, 1000))):]
+		out = {"slow": rows, "routes": _qp.top_routes(sort=sort, limit=limit), "n1_threshold": _qp.n1_threshold()}
+		# worker jobs report through Redis (other processes)
+		try:
+			out["jobs"] = _qp.recent_jobs(limit=min(limit, 200))
+			out["job_kinds"] = _qp.job_totals()
+		except Exception:
+			out["jobs"] = []
+			out["job_kinds"] = []
+		return out
 
 	@diag.post("/slowlog/clear")
 	def _slowlog_clear():
 		buf = getattr(app.state, "slowlog", None)
 		if hasattr(buf, "clear"):
 			buf.clear()
+		_qp.reset_routes()
 		return {"status": "ok"}
 
 	app.include_router(diag)
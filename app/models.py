@@ -3,7 +3,7 @@ from typing import Optional
 
 from pydantic import ConfigDict
 from sqlmodel import Field, SQLModel
-from sqlalchemy import UniqueConstraint, Text, Column, BigInteger, String
+from sqlalchemy import UniqueConstraint, Text, Column, BigInteger, String, Float
 
 
 class Client(SQLModel, table=True):
@@ -311,6 +311,37 @@ class ProductUpsell(SQLModel, table=True):
 	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
 
 
+class ProductCopurchase(SQLModel, table=True):
+	"""
+	Co-purchase matrix maintained by services.copurchase.
+	Stored symmetrically (a,b) and (b,a); the diagonal (a,a) holds the number of orders containing a.
+	"""
+	__tablename__ = "product_copurchase"
+	__table_args__ = (UniqueConstraint("product_id", "other_product_id", name="uq_product_copurchase_pair"),)
+
+	id: Optional[int] = Field(default=None, primary_key=True)
+	product_id: int = Field(index=True)
+	other_product_id: int = Field(index=True)
+	order_count: int = Field(default=0, description="Orders containing both products")
+	weighted_score: float = Field(
+		default=0.0,
+		sa_column=Column(Float(precision=53), nullable=False, default=0.0),
+		description="Recency-weighted order count, scaled to the score epoch (see services.copurchase)",
+	)
+	last_order_date: Optional[dt.date] = Field(default=None)
+	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
+class ProductCopurchaseOrder(SQLModel, table=True):
+	"""Product set of each order as last applied to product_copurchase (makes refreshes idempotent)."""
+	__tablename__ = "product_copurchase_order"
+
+	order_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+	product_ids: str = Field(default="", sa_column=Column(Text, nullable=False), description="Sorted comma-separated product ids")
+	order_date: Optional[dt.date] = Field(default=None)
+	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
 class ProductCategory(SQLModel, table=True):
 	"""Category for merchandising/storefront; can be synced from himan.com.tr."""
 	__tablename__ = "product_categories"
@@ -542,6 +573,23 @@ class Attachment(SQLModel, table=True):
     fetched_at: Optional[dt.datetime] = None
     fetch_status: Optional[str] = Field(default=None, index=True)
     fetch_error: Optional[str] = None
+    # content-addressed storage (media_blobs.id); storage_path/thumb_path point at the blob files
+    blob_id: Optional[int] = Field(default=None, index=True)
+
+
+class MediaBlob(SQLModel, table=True):
+    """One stored media file per distinct SHA-256; attachments reference it via blob_id."""
+
+    __tablename__ = "media_blobs"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    sha256: str = Field(index=True, unique=True, max_length=64)
+    size_bytes: int = 0
+    mime: Optional[str] = None
+    storage_path: str = Field(sa_column=Column(Text))
+    thumb_path: Optional[str] = Field(default=None, sa_column=Column(Text))
+    ref_count: int = Field(default=0, index=True)
+    created_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+    last_ref_at: Optional[dt.datetime] = None
 
 
 class Conversation(SQLModel, table=True):
@@ -712,6 +760,7 @@ class AiShadowState(SQLModel, table=True):
 	ai_images_sent: bool = Field(default=False, description="Whether AI already scheduled product images for this conversation")
 	state_json: Optional[str] = Field(default=None, sa_column=Column(Text))
 	first_reply_notified_at: Optional[dt.datetime] = Field(default=None, description="When admin was notified about first customer reply after AI intro message")
+	trace_ctx: Optional[str] = Field(default=None, max_length=128, description="Pipeline trace context of the latest inbound (services.tracing)")
 	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow, index=True)
 
 
@@ -771,6 +820,21 @@ class AiOrderCandidate(SQLModel, table=True):
 	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow, index=True)
 
 
+class ItemStock(SQLModel, table=True):
+	"""
+	Materialized per-item stock counters, maintained in the same transaction as StockMovement
+	writes (services.item_stock). Rebuild/check: scripts/rebuild_item_stock.py
+	"""
+	__tablename__ = "item_stock"
+
+	item_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+	on_hand: int = Field(default=0, description="sum(in) - sum(out)")
+	reserved: int = Field(default=0, description="Reserved quantity (no reservation flow yet; kept at 0)")
+	sold_all_time: int = Field(default=0, description="Net quantity moved out for orders (out - restored in, related_order_id set)")
+	last_movement_at: Optional[dt.datetime] = Field(default=None)
+	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
 class SystemSetting(SQLModel, table=True):
 	__tablename__ = "system_settings"
 	key: str = Field(primary_key=True, description="Setting key")
@@ -895,6 +959,29 @@ class Income(SQLModel, table=True):
 	deleted_at: Optional[dt.datetime] = Field(default=None, index=True, description="Soft delete timestamp; null = active")
 
 
+class AccountBalance(SQLModel, table=True):
+	"""
+	Running income/expense totals per account, maintained in the same transaction as Income/Cost
+	writes (services.account_ledger). Rebuild/check: scripts/rebuild_account_ledger.py
+	"""
+	__tablename__ = "account_balance"
+
+	account_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+	income_total: float = Field(default=0.0, sa_column=Column(Float(precision=53), nullable=False, default=0.0))
+	expense_total: float = Field(default=0.0, sa_column=Column(Float(precision=53), nullable=False, default=0.0))
+	updated_at: dt.datetime = Field(default_factory=dt.datetime.utcnow)
+
+
+class AccountBalanceDaily(SQLModel, table=True):
+	"""Per-account, per-day income/expense deltas (entry date, or created_at when undated)."""
+	__tablename__ = "account_balance_daily"
+
+	account_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+	day: dt.date = Field(primary_key=True)
+	income: float = Field(default=0.0, sa_column=Column(Float(precision=53), nullable=False, default=0.0))
+	expense: float = Field(default=0.0, sa_column=Column(Float(precision=53), nullable=False, default=0.0))
+
+
 class OrderPayment(SQLModel, table=True):
 	"""Links orders to income entries when payments are collected."""
 	id: Optional[int] = Field(default=None, primary_key=True)
@@ -8,7 +8,7 @@ from sqlmodel import select
 
 from ..db import get_session
 from ..models import Account, Income, Cost, CostType, Supplier
-from ..services.finance import calculate_account_balance, get_account_balances
+from ..services.finance import calculate_account_balance, get_account_balances, opening_balance
 
 router = APIRouter()
 
@@ -197,8 +197,8 @@ def account_transactions(request: Request, account_id: int, start: Optional[str]
 		# Sort by date descending
 		transactions.sort(key=lambda x: x["date"] or dt.date.min, reverse=True)
 		
-		# Calculate running balance
-		balance = float(account.initial_balance or 0.0)
+		# Calculate running balance (a date-filtered view starts from the balance carried into it)
+		balance = opening_balance(session, account, start_date) if start_date else float(account.initial_balance or 0.0)
 		for txn in reversed(transactions):  # Process oldest first
 			balance += txn["amount"]
 			txn["running_balance"] = balance
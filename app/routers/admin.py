@@ -10,6 +10,16 @@ from sqlmodel import select
 from ..db import get_session
 from ..services.queue import _get_redis
 from ..services.queue import enqueue
+from ..services.ai import get_ai_client_pool_stats
+from ..services.catalog_snapshot import get_catalog_stats
+from ..services.webhook_buffer import get_buffer_stats
+from ..services.offload import get_offload_stats
+from ..services.graph_client import get_graph_stats
+from ..services.user_enrich_batch import get_batch_stats as get_enrich_batch_stats
+from ..services.media_serving import attachment_cache
+from ..services.copurchase import mark_orders_dirty
+from ..services.payload_archive import load_raw
+from ..services.event_bus import get_event_bus_stats
 from ..models import Message, Client, Order, ShippingCompanyRate
 
 
@@ -159,6 +169,14 @@ def health() -> Dict[str, Any]:
 		"redis": _check_redis(),
 		"media_root_exists": media_root.exists(),
 		"thumbs_root_exists": thumbs_root.exists(),
+		"ai_client_pool": get_ai_client_pool_stats(),
+		"ai_catalog": get_catalog_stats(),
+		"webhook_buffer": get_buffer_stats(),
+		"offload": get_offload_stats(),
+		"media_path_cache": attachment_cache.stats(),
+		"graph": get_graph_stats(),
+		"enrich_batch": get_enrich_batch_stats(),
+		"event_bus": get_event_bus_stats(),
 	}
 
 
@@ -173,6 +191,57 @@ def status_page(request: Request):
 	return templates.TemplateResponse("admin_status.html", {"request": request, **ctx})
 
 
+@router.get("/traces")
+def traces_page(
+	request: Request,
+	trace: Optional[str] = None,
+	conversation: Optional[int] = None,
+	window: int = 60,
+):
+	"""DM -> AI reply pipeline traces: p50/p95 per stage, recent traces and one waterfall."""
+	uid = request.session.get("uid")
+	templates = request.app.state.templates
+	if not uid:
+		return templates.TemplateResponse("login.html", {"request": request, "error": None})
+	from ..services import tracing
+
+	window_minutes = max(5, min(int(window or 60), 30 * 24 * 60))
+	try:
+		stages = tracing.stage_latency(window_minutes)
+	except Exception:
+		stages = {}
+	try:
+		recent = tracing.list_traces(conversation, limit=50)
+	except Exception:
+		recent = []
+	if not trace and recent:
+		trace = recent[0]["trace_id"]
+	try:
+		view = tracing.waterfall(tracing.get_trace(trace)) if trace else tracing.waterfall([])
+	except Exception:
+		view = tracing.waterfall([])
+	return templates.TemplateResponse(
+		"admin_traces.html",
+		{
+			"request": request,
+			"stages": stages,
+			"recent": recent,
+			"trace_id": trace,
+			"conversation": conversation,
+			"window": window_minutes,
+			"view": view,
+			"sample_rate": os.getenv("TRACE_SAMPLE_RATE", str(tracing.DEFAULT_SAMPLE_RATE)),
+		},
+	)
+
+
+@router.get("/traces/{trace_id}.json")
+def trace_json(trace_id: str) -> Dict[str, Any]:
+	from ..services import tracing
+
+	return {"trace_id": trace_id, "spans": tracing.get_trace(trace_id)}
+
+
 @router.get("/data-integrity")
 def data_integrity_page(
 	request: Request,
@@ -416,6 +485,7 @@ def _merge_order_into(session, from_order_id: int, to_order_id: int, delete_merg
 	session.exec(text("UPDATE importrow SET matched_order_id=:to_id WHERE matched_order_id=:from_id").bindparams(to_id=to_order_id, from_id=from_order_id))
 	session.exec(text("UPDATE ordereditlog SET order_id=:to_id WHERE order_id=:from_id").bindparams(to_id=to_order_id, from_id=from_order_id))
 	session.exec(text("UPDATE orderitem SET order_id=:to_id WHERE order_id=:from_id").bindparams(to_id=to_order_id, from_id=from_order_id))
+	mark_orders_dirty([from_order_id, to_order_id], session=session)
 	session.exec(text("UPDATE orderpayment SET order_id=:to_id WHERE order_id=:from_id").bindparams(to_id=to_order_id, from_id=from_order_id))
 	session.exec(text("UPDATE stockmovement SET related_order_id=:to_id WHERE related_order_id=:from_id").bindparams(to_id=to_order_id, from_id=from_order_id))
 	session.exec(text("UPDATE payment SET order_id=:to_id, client_id=:to_client WHERE order_id=:from_id").bindparams(to_id=to_order_id, from_id=from_order_id, to_client=to_order.client_id))
@@ -1026,7 +1096,7 @@ def fix_message_timestamps(request: Request):
 			total = len(rows)
 			for msg in rows:
 				try:
-					raw = msg.raw_json or "{}"
+					raw = load_raw(session, int(msg.id), msg.raw_json) or "{}"
 					data = json.loads(raw)
 					ts = data.get("timestamp")
 					if ts is None:
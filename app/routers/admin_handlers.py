@@ -146,7 +146,12 @@ def reset_instagram_data():
             except Exception:
                 if key is not None:
                     counts[key] = 0
-        # attachments before message
+        # attachments before message; their blob refs are released in the same transaction
+        try:
+            from ..services.media_store import release_all_attachments
+            release_all_attachments(session)
+        except Exception:
+            pass
         run("DELETE FROM attachments", key="attachments")
         run("DELETE FROM message", key="message")
         # AI shadow and summaries
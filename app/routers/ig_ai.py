@@ -15,7 +15,7 @@ import datetime as dt
 from ..db import get_session
 from ..services.queue import enqueue, delete_job
 from ..services.monitoring import get_ai_run_logs
-from ..services.ai import get_shadow_temperature_setting
+from ..services.ai import get_shadow_temperature_setting, invalidate_ai_settings_cache
 from ..services.ai_models import (
     get_model_whitelist,
     group_model_names,
@@ -3084,6 +3084,7 @@ def save_ai_settings(
             )
         
         session.commit()
+    invalidate_ai_settings_cache()
     
     from fastapi.responses import RedirectResponse
     return RedirectResponse(url="/ig/ai/settings", status_code=303)
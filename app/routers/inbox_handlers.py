@@ -14,7 +14,7 @@ router = APIRouter()
 
 
 @router.get("/inbox")
-async def inbox(
+def inbox(
     request: Request,
     limit: int = 25,
     q: str | None = None,
@@ -524,7 +524,7 @@ async def inbox(
 
 
 @router.post("/inbox/refresh")
-async def refresh_inbox(limit: int = 25):
+def refresh_inbox(limit: int = 25):
     # Temporarily bypass Graph API and rely solely on locally stored messages.
     # This endpoint now acts as a no-op refresh to keep the UI flow intact.
     try:
@@ -547,7 +547,7 @@ _DUE_WHERE_AI_QUEUE = """
 
 
 @router.get("/inbox/ai-queue")
-async def ai_reply_queue_list(request: Request, limit: int = 200):
+def ai_reply_queue_list(request: Request, limit: int = 200):
     """Worker'ın baktığı AI cevap kuyruğundaki konuşmaları listeler (sırayla)."""
     from sqlalchemy import text as _text
     rows = []
@@ -600,7 +600,7 @@ async def ai_reply_queue_list(request: Request, limit: int = 200):
 
 
 @router.get("/inbox/ai-replied")
-async def ai_replied_messages(
+def ai_replied_messages(
     request: Request,
     limit: int = 50,
 ):
@@ -687,7 +687,7 @@ async def ai_replied_messages(
 
 
 @router.get("/inbox/admin-messages")
-async def admin_messages_page(request: Request, limit: int = 50, unread_only: bool = False):
+def admin_messages_page(request: Request, limit: int = 50, unread_only: bool = False):
 	"""Admin mesajları sayfası"""
 	with get_session() as session:
 		query = select(AdminMessage)
@@ -740,7 +740,7 @@ async def admin_messages_page(request: Request, limit: int = 50, unread_only: bo
 
 
 @router.post("/inbox/admin/pushover-targets")
-async def add_pushover_target(label: str = Form(...), user_key: str = Form(...)):
+def add_pushover_target(label: str = Form(...), user_key: str = Form(...)):
 	label = (label or "").strip()
 	user_key = (user_key or "").strip()
 	if not label or not user_key:
@@ -752,7 +752,7 @@ async def add_pushover_target(label: str = Form(...), user_key: str = Form(...))
 
 
 @router.post("/inbox/admin/pushover-targets/{target_id}/delete")
-async def delete_pushover_target(target_id: int):
+def delete_pushover_target(target_id: int):
 	with get_session() as session:
 		target = session.get(AdminPushoverRecipient, int(target_id))
 		if not target:
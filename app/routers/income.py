@@ -8,7 +8,7 @@ from sqlmodel import select
 
 from ..db import get_session
 from ..models import Income, Account, Order, OrderPayment, Client, IncomeHistoryLog
-from ..services.finance import get_unpaid_orders, calculate_expected_payment, mark_orders_collected
+from ..services.finance import get_unpaid_orders, expected_payments, mark_orders_collected, plan_collection
 
 router = APIRouter()
 
@@ -199,38 +199,33 @@ def orders_to_collect(
 	with get_session() as session:
 		unpaid = get_unpaid_orders(session, start_date, end_date)
 		
+		# Client names for the whole selection in one query (search and display)
+		client_ids = {o.client_id for o in unpaid if o.client_id is not None}
+		clients = session.exec(select(Client.id, Client.name).where(Client.id.in_(client_ids))).all() if client_ids else []
+		client_map = {cid: name for cid, name in clients if cid is not None}
+		
 		# Filter by search query if provided
 		if q:
 			q_lower = q.lower()
-			filtered = []
-			for order in unpaid:
-				if order.id is None:
-					continue
-				# Search in tracking_no
-				if order.tracking_no and q_lower in order.tracking_no.lower():
-					filtered.append(order)
-					continue
-				# Search in client name
-				client = session.exec(select(Client).where(Client.id == order.client_id)).first()
-				if client and client.name and q_lower in client.name.lower():
-					filtered.append(order)
-					continue
-			unpaid = filtered
+			unpaid = [
+				order for order in unpaid
+				if order.id is not None and (
+					(order.tracking_no and q_lower in order.tracking_no.lower())
+					or q_lower in (client_map.get(order.client_id) or "").lower()
+				)
+			]
 		
 		# Limit results
 		unpaid = unpaid[:limit]
 		
-		# Get client info and calculate expected payments
-		client_ids = {o.client_id for o in unpaid}
-		clients = session.exec(select(Client).where(Client.id.in_(client_ids))).all() if client_ids else []
-		client_map = {c.id: c.name for c in clients if c.id is not None}
+		expected_map = expected_payments(session, [o.id for o in unpaid if o.id is not None])
 		
 		orders_data = []
 		total_expected = 0.0
 		for order in unpaid:
 			if order.id is None:
 				continue
-			expected = calculate_expected_payment(session, order.id)
+			expected = expected_map.get(order.id, 0.0)
 			total_expected += expected
 			orders_data.append({
 				"id": order.id,
@@ -249,6 +244,26 @@ def orders_to_collect(
 		}
 
 
+@router.post("/bulk-collect/preview")
+def bulk_collect_preview(body: Dict[str, Any] = Body(...)):
+	"""Diff preview for /bulk-collect: same body, nothing is written.
+	
+	Returns per-order expected vs collected amounts, orders that would be skipped
+	(already collected / unknown) and, when "amount" is given, the unallocated difference.
+	"""
+	try:
+		order_ids = [int(x) for x in body.get("order_ids", [])]
+		collected_amounts = body.get("collected_amounts")
+		amount = body.get("amount")
+		if not order_ids:
+			return JSONResponse({"error": "No orders selected"}, status_code=400)
+		collected_dict = {int(k): float(v) for k, v in collected_amounts.items()} if collected_amounts else None
+		with get_session() as session:
+			return plan_collection(session, order_ids, collected_dict, float(amount) if amount is not None else None)
+	except Exception as e:
+		return JSONResponse({"error": str(e)}, status_code=500)
+
+
 @router.post("/bulk-collect")
 def bulk_collect_orders(body: Dict[str, Any] = Body(...)):
 	"""Mark multiple orders as collected and create income entry.
@@ -264,6 +279,10 @@ def bulk_collect_orders(body: Dict[str, Any] = Body(...)):
 		"order_ids": [int, ...],
 		"collected_amounts": Optional[Dict[int, float]]  # order_id -> actual amount
 	}
+	
+	Expected amounts are computed for the whole selection at once and all OrderPayment
+	rows are written with one bulk insert in the same transaction as the income entry.
+	Orders that are already collected are skipped (see /bulk-collect/preview).
 	"""
 	try:
 		account_id = int(body.get("account_id"))
@@ -283,7 +302,15 @@ def bulk_collect_orders(body: Dict[str, Any] = Body(...)):
 		if not order_ids:
 			return JSONResponse({"error": "No orders selected"}, status_code=400)
 		
+		collected_dict = None
+		if collected_amounts:
+			collected_dict = {int(k): float(v) for k, v in collected_amounts.items()}
+		
 		with get_session() as session:
+			plan = plan_collection(session, order_ids, collected_dict, amount)
+			if not plan["rows"]:
+				return JSONResponse({"error": "No collectable orders in selection", "preview": plan}, status_code=400)
+			
 			# Create income entry
 			income = Income(
 				account_id=account_id,
@@ -311,17 +338,18 @@ def bulk_collect_orders(body: Dict[str, Any] = Body(...)):
 			)
 			
 			# Mark orders as collected
-			collected_dict = None
-			if collected_amounts:
-				collected_dict = {int(k): float(v) for k, v in collected_amounts.items()}
-			
-			count = mark_orders_collected(session, order_ids, income.id, collected_dict)
+			count = mark_orders_collected(session, order_ids, income.id, collected_dict, plan=plan)
 			session.commit()
 			
 			return {
 				"success": True,
 				"income_id": income.id,
 				"orders_collected": count,
+				"skipped_already_collected": plan["already_collected"],
+				"skipped_missing": plan["missing"],
+				"expected_total": plan["expected_total"],
+				"collected_total": plan["collected_total"],
+				"unallocated": plan.get("unallocated"),
 			}
 	except Exception as e:
 		return JSONResponse({"error": str(e)}, status_code=500)
@@ -2,7 +2,7 @@ import hashlib
 import hmac
 import json
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from pathlib import Path
 import time
 
@@ -20,6 +20,9 @@ import httpx
 from .websocket_handlers import notify_new_message
 import logging
 from ..services.monitoring import increment_counter
+from ..services.offload import run_db
+from ..services.webhook_buffer import append_raw_event, fast_path_enabled
+from ..services import tracing
 from starlette.requests import ClientDisconnect
 
 
@@ -82,6 +85,7 @@ async def verify_subscription(request: Request):
 
 @router.post("/webhooks/instagram")
 async def receive_events(request: Request):
+	trace_t0 = time.perf_counter()
 	try:
 		body = await request.body()
 	except ClientDisconnect:
@@ -111,18 +115,9 @@ async def receive_events(request: Request):
 			payload.get("object"),
 			len(payload.get("entry", [])),
 		)
-		# Debug: log full payload JSON to help trace mapping issues (from/to/conversation IDs, etc.)
-		try:
-			_log.info("IG webhook POST: full payload JSON=%s", json.dumps(payload, ensure_ascii=False))
-		except Exception:
-			# Best-effort; never let debug logging break webhook handling
-			pass
-		payload_path = _persist_payload_to_disk(payload, body)
-		if payload_path:
-			try:
-				_log.info("IG webhook POST: payload written to %s", payload_path)
-			except Exception:
-				pass
+		# Full payload only at debug level: serialising it on every request costs event-loop time
+		if _log.isEnabledFor(logging.DEBUG):
+			_log.debug("IG webhook POST: full payload JSON=%s", json.dumps(payload, ensure_ascii=False))
 	except Exception:
 		try:
 			_log.warning("IG webhook POST: invalid JSON, body_len=%d", len(body or b""))
@@ -137,6 +132,30 @@ async def receive_events(request: Request):
 			pass
 		return {"status": "ignored"}
 
+	# Sampled trace of this delivery through ingest and the AI reply (see services.tracing)
+	trace = tracing.start_trace()
+
+	# Fast path: append to the Redis stream and return; the flusher group-commits into raw_events
+	if fast_path_enabled() and append_raw_event(body, signature, "instagram", trace=tracing.inject(trace)):
+		tracing.record_perf_span("webhook.receive", trace_t0, ctx=trace, stage=True, buffered=True)
+		return {"status": "ok", "buffered": True}
+
+	# Fallback (buffer disabled or Redis down): store synchronously, off the event loop
+	saved_raw, _raw_event_id = await run_db(_store_raw_event_sync, payload, body, signature, trace)
+	tracing.record_perf_span("webhook.receive", trace_t0, ctx=trace, stage=True, buffered=False)
+	return {"status": "ok", "raw_saved": saved_raw}
+
+
+def _store_raw_event_sync(
+	payload: Dict[str, Any], body: bytes, signature: Optional[str], trace: Optional[tracing.TraceContext] = None
+) -> Tuple[int, Optional[int]]:
+	payload_path = _persist_payload_to_disk(payload, body)
+	if payload_path:
+		try:
+			_log.info("IG webhook POST: payload written to %s", payload_path)
+		except Exception:
+			pass
+
 	# Insert raw_event once and enqueue ingestion. Idempotent on uniq_hash of full payload.
 	entries: List[Dict[str, Any]] = payload.get("entry", [])
 	saved_raw = 0
@@ -190,9 +209,11 @@ async def receive_events(request: Request):
 	if raw_event_id:
 		try:
 			_log.info("IG webhook POST: queuing message processing for raw_event_id=%s", raw_event_id)
-			from ..services.queue import enqueue
 			# Use raw_event_id as the job key and pass it in the payload for the worker
-			enqueue("ingest", key=str(raw_event_id), payload={"raw_event_id": int(raw_event_id)})
+			job_payload: Dict[str, Any] = {"raw_event_id": int(raw_event_id)}
+			if trace is not None:
+				job_payload["tp"] = tracing.inject(trace)
+			enqueue("ingest", key=str(raw_event_id), payload=job_payload)
 		except Exception as e:
 			# best-effort: ignore failures here; ingestion worker will backfill later
 			try:
@@ -204,14 +225,11 @@ async def receive_events(request: Request):
 			_log.warning("IG webhook POST: no raw_event_id to queue for processing")
 		except Exception:
 			pass
-	return {"status": "ok", "raw_saved": saved_raw}
+	return saved_raw, raw_event_id
 
 
-@router.get("/ig/media/{ig_message_id}/{idx}")
-async def get_media(ig_message_id: str, idx: int):
-	# Try to serve from attachments_json; otherwise query Graph attachments
+def _stored_attachment_url(ig_message_id: str, idx: int) -> Optional[str]:
 	url: Optional[str] = None
-	mime: Optional[str] = None
 	with get_session() as session:
 		rec = session.exec(select(Message).where(Message.ig_message_id == ig_message_id)).first()  # type: ignore
 		if rec and rec.attachments_json:
@@ -232,22 +250,29 @@ async def get_media(ig_message_id: str, idx: int):
 							url = att["image_data"].get("url") or att["image_data"].get("preview_url")
 			except Exception:
 				url = None
+	return url
+
+
+@router.get("/ig/media/{ig_message_id}/{idx}")
+async def get_media(ig_message_id: str, idx: int):
+	# Try to serve from attachments_json; otherwise query Graph attachments
+	mime: Optional[str] = None
+	url: Optional[str] = await run_db(_stored_attachment_url, ig_message_id, idx)
 	if not url:
 		# As a last resort, query Graph attachments for the message id (avoid when possible)
 		token, _, _ = _get_base_token_and_id()
 		base = f"https://graph.facebook.com/{GRAPH_VERSION}"
 		path = f"/{ig_message_id}/attachments"
 		params = {"access_token": token, "fields": "mime_type,file_url,image_data{url,preview_url},name"}
-		async with httpx.AsyncClient() as client:
-			try:
-				data = await graph_get(client, base + path, params)
-			except Exception:
-				raise HTTPException(status_code=404, detail="Media unavailable")
-			arr = data.get("data") or []
-			if isinstance(arr, list) and idx < len(arr):
-				att = arr[idx] or {}
-				url = att.get("file_url") or ((att.get("image_data") or {}).get("url")) or ((att.get("image_data") or {}).get("preview_url"))
-				mime = att.get("mime_type")
+		try:
+			data = await graph_get(None, base + path, params)
+		except Exception:
+			raise HTTPException(status_code=404, detail="Media unavailable")
+		arr = data.get("data") or []
+		if isinstance(arr, list) and idx < len(arr):
+			att = arr[idx] or {}
+			url = att.get("file_url") or ((att.get("image_data") or {}).get("url")) or ((att.get("image_data") or {}).get("preview_url"))
+			mime = att.get("mime_type")
 	if not url:
 		raise HTTPException(status_code=404, detail="Media not found")
 	# fetch and stream
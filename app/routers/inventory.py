@@ -11,7 +11,7 @@ from sqlalchemy import func
 
 from ..db import get_session
 from ..models import Item, Product, StockMovement, StockRequest, StockRequestHit, Order, ProductSizeChart, Supplier
-from ..services.inventory import get_stock_map, recalc_orders_from_mappings, adjust_stock
+from ..services.inventory import compute_on_hand_for_items, recalc_orders_from_mappings, adjust_stock
 from ..services.stock_units import sync_units_after_movement
 
 
@@ -69,7 +69,7 @@ def list_stock(product_id: Optional[int] = Query(default=None), size: Optional[s
 		if color:
 			q = q.where(Item.color == color)
 		rows = session.exec(q.limit(limit)).all()
-		stock_map = get_stock_map(session)
+		stock_map = compute_on_hand_for_items(session, [it.id for it in rows])
 		return {
 			"items": [
 				{
@@ -99,7 +99,7 @@ def stock_table(request: Request, product_id: Optional[int] = Query(default=None
 		if color:
 			q = q.where(Item.color == color)
 		rows = session.exec(q.limit(limit)).all()
-		stock_map = get_stock_map(session)
+		stock_map = compute_on_hand_for_items(session, [it.id for it in rows])
 		# Build product_id -> name map for display
 		pids = sorted({it.product_id for it in rows if it.product_id})
 		pmap = {}
@@ -8,7 +8,7 @@ import os
 
 from ..db import get_session
 from ..models import Client, Item, Order, OrderItem, Payment, PaymentHistoryLog, Product, SystemSetting, Income, StockUnit
-from ..services.inventory import adjust_stock, get_stock_map
+from ..services.inventory import adjust_stock, compute_on_hand_for_items
 from ..services.stock_units import get_units_for_movement, stock_unit_tracking_enabled
 from ..services.shipping import compute_shipping_fee
 from ..services.importer.committers import _normalize_shipping_company
@@ -287,7 +287,7 @@ def page(request: Request):
 		prod_ids = [it.product_id for it in items if it.product_id]
 		products = session.exec(select(Product).where(Product.id.in_(prod_ids))).all() if prod_ids else []
 		prod_price_map = {p.id: p.default_price for p in products if p.id is not None}
-		stock_map = get_stock_map(session)
+		stock_map = compute_on_hand_for_items(session, [it.id for it in items])
 		items_payload = [_serialize_item(it, stock_map.get(it.id or 0), prod_price_map.get(it.product_id)) for it in items]
 		templates = request.app.state.templates
 		return templates.TemplateResponse(
@@ -361,7 +361,7 @@ def search_items(q: Optional[str] = Query(default=None, description="SKU/isim/re
 		prod_ids = [it.product_id for it in items if it.product_id]
 		products = session.exec(select(Product).where(Product.id.in_(prod_ids))).all() if prod_ids else []
 		prod_price_map = {p.id: p.default_price for p in products if p.id is not None}
-		stock_map = get_stock_map(session)
+		stock_map = compute_on_hand_for_items(session, [it.id for it in items])
 		return {
 			"items": [
 				_serialize_item(it, stock_map.get(it.id or 0), prod_price_map.get(it.product_id))
@@ -767,7 +767,7 @@ def order_add_item(request: Request, payload: dict = Body(...)):
 			if (u.status or "") != "in_stock":
 				raise HTTPException(status_code=400, detail=f"Parça stokta değil (status={u.status})")
 		else:
-			stock_map = get_stock_map(session)
+			stock_map = compute_on_hand_for_items(session, [item.id])
 			on_hand = int(stock_map.get(item.id, 0))
 			if on_hand < qty:
 				raise HTTPException(status_code=400, detail=f"Insufficient stock for item {item.id} (on_hand={on_hand})")
@@ -814,7 +814,7 @@ def order_add_item(request: Request, payload: dict = Body(...)):
 			order.quantity = total_q
 		session.add(order)
 
-		stock_after = get_stock_map(session)
+		stock_after = compute_on_hand_for_items(session, [item.id])
 		cart = _order_kargo_cart_payload(session, order_id)
 		return {
 			"status": "ok",
@@ -900,7 +900,7 @@ def order_remove_item(request: Request, payload: dict = Body(...)):
 		session.add(order)
 
 		cart = _order_kargo_cart_payload(session, order_id)
-		stock_after = get_stock_map(session)
+		stock_after = compute_on_hand_for_items(session, [item_id])
 		return {
 			"status": "ok",
 			"order_id": order_id,
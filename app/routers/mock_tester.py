@@ -74,7 +74,7 @@ def _format_utc3(value: Union[dt.datetime, int, float, str, None]) -> Optional[s
 
 
 @router.get("")
-async def mock_tester_index(request: Request):
+def mock_tester_index(request: Request):
 	"""Main testing interface."""
 	templates = request.app.state.templates
 	
@@ -129,7 +129,7 @@ async def mock_tester_index(request: Request):
 
 
 @router.post("/create")
-async def create_conversation(
+def create_conversation(
 	request: Request,
 	ad_id: Optional[str] = Form(None),
 	ad_link: Optional[str] = Form(None),
@@ -163,7 +163,7 @@ async def create_conversation(
 
 
 @router.post("/{conversation_id}/send")
-async def send_message(
+def send_message(
 	request: Request,
 	conversation_id: int,
 	message_text: str = Form(...),
@@ -190,7 +190,7 @@ async def send_message(
 
 
 @router.get("/{conversation_id}")
-async def view_conversation(request: Request, conversation_id: int, limit: int = 100):
+def view_conversation(request: Request, conversation_id: int, limit: int = 100):
 	"""View a mock conversation thread."""
 	with get_session() as session:
 		# Load conversation
@@ -1,14 +1,36 @@
 from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
 from sqlmodel import select
 import datetime as dt
+import hmac
+import os
 
 from ..db import get_session
 from ..models import Message
-from ..services.monitoring import get_worker_statuses, get_queue_stats, sum_counters
+from ..services.monitoring import (
+    get_worker_statuses,
+    get_queue_stats,
+    histogram_summary_many,
+    render_prometheus,
+    sum_counters_many,
+)
 
 
 router = APIRouter(prefix="/noc", tags=["noc"])
 
+RATE_METRICS = [
+    "messages",
+    "enrich_success",
+    "enrich_user",
+    "enrich_page",
+    "hydrate_conversation",
+    "media_fetch",
+    "media_image",
+    "media_video",
+    "media_audio",
+]
+LATENCY_METRICS = ["http_request_ms", "ai_completion_ms"]
+
 
 @router.get("")
 def noc_page(request: Request):
@@ -22,28 +44,37 @@ def noc_page(request: Request):
 
 @router.get("/data")
 def noc_data(request: Request, window: int = 60):
-    # No heavy DB ops; mostly Redis-backed
-    window_minutes = max(1, min(int(window or 60), 24 * 60))
+    # No heavy DB ops; a few pipelined Redis round trips whatever the window (rolled-up counters)
+    window_minutes = max(1, min(int(window or 60), 30 * 24 * 60))
     now = dt.datetime.utcnow().isoformat()
     workers = get_worker_statuses()
     queues = get_queue_stats()
-    rates = {
-        "messages": sum_counters("messages", window_minutes),
-        "enrich_success": sum_counters("enrich_success", window_minutes),
-        "enrich_user": sum_counters("enrich_user", window_minutes),
-        "enrich_page": sum_counters("enrich_page", window_minutes),
-        "hydrate_conversation": sum_counters("hydrate_conversation", window_minutes),
-        "media_fetch": sum_counters("media_fetch", window_minutes),
-        "media_image": sum_counters("media_image", window_minutes),
-        "media_video": sum_counters("media_video", window_minutes),
-        "media_audio": sum_counters("media_audio", window_minutes),
-    }
+    rates = sum_counters_many(RATE_METRICS, window_minutes)
+    try:
+        latency = histogram_summary_many(LATENCY_METRICS, window_minutes)
+    except Exception:
+        latency = {}
     return {
         "now": now,
         "window_minutes": window_minutes,
         "workers": workers,
         "queues": queues,
         "rates": rates,
+        "latency": latency,
     }
 
 
+@router.get("/metrics")
+def noc_metrics(request: Request):
+    """Prometheus scrape endpoint. With METRICS_TOKEN set, a bearer token (or ?token=) is required."""
+    token = os.getenv("METRICS_TOKEN")
+    if token:
+        auth = request.headers.get("authorization") or ""
+        given = auth[7:].strip() if auth.lower().startswith("bearer ") else request.query_params.get("token")
+        if not hmac.compare_digest(str(given or ""), token):
+            return PlainTextResponse("unauthorized\n", status_code=401)
+    try:
+        body = render_prometheus()
+    except Exception as e:
+        return PlainTextResponse(f"# metrics unavailable: {e}\n", status_code=503)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -31,15 +31,16 @@ from ..models import (
 )
 from ..services.inventory import get_or_create_item as _get_or_create_item
 from ..services.inventory import adjust_stock, restore_order_stock_lines
-from ..services.shipping import compute_shipping_fee
+from ..services.shipping import compute_shipping_fee, compute_shipping_fees
 from ..services.finance import get_effective_total, ensure_iban_income
 from fastapi.responses import StreamingResponse, RedirectResponse
 from urllib.parse import quote
 import io
-try:
-    import openpyxl
-except Exception:
-    openpyxl = None  # type: ignore
+from ..utils.lazy import lazy_module
+from ..services.event_bus import publish_after_commit
+
+# Only the export endpoints need it; imported on first use
+openpyxl = lazy_module("openpyxl")
 
 router = APIRouter()
 
@@ -334,21 +335,20 @@ def list_orders_table(
 
         # shipping_map based on Order.total_amount for display
         shipping_map: dict[int, float] = {}
+        # Orders without a stored fee: compute in one pass over the cached rate tables
+        missing_fee = [o for o in rows if o.shipping_fee is None]
+        computed_fees = compute_shipping_fees(
+            [(float(o.total_amount or 0.0), o.shipping_company or None, bool(o.paid_by_bank_transfer)) for o in missing_fee],
+            session=session,
+        )
+        computed_map = {id(o): fee for o, fee in zip(missing_fee, computed_fees)}
         for o in rows:
             oid = o.id or 0
             # Compute full shipping including 20% tax for display
-            pre_tax = None
             if o.shipping_fee is not None:
                 pre_tax = float(o.shipping_fee or 0.0)
             else:
-                amt = float(o.total_amount or 0.0)
-                company_code = o.shipping_company or None
-                pre_tax = compute_shipping_fee(
-                    amt,
-                    company_code=company_code,
-                    paid_by_bank_transfer=bool(o.paid_by_bank_transfer),
-                    session=session
-                )
+                pre_tax = computed_map.get(id(o), 0.0)
             shipping_map[oid] = round(float(pre_tax or 0.0) * 1.20, 2)
 
         # Use stored total_cost; if missing, compute via FIFO using stock movements (unit_cost)
@@ -468,26 +468,14 @@ def recalc_financials(confirm: bool = Query(default=False, description="Set true
     with get_session() as session:
         from sqlmodel import select as _select
         rows = session.exec(select(Order)).all()
+        # shipping from toplam; zero totals => base only; IBAN => base fee of the company
+        fees = compute_shipping_fees(
+            [(float(o.total_amount or 0.0), o.shipping_company or None, bool(o.paid_by_bank_transfer)) for o in rows],
+            session=session,
+        )
         updated = 0
-        for o in rows:
-            # shipping from toplam; zero totals => base only
-            amt = float(o.total_amount or 0.0)
-            company_code = o.shipping_company or None
-            if bool(o.paid_by_bank_transfer):
-                # IBAN ödemelerinde sadece base fee (kargo firmasına göre)
-                o.shipping_fee = compute_shipping_fee(
-                    amt,
-                    company_code=company_code,
-                    paid_by_bank_transfer=True,
-                    session=session
-                )
-            else:
-                o.shipping_fee = compute_shipping_fee(
-                    amt,
-                    company_code=company_code,
-                    paid_by_bank_transfer=False,
-                    session=session
-                )
+        for o, fee in zip(rows, fees):
+            o.shipping_fee = fee
             # cost from order items using FIFO (zero if refunded/switched or negative totals)
             if (o.status or "") in ("refunded", "switched", "stitched", "cancelled") or (float(o.total_amount or 0.0) < 0.0):
                 o.total_cost = 0.0
@@ -541,6 +529,7 @@ def refund_order(order_id: int):
             o.total_cost = 0.0
         except Exception:
             pass
+        publish_after_commit(session, {"type": "order_updated", "order_id": order_id, "status": o.status})
         return RedirectResponse(url=f"/orders/{order_id}/edit?status=ok", status_code=303)
 
 
@@ -607,6 +596,7 @@ def cancel_order(order_id: int, body: dict = Body(default={})):
         except Exception:
             pass
 
+        publish_after_commit(session, {"type": "order_updated", "order_id": order_id, "status": "cancelled"})
         return {"status": "ok", "restore_inventory": restore_inventory}
 
 
@@ -2195,6 +2185,7 @@ async def edit_order_apply(order_id: int, request: Request):
         except Exception:
             pass
 
+        publish_after_commit(session, {"type": "order_updated", "order_id": order_id, "status": o.status})
         return RedirectResponse(url=f"/orders/{order_id}/edit?status=ok", status_code=303)
 
 
@@ -10,6 +10,7 @@ from sqlmodel import select
 
 from ..db import get_session
 from ..models import Product, Item, ProductUpsell, ProductSizeChart, SizeChart, SupplierProductPrice, Supplier
+from ..services.copurchase import get_copurchase
 from ..utils.slugify import slugify
 
 
@@ -395,6 +396,29 @@ def list_product_upsells(product_id: int):
 		}
 
 
+@router.get("/{product_id}/upsells/suggested")
+def suggested_product_upsells(
+	product_id: int,
+	limit: int = Query(default=10, ge=1, le=50),
+	min_count: int = Query(default=2, ge=1),
+	order_by: str = Query(default="score"),
+):
+	"""Co-purchase based upsell suggestions (full order history, see services.copurchase)."""
+	rows = get_copurchase(product_id, limit=limit, min_count=min_count, order_by=order_by)
+	if rows is None:
+		return {"product_id": product_id, "built": False, "suggestions": []}
+	names: dict[int, str | None] = {}
+	if rows:
+		with get_session() as session:
+			for p in session.exec(select(Product).where(Product.id.in_([r["product_id"] for r in rows]))).all():
+				names[int(p.id)] = p.name
+	return {
+		"product_id": product_id,
+		"built": True,
+		"suggestions": [dict(r, product_name=names.get(r["product_id"])) for r in rows],
+	}
+
+
 @router.post("/{product_id}/upsells")
 def create_product_upsell(product_id: int, body: dict):
 	upsell_product_id = body.get("upsell_product_id")
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Request, HTTPException, Form, Body
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import RedirectResponse
 from starlette.status import HTTP_303_SEE_OTHER
 from pathlib import Path
 from typing import Any
@@ -462,6 +462,11 @@ def debug_reset_conversation(
             if msg_ids:
                 placeholders = ",".join([f":p{i}" for i in range(len(msg_ids))])
                 params = {f"p{i}": msg_ids[i] for i in range(len(msg_ids))}
+                try:
+                    from ..services.media_store import release_message_attachments
+                    release_message_attachments(session, msg_ids)
+                except Exception:
+                    pass
                 session.exec(_text(f"DELETE FROM attachments WHERE message_id IN ({placeholders})").params(**params))
             session.exec(_text("DELETE FROM message WHERE conversation_id = :cid").params(cid=cid_str))
 
@@ -508,70 +513,640 @@ def debug_reset_conversation(
     return RedirectResponse(url=f"/ig/inbox/{conversation_id}", status_code=HTTP_303_SEE_OTHER)
 
 
+def _load_admin_alerts(session, conversation_id: int) -> tuple[list[dict[str, Any]], dict[int, list[dict[str, Any]]]]:
+    """Latest admin rows of a thread, plus trigger message id -> escalation notes."""
+    from sqlmodel import select
+    admin_alerts: list[dict[str, Any]] = []
+    escalation_map: dict[int, list[dict[str, Any]]] = {}
+    try:
+        admin_rows = session.exec(
+            select(AdminMessage)
+            .where(AdminMessage.conversation_id == int(conversation_id))
+            .order_by(AdminMessage.created_at.desc())
+            .limit(50)
+        ).all()
+        for row in admin_rows:
+            try:
+                meta = json.loads(row.metadata_json) if getattr(row, "metadata_json", None) else {}
+            except Exception:
+                meta = {}
+            created_at = getattr(row, "created_at", None)
+            try:
+                ts_ms = int(created_at.timestamp() * 1000) if isinstance(created_at, _d) else None
+            except Exception:
+                ts_ms = None
+            alert_entry = {
+                "id": getattr(row, "id", None),
+                "message": getattr(row, "message", None),
+                "message_type": getattr(row, "message_type", None),
+                "is_read": getattr(row, "is_read", False),
+                "created_at": created_at,
+                "timestamp_ms": ts_ms,
+                "metadata": meta,
+            }
+            admin_alerts.append(alert_entry)
+            trigger_id = meta.get("trigger_message_id")
+            if trigger_id:
+                try:
+                    trigger_key = int(trigger_id)
+                except (TypeError, ValueError):
+                    continue
+                escalation_map.setdefault(trigger_key, []).append(
+                    {
+                        "message": getattr(row, "message", None),
+                        "message_type": getattr(row, "message_type", None),
+                        "created_at": getattr(row, "created_at", None),
+                    }
+                )
+    except Exception:
+        admin_alerts = []
+        escalation_map = {}
+    return admin_alerts, escalation_map
+
+
+def _message_render_context(session, msgs: list[Any], enqueue_missing: bool = True) -> dict[str, Any]:
+    """Lookups the message bubbles need (usernames, ads, attachments, template cards) for `msgs` only."""
+    # Resolve per-message sender usernames via ig_users only.
+    # Enqueue missing ones for background enrichment instead of fetching inline.
+    usernames: dict[str, str] = {}
+    ad_ids: list[str] = []
+    try:
+        sender_ids: list[str] = []
+        for mm in msgs:
+            if mm.ig_sender_id:
+                sid = str(mm.ig_sender_id)
+                if sid not in sender_ids:
+                    sender_ids.append(sid)
+            try:
+                if mm.ad_id:
+                    aid = str(mm.ad_id)
+                    if aid not in ad_ids:
+                        ad_ids.append(aid)
+            except Exception:
+                pass
+        if sender_ids:
+            placeholders = ",".join([":p" + str(i) for i in range(len(sender_ids))])
+            from sqlalchemy import text as _text
+            params = {("p" + str(i)): sender_ids[i] for i in range(len(sender_ids))}
+            rows_u = session.exec(_text(f"SELECT ig_user_id, username FROM ig_users WHERE ig_user_id IN ({placeholders})")).params(**params).all()
+            ids_without_username: list[str] = []
+            for r in rows_u:
+                uid = r.ig_user_id if hasattr(r, "ig_user_id") else r[0]
+                un = r.username if hasattr(r, "username") else r[1]
+                if uid and un:
+                    usernames[str(uid)] = str(un)
+                elif uid:
+                    ids_without_username.append(str(uid))
+            # Enrich kuyruğuna az sayıda ekle (sayfa yükü gecikmesin; geri kalanı başka tetiklemede dolar)
+            try:
+                for uid in (ids_without_username[:5] if enqueue_missing else []):
+                    enqueue("enrich_user", key=str(uid), payload={"ig_user_id": str(uid)})
+            except Exception:
+                pass
+    except Exception:
+        usernames = {}
+
+    # Fetch cached ads for messages in this thread
+    ads_cache: dict[str, dict[str, Any]] = {}
+    ad_products: dict[str, dict[str, Any]] = {}
+    try:
+        if ad_ids:
+            placeholders = ",".join([":a" + str(i) for i in range(len(ad_ids))])
+            from sqlalchemy import text as _text
+            params = {("a" + str(i)): ad_ids[i] for i in range(len(ad_ids))}
+            stmt_ads = _text(f"SELECT ad_id, name, image_url, link FROM ads WHERE ad_id IN ({placeholders})").bindparams(**params)
+            rows_ad = session.exec(stmt_ads).all()
+            for r in rows_ad:
+                aid = r.ad_id if hasattr(r, "ad_id") else r[0]
+                name = r.name if hasattr(r, "name") else (r[1] if len(r) > 1 else None)
+                img = r.image_url if hasattr(r, "image_url") else (r[2] if len(r) > 2 else None)
+                lnk = r.link if hasattr(r, "link") else (r[3] if len(r) > 3 else None)
+                ads_cache[str(aid)] = {"name": name, "image_url": img, "link": lnk}
+            # Enrich with linked product info
+            try:
+                stmt_ap = _text(
+                    f"""
+                    SELECT ap.ad_id, ap.product_id, p.name AS product_name
+                    FROM ads_products ap
+                    LEFT JOIN product p ON ap.product_id = p.id
+                    WHERE ap.ad_id IN ({placeholders})
+                    """
+                ).bindparams(**params)
+                rows_ap = session.exec(stmt_ap).all()
+                for r in rows_ap:
+                    try:
+                        aid = getattr(r, "ad_id", None) if hasattr(r, "ad_id") else (r[0] if len(r) > 0 else None)
+                        pid = getattr(r, "product_id", None) if hasattr(r, "product_id") else (r[1] if len(r) > 1 else None)
+                        pname = getattr(r, "product_name", None) if hasattr(r, "product_name") else (r[2] if len(r) > 2 else None)
+                        if not aid:
+                            continue
+                        ad_products[str(aid)] = {"product_id": pid, "product_name": pname}
+                    except Exception:
+                        continue
+            except Exception:
+                ad_products = {}
+    except Exception:
+        ads_cache = {}
+        ad_products = {}
+
+    # Build attachment indices so template can render images (fallback: legacy attachments_json)
+    att_map = {}
+    template_cards: dict[str, list[dict[str, Any]]] = {}
+    for mm in msgs:
+        if not mm.attachments_json:
+            continue
+        try:
+            data = json.loads(mm.attachments_json)
+            items = []
+            if isinstance(data, list):
+                items = data
+            elif isinstance(data, dict) and isinstance(data.get("data"), list):
+                items = data["data"]
+            if items:
+                mid_key = mm.ig_message_id or ""
+                att_map[mid_key] = list(range(len(items)))
+                cards: list[dict[str, Any]] = []
+                for att in items:
+                    if not isinstance(att, dict):
+                        continue
+                    payload = att.get("payload") or {}
+                    generic = payload.get("generic") or {}
+                    elements = None
+                    if isinstance(generic, dict) and isinstance(generic.get("elements"), list):
+                        elements = generic.get("elements")
+                    elif isinstance(payload.get("elements"), list):
+                        elements = payload.get("elements")
+                    elif isinstance(payload.get("cards"), list):
+                        elements = payload.get("cards")
+                    if not isinstance(elements, list):
+                        continue
+                    for el in elements:
+                        if not isinstance(el, dict):
+                            continue
+                        cards.append(
+                            {
+                                "title": el.get("title") or el.get("header"),
+                                "subtitle": el.get("subtitle") or el.get("description"),
+                                "image_url": el.get("image_url") or el.get("image") or el.get("media_url"),
+                                "buttons": el.get("buttons") or [],
+                                "default_action": el.get("default_action") or {},
+                            }
+                        )
+                if cards:
+                    template_cards[mid_key] = cards
+        except Exception:
+            pass
+    # New: Build local attachment id map from attachments table
+    att_ids_map = {}
+    # attachment id -> content hash, used as ?v= so the browser can cache media as immutable
+    att_sha_map = {}
+    try:
+        # Map message.id -> ig_message_id
+        msgid_to_mid = {}
+        msg_ids = []
+        for mm in msgs:
+            if mm.id:
+                msg_ids.append(mm.id)
+                msgid_to_mid[int(mm.id)] = mm.ig_message_id or ""
+        if msg_ids:
+            # Build a parameterized IN clause
+            placeholders = ",".join([":p" + str(i) for i in range(len(msg_ids))])
+            from sqlalchemy import text as _text
+            params = {("p" + str(i)): int(msg_ids[i]) for i in range(len(msg_ids))}
+            # Only include attachments that are already fetched to avoid 404s on /ig/media/local/*
+            rows = session.exec(_text(f"SELECT id, message_id, position, storage_path, fetch_status, checksum_sha256 FROM attachments WHERE message_id IN ({placeholders}) ORDER BY position ASC")).params(**params).all()
+            for r in rows:
+                att_id = r.id if hasattr(r, "id") else r[0]
+                m_id = r.message_id if hasattr(r, "message_id") else r[1]
+                pos = r.position if hasattr(r, "position") else r[2]
+                sp = r.storage_path if hasattr(r, "storage_path") else (r[3] if len(r) > 3 else None)
+                fs = r.fetch_status if hasattr(r, "fetch_status") else (r[4] if len(r) > 4 else None)
+                mid = msgid_to_mid.get(int(m_id)) or ""
+                # Only map to local ids when we actually have a file on disk
+                if mid and sp and str(sp).strip() and str(fs or "").lower() == "ok":
+                    att_ids_map.setdefault(mid, []).append(int(att_id))
+                    chk = r.checksum_sha256 if hasattr(r, "checksum_sha256") else (r[5] if len(r) > 5 else None)
+                    if chk:
+                        att_sha_map[int(att_id)] = str(chk)
+    except Exception:
+        att_ids_map = {}
+    # Additionally, if attachments_json is missing but we have attachment rows,
+    # build a positions list so template can stream directly from Graph.
+    try:
+        if msg_ids:
+            from sqlalchemy import text as _text
+            placeholders = ",".join([":q" + str(i) for i in range(len(msg_ids))])
+            params = {("q" + str(i)): int(msg_ids[i]) for i in range(len(msg_ids))}
+            rows_pos = session.exec(_text(f"SELECT message_id, position FROM attachments WHERE message_id IN ({placeholders}) ORDER BY position ASC")).params(**params).all()
+            # message_id -> [positions...]
+            tmp: dict[int, list[int]] = {}
+            for r in rows_pos:
+                m_id = r.message_id if hasattr(r, "message_id") else r[0]
+                pos = r.position if hasattr(r, "position") else (r[1] if len(r) > 1 else None)
+                if m_id is None or pos is None:
+                    continue
+                tmp.setdefault(int(m_id), []).append(int(pos))
+            # convert to ig_message_id -> positions only when attachments_json did not already provide mapping
+            for mid_internal, positions in tmp.items():
+                mid = msgid_to_mid.get(int(mid_internal)) or ""
+                if not mid:
+                    continue
+                if mid not in att_map and positions:
+                    att_map[mid] = positions
+    except Exception:
+        pass
+    return {
+        "usernames": usernames,
+        "ads_cache": ads_cache,
+        "ad_products": ad_products,
+        "att_map": att_map,
+        "att_ids_map": att_ids_map,
+        "att_sha_map": att_sha_map,
+        "template_cards": template_cards,
+    }
+
+
+def _parse_actions(raw_val: Any) -> list[dict[str, Any]]:
+    if not raw_val:
+        return []
+    try:
+        if isinstance(raw_val, str):
+            parsed = json.loads(raw_val)
+        else:
+            parsed = raw_val
+        if isinstance(parsed, list):
+            return parsed  # type: ignore[return-value]
+    except Exception:
+        pass
+    return []
+
+
+def _parse_function_callbacks(raw_val: Any) -> list[dict[str, Any]]:
+    """Parse function_callbacks from json_meta. Intro-only replies have no tools, so json_meta may lack this key."""
+    if not raw_val:
+        return []
+    try:
+        if isinstance(raw_val, str):
+            parsed = json.loads(raw_val)
+        else:
+            parsed = raw_val
+        if isinstance(parsed, dict):
+            # Intro-only path stores debug_meta (intro_only, user_payload, ...) without function_callbacks
+            callbacks = parsed.get("function_callbacks", [])
+            if isinstance(callbacks, list):
+                return callbacks  # type: ignore[return-value]
+            return []
+        elif isinstance(parsed, list):
+            return parsed  # type: ignore[return-value]
+    except Exception:
+        pass
+    return []
+
+
+def _parse_state(raw_val: Any) -> dict[str, Any]:
+    if not raw_val:
+        return {}
+    if isinstance(raw_val, dict):
+        return raw_val  # type: ignore[return-value]
+    try:
+        if isinstance(raw_val, str):
+            parsed = json.loads(raw_val)
+            if isinstance(parsed, dict):
+                return parsed  # type: ignore[return-value]
+    except Exception:
+        return {}
+    return {}
+
+
+def _draft_virtual_messages(rows_shadow: list[Any], focus_slug: Any = None) -> list[dict[str, Any]]:
+    """ai_shadow_reply rows -> inline draft bubbles (one per text line)."""
+    vms: list[dict] = []
+    for rr in rows_shadow:
+        try:
+            txt = getattr(rr, "reply_text", None) if hasattr(rr, "reply_text") else (rr[1] if len(rr) > 1 else None)
+            status = getattr(rr, "status", None) if hasattr(rr, "status") else (rr[6] if len(rr) > 6 else None)
+            actions_val = getattr(rr, "actions_json", None) if hasattr(rr, "actions_json") else (rr[7] if len(rr) > 7 else None)
+            state_val = getattr(rr, "state_json", None) if hasattr(rr, "state_json") else (rr[8] if len(rr) > 8 else None)
+            json_meta_val = getattr(rr, "json_meta", None) if hasattr(rr, "json_meta") else (rr[9] if len(rr) > 9 else None)
+            confidence_val = getattr(rr, "confidence", None) if hasattr(rr, "confidence") else (rr[3] if len(rr) > 3 else None)
+            state_dict = _parse_state(state_val)
+            actions_list = _parse_actions(actions_val)
+            function_callbacks_vm = _parse_function_callbacks(json_meta_val)
+            # Include all records, even if empty text (for no_reply decisions)
+            if not txt:
+                txt = ""  # Will be handled in template
+
+            # Decode any escape sequences that might still be in the stored text
+            if txt:
+                from ..services.ai_reply import _decode_escape_sequences
+                txt = _decode_escape_sequences(str(txt))
+                txt = _sanitize_reply_text(str(txt))
+            # Split text by newlines to show as separate messages
+            text_lines = []
+            if txt:
+                lines = [line.strip() for line in str(txt).split('\n') if line.strip()]
+                if not lines:
+                    lines = [str(txt).strip()]
+                text_lines = lines
+            else:
+                text_lines = [""]
+
+            did = getattr(rr, "id", None) if hasattr(rr, "id") else (rr[0] if len(rr) > 0 else None)
+            ca = getattr(rr, "created_at", None) if hasattr(rr, "created_at") else (rr[5] if len(rr) > 5 else None)
+            ts = None
+            if ca:
+                try:
+                    ts = _d.fromisoformat(ca.replace("Z","+00:00")).timestamp()*1000 if isinstance(ca, str) else (ca.timestamp()*1000)
+                    ts = int(ts)
+                except Exception:
+                    ts = None
+            # Normalize status for template
+            normalized_status = (status or "suggested").lower()
+            if normalized_status not in ["sent", "error", "no_reply", "suggested", "dismissed", "expired"]:
+                normalized_status = "suggested"
+
+            # Create a separate virtual message for each line
+            for line_idx, line_text in enumerate(text_lines):
+                vm = {
+                    "direction": "out",
+                    "text": line_text,
+                    "timestamp_ms": ts or 0,
+                    "sender_username": "AI",
+                    "ig_message_id": None,
+                    "ig_sender_id": None,
+                    "ig_recipient_id": None,
+                    "is_ai_draft": True,
+                    "ai_decision_status": normalized_status,  # Pass status to template
+                    "draft_id": int(did) if did is not None else None,
+                    "ai_model": getattr(rr, "model", None) if hasattr(rr, "model") else (rr[2] if len(rr) > 2 else None),
+                    "ai_reason": getattr(rr, "reason", None) if hasattr(rr, "reason") else (rr[4] if len(rr) > 4 else None),
+                    "ai_confidence": confidence_val,
+                    "product_slug": focus_slug or None,
+                    "ai_actions": actions_list if line_idx == 0 else [],  # Only show actions on first message
+                    "ai_state": state_dict if state_dict else None,
+                    "ai_function_callbacks": function_callbacks_vm if line_idx == 0 else [],  # Only show function_callbacks on first message
+                }
+                vms.append(vm)
+        except Exception:
+            continue
+    return vms
+
+
+_SHADOW_COLUMNS = "id, reply_text, model, confidence, reason, created_at, status, actions_json, state_json, json_meta"
+
+
+def _thread_page_size(limit: int | None = None) -> int:
+    if limit is None:
+        try:
+            limit = int(_os.getenv("THREAD_PAGE_SIZE", "50"))
+        except Exception:
+            limit = 50
+    return min(max(int(limit), 1), 500)
+
+
+def _thread_window(session, conversation_id: int, limit: int, before_ts: int | None = None, before_id: int | None = None) -> tuple[list[Any], bool]:
+    """Newest `limit` messages older than the (before_ts, before_id) cursor, chronological; plus has_more."""
+    from sqlmodel import select
+    from sqlalchemy import and_, or_
+
+    stmt = select(Message).where(Message.conversation_id == int(conversation_id))
+    if before_ts is not None:
+        if before_id is not None:
+            stmt = stmt.where(
+                or_(
+                    Message.timestamp_ms < int(before_ts),
+                    and_(Message.timestamp_ms == int(before_ts), Message.id < int(before_id)),
+                )
+            )
+        else:
+            stmt = stmt.where(Message.timestamp_ms < int(before_ts))
+    rows = session.exec(stmt.order_by(Message.timestamp_ms.desc(), Message.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
+
+
+def _shadow_rows(session, conversation_id: int, before_ts: int | None = None, limit: int = 50) -> list[Any]:
+    """Latest `limit` AI drafts (optionally created before before_ts), oldest first."""
+    from sqlalchemy import text as _text
+
+    where = "conversation_id=:cid"
+    params: dict[str, Any] = {"cid": int(conversation_id), "n": int(limit)}
+    if before_ts is not None:
+        where += " AND created_at < :before"
+        # drafts are filtered again on their rendered timestamp; keep a small margin here
+        params["before"] = _d.utcfromtimestamp(int(before_ts) / 1000.0 + 60)
+    rows = session.exec(
+        _text(f"SELECT {_SHADOW_COLUMNS} FROM ai_shadow_reply WHERE {where} ORDER BY created_at DESC, id DESC LIMIT :n").params(**params)
+    ).all()
+    return list(reversed(rows))
+
+
+def _drafts_in_window(vms: list[dict[str, Any]], from_ts: int | None, before_ts: int | None) -> list[dict[str, Any]]:
+    out = []
+    for vm in vms:
+        ts = int(vm.get("timestamp_ms") or 0)
+        if from_ts is not None and ts < from_ts:
+            continue
+        if before_ts is not None and ts >= before_ts:
+            continue
+        out.append(vm)
+    return out
+
+
+def _thread_cursor(msgs: list[Any], has_more: bool) -> dict[str, Any]:
+    first = msgs[0] if msgs else None
+    return {
+        "before_ts": getattr(first, "timestamp_ms", None) if first is not None else None,
+        "before_id": getattr(first, "id", None) if first is not None else None,
+        "has_more": bool(has_more),
+    }
+
+
+# Rows written this close to the watermark may still be uncommitted when it is taken; ids
+# are allocated before commit, so updated_at is also stamped on insert (migration 7) and a
+# late-committing lower id is picked up by the time window instead
+_DELTA_SKEW_MS = 5000
+
+
+def _thread_watermark(session, conversation_id: int) -> str:
+    """Opaque delta cursor: "<max message id>.<max draft id>.<db now ms>"."""
+    from sqlalchemy import text as _text
+
+    row = session.exec(
+        _text(
+            """
+            SELECT
+              (SELECT COALESCE(MAX(id), 0) FROM message WHERE conversation_id=:cid) AS mid,
+              (SELECT COALESCE(MAX(id), 0) FROM ai_shadow_reply WHERE conversation_id=:cid) AS did,
+              CAST(UNIX_TIMESTAMP(NOW(3)) * 1000 AS UNSIGNED) AS now_ms
+            """
+        ).params(cid=int(conversation_id))
+    ).first()
+    if not row:
+        return "0.0.0"
+    return f"{int(row[0] or 0)}.{int(row[1] or 0)}.{int(row[2] or 0)}"
+
+
+def _parse_watermark(value: str | None) -> tuple[int, int, int] | None:
+    try:
+        mid, did, ts = (int(x) for x in str(value or "").split("."))
+        return mid, did, ts
+    except Exception:
+        return None
+
+
+def _message_json(m: Any) -> dict[str, Any]:
+    if isinstance(m, dict):
+        keys = ("draft_id", "direction", "text", "timestamp_ms", "ai_decision_status", "ai_model", "ai_reason", "ai_confidence")
+        return {"kind": "draft", **{k: m.get(k) for k in keys}}
+    return {
+        "kind": "message",
+        "id": m.id,
+        "ig_message_id": m.ig_message_id,
+        "platform": m.platform,
+        "direction": m.direction,
+        "text": m.text,
+        "timestamp_ms": m.timestamp_ms,
+        "ig_sender_id": m.ig_sender_id,
+        "sender_username": m.sender_username,
+        "ai_status": m.ai_status,
+        "sender_type": m.sender_type,
+        "ad_id": m.ad_id,
+        "ad_title": m.ad_title,
+        "story_id": m.story_id,
+    }
+
+
+def _render_thread_fragment(request: Request, session, conversation_id: int, convo: Any, items: list[Any], render_ctx: dict[str, Any], focus_slug: Any) -> str:
+    focus_product = {"slug": focus_slug} if focus_slug else None
+    _alerts, escalation_map = _load_admin_alerts(session, int(conversation_id))
+    tmpl = request.app.state.templates.get_template("_thread_messages.html")
+    return tmpl.render(
+        messages=items,
+        conv_platform=str(getattr(convo, "platform", None) or "instagram"),
+        focus_product=focus_product,
+        escalation_map=escalation_map,
+        **render_ctx,
+    )
+
+
+def _sort_thread_items(items: list[Any]) -> list[Any]:
+    return sorted(items, key=lambda m: (getattr(m, "timestamp_ms", None) if hasattr(m, "timestamp_ms") else (m.get("timestamp_ms") if isinstance(m, dict) else 0)) or 0)
+
+
+@router.get("/inbox/{conversation_id}/messages")
+def thread_messages(
+    request: Request,
+    conversation_id: int,
+    before_ts: int | None = None,
+    before_id: int | None = None,
+    limit: int | None = None,
+    html: bool = False,
+):
+    """JSON page of a thread, newest first window below the cursor (older history on scroll)."""
+    page = _thread_page_size(limit)
+    with get_session() as session:
+        convo = session.get(Conversation, int(conversation_id))
+        if convo is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        msgs, has_more = _thread_window(session, int(conversation_id), page, before_ts=before_ts, before_id=before_id)
+        items: list[Any] = list(msgs)
+        focus_slug = None
+        if _os.getenv("IG_INLINE_DRAFTS", "1") not in ("0", "false", "False"):
+            try:
+                focus_slug, _conf = _detect_focus_product(str(conversation_id), session=session)
+            except Exception:
+                focus_slug = None
+            from_ts = getattr(msgs[0], "timestamp_ms", None) if (msgs and has_more) else None
+            vms = _draft_virtual_messages(_shadow_rows(session, int(conversation_id), before_ts=before_ts), focus_slug)
+            items += _drafts_in_window(vms, from_ts, before_ts)
+        items = _sort_thread_items(items)
+        out: dict[str, Any] = {
+            "conversation_id": int(conversation_id),
+            "messages": [_message_json(m) for m in items],
+            **_thread_cursor(msgs, has_more),
+        }
+        if before_ts is None:
+            out["watermark"] = _thread_watermark(session, int(conversation_id))
+        if html:
+            render_ctx = _message_render_context(session, msgs, enqueue_missing=False)
+            out["html"] = _render_thread_fragment(request, session, int(conversation_id), convo, items, render_ctx, focus_slug)
+        return out
+
+
+@router.get("/inbox/{conversation_id}/delta")
+def thread_delta(request: Request, conversation_id: int, since: str, html: bool = False, limit: int = 200):
+    """
+    Messages/drafts created or changed since the watermark returned by a previous call (or
+    embedded in the thread page). reload=true when the gap is too large to patch in place.
+    """
+    from sqlmodel import select
+    from sqlalchemy import or_
+    from sqlalchemy import text as _text
+
+    wm = _parse_watermark(since)
+    if wm is None:
+        raise HTTPException(status_code=400, detail="invalid watermark")
+    last_mid, last_did, ts_ms = wm
+    since_sec = max(0, ts_ms - _DELTA_SKEW_MS) / 1000.0
+    limit = min(max(int(limit), 1), 500)
+    with get_session() as session:
+        convo = session.get(Conversation, int(conversation_id))
+        if convo is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        # taken first so nothing committed during this request is skipped next time
+        watermark = _thread_watermark(session, int(conversation_id))
+        changed_col = _text("message.updated_at >= FROM_UNIXTIME(:since)").bindparams(since=since_sec)
+        msgs = session.exec(
+            select(Message)
+            .where(Message.conversation_id == int(conversation_id))
+            .where(or_(Message.id > int(last_mid), changed_col))
+            .order_by(Message.timestamp_ms.asc(), Message.id.asc())
+            .limit(limit + 1)
+        ).all()
+        if len(msgs) > limit:
+            return {"reload": True, "watermark": watermark}
+        rows_shadow = session.exec(
+            _text(
+                f"SELECT {_SHADOW_COLUMNS} FROM ai_shadow_reply "
+                "WHERE conversation_id=:cid AND (id > :did OR updated_at >= FROM_UNIXTIME(:since)) "
+                "ORDER BY created_at ASC LIMIT :n"
+            ).params(cid=int(conversation_id), did=int(last_did), since=since_sec, n=limit)
+        ).all()
+        items: list[Any] = list(msgs)
+        focus_slug = None
+        if rows_shadow and _os.getenv("IG_INLINE_DRAFTS", "1") not in ("0", "false", "False"):
+            try:
+                focus_slug, _conf = _detect_focus_product(str(conversation_id), session=session)
+            except Exception:
+                focus_slug = None
+            items += _draft_virtual_messages(list(rows_shadow), focus_slug)
+        items = _sort_thread_items(items)
+        out: dict[str, Any] = {
+            "reload": False,
+            "watermark": watermark,
+            "messages": [_message_json(m) for m in items],
+        }
+        if html and items:
+            render_ctx = _message_render_context(session, list(msgs), enqueue_missing=False)
+            out["html"] = _render_thread_fragment(request, session, int(conversation_id), convo, items, render_ctx, focus_slug)
+        return out
+
+
 @router.get("/inbox/{conversation_id}")
-def thread(request: Request, conversation_id: int, limit: int = 500):
+def thread(request: Request, conversation_id: int, limit: int | None = None):
     import logging
     _log = logging.getLogger("instagram.inbox")
     t0 = time.perf_counter()
     with get_session() as session:
-        from sqlmodel import select
         # Load conversation row (for basic metadata) and messages for this internal id
         convo = session.get(Conversation, int(conversation_id))
         if convo is None:
             raise HTTPException(status_code=404, detail="Conversation not found")
-        msgs = session.exec(
-            select(Message)
-            .where(Message.conversation_id == int(conversation_id))
-            .order_by(Message.timestamp_ms.desc())
-            .limit(min(max(limit, 1), 500))
-        ).all()
-        # chronological order for display
-        msgs = list(reversed(msgs))
-        admin_alerts: list[dict[str, Any]] = []
-        escalation_map: dict[int, list[dict[str, Any]]] = {}
-        try:
-            admin_rows = session.exec(
-                select(AdminMessage)
-                .where(AdminMessage.conversation_id == int(conversation_id))
-                .order_by(AdminMessage.created_at.desc())
-                .limit(50)
-            ).all()
-            for row in admin_rows:
-                try:
-                    meta = json.loads(row.metadata_json) if getattr(row, "metadata_json", None) else {}
-                except Exception:
-                    meta = {}
-                created_at = getattr(row, "created_at", None)
-                try:
-                    ts_ms = int(created_at.timestamp() * 1000) if isinstance(created_at, _d) else None
-                except Exception:
-                    ts_ms = None
-                alert_entry = {
-                    "id": getattr(row, "id", None),
-                    "message": getattr(row, "message", None),
-                    "message_type": getattr(row, "message_type", None),
-                    "is_read": getattr(row, "is_read", False),
-                    "created_at": created_at,
-                    "timestamp_ms": ts_ms,
-                    "metadata": meta,
-                }
-                admin_alerts.append(alert_entry)
-                trigger_id = meta.get("trigger_message_id")
-                if trigger_id:
-                    try:
-                        trigger_key = int(trigger_id)
-                    except (TypeError, ValueError):
-                        continue
-                    escalation_map.setdefault(trigger_key, []).append(
-                        {
-                            "message": getattr(row, "message", None),
-                            "message_type": getattr(row, "message_type", None),
-                            "created_at": getattr(row, "created_at", None),
-                        }
-                    )
-        except Exception:
-            admin_alerts = []
-            escalation_map = {}
+        # Latest page only; older history is fetched on scroll (/messages?before_ts=...)
+        msgs, has_more = _thread_window(session, int(conversation_id), _thread_page_size(limit))
+        thread_cursor = _thread_cursor(msgs, has_more)
+        admin_alerts, escalation_map = _load_admin_alerts(session, int(conversation_id))
         # Determine other party id from messages then resolve username
         other_label = None
         other_username = None
@@ -781,45 +1356,8 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
             link_context["ad_edit_url"] = None
             link_context["link_edit_label"] = None
 
-        # Resolve per-message sender usernames via ig_users only.
-        # Enqueue missing ones for background enrichment instead of fetching inline.
-        usernames: dict[str, str] = {}
-        ad_ids: list[str] = []
-        try:
-            sender_ids: list[str] = []
-            for mm in msgs:
-                if mm.ig_sender_id:
-                    sid = str(mm.ig_sender_id)
-                    if sid not in sender_ids:
-                        sender_ids.append(sid)
-                try:
-                    if mm.ad_id:
-                        aid = str(mm.ad_id)
-                        if aid not in ad_ids:
-                            ad_ids.append(aid)
-                except Exception:
-                    pass
-            if sender_ids:
-                placeholders = ",".join([":p" + str(i) for i in range(len(sender_ids))])
-                from sqlalchemy import text as _text
-                params = {("p" + str(i)): sender_ids[i] for i in range(len(sender_ids))}
-                rows_u = session.exec(_text(f"SELECT ig_user_id, username FROM ig_users WHERE ig_user_id IN ({placeholders})")).params(**params).all()
-                ids_without_username: list[str] = []
-                for r in rows_u:
-                    uid = r.ig_user_id if hasattr(r, "ig_user_id") else r[0]
-                    un = r.username if hasattr(r, "username") else r[1]
-                    if uid and un:
-                        usernames[str(uid)] = str(un)
-                    elif uid:
-                        ids_without_username.append(str(uid))
-                # Enrich kuyruğuna az sayıda ekle (sayfa yükü gecikmesin; geri kalanı başka tetiklemede dolar)
-                try:
-                    for uid in ids_without_username[:5]:
-                        enqueue("enrich_user", key=str(uid), payload={"ig_user_id": str(uid)})
-                except Exception:
-                    pass
-        except Exception:
-            usernames = {}
+        render_ctx = _message_render_context(session, msgs)
+        usernames = render_ctx["usernames"]
 
         # Detect focus product once (reuse session to avoid extra connection)
         try:
@@ -856,198 +1394,14 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
             except Exception:
                 focus_product = None
 
-        # Fetch cached ads for messages in this thread
-        ads_cache: dict[str, dict[str, Any]] = {}
-        ad_products: dict[str, dict[str, Any]] = {}
-        try:
-            if ad_ids:
-                placeholders = ",".join([":a" + str(i) for i in range(len(ad_ids))])
-                from sqlalchemy import text as _text
-                params = {("a" + str(i)): ad_ids[i] for i in range(len(ad_ids))}
-                stmt_ads = _text(f"SELECT ad_id, name, image_url, link FROM ads WHERE ad_id IN ({placeholders})").bindparams(**params)
-                rows_ad = session.exec(stmt_ads).all()
-                for r in rows_ad:
-                    aid = r.ad_id if hasattr(r, "ad_id") else r[0]
-                    name = r.name if hasattr(r, "name") else (r[1] if len(r) > 1 else None)
-                    img = r.image_url if hasattr(r, "image_url") else (r[2] if len(r) > 2 else None)
-                    lnk = r.link if hasattr(r, "link") else (r[3] if len(r) > 3 else None)
-                    ads_cache[str(aid)] = {"name": name, "image_url": img, "link": lnk}
-                # Enrich with linked product info
-                try:
-                    stmt_ap = _text(
-                        f"""
-                        SELECT ap.ad_id, ap.product_id, p.name AS product_name
-                        FROM ads_products ap
-                        LEFT JOIN product p ON ap.product_id = p.id
-                        WHERE ap.ad_id IN ({placeholders})
-                        """
-                    ).bindparams(**params)
-                    rows_ap = session.exec(stmt_ap).all()
-                    for r in rows_ap:
-                        try:
-                            aid = getattr(r, "ad_id", None) if hasattr(r, "ad_id") else (r[0] if len(r) > 0 else None)
-                            pid = getattr(r, "product_id", None) if hasattr(r, "product_id") else (r[1] if len(r) > 1 else None)
-                            pname = getattr(r, "product_name", None) if hasattr(r, "product_name") else (r[2] if len(r) > 2 else None)
-                            if not aid:
-                                continue
-                            ad_products[str(aid)] = {"product_id": pid, "product_name": pname}
-                        except Exception:
-                            continue
-                except Exception:
-                    ad_products = {}
-        except Exception:
-            ads_cache = {}
-            ad_products = {}
-
-        # Build attachment indices so template can render images (fallback: legacy attachments_json)
-        att_map = {}
-        template_cards: dict[str, list[dict[str, Any]]] = {}
-        for mm in msgs:
-            if not mm.attachments_json:
-                continue
-            try:
-                data = json.loads(mm.attachments_json)
-                items = []
-                if isinstance(data, list):
-                    items = data
-                elif isinstance(data, dict) and isinstance(data.get("data"), list):
-                    items = data["data"]
-                if items:
-                    mid_key = mm.ig_message_id or ""
-                    att_map[mid_key] = list(range(len(items)))
-                    cards: list[dict[str, Any]] = []
-                    for att in items:
-                        if not isinstance(att, dict):
-                            continue
-                        payload = att.get("payload") or {}
-                        generic = payload.get("generic") or {}
-                        elements = None
-                        if isinstance(generic, dict) and isinstance(generic.get("elements"), list):
-                            elements = generic.get("elements")
-                        elif isinstance(payload.get("elements"), list):
-                            elements = payload.get("elements")
-                        elif isinstance(payload.get("cards"), list):
-                            elements = payload.get("cards")
-                        if not isinstance(elements, list):
-                            continue
-                        for el in elements:
-                            if not isinstance(el, dict):
-                                continue
-                            cards.append(
-                                {
-                                    "title": el.get("title") or el.get("header"),
-                                    "subtitle": el.get("subtitle") or el.get("description"),
-                                    "image_url": el.get("image_url") or el.get("image") or el.get("media_url"),
-                                    "buttons": el.get("buttons") or [],
-                                    "default_action": el.get("default_action") or {},
-                                }
-                            )
-                    if cards:
-                        template_cards[mid_key] = cards
-            except Exception:
-                pass
-        # New: Build local attachment id map from attachments table
-        att_ids_map = {}
-        try:
-            # Map message.id -> ig_message_id
-            msgid_to_mid = {}
-            msg_ids = []
-            for mm in msgs:
-                if mm.id:
-                    msg_ids.append(mm.id)
-                    msgid_to_mid[int(mm.id)] = mm.ig_message_id or ""
-            if msg_ids:
-                # Build a parameterized IN clause
-                placeholders = ",".join([":p" + str(i) for i in range(len(msg_ids))])
-                from sqlalchemy import text as _text
-                params = {("p" + str(i)): int(msg_ids[i]) for i in range(len(msg_ids))}
-                # Only include attachments that are already fetched to avoid 404s on /ig/media/local/*
-                rows = session.exec(_text(f"SELECT id, message_id, position, storage_path, fetch_status FROM attachments WHERE message_id IN ({placeholders}) ORDER BY position ASC")).params(**params).all()
-                for r in rows:
-                    att_id = r.id if hasattr(r, "id") else r[0]
-                    m_id = r.message_id if hasattr(r, "message_id") else r[1]
-                    pos = r.position if hasattr(r, "position") else r[2]
-                    sp = r.storage_path if hasattr(r, "storage_path") else (r[3] if len(r) > 3 else None)
-                    fs = r.fetch_status if hasattr(r, "fetch_status") else (r[4] if len(r) > 4 else None)
-                    mid = msgid_to_mid.get(int(m_id)) or ""
-                    # Only map to local ids when we actually have a file on disk
-                    if mid and sp and str(sp).strip() and str(fs or "").lower() == "ok":
-                        att_ids_map.setdefault(mid, []).append(int(att_id))
-        except Exception:
-            att_ids_map = {}
-        # Additionally, if attachments_json is missing but we have attachment rows,
-        # build a positions list so template can stream directly from Graph.
-        try:
-            if msg_ids:
-                from sqlalchemy import text as _text
-                placeholders = ",".join([":q" + str(i) for i in range(len(msg_ids))])
-                params = {("q" + str(i)): int(msg_ids[i]) for i in range(len(msg_ids))}
-                rows_pos = session.exec(_text(f"SELECT message_id, position FROM attachments WHERE message_id IN ({placeholders}) ORDER BY position ASC")).params(**params).all()
-                # message_id -> [positions...]
-                tmp: dict[int, list[int]] = {}
-                for r in rows_pos:
-                    m_id = r.message_id if hasattr(r, "message_id") else r[0]
-                    pos = r.position if hasattr(r, "position") else (r[1] if len(r) > 1 else None)
-                    if m_id is None or pos is None:
-                        continue
-                    tmp.setdefault(int(m_id), []).append(int(pos))
-                # convert to ig_message_id -> positions only when attachments_json did not already provide mapping
-                for mid_internal, positions in tmp.items():
-                    mid = msgid_to_mid.get(int(mid_internal)) or ""
-                    if not mid:
-                        continue
-                    if mid not in att_map and positions:
-                        att_map[mid] = positions
-        except Exception:
-            pass
         templates = request.app.state.templates
         # Fetch latest AI shadow drafts for this conversation (limit 50 for faster load; enough for inline display).
         # Intro-only path stores minimal state (hail_sent, cart); full path stores full state; both are handled.
         shadow = None
         rows_shadow: list[Any] = []
         try:
-            from sqlalchemy import text as _text
-            rows_shadow = session.exec(
-                _text(
-                    "SELECT id, reply_text, model, confidence, reason, created_at, status, actions_json, state_json, json_meta FROM ai_shadow_reply WHERE conversation_id=:cid ORDER BY created_at ASC LIMIT 50"
-                ).params(cid=int(conversation_id))
-            ).all()
+            rows_shadow = _shadow_rows(session, int(conversation_id))
             # Represent the last one (if any) in 'shadow' for legacy panel rendering
-            def _parse_actions(raw_val: Any) -> list[dict[str, Any]]:
-                if not raw_val:
-                    return []
-                try:
-                    if isinstance(raw_val, str):
-                        parsed = json.loads(raw_val)
-                    else:
-                        parsed = raw_val
-                    if isinstance(parsed, list):
-                        return parsed  # type: ignore[return-value]
-                except Exception:
-                    pass
-                return []
-            
-            def _parse_function_callbacks(raw_val: Any) -> list[dict[str, Any]]:
-                """Parse function_callbacks from json_meta. Intro-only replies have no tools, so json_meta may lack this key."""
-                if not raw_val:
-                    return []
-                try:
-                    if isinstance(raw_val, str):
-                        parsed = json.loads(raw_val)
-                    else:
-                        parsed = raw_val
-                    if isinstance(parsed, dict):
-                        # Intro-only path stores debug_meta (intro_only, user_payload, ...) without function_callbacks
-                        callbacks = parsed.get("function_callbacks", [])
-                        if isinstance(callbacks, list):
-                            return callbacks  # type: ignore[return-value]
-                        return []
-                    elif isinstance(parsed, list):
-                        return parsed  # type: ignore[return-value]
-                except Exception:
-                    pass
-                return []
-            
             if rows_shadow:
                 rlast = rows_shadow[-1]
                 reply_text_raw = getattr(rlast, "reply_text", None) if hasattr(rlast, "reply_text") else (rlast[1] if len(rlast) > 1 else None)
@@ -1066,20 +1420,6 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
                     if not lines:
                         lines = [str(reply_text_raw).strip()] if str(reply_text_raw).strip() else []
                     reply_text_lines = lines
-                def _parse_state(raw_val: Any) -> dict[str, Any]:
-                    if not raw_val:
-                        return {}
-                    if isinstance(raw_val, dict):
-                        return raw_val  # type: ignore[return-value]
-                    try:
-                        if isinstance(raw_val, str):
-                            parsed = json.loads(raw_val)
-                            if isinstance(parsed, dict):
-                                return parsed  # type: ignore[return-value]
-                    except Exception:
-                        return {}
-                    return {}
-
                 json_meta_raw = getattr(rlast, "json_meta", None) if hasattr(rlast, "json_meta") else (rlast[9] if len(rlast) > 9 else None)
                 function_callbacks_list = _parse_function_callbacks(json_meta_raw)
 
@@ -1120,75 +1460,9 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
         inline_drafts = (_os.getenv("IG_INLINE_DRAFTS", "1") not in ("0", "false", "False"))
         if inline_drafts and rows_shadow:
             # Reuse focus_slug already computed above (no second _detect_focus_product call)
-            vms: list[dict] = []
-            for rr in rows_shadow:
-                try:
-                    txt = getattr(rr, "reply_text", None) if hasattr(rr, "reply_text") else (rr[1] if len(rr) > 1 else None)
-                    status = getattr(rr, "status", None) if hasattr(rr, "status") else (rr[6] if len(rr) > 6 else None)
-                    actions_val = getattr(rr, "actions_json", None) if hasattr(rr, "actions_json") else (rr[7] if len(rr) > 7 else None)
-                    state_val = getattr(rr, "state_json", None) if hasattr(rr, "state_json") else (rr[8] if len(rr) > 8 else None)
-                    json_meta_val = getattr(rr, "json_meta", None) if hasattr(rr, "json_meta") else (rr[9] if len(rr) > 9 else None)
-                    confidence_val = getattr(rr, "confidence", None) if hasattr(rr, "confidence") else (rr[3] if len(rr) > 3 else None)
-                    state_dict = _parse_state(state_val)
-                    actions_list = _parse_actions(actions_val)
-                    function_callbacks_vm = _parse_function_callbacks(json_meta_val)
-                    # Include all records, even if empty text (for no_reply decisions)
-                    if not txt:
-                        txt = ""  # Will be handled in template
-                    
-                    # Decode any escape sequences that might still be in the stored text
-                    if txt:
-                        from ..services.ai_reply import _decode_escape_sequences
-                        txt = _decode_escape_sequences(str(txt))
-                        txt = _sanitize_reply_text(str(txt))
-                    # Split text by newlines to show as separate messages
-                    text_lines = []
-                    if txt:
-                        lines = [line.strip() for line in str(txt).split('\n') if line.strip()]
-                        if not lines:
-                            lines = [str(txt).strip()]
-                        text_lines = lines
-                    else:
-                        text_lines = [""]
-                    
-                    did = getattr(rr, "id", None) if hasattr(rr, "id") else (rr[0] if len(rr) > 0 else None)
-                    ca = getattr(rr, "created_at", None) if hasattr(rr, "created_at") else (rr[5] if len(rr) > 5 else None)
-                    ts = None
-                    if ca:
-                        try:
-                            ts = _d.fromisoformat(ca.replace("Z","+00:00")).timestamp()*1000 if isinstance(ca, str) else (ca.timestamp()*1000)
-                            ts = int(ts)
-                        except Exception:
-                            ts = None
-                    # Normalize status for template
-                    normalized_status = (status or "suggested").lower()
-                    if normalized_status not in ["sent", "error", "no_reply", "suggested", "dismissed", "expired"]:
-                        normalized_status = "suggested"
-                    
-                    # Create a separate virtual message for each line
-                    for line_idx, line_text in enumerate(text_lines):
-                        vm = {
-                            "direction": "out",
-                            "text": line_text,
-                            "timestamp_ms": ts or 0,
-                            "sender_username": "AI",
-                            "ig_message_id": None,
-                            "ig_sender_id": None,
-                            "ig_recipient_id": None,
-                            "is_ai_draft": True,
-                            "ai_decision_status": normalized_status,  # Pass status to template
-                            "draft_id": int(did) if did is not None else None,
-                            "ai_model": getattr(rr, "model", None) if hasattr(rr, "model") else (rr[2] if len(rr) > 2 else None),
-                            "ai_reason": getattr(rr, "reason", None) if hasattr(rr, "reason") else (rr[4] if len(rr) > 4 else None),
-                            "ai_confidence": confidence_val,
-                            "product_slug": focus_slug or None,
-                            "ai_actions": actions_list if line_idx == 0 else [],  # Only show actions on first message
-                            "ai_state": state_dict if state_dict else None,
-                            "ai_function_callbacks": function_callbacks_vm if line_idx == 0 else [],  # Only show function_callbacks on first message
-                        }
-                        vms.append(vm)
-                except Exception:
-                    continue
+            vms = _draft_virtual_messages(rows_shadow, focus_slug)
+            if thread_cursor["has_more"]:
+                vms = _drafts_in_window(vms, thread_cursor["before_ts"], None)
             msgs = list(msgs) + vms
             try:
                 msgs.sort(key=lambda m: (getattr(m, "timestamp_ms", None) if hasattr(m, "timestamp_ms") else (m.get("timestamp_ms") if isinstance(m, dict) else 0)) or 0)
@@ -1302,6 +1576,11 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
             assignable_users = []
             current_assignment = None
 
+        try:
+            thread_watermark = _thread_watermark(session, int(conversation_id))
+        except Exception:
+            thread_watermark = None
+
         duration_sec = time.perf_counter() - t0
         try:
             _log.info("thread load conversation_id=%s duration_sec=%.2f", conversation_id, duration_sec)
@@ -1315,11 +1594,12 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
                 "messages": msgs,
                 "other_label": other_label,
                 "enrich": enrich_status,
-                "att_map": att_map,
-                "att_ids_map": att_ids_map,
+                "att_map": render_ctx["att_map"],
+                "att_ids_map": render_ctx["att_ids_map"],
+                "att_sha_map": render_ctx["att_sha_map"],
                 "usernames": usernames,
-                "ads_cache": ads_cache,
-                "ad_products": ad_products,
+                "ads_cache": render_ctx["ads_cache"],
+                "ad_products": render_ctx["ad_products"],
                 "focus_product": focus_product,
                 "contact_name": contact_name,
                 "contact_phone": contact_phone,
@@ -1334,30 +1614,90 @@ def thread(request: Request, conversation_id: int, limit: int = 500):
 				"admin_alerts": admin_alerts,
 				"escalation_map": escalation_map,
                 "user_context": user_context,
-                "template_cards": template_cards,
+                "template_cards": render_ctx["template_cards"],
                 "public_conversation_id": public_conversation_id,
                 "conversation_platform": str(getattr(convo, "platform", None) or "instagram"),
                 "brand_profile": brand_profile,
                 "assignable_users": assignable_users,
                 "current_assignment": current_assignment,
                 "last_message_direction": last_message_direction,
+                "thread_cursor": thread_cursor,
+                "thread_watermark": thread_watermark,
             },
         )
 
 
-@router.get("/media/local/{attachment_id}")
-def serve_media_local(attachment_id: int):
-    # Stream from local FS using attachments.storage_path
+def _attachment_source(attachment_id: int):
     from sqlalchemy import text
     with get_session() as session:
-        row = session.exec(text("SELECT storage_path, mime FROM attachments WHERE id=:id")).params(id=attachment_id).first()
-        if not row:
-            raise HTTPException(status_code=404, detail="Attachment not found")
-        storage_path = row.storage_path if hasattr(row, "storage_path") else row[0]
-        mime = row.mime if hasattr(row, "mime") else (row[1] if len(row) > 1 else None)
-        if not storage_path or not Path(storage_path).exists():
-            raise HTTPException(status_code=404, detail="File not found")
-        return FileResponse(storage_path, media_type=(mime or "application/octet-stream"))
+        row = session.exec(
+            text("SELECT storage_path, mime, checksum_sha256 FROM attachments WHERE id=:id").params(id=attachment_id)
+        ).first()
+        if not row or not row[0]:
+            return None
+        return str(row[0]), row[1], row[2]
+
+
+def _cached_attachment_source(attachment_id: int):
+    from ..services.media_serving import attachment_cache
+    src = attachment_cache.get(attachment_id, _attachment_source)
+    if src and not Path(src[0]).exists():
+        # refetched or moved since it was cached: look it up again
+        attachment_cache.invalidate(attachment_id)
+        src = attachment_cache.get(attachment_id, _attachment_source)
+    return src
+
+
+@router.get("/media/local/{attachment_id}")
+def serve_media_local(request: Request, attachment_id: int):
+    # Stream from local FS using attachments.storage_path (ETag/304/Range aware)
+    from ..services.media_serving import attachment_cache_control, file_etag, serve_file
+    src = _cached_attachment_source(attachment_id)
+    if not src:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    storage_path, mime, checksum = src
+    path = Path(storage_path)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    return serve_file(
+        request,
+        path,
+        mime or "application/octet-stream",
+        etag=file_etag(path, checksum),
+        cache_control=attachment_cache_control(request, checksum),
+    )
+
+
+@router.get("/media/local/{attachment_id}/thumb/{spec}")
+async def serve_media_thumb(request: Request, attachment_id: int, spec: str):
+    # Resized variant (avatar|preview|card), rendered on first request in the derivative pool
+    from ..services.derivatives import SPECS, get_derivative, negotiate_format
+    from ..services.media_serving import attachment_cache_control, file_etag, serve_file
+    from ..services.offload import run_db
+    if spec not in SPECS:
+        raise HTTPException(status_code=404, detail="Unknown size")
+    src = await run_db(_cached_attachment_source, attachment_id)
+    if not src:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    storage_path, mime, checksum = src
+    if not checksum or not str(mime or "").startswith("image"):
+        raise HTTPException(status_code=404, detail="No image")
+    if not Path(storage_path).exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    cache_control = attachment_cache_control(request, checksum)
+    fmt = negotiate_format(request.headers.get("accept"))
+    path = await get_derivative(Path(storage_path), str(checksum), spec, fmt)
+    if path is None:
+        # undecodable image: fall back to the original
+        return serve_file(request, Path(storage_path), mime or "application/octet-stream", etag=file_etag(Path(storage_path), checksum), cache_control=cache_control)
+    return serve_file(
+        request,
+        path,
+        "image/webp" if fmt == "webp" else "image/jpeg",
+        etag=file_etag(path, str(checksum), variant=f"{spec}.{fmt}"),
+        cache_control=cache_control,
+        extra_headers={"Vary": "Accept"},
+    )
 
 
 @router.post("/inbox/{conversation_id}/refresh")
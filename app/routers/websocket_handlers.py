@@ -1,23 +1,15 @@
+import json
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-router = APIRouter()
+from ..services.event_bus import hub, publish_async
 
-# simple in-memory websocket registry (single-process)
-connections: set[WebSocket] = set()
+router = APIRouter()
 
 
 async def broadcast_event(data: dict) -> None:
-    dead: list[WebSocket] = []
-    for ws in list(connections):
-        try:
-            await ws.send_json(data)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        try:
-            connections.discard(ws)
-        except Exception:
-            pass
+    # goes through Redis so sockets held by other web processes/pods see it too
+    await publish_async(data)
 
 
 async def notify_new_message(event: dict) -> None:
@@ -25,21 +17,34 @@ async def notify_new_message(event: dict) -> None:
     await broadcast_event(event)
 
 
+def _conversation_keys(value) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(v) for v in value if v is not None and str(v)]
+    return [s.strip() for s in str(value).split(",") if s.strip()]
+
+
 @router.websocket("/ws")
 async def ws_inbox(websocket: WebSocket):
+    """Inbox/thread live events. ?conversation=<pk or public id>[,...] limits the stream;
+    clients may also send {"subscribe": [...]} / {"unsubscribe": [...]} at any time."""
     await websocket.accept()
-    connections.add(websocket)
+    client = await hub.register(websocket, _conversation_keys(websocket.query_params.get("conversation")))
     try:
         while True:
-            # we do not use incoming messages; keep the socket open
-            await websocket.receive_text()
+            raw = await websocket.receive_text()
+            try:
+                msg = json.loads(raw)
+            except Exception:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            client.conversations.update(_conversation_keys(msg.get("subscribe")))
+            client.conversations.difference_update(_conversation_keys(msg.get("unsubscribe")))
     except WebSocketDisconnect:
-        try:
-            connections.discard(websocket)
-        except Exception:
-            pass
+        pass
     except Exception:
-        try:
-            connections.discard(websocket)
-        except Exception:
-            pass
+        pass
+    finally:
+        await hub.unregister(client)
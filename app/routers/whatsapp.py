@@ -12,6 +12,7 @@ from sqlalchemy import text
 from starlette.requests import ClientDisconnect
 
 from ..db import get_session
+from ..services.offload import run_db
 from ..services.queue import enqueue
 
 
@@ -93,12 +94,6 @@ async def receive_events(request: Request):
 
     try:
         payload: Dict[str, Any] = json.loads(body.decode("utf-8"))
-        payload_path = _persist_payload_to_disk(payload, body)
-        if payload_path:
-            try:
-                _log.info("WA webhook POST: payload written to %s", payload_path)
-            except Exception:
-                pass
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
@@ -110,6 +105,19 @@ async def receive_events(request: Request):
             pass
         return {"status": "ignored"}
 
+    # Disk + MySQL writes run on the DB thread pool, not on the event loop
+    raw_event_id = await run_db(_store_raw_event_sync, payload, body, signature)
+    return {"status": "ok", "raw_event_id": raw_event_id}
+
+
+def _store_raw_event_sync(payload: Dict[str, Any], body: bytes, signature: Optional[str]) -> Optional[int]:
+    payload_path = _persist_payload_to_disk(payload, body)
+    if payload_path:
+        try:
+            _log.info("WA webhook POST: payload written to %s", payload_path)
+        except Exception:
+            pass
+
     uniq_hash = hashlib.sha256(body).hexdigest()
     raw_event_id = None
 
@@ -155,4 +163,4 @@ async def receive_events(request: Request):
             enqueue("ingest", key=str(raw_event_id), payload={"raw_event_id": int(raw_event_id)})
         except Exception:
             pass
-    return {"status": "ok", "raw_event_id": raw_event_id}
+    return raw_event_id
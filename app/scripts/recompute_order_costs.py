@@ -1,9 +1,9 @@
 import argparse
 import datetime as dt
-from sqlmodel import Session, select
+from sqlmodel import select
 
-from ..db import engine
 from ..models import Order
+from ..services.batching import Checkpoint, Progress, Throttle, run_keyset
 from ..services.inventory import calculate_order_cost_fifo
 
 CANCEL_STATUSES = {"refunded", "switched", "stitched", "cancelled"}
@@ -15,21 +15,27 @@ def _parse_date(val: str | None):
     return dt.date.fromisoformat(val)
 
 
-def recompute(start: dt.date | None, end: dt.date | None, batch: int = 200) -> tuple[int, int]:
+def recompute(
+    start: dt.date | None,
+    end: dt.date | None,
+    batch: int = 200,
+    resume: bool = False,
+    sleep: float | None = None,
+) -> tuple[int, int]:
     """Recompute FIFO cost for orders and persist to total_cost.
 
+    Orders are read in keyset pages by id and each page is committed on its own, so
+    memory stays flat and row locks are held for one batch only. --resume continues
+    after the last committed page.
+
     Returns (updated_count, error_count).
     """
-    updated = 0
     errors = 0
-    with Session(engine) as session:
-        q = select(Order)
-        if start:
-            q = q.where(Order.data_date >= start)
-        if end:
-            q = q.where(Order.data_date <= end)
-        rows = session.exec(q).all()
-        for idx, o in enumerate(rows, start=1):
+
+    def _batch(session, rows) -> int:
+        nonlocal errors
+        n = 0
+        for o in rows:
             try:
                 if (o.status or "") in CANCEL_STATUSES:
                     cost = 0.0
@@ -37,12 +43,26 @@ def recompute(start: dt.date | None, end: dt.date | None, batch: int = 200) -> t
                     cost = float(calculate_order_cost_fifo(session, int(o.id)))
                 o.total_cost = cost
                 session.add(o)
-                updated += 1
+                n += 1
             except Exception:
                 errors += 1
-            if idx % batch == 0:
-                session.commit()
-        session.commit()
+        return n
+
+    q = select(Order)
+    if start:
+        q = q.where(Order.data_date >= start)
+    if end:
+        q = q.where(Order.data_date <= end)
+    updated = run_keyset(
+        q,
+        Order.id,
+        _batch,
+        batch_size=batch,
+        checkpoint=Checkpoint(f"recompute_order_costs:{start}:{end}"),
+        resume=resume,
+        throttle=Throttle(sleep=sleep),
+        progress=Progress("recompute_order_costs"),
+    )
     return updated, errors
 
 
@@ -51,10 +71,12 @@ def main():
     parser.add_argument("--start", help="Start data_date (YYYY-MM-DD)", default=None)
     parser.add_argument("--end", help="End data_date (YYYY-MM-DD)", default=None)
     parser.add_argument("--batch", type=int, default=200, help="Commit batch size")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last committed batch")
+    parser.add_argument("--sleep", type=float, default=None, help="Pause between batches (default BATCH_SLEEP)")
     args = parser.parse_args()
     start = _parse_date(args.start)
     end = _parse_date(args.end)
-    updated, errors = recompute(start, end, batch=args.batch)
+    updated, errors = recompute(start, end, batch=args.batch, resume=args.resume, sleep=args.sleep)
     print(f"Recompute finished. Updated={updated} Errors={errors} Range start={start} end={end}")
 
 
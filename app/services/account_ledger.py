@@ -0,0 +1,396 @@
+"""
+Running account balances (account_balance + account_balance_daily).
+
+Every Income/Cost insert, update, soft delete (deleted_at set/cleared) or delete flushed
+through the ORM adjusts the per-account totals and the per-day deltas in the same
+transaction (after_flush hook), so the income/cost/transfer/IBAN paths stay consistent
+without touching each call site. Balance = account.initial_balance + income_total -
+expense_total, i.e. one row read per account instead of two SUMs over full history.
+
+Entries without a date are booked on DATE(created_at). Reads use the ledger only after
+a full rebuild has marked it ready (system_settings.account_ledger_ready); until then
+finance falls back to aggregating income/cost. check_account_ledger() recomputes from
+scratch and reports drift: scripts/rebuild_account_ledger.py --check.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func, inspect as _inspect, text as _text
+from sqlalchemy.orm import Session as _OrmSession
+from sqlmodel import select
+
+from ..db import get_session
+from ..models import Account, AccountBalance, AccountBalanceDaily, Cost, Income, SystemSetting
+
+
+log = logging.getLogger("account_ledger")
+
+READY_SETTING_KEY = "account_ledger_ready"
+
+# amounts are FLOAT columns; anything below this is rounding noise, not drift
+DRIFT_EPSILON = 0.01
+
+_ready = False
+_ready_checked_at = 0.0
+
+# deltas[(account_id, day)] = [income_delta, expense_delta]
+_Deltas = Dict[Tuple[int, dt.date], List[float]]
+
+
+def _entry_day(date: Optional[dt.date], created_at: Optional[dt.datetime]) -> dt.date:
+	if date is not None:
+		return date
+	if created_at is not None:
+		return created_at.date()
+	return dt.datetime.utcnow().date()
+
+
+def _accumulate(
+	deltas: _Deltas,
+	kind: str,
+	account_id: Optional[int],
+	amount: Optional[float],
+	day: dt.date,
+	deleted_at: Optional[dt.datetime],
+	sign: int,
+) -> None:
+	"""Add (sign=+1) or reverse (sign=-1) the effect of one live income/cost entry."""
+	if account_id is None or deleted_at is not None or not amount:
+		return
+	d = deltas.setdefault((int(account_id), day), [0.0, 0.0])
+	if kind == "income":
+		d[0] += sign * float(amount)
+	else:
+		d[1] += sign * float(amount)
+
+
+_UPSERT_BALANCE_SQL = _text(
+	"""
+	INSERT INTO account_balance(account_id, income_total, expense_total, updated_at)
+	VALUES (:account_id, :income, :expense, :now)
+	ON DUPLICATE KEY UPDATE
+	  income_total = income_total + VALUES(income_total),
+	  expense_total = expense_total + VALUES(expense_total),
+	  updated_at = VALUES(updated_at)
+	"""
+)
+
+_UPSERT_DAILY_SQL = _text(
+	"""
+	INSERT INTO account_balance_daily(account_id, day, income, expense)
+	VALUES (:account_id, :day, :income, :expense)
+	ON DUPLICATE KEY UPDATE
+	  income = income + VALUES(income),
+	  expense = expense + VALUES(expense)
+	"""
+)
+
+
+def _apply(connection: Any, deltas: _Deltas) -> None:
+	if not deltas:
+		return
+	now = dt.datetime.utcnow()
+	totals: Dict[int, List[float]] = {}
+	for (aid, _day), (inc, exp) in deltas.items():
+		t = totals.setdefault(aid, [0.0, 0.0])
+		t[0] += inc
+		t[1] += exp
+	# balance rows first, sorted by account_id: concurrent writers (and the rebuild) lock
+	# them in the same order before touching the daily rows
+	connection.execute(
+		_UPSERT_BALANCE_SQL,
+		[{"account_id": aid, "income": t[0], "expense": t[1], "now": now} for aid, t in sorted(totals.items())],
+	)
+	connection.execute(
+		_UPSERT_DAILY_SQL,
+		[
+			{"account_id": aid, "day": day, "income": d[0], "expense": d[1]}
+			for (aid, day), d in sorted(deltas.items())
+		],
+	)
+
+
+def _history_value(state: Any, name: str) -> Any:
+	hist = state.attrs[name].history
+	if hist.deleted:
+		return hist.deleted[0]
+	if hist.unchanged:
+		return hist.unchanged[0]
+	return getattr(state.object, name)
+
+
+def _kind(obj: Any) -> Optional[str]:
+	if isinstance(obj, Income):
+		return "income"
+	if isinstance(obj, Cost):
+		return "expense"
+	return None
+
+
+_TRACKED = ("account_id", "amount", "date", "deleted_at")
+
+
+def _keep_old_value(target, value, oldvalue, initiator):  # noqa: ANN001
+	return value
+
+
+# active_history: assigning to an expired instance still loads the previous value, so the
+# flush hook can reverse it instead of seeing only the new one
+for _model in (Income, Cost):
+	for _name in _TRACKED:
+		event.listen(getattr(_model, _name), "set", _keep_old_value, active_history=True, retval=True)
+
+
+@event.listens_for(_OrmSession, "after_flush")
+def _account_ledger_after_flush(session, flush_context) -> None:
+	deltas: _Deltas = {}
+	for obj in session.new:
+		kind = _kind(obj)
+		if kind:
+			_accumulate(deltas, kind, obj.account_id, obj.amount, _entry_day(obj.date, obj.created_at), obj.deleted_at, +1)
+	for obj in session.deleted:
+		kind = _kind(obj)
+		if kind:
+			state = _inspect(obj)
+			_accumulate(
+				deltas,
+				kind,
+				_history_value(state, "account_id"),
+				_history_value(state, "amount"),
+				_entry_day(_history_value(state, "date"), _history_value(state, "created_at")),
+				_history_value(state, "deleted_at"),
+				-1,
+			)
+	for obj in session.dirty:
+		kind = _kind(obj)
+		if not kind:
+			continue
+		state = _inspect(obj)
+		if not any(state.attrs[n].history.has_changes() for n in _TRACKED):
+			continue
+		_accumulate(
+			deltas,
+			kind,
+			_history_value(state, "account_id"),
+			_history_value(state, "amount"),
+			_entry_day(_history_value(state, "date"), obj.created_at),
+			_history_value(state, "deleted_at"),
+			-1,
+		)
+		_accumulate(deltas, kind, obj.account_id, obj.amount, _entry_day(obj.date, obj.created_at), obj.deleted_at, +1)
+	# an edit that does not move money (e.g. notes) nets out to zero
+	deltas = {k: v for k, v in deltas.items() if abs(v[0]) > 1e-9 or abs(v[1]) > 1e-9}
+	if deltas:
+		_apply(session.connection(), deltas)
+
+
+def account_ledger_ready(session) -> bool:
+	"""True once a full rebuild has populated the ledger (cached; rechecked every 30s until then)."""
+	global _ready, _ready_checked_at
+	if _ready:
+		return True
+	now = time.monotonic()
+	if now - _ready_checked_at < 30:
+		return False
+	_ready_checked_at = now
+	try:
+		row = session.exec(select(SystemSetting).where(SystemSetting.key == READY_SETTING_KEY)).first()
+		_ready = bool(row and str(row.value).strip() == "1")
+	except Exception:
+		_ready = False
+	return _ready
+
+
+def read_balances(session, account_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+	"""initial_balance + income_total - expense_total; one joined row per account."""
+	q = select(Account.id, Account.initial_balance, AccountBalance.income_total, AccountBalance.expense_total).outerjoin(
+		AccountBalance, AccountBalance.account_id == Account.id
+	)
+	if account_ids is not None:
+		ids = sorted({int(i) for i in account_ids if i is not None})
+		if not ids:
+			return {}
+		q = q.where(Account.id.in_(ids))
+	else:
+		q = q.where(Account.is_active == True)
+	return {
+		int(aid): float(initial or 0.0) + float(inc or 0.0) - float(exp or 0.0)
+		for aid, initial, inc, exp in session.exec(q).all()
+		if aid is not None
+	}
+
+
+def read_net_before(session, account_id: int, day: dt.date) -> float:
+	"""Net movement (income - expense) booked strictly before `day`, from the daily deltas."""
+	row = session.exec(
+		select(func.sum(AccountBalanceDaily.income), func.sum(AccountBalanceDaily.expense))
+		.where(AccountBalanceDaily.account_id == int(account_id))
+		.where(AccountBalanceDaily.day < day)
+	).first()
+	if not row:
+		return 0.0
+	return float(row[0] or 0.0) - float(row[1] or 0.0)
+
+
+def aggregate_totals(session, account_ids: List[int]) -> Dict[int, Tuple[float, float]]:
+	"""(income_total, expense_total) per account straight from income/cost (two grouped queries)."""
+	if not account_ids:
+		return {}
+	out: Dict[int, List[float]] = {int(a): [0.0, 0.0] for a in account_ids}
+	for aid, total in session.exec(
+		select(Income.account_id, func.sum(Income.amount))
+		.where(Income.account_id.in_(account_ids))
+		.where(Income.deleted_at.is_(None))
+		.group_by(Income.account_id)
+	).all():
+		if aid is not None:
+			out[int(aid)][0] = float(total or 0.0)
+	for aid, total in session.exec(
+		select(Cost.account_id, func.sum(Cost.amount))
+		.where(Cost.account_id.in_(account_ids))
+		.where(Cost.deleted_at.is_(None))
+		.group_by(Cost.account_id)
+	).all():
+		if aid is not None:
+			out[int(aid)][1] = float(total or 0.0)
+	return {aid: (v[0], v[1]) for aid, v in out.items()}
+
+
+def _aggregate_daily(session, account_ids: List[int]) -> _Deltas:
+	deltas: _Deltas = {}
+	for model, kind in ((Income, "income"), (Cost, "expense")):
+		day_expr = func.coalesce(model.date, func.date(model.created_at))
+		rows = session.exec(
+			select(model.account_id, day_expr, func.sum(model.amount))
+			.where(model.account_id.in_(account_ids))
+			.where(model.deleted_at.is_(None))
+			.group_by(model.account_id, day_expr)
+		).all()
+		for aid, day, total in rows:
+			if aid is None or day is None:
+				continue
+			if isinstance(day, str):
+				day = dt.date.fromisoformat(day[:10])
+			elif isinstance(day, dt.datetime):
+				day = day.date()
+			_accumulate(deltas, kind, aid, float(total or 0.0), day, None, +1)
+	return deltas
+
+
+def _all_account_ids(session) -> List[int]:
+	return sorted(int(i) for i in session.exec(select(Account.id)).all() if i is not None)
+
+
+def check_account_ledger(*, limit: int = 200) -> Dict[str, Any]:
+	"""Recompute every account from income/cost and compare with the ledger (totals and days)."""
+	with get_session() as session:
+		ids = _all_account_ids(session)
+		expected = aggregate_totals(session, ids)
+		expected_daily = _aggregate_daily(session, ids) if ids else {}
+		stored = {int(r.account_id): r for r in session.exec(select(AccountBalance)).all()}
+		stored_daily = {
+			(int(r.account_id), r.day): (float(r.income or 0.0), float(r.expense or 0.0))
+			for r in session.exec(select(AccountBalanceDaily)).all()
+		}
+	mismatches: List[Dict[str, Any]] = []
+	for aid in ids:
+		exp_inc, exp_exp = expected.get(aid, (0.0, 0.0))
+		row = stored.get(aid)
+		got_inc = float(row.income_total or 0.0) if row else 0.0
+		got_exp = float(row.expense_total or 0.0) if row else 0.0
+		drift = (got_inc - got_exp) - (exp_inc - exp_exp)
+		if abs(got_inc - exp_inc) > DRIFT_EPSILON or abs(got_exp - exp_exp) > DRIFT_EPSILON:
+			mismatches.append(
+				{
+					"account_id": aid,
+					"income_total": round(got_inc, 2),
+					"expected_income_total": round(exp_inc, 2),
+					"expense_total": round(got_exp, 2),
+					"expected_expense_total": round(exp_exp, 2),
+					"drift": round(drift, 2),
+					"missing_row": row is None,
+				}
+			)
+	day_mismatches: List[Dict[str, Any]] = []
+	for key in sorted(set(expected_daily) | set(stored_daily)):
+		exp_inc, exp_exp = expected_daily.get(key, [0.0, 0.0])
+		got_inc, got_exp = stored_daily.get(key, (0.0, 0.0))
+		if abs(got_inc - exp_inc) > DRIFT_EPSILON or abs(got_exp - exp_exp) > DRIFT_EPSILON:
+			day_mismatches.append(
+				{
+					"account_id": key[0],
+					"day": key[1].isoformat(),
+					"drift": round((got_inc - got_exp) - (exp_inc - exp_exp), 2),
+				}
+			)
+	if mismatches or day_mismatches:
+		log.warning("account ledger drift accounts=%d days=%d", len(mismatches), len(day_mismatches))
+	return {
+		"accounts_checked": len(ids),
+		"mismatch_count": len(mismatches),
+		"mismatches": mismatches[:limit],
+		"day_mismatch_count": len(day_mismatches),
+		"day_mismatches": day_mismatches[:limit],
+	}
+
+
+def rebuild_account_ledger(account_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+	"""
+	Recompute totals and daily deltas from income/cost (all accounts, or only account_ids).
+	A full rebuild marks the ledger ready for reads.
+	"""
+	global _ready
+	full = account_ids is None
+	if full:
+		with get_session() as session:
+			ids = _all_account_ids(session)
+	else:
+		ids = sorted({int(i) for i in account_ids if i is not None})
+	now = dt.datetime.utcnow()
+	days = 0
+	if ids:
+		with get_session() as session:
+			session.exec(
+				_text(
+					"INSERT IGNORE INTO account_balance(account_id, income_total, expense_total, updated_at) VALUES (:account_id, 0, 0, :now)"
+				),
+				params=[{"account_id": aid, "now": now} for aid in ids],
+			)
+		with get_session() as session:
+			# Lock balance rows first: writers touching these accounts wait for the recount
+			session.exec(select(AccountBalance.account_id).where(AccountBalance.account_id.in_(ids)).with_for_update()).all()
+			totals = aggregate_totals(session, ids)
+			daily = _aggregate_daily(session, ids)
+			session.exec(
+				_text(
+					"UPDATE account_balance SET income_total=:income, expense_total=:expense, updated_at=:now WHERE account_id=:account_id"
+				),
+				params=[
+					{"account_id": aid, "income": totals.get(aid, (0.0, 0.0))[0], "expense": totals.get(aid, (0.0, 0.0))[1], "now": now}
+					for aid in ids
+				],
+			)
+			session.exec(delete(AccountBalanceDaily).where(AccountBalanceDaily.account_id.in_(ids)))
+			if daily:
+				session.exec(
+					_text("INSERT INTO account_balance_daily(account_id, day, income, expense) VALUES (:account_id, :day, :income, :expense)"),
+					params=[
+						{"account_id": aid, "day": day, "income": d[0], "expense": d[1]}
+						for (aid, day), d in sorted(daily.items())
+					],
+				)
+			days = len(daily)
+	if full:
+		with get_session() as session:
+			row = session.exec(select(SystemSetting).where(SystemSetting.key == READY_SETTING_KEY)).first()
+			if row is None:
+				row = SystemSetting(key=READY_SETTING_KEY, value="1", description="account_balance ledger populated")
+			row.value = "1"
+			row.updated_at = dt.datetime.utcnow()
+			session.add(row)
+		_ready = True
+	return {"accounts": len(ids), "days": days}
@@ -4,18 +4,33 @@ from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import json
 import logging
 import os
+import threading
+import time
 from math import isfinite
+from types import SimpleNamespace
 
-try:
-    # OpenAI v1.x client
-    from openai import OpenAI, BadRequestError  # type: ignore
-except Exception:  # pragma: no cover
-    OpenAI = None  # type: ignore
-    BadRequestError = Exception  # type: ignore
+from ..utils.lazy import lazy_module
+
+# OpenAI v1.x client; imported on first use (it costs ~200ms and tens of MB at startup)
+_openai = lazy_module("openai")
 
 from .ai_models import get_model_whitelist, normalize_model_choice
 
 
+def _observe_completion(total_ms: int, started: Optional[float] = None, model: Optional[str] = None) -> None:
+    # latency histogram for NOC / Prometheus and an LLM span on a traced reply; never fails the completion
+    try:
+        from .monitoring import safe_observe
+
+        safe_observe("ai_completion_ms", total_ms)
+        if started is not None:
+            from . import tracing
+
+            tracing.record_perf_span("llm", started, model=model)
+    except Exception:
+        pass
+
+
 def _estimate_tokens(text: str) -> int:
     """Rough token estimator.
 
@@ -29,23 +44,302 @@ def _estimate_tokens(text: str) -> int:
         return max(1, len(text or "") // 4)
 
 
+# Process-wide registry of OpenAI clients keyed by (api_key, timeout). Each entry owns a
+# keep-alive httpx pool so repeated AIClient(...) constructions reuse TLS connections.
+_client_registry: Dict[Tuple[str, float], Any] = {}
+_client_registry_lock = threading.Lock()
+_pool_stats: Dict[str, int] = {
+    "clients_created": 0,
+    "clients_reused": 0,
+    "requests": 0,
+    "connections_opened": 0,
+    "tls_handshakes": 0,
+}
+_pool_stats_lock = threading.Lock()
+
+
+def _bump_pool_stat(name: str, delta: int = 1) -> None:
+    with _pool_stats_lock:
+        _pool_stats[name] = _pool_stats.get(name, 0) + delta
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 needs the optional `h2` package; keep HTTP/1.1 keep-alive otherwise."""
+    if os.getenv("OPENAI_HTTP2", "1") == "0":
+        return False
+    try:
+        import h2  # type: ignore  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def _trace_connection_events(event_name: str, info: Dict[str, Any]) -> None:
+    # httpcore trace callback: only fires when a new connection/handshake is made,
+    # so requests - connections_opened == requests served from the keep-alive pool.
+    if event_name == "connection.connect_tcp.complete":
+        _bump_pool_stat("connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        _bump_pool_stat("tls_handshakes")
+
+
+def _on_http_request(request: Any) -> None:
+    _bump_pool_stat("requests")
+    try:
+        request.extensions["trace"] = _trace_connection_events
+    except Exception:
+        pass
+
+
+def _build_http_client(timeout: float) -> Any:
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120")),
+    )
+    return httpx.Client(
+        timeout=timeout,
+        limits=limits,
+        http2=_http2_enabled(),
+        event_hooks={"request": [_on_http_request]},
+    )
+
+
+def get_pooled_openai_client(api_key: Optional[str] = None, timeout: Optional[float] = None) -> Optional[Any]:
+    """Return the shared OpenAI client for (api_key, timeout), creating it once per process."""
+    key_val = api_key or os.getenv("OPENAI_API_KEY") or ""
+    if not key_val or _openai is None:
+        return None
+    timeout_val = float(timeout if timeout is not None else os.getenv("OPENAI_TIMEOUT", "30.0"))
+    registry_key = (key_val, timeout_val)
+    client = _client_registry.get(registry_key)
+    if client is not None:
+        _bump_pool_stat("clients_reused")
+        return client
+    with _client_registry_lock:
+        client = _client_registry.get(registry_key)
+        if client is None:
+            try:
+                client = _openai.OpenAI(api_key=key_val, timeout=timeout_val, http_client=_build_http_client(timeout_val))
+            except Exception:
+                logging.getLogger("ai").warning("Pooled OpenAI client init failed; using default transport", exc_info=True)
+                client = _openai.OpenAI(api_key=key_val, timeout=timeout_val)
+            _client_registry[registry_key] = client
+            _bump_pool_stat("clients_created")
+        else:
+            _bump_pool_stat("clients_reused")
+    return client
+
+
+def get_ai_client_pool_stats() -> Dict[str, Any]:
+    """Snapshot of client registry / connection reuse counters for this process."""
+    with _pool_stats_lock:
+        stats: Dict[str, Any] = dict(_pool_stats)
+    requests = int(stats.get("requests") or 0)
+    opened = int(stats.get("connections_opened") or 0)
+    stats["connections_reused"] = max(0, requests - opened)
+    stats["reuse_ratio"] = round(stats["connections_reused"] / requests, 3) if requests else None
+    stats["registry_size"] = len(_client_registry)
+    stats["http2"] = _http2_enabled()
+    return stats
+
+
+def _collect_stream(
+    stream: Any,
+    *,
+    on_delta: Optional[Callable[[str], None]] = None,
+    timings: Optional[Dict[str, Any]] = None,
+    started: Optional[float] = None,
+) -> Any:
+    """Drain a streamed chat completion into a response-shaped object.
+
+    Text deltas are forwarded to on_delta as they arrive and tool-call deltas are
+    stitched by index, so the caller's tool loop can treat the result exactly like a
+    non-streamed completion. The first content/tool delta sets timings["ttfb_ms"].
+    """
+    t0 = started if started is not None else time.perf_counter()
+    content_parts: List[str] = []
+    tool_slots: Dict[int, Dict[str, Any]] = {}
+    seen_first = False
+    for chunk in stream:
+        choices = getattr(chunk, "choices", None) or []
+        if not choices:
+            continue
+        delta = getattr(choices[0], "delta", None)
+        if delta is None:
+            continue
+        piece = getattr(delta, "content", None)
+        tool_deltas = getattr(delta, "tool_calls", None) or []
+        if not seen_first and (piece or tool_deltas):
+            seen_first = True
+            if timings is not None:
+                timings.setdefault("ttfb_ms", int((time.perf_counter() - t0) * 1000))
+        if piece:
+            content_parts.append(piece)
+            if on_delta is not None:
+                try:
+                    on_delta(piece)
+                except Exception:
+                    logging.getLogger("ai").warning("stream on_delta callback failed", exc_info=True)
+        for tc in tool_deltas:
+            try:
+                idx = int(getattr(tc, "index", 0) or 0)
+            except Exception:
+                idx = 0
+            slot = tool_slots.setdefault(idx, {"id": None, "type": "function", "name": "", "arguments": ""})
+            if getattr(tc, "id", None):
+                slot["id"] = tc.id
+            if getattr(tc, "type", None):
+                slot["type"] = tc.type
+            fn = getattr(tc, "function", None)
+            if fn is not None:
+                if getattr(fn, "name", None):
+                    slot["name"] += fn.name
+                if getattr(fn, "arguments", None):
+                    slot["arguments"] += fn.arguments
+    tool_calls = [
+        SimpleNamespace(
+            id=slot["id"],
+            type=slot["type"] or "function",
+            function=SimpleNamespace(name=slot["name"], arguments=slot["arguments"]),
+        )
+        for _, slot in sorted(tool_slots.items())
+    ]
+    message = SimpleNamespace(content="".join(content_parts) or None, tool_calls=tool_calls or None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class JSONFieldStreamExtractor:
+    """Incrementally decode one top-level string field from a streamed JSON object.
+
+    feed() returns the newly decoded characters of the field (e.g. reply_text) so a
+    caller can react to the reply while the rest of the object is still generating.
+    """
+
+    def __init__(self, field: str = "reply_text") -> None:
+        self._needle = f'"{field}"'
+        self._buf = ""
+        self._pos = 0
+        self._state = "seek"  # seek -> colon -> open -> value -> done
+        self._pending_escape = ""
+        self.value = ""
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> str:
+        if not chunk or self._state == "done":
+            return ""
+        self._buf += chunk
+        out: List[str] = []
+        while self._pos < len(self._buf) and self._state != "done":
+            if self._state == "seek":
+                idx = self._buf.find(self._needle, self._pos)
+                if idx == -1:
+                    # keep a tail long enough to match a needle split across chunks
+                    self._pos = max(self._pos, len(self._buf) - len(self._needle))
+                    break
+                self._pos = idx + len(self._needle)
+                self._state = "colon"
+                continue
+            ch = self._buf[self._pos]
+            if self._state == "colon":
+                self._pos += 1
+                if ch == ":":
+                    self._state = "open"
+                elif not ch.isspace():
+                    self._state = "seek"
+                continue
+            if self._state == "open":
+                self._pos += 1
+                if ch == '"':
+                    self._state = "value"
+                elif not ch.isspace():
+                    self._state = "done"  # non-string value; nothing to stream
+                continue
+            # value
+            if self._pending_escape:
+                self._pending_escape += ch
+                self._pos += 1
+                decoded = self._decode_escape(self._pending_escape)
+                if decoded is not None:
+                    out.append(decoded)
+                    self._pending_escape = ""
+                continue
+            self._pos += 1
+            if ch == "\\":
+                self._pending_escape = ch
+            elif ch == '"':
+                self._state = "done"
+            else:
+                out.append(ch)
+        text = "".join(out)
+        self.value += text
+        return text
+
+    @staticmethod
+    def _decode_escape(seq: str) -> Optional[str]:
+        if len(seq) < 2:
+            return None
+        kind = seq[1]
+        if kind == "u":
+            if len(seq) < 6:
+                return None
+            try:
+                return chr(int(seq[2:6], 16))
+            except ValueError:
+                return ""
+        return {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(kind, kind)
+
+
+def parse_json_object_loose(txt: str) -> Optional[Dict[str, Any]]:
+    """Parse a model reply into a dict, tolerating code fences and trailing commas."""
+    if not txt or not txt.strip():
+        return None
+    try:
+        data = json.loads(txt)
+        return data if isinstance(data, dict) else None
+    except Exception:
+        pass
+    cleaned = txt.strip().strip("` ")
+    if cleaned.lower().startswith("json\n"):
+        cleaned = cleaned.split("\n", 1)[1]
+    start = cleaned.find("{")
+    end = cleaned.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    import re as _re
+
+    segment = _re.sub(r",\s*([}\]])", r"\1", cleaned[start : end + 1])
+    try:
+        data = json.loads(segment)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
 class AIClient:
     """Thin wrapper around OpenAI client focused on JSON responses.
 
     - Reads API key from OPENAI_API_KEY env var by default
     - Provides generate_json helper using JSON mode
     - Includes basic timeout and retry handling
+    - Shares the underlying OpenAI/httpx client per (api_key, timeout), so
+      constructing an AIClient per draft is cheap and reuses pooled connections
     """
 
     def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o-mini") -> None:
         self._api_key = api_key or os.getenv("OPENAI_API_KEY") or ""
         self._model = normalize_model_choice(model, log_prefix="AIClient")
-        self._enabled = bool(self._api_key and OpenAI is not None)
+        self._enabled = bool(self._api_key and _openai is not None)
         self._token_param = self._detect_token_param(self._model)
         # Configure timeout: default 30 seconds, configurable via OPENAI_TIMEOUT env var
         timeout_seconds = float(os.getenv("OPENAI_TIMEOUT", "30.0"))
         self._timeout = timeout_seconds
-        self._client = OpenAI(api_key=self._api_key, timeout=timeout_seconds) if self._enabled else None
+        self._client = get_pooled_openai_client(self._api_key, timeout_seconds) if self._enabled else None
 
     @staticmethod
     def _detect_token_param(model_name: str) -> str:
@@ -77,9 +371,11 @@ class AIClient:
         tools: Optional[List[Dict[str, Any]]] = None,
         tool_choice: Optional[Union[str, Dict[str, Any]]] = None,
         tool_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], str]]] = None,
+        timings: Optional[Dict[str, Any]] = None,
     ) -> Union[Dict[str, Any], Tuple[Dict[str, Any], str], Tuple[Dict[str, Any], Dict[str, Any]], Tuple[Dict[str, Any], str, Dict[str, Any]]]:
         if not self._enabled or not self._client:
             raise RuntimeError("AI client is not configured. Set OPENAI_API_KEY.")
+        started = time.perf_counter()
 
         messages: list[dict[str, Any]] = []
         if system_prompt:
@@ -161,7 +457,7 @@ class AIClient:
             completion_kwargs = _build_kwargs(current_messages)
             try:
                 return self._client.chat.completions.create(**completion_kwargs)
-            except BadRequestError as exc:
+            except _openai.BadRequestError as exc:
                 msg = str(exc).lower()
                 if "temperature" in msg and "unsupported" in msg and "1" in msg:
                     if "temperature" in completion_kwargs:
@@ -227,6 +523,12 @@ class AIClient:
                 )
             response = _run_completion(messages)
         
+        total_ms = int((time.perf_counter() - started) * 1000)
+        _observe_completion(total_ms, started, self._model)
+        if timings is not None:
+            timings["total_ms"] = total_ms
+            timings["calls"] = tool_loop_count + 1
+
         # Capture final request payload if requested
         final_request_payload = None
         if include_request_payload:
@@ -347,12 +649,20 @@ class AIClient:
         tool_choice: Optional[Union[str, Dict[str, Any]]] = None,
         tool_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], str]]] = None,
         response_format: Optional[Dict[str, Any]] = None,
+        stream: bool = False,
+        on_delta: Optional[Callable[[str], None]] = None,
+        timings: Optional[Dict[str, Any]] = None,
     ) -> Union[str, Tuple[str, str], Tuple[str, Dict[str, Any]], Tuple[str, str, Dict[str, Any]]]:
         """
         General chat generation with optional tool calls (no JSON parsing).
+
+        With stream=True each completion round is streamed: text deltas go to on_delta
+        and tool calls are reassembled before the tool loop continues. timings (if given)
+        receives ttfb_ms for the first round plus total_ms and calls.
         """
         if not self._enabled or not self._client:
             raise RuntimeError("AI client is not configured. Set OPENAI_API_KEY.")
+        started = time.perf_counter()
 
         messages: list[dict[str, Any]] = []
         if system_prompt:
@@ -405,6 +715,8 @@ class AIClient:
             }
             if response_format:
                 payload["response_format"] = response_format
+            if stream:
+                payload["stream"] = True
             if temperature is not None:
                 payload["temperature"] = temperature
             payload[self._token_param] = max_output_tokens
@@ -414,12 +726,27 @@ class AIClient:
                     payload["tool_choice"] = tool_choice
             return payload
 
+        def _create(completion_kwargs: Dict[str, Any]) -> Any:
+            if completion_kwargs.get("stream"):
+                call_started = time.perf_counter()
+                return _collect_stream(
+                    self._client.chat.completions.create(**completion_kwargs),
+                    on_delta=on_delta,
+                    timings=timings,
+                    started=call_started,
+                )
+            return self._client.chat.completions.create(**completion_kwargs)
+
         def _run_completion(current_messages: list[dict[str, Any]]) -> Any:
             completion_kwargs = _build_kwargs(current_messages)
             try:
-                return self._client.chat.completions.create(**completion_kwargs)
-            except BadRequestError as exc:
+                return _create(completion_kwargs)
+            except _openai.BadRequestError as exc:
                 msg = str(exc).lower()
+                if "stream" in msg and completion_kwargs.get("stream"):
+                    logging.getLogger("ai").warning("Model %s rejected streaming; retrying without stream", self._model)
+                    completion_kwargs.pop("stream", None)
+                    return _create(completion_kwargs)
                 if "temperature" in msg and "unsupported" in msg and "1" in msg:
                     if "temperature" in completion_kwargs:
                         logging.getLogger("ai").warning(
@@ -428,12 +755,12 @@ class AIClient:
                             completion_kwargs.get("temperature"),
                         )
                         completion_kwargs.pop("temperature", None)
-                        return self._client.chat.completions.create(**completion_kwargs)
+                        return _create(completion_kwargs)
                 if "max_completion_tokens" in msg and self._token_param == "max_tokens":
                     completion_kwargs.pop("max_tokens", None)
                     completion_kwargs["max_completion_tokens"] = max_output_tokens
                     self._token_param = "max_completion_tokens"
-                    return self._client.chat.completions.create(**completion_kwargs)
+                    return _create(completion_kwargs)
                 raise
 
         response = _run_completion(messages)
@@ -484,6 +811,13 @@ class AIClient:
                 )
             response = _run_completion(messages)
 
+        total_ms = int((time.perf_counter() - started) * 1000)
+        _observe_completion(total_ms, started, self._model)
+        if timings is not None:
+            timings["total_ms"] = total_ms
+            timings["calls"] = tool_loop_count + 1
+            timings["streamed"] = bool(stream)
+
         final_request_payload = None
         if include_request_payload:
             final_request_payload = _build_kwargs(messages)
@@ -503,19 +837,74 @@ class AIClient:
         return txt
 
 
+# In-process cache for SystemSetting lookups done on every draft. Entries are trusted for
+# AI_SETTINGS_CACHE_POLL seconds; after that a Redis version counter (bumped by writers via
+# invalidate_ai_settings_cache) decides whether MySQL must be re-read.
+_SETTINGS_VERSION_KEY = "settings:ai:version"
+_settings_cache: Dict[str, Tuple[Optional[str], float, Optional[str]]] = {}
+_settings_cache_lock = threading.Lock()
+
+
+def _settings_version() -> Optional[str]:
+    try:
+        from .monitoring import _get_redis
+
+        val = _get_redis().get(_SETTINGS_VERSION_KEY)
+        return str(val or "0")
+    except Exception:
+        return None
+
+
+def _read_setting_value(key: str) -> Optional[str]:
+    """Return SystemSetting.value for key (None if missing). Raises on DB errors."""
+    poll = float(os.getenv("AI_SETTINGS_CACHE_POLL", "5"))
+    max_age = float(os.getenv("AI_SETTINGS_CACHE_TTL", "60"))
+    now = time.monotonic()
+    with _settings_cache_lock:
+        entry = _settings_cache.get(key)
+    if entry is not None:
+        value, fetched_at, version = entry
+        age = now - fetched_at
+        if age < poll:
+            return value
+        current_version = _settings_version()
+        if current_version is not None and current_version == version:
+            with _settings_cache_lock:
+                _settings_cache[key] = (value, now, version)
+            return value
+        if current_version is None and age < max_age:
+            return value
+    version = _settings_version()
+    from ..db import get_session
+    from ..models import SystemSetting
+    from sqlmodel import select
+
+    with get_session() as session:
+        setting = session.exec(select(SystemSetting).where(SystemSetting.key == key)).first()
+        value = setting.value if setting else None
+    with _settings_cache_lock:
+        _settings_cache[key] = (value, time.monotonic(), version)
+    return value
+
+
+def invalidate_ai_settings_cache() -> None:
+    """Drop cached settings locally and notify other processes via the Redis version key."""
+    with _settings_cache_lock:
+        _settings_cache.clear()
+    try:
+        from .monitoring import _get_redis
+
+        _get_redis().incr(_SETTINGS_VERSION_KEY)
+    except Exception:
+        logging.getLogger("ai").warning("AI settings version bump failed", exc_info=True)
+
+
 def get_ai_shadow_model_from_settings(default: str = "gpt-4o-mini") -> str:
     """Get shadow AI model from DB first, falling back to env var and default."""
     try:
-        from ..db import get_session
-        from ..models import SystemSetting
-        from sqlmodel import select
-
-        with get_session() as session:
-            setting = session.exec(
-                select(SystemSetting).where(SystemSetting.key == "ai_shadow_model")
-            ).first()
-            if setting and setting.value:
-                return normalize_model_choice(setting.value, default=default, log_prefix="AI shadow DB")
+        value = _read_setting_value("ai_shadow_model")
+        if value:
+            return normalize_model_choice(value, default=default, log_prefix="AI shadow DB")
     except Exception:
         logging.getLogger("ai_shadow").warning("Shadow model DB lookup failed", exc_info=True)
 
@@ -539,16 +928,9 @@ def get_shadow_temperature_setting(default: float = 0.1) -> float:
         return max(0.0, min(temp, 2.0))
 
     try:
-        from ..db import get_session
-        from ..models import SystemSetting
-        from sqlmodel import select
-
-        with get_session() as session:
-            setting = session.exec(
-                select(SystemSetting).where(SystemSetting.key == "ai_shadow_temperature")
-            ).first()
-            if setting and setting.value:
-                default = _sanitize(setting.value, default)
+        value = _read_setting_value("ai_shadow_temperature")
+        if value:
+            default = _sanitize(value, default)
     except Exception:
         logging.getLogger("ai_shadow").warning("Shadow temperature DB lookup failed", exc_info=True)
 
@@ -568,16 +950,9 @@ def is_shadow_temperature_opt_out() -> bool:
         return str(val).strip().lower() in ("1", "true", "yes", "on")
 
     try:
-        from ..db import get_session
-        from ..models import SystemSetting
-        from sqlmodel import select
-
-        with get_session() as session:
-            setting = session.exec(
-                select(SystemSetting).where(SystemSetting.key == "ai_shadow_temperature_opt_out")
-            ).first()
-            if setting and setting.value is not None:
-                return _as_bool(setting.value)
+        value = _read_setting_value("ai_shadow_temperature_opt_out")
+        if value is not None:
+            return _as_bool(value)
     except Exception:
         logging.getLogger("ai_shadow").warning("Shadow temperature opt-out lookup failed", exc_info=True)
 
@@ -597,18 +972,10 @@ def get_ai_model_from_settings(default: str = "gpt-4o-mini") -> str:
         The model name from settings or default
     """
     try:
-        from ..db import get_session
-        from ..models import SystemSetting
-        from sqlmodel import select
-        
-        with get_session() as session:
-            setting = session.exec(
-                select(SystemSetting).where(SystemSetting.key == "ai_model")
-            ).first()
-            
-            if setting and setting.value:
-                return normalize_model_choice(setting.value, default=default, log_prefix="AI model DB")
-            return normalize_model_choice(default, log_prefix="AI model default")
+        value = _read_setting_value("ai_model")
+        if value:
+            return normalize_model_choice(value, default=default, log_prefix="AI model DB")
+        return normalize_model_choice(default, log_prefix="AI model default")
     except Exception:
         # If there's any error, return default
         return default
@@ -10,6 +10,7 @@ from ..db import get_session
 from ..models import Message, Product
 from .ai import AIClient
 from .ai_context import VariantExclusions, parse_variant_exclusions, variant_is_excluded
+from .catalog_snapshot import get_catalog
 
 
 class AIAdapter:
@@ -35,6 +36,19 @@ def sys_prompt(text: str) -> str:
 def lookup_price(sku_or_slug: str) -> Optional[float]:
 	"""Return default/unit price if available (prioritizing product defaults)."""
 	from ..models import Item
+	catalog = get_catalog()
+	if catalog is not None:
+		prod = catalog.find_product(sku_or_slug)
+		if prod and prod.default_price is not None:
+			return float(prod.default_price)
+		item = catalog.item_for_sku(sku_or_slug)
+		if item:
+			prod2 = catalog.product(item.product_id)
+			if prod2 and prod2.default_price is not None:
+				return float(prod2.default_price)
+			if item.price is not None:
+				return float(item.price)
+		return None
 	with get_session() as session:
 		try:
 			# Prefer product lookup by slug/name first
@@ -78,9 +92,14 @@ def build_product_link(sku_or_slug: str) -> Optional[str]:
 
 
 def get_stock_snapshot(sku: str) -> Optional[dict]:
-	"""Placeholder stock snapshot; extend once stock tables are in use."""
+	"""On-hand snapshot for a SKU from the catalog; unknown SKUs are reported as available."""
 	try:
-		return {"sku": sku, "available": True}
+		catalog = get_catalog()
+		item = catalog.item_for_sku(sku) if catalog is not None else None
+		if item is None:
+			return {"sku": sku, "available": True}
+		on_hand = catalog.on_hand_for(item.id)
+		return {"sku": sku, "available": on_hand > 0, "on_hand": on_hand}
 	except Exception:
 		return None
 
@@ -206,6 +225,16 @@ def _detect_focus_product_impl(session, conversation_id: str) -> Tuple[Optional[
 			).all()
 			texts = " ".join([(m.text or "") for m in msgs if (m.direction or "in") == "in"])
 			if texts.strip():
+				catalog = get_catalog()
+				if catalog is not None:
+					texts_lower = texts.lower()
+					best_cat: Tuple[Optional[str], float] = (None, 0.0)
+					for pid in sorted(catalog.products):
+						rec = catalog.products[pid]
+						score = 0.25 * sum(1 for t in rec.ai_tags if t in texts_lower)
+						if score > best_cat[1]:
+							best_cat = (rec.slug or rec.name, min(0.95, score))
+					return best_cat
 				products: List[Product] = session.exec(select(Product)).all()  # type: ignore
 				best: Tuple[Optional[str], float] = (None, 0.0)
 				for p in products:
@@ -273,10 +302,13 @@ def build_prompt(conversation_id: str, customer_text: str) -> Tuple[str, str]:
 		except Exception:
 			variant_exclusions = VariantExclusions()
 
+	catalog = get_catalog()
 	with get_session() as session:
 		product_row: Optional[Product] = None
 		try:
-			if focus:
+			if focus and catalog is not None:
+				product_row = catalog.find_product(str(focus))
+			elif focus:
 				product_row = session.exec(
 					select(Product).where((Product.slug == str(focus)) | (Product.name == str(focus))).limit(1)
 				).first()
@@ -286,7 +318,9 @@ def build_prompt(conversation_id: str, customer_text: str) -> Tuple[str, str]:
 
 		pid: Optional[int] = None
 		try:
-			if focus:
+			if focus and catalog is not None:
+				rowi = catalog.item_for_sku(str(focus))
+			elif focus:
 				rowi = session.exec(
 					_text(
 						"SELECT sku, name, color, size, price, product_id FROM item WHERE sku=:s LIMIT 1"
@@ -311,9 +345,12 @@ def build_prompt(conversation_id: str, customer_text: str) -> Tuple[str, str]:
 				stock.append({"sku": sku, "name": name, "color": color, "size": size, "price": price})
 		if pid is None and focus:
 			try:
-				rowp = session.exec(
-					select(Product).where((Product.slug == str(focus)) | (Product.name == str(focus))).limit(1)
-				).first()
+				if catalog is not None:
+					rowp = catalog.find_product(str(focus))
+				else:
+					rowp = session.exec(
+						select(Product).where((Product.slug == str(focus)) | (Product.name == str(focus))).limit(1)
+					).first()
 			except Exception:
 				rowp = None
 			if rowp:
@@ -324,11 +361,14 @@ def build_prompt(conversation_id: str, customer_text: str) -> Tuple[str, str]:
 				_hydrate_product_context(rowp)
 		if pid is not None:
 			try:
-				rows_sib = session.exec(
-					_text("SELECT sku, name, color, size, price FROM item WHERE product_id=:pid LIMIT 200").params(
-						pid=int(pid)
-					)
-				).all()
+				if catalog is not None:
+					rows_sib = catalog.product_items(int(pid))
+				else:
+					rows_sib = session.exec(
+						_text("SELECT sku, name, color, size, price FROM item WHERE product_id=:pid LIMIT 200").params(
+							pid=int(pid)
+						)
+					).all()
 			except Exception:
 				rows_sib = []
 			for r in rows_sib:
@@ -345,7 +385,10 @@ def build_prompt(conversation_id: str, customer_text: str) -> Tuple[str, str]:
 					continue
 			if product_row is None:
 				try:
-					product_row = session.exec(select(Product).where(Product.id == int(pid)).limit(1)).first()
+					if catalog is not None:
+						product_row = catalog.product(int(pid))
+					else:
+						product_row = session.exec(select(Product).where(Product.id == int(pid)).limit(1)).first()
 				except Exception:
 					product_row = None
 				_hydrate_product_context(product_row)
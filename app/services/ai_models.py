@@ -6,8 +6,6 @@ import os
 from collections import OrderedDict
 from typing import Dict, List, Tuple
 
-from openai import OpenAI
-
 from ..db import get_session
 from ..models import SystemSetting
 
@@ -85,6 +83,8 @@ def normalize_model_choice(model_name: str | None, default: str | None = None, *
 
 
 def refresh_openai_model_whitelist() -> Dict[str, List[str]]:
+    from openai import OpenAI
+
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     response = client.models.list()
     fetched: List[str] = []
@@ -5,7 +5,9 @@ import logging
 import json
 import os
 import re
+import time
 import unicodedata
+from types import SimpleNamespace
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from sqlmodel import select
@@ -25,10 +27,15 @@ from ..models import (
 )
 from .ai import (
 	AIClient,
+	JSONFieldStreamExtractor,
 	get_ai_shadow_model_from_settings,
+	parse_json_object_loose,
 	get_shadow_temperature_setting,
 	is_shadow_temperature_opt_out,
 )
+from .catalog_snapshot import get_catalog
+from .conversation_snapshot import get_conversation_snapshot
+from .copurchase import get_copurchase
 from .ai_context import VariantExclusions, parse_variant_exclusions, variant_is_excluded
 from .ai_ig import _detect_focus_product
 from .ai_orders import (
@@ -40,12 +47,33 @@ from .ai_orders import (
 )
 from .ai_utils import parse_height_weight, calculate_size_suggestion, detect_color_count
 from .prompts import get_global_system_prompt, get_serializer_prompt
+from . import tracing
 
 
 # Cevapla birlikte gönderilecek max ürün görseli. AI_MAX_PRODUCT_IMAGES ile override (örn. 8 veya 10).
 MAX_AI_IMAGES_PER_REPLY = int(os.getenv("AI_MAX_PRODUCT_IMAGES", "8"))
 log = logging.getLogger("ai.reply")
 
+# Agent çıktısının serializer şemasına doğrudan uyması için (AI_REPLY_PIPELINE_MODE=fused)
+FUSED_OUTPUT_INSTRUCTIONS = """
+=== ÇIKTI FORMATI (TEK ADIM) ===
+Gerekli tool çağrılarını yaptıktan sonra son cevabını SADECE aşağıdaki şemaya uyan tek bir JSON objesi olarak döndür (dışarıda metin/markdown yok):
+{"reply_text": "string", "should_reply": true, "confidence": 0.0, "reason": "string", "notes": null, "state": object | null}
+- reply_text alanını İLK alan olarak yaz; müşteriye gidecek düz DM metnidir, JSON/state/alan adı içeremez.
+- should_reply: müşteriye DM gidecekse true, yöneticiye eskalasyon yapıldıysa false.
+- state: güncel satış state'i (cart, hail_sent, upsell_offered, last_step vb.).
+"""
+
+
+def _get_reply_pipeline_mode() -> str:
+	"""
+	two_stage: agent (tools, free text) + serializer JSON call (default).
+	fused: agent returns the serializer schema itself; the serializer call only runs
+	as a fallback when the agent output cannot be parsed.
+	"""
+	mode = (os.getenv("AI_REPLY_PIPELINE_MODE") or "two_stage").strip().lower()
+	return mode if mode in ("two_stage", "fused") else "two_stage"
+
 
 def _has_any_human_agent_outbound(conversation_id: int) -> bool:
 	"""
@@ -62,6 +90,9 @@ def _has_any_human_agent_outbound(conversation_id: int) -> bool:
 	- direction='out' AND sender_type IS NULL AND ai_status IS NULL (or not 'sent') -> likely manual
 	- direction='out' AND ai_status='sent' is assumed AI-generated even if sender_type is NULL (legacy rows)
 	"""
+	snapshot = get_conversation_snapshot(int(conversation_id))
+	if snapshot is not None:
+		return snapshot.has_human_agent_outbound
 	try:
 		with get_session() as session:
 			# Use raw SQL for speed and to avoid ORM edge cases with optional fields.
@@ -283,52 +314,56 @@ def _load_product_stock(product_id: int) -> List[Dict[str, Any]]:
 		return []
 	stock: List[Dict[str, Any]] = []
 	try:
-		with get_session() as session:
-			# Get product to check default price
-			product = session.exec(select(Product).where(Product.id == product_id).limit(1)).first()
-			product_default_price: Optional[float] = None
-			if product and product.default_price:
-				try:
-					product_default_price = float(product.default_price)
-				except (ValueError, TypeError):
-					pass
-			
-			# Load all items for this product
-			items = session.exec(
-				select(Item).where(Item.product_id == product_id).limit(200)
-			).all()
-			
-			for item in items:
-				try:
-					sku = item.sku
-					if not isinstance(sku, str):
-						continue
-					# Use product-level price for all variants when available.
-					# Variant prices are often inconsistent for upsell config generation.
-					price = product_default_price if product_default_price is not None else item.price
-					stock.append(
-						{
-							"sku": sku,
-							"name": item.name,
-							"color": item.color,
-							"size": item.size,
-							"price": price,
-						}
-					)
-				except Exception:
+		catalog = get_catalog()
+		product = catalog.product(product_id) if catalog is not None else None
+		if product is not None:
+			items = catalog.product_items(product_id)
+		else:
+			with get_session() as session:
+				product = session.exec(select(Product).where(Product.id == product_id).limit(1)).first()
+				# Load all items for this product
+				items = session.exec(
+					select(Item).where(Item.product_id == product_id).limit(200)
+				).all()
+		# Check product default price
+		product_default_price: Optional[float] = None
+		if product and product.default_price:
+			try:
+				product_default_price = float(product.default_price)
+			except (ValueError, TypeError):
+				pass
+		
+		for item in items:
+			try:
+				sku = item.sku
+				if not isinstance(sku, str):
 					continue
-			
-			# If no stock found, create a placeholder entry
-			if not stock and product:
+				# Use product-level price for all variants when available.
+				# Variant prices are often inconsistent for upsell config generation.
+				price = product_default_price if product_default_price is not None else item.price
 				stock.append(
 					{
-						"sku": f"product:{product_id}",
-						"name": product.name,
-						"color": None,
-						"size": None,
-						"price": product_default_price,
+						"sku": sku,
+						"name": item.name,
+						"color": item.color,
+						"size": item.size,
+						"price": price,
 					}
 				)
+			except Exception:
+				continue
+		
+		# If no stock found, create a placeholder entry
+		if not stock and product:
+			stock.append(
+				{
+					"sku": f"product:{product_id}",
+					"name": product.name,
+					"color": None,
+					"size": None,
+					"price": product_default_price,
+				}
+			)
 	except Exception as exc:
 		try:
 			log.warning("_load_product_stock failed product_id=%s error=%s", product_id, str(exc)[:200])
@@ -359,20 +394,23 @@ def _load_product_info(product_id: int) -> Dict[str, Any]:
 		"images": [],
 	}
 	try:
-		with get_session() as session:
-			product = session.exec(select(Product).where(Product.id == product_id).limit(1)).first()
-			if product:
-				product_info["product_name"] = product.name
-				if product.default_price:
-					try:
-						product_info["default_price"] = float(product.default_price)
-					except (ValueError, TypeError):
-						pass
-				product_info["default_color"] = product.default_color
-			
-			# Load product images
-			product_images = _select_product_images_for_reply(product_id, variant_key=None)
-			product_info["images"] = product_images
+		catalog = get_catalog()
+		product = catalog.product(product_id) if catalog is not None else None
+		if product is None:
+			with get_session() as session:
+				product = session.exec(select(Product).where(Product.id == product_id).limit(1)).first()
+		if product:
+			product_info["product_name"] = product.name
+			if product.default_price:
+				try:
+					product_info["default_price"] = float(product.default_price)
+				except (ValueError, TypeError):
+					pass
+			product_info["default_color"] = product.default_color
+		
+		# Load product images
+		product_images = _select_product_images_for_reply(product_id, variant_key=None)
+		product_info["images"] = product_images
 	except Exception as exc:
 		try:
 			log.warning("_load_product_info failed product_id=%s error=%s", product_id, str(exc)[:200])
@@ -438,7 +476,82 @@ def _load_manual_upsells(product_id: int) -> Dict[int, Dict[str, Any]]:
 		return {}
 
 
+def _upsell_copy_text(product_name: str, price: Optional[float]) -> str:
+	label = f"{product_name} - {price:.0f}₺" if price else product_name
+	return f"Bununla birlikte {label} de almak ister misin?"
+
+
 def _calculate_upsell_recommendations(product_id: int, limit_orders: int = 100, min_cooccurrence: int = 2) -> Dict[int, Dict[str, Any]]:
+	"""
+	Upsell recommendations from the precomputed co-purchase matrix (services.copurchase),
+	ranked by recency-weighted co-purchase score over the full order history.
+
+	Falls back to scanning the latest `limit_orders` orders while the matrix has not been built.
+	Returns the same shape as _scan_upsell_cooccurrence, plus "score" and "lift".
+	"""
+	if not product_id:
+		return {}
+	try:
+		rows = get_copurchase(int(product_id), limit=3, min_count=min_cooccurrence)
+	except Exception as exc:
+		rows = None
+		try:
+			log.warning("copurchase lookup failed product_id=%s error=%s", product_id, str(exc)[:200])
+		except Exception:
+			pass
+	if rows is None:
+		return _scan_upsell_cooccurrence(product_id, limit_orders=limit_orders, min_cooccurrence=min_cooccurrence)
+	if not rows:
+		return {}
+	upsell_map: Dict[int, Dict[str, Any]] = {}
+	try:
+		wanted = [r["product_id"] for r in rows]
+		catalog = get_catalog()
+		by_id: Dict[int, Any] = {}
+		if catalog is not None:
+			by_id = {pid: catalog.product(pid) for pid in wanted if catalog.product(pid) is not None}
+		if len(by_id) < len(wanted):
+			with get_session() as session:
+				products = session.exec(select(Product).where(Product.id.in_(wanted))).all()
+			by_id = {int(p.id): p for p in products if p and p.id}
+		for row in rows:
+			other_pid = row["product_id"]
+			prod = by_id.get(other_pid)
+			if prod is None:
+				continue
+			product_name = prod.name or f"Product {other_pid}"
+			price: Optional[float] = None
+			try:
+				if getattr(prod, "default_price", None) is not None:
+					price = float(prod.default_price)
+			except (ValueError, TypeError):
+				price = None
+			upsell_stock = _load_product_stock(other_pid)
+			upsell_product_info = _load_product_info(other_pid)
+			upsell_map[other_pid] = {
+				"product_id": other_pid,
+				"product_name": product_name,
+				"copy": _upsell_copy_text(product_name, price),
+				"cooccurrence_count": row["order_count"],
+				"score": row["score"],
+				"lift": row["lift"],
+				"source": "copurchase",
+				"stock": upsell_stock,
+				"stock_compact": _compact_stock_list(upsell_stock),
+				"default_price": upsell_product_info.get("default_price"),
+				"default_color": upsell_product_info.get("default_color"),
+				"images": upsell_product_info.get("images", []),
+			}
+	except Exception as exc:
+		try:
+			log.warning("_calculate_upsell_recommendations failed product_id=%s error=%s", product_id, str(exc)[:200])
+		except Exception:
+			pass
+		return {}
+	return upsell_map
+
+
+def _scan_upsell_cooccurrence(product_id: int, limit_orders: int = 100, min_cooccurrence: int = 2) -> Dict[int, Dict[str, Any]]:
 	"""
 	Calculate upsell recommendations based on order history.
 	
@@ -564,14 +677,7 @@ def _calculate_upsell_recommendations(product_id: int, limit_orders: int = 100,
 					product_name = product_names.get(other_pid, f"Product {other_pid}")
 					price = product_prices.get(other_pid)
 					
-					# Generate suggested copy text
-					copy_parts = []
-					if price:
-						copy_parts.append(f"{product_name} - {price:.0f}₺")
-					else:
-						copy_parts.append(product_name)
-					
-					copy_text = f"Bununla birlikte {copy_parts[0]} de almak ister misin?"
+					copy_text = _upsell_copy_text(product_name, price)
 					
 					# Load stock information for this upsell product
 					upsell_stock = _load_product_stock(other_pid)
@@ -603,7 +709,7 @@ def _calculate_upsell_recommendations(product_id: int, limit_orders: int = 100,
 			
 	except Exception as e:
 		try:
-			log.warning("_calculate_upsell_recommendations failed product_id=%s error=%s", product_id, str(e)[:200])
+			log.warning("_scan_upsell_cooccurrence failed product_id=%s error=%s", product_id, str(e)[:200])
 		except Exception:
 			pass
 		return {}
@@ -697,12 +803,16 @@ def _load_focus_product_and_stock(conversation_id: int) -> Tuple[Optional[Dict[s
 	variant_exclusions: VariantExclusions = VariantExclusions()
 	if not focus_slug:
 		return None, stock
+	catalog = get_catalog()
 	with get_session() as session:
 		# Try to resolve by SKU first
 		try:
-			rowi = session.exec(
-				select(Item).where(Item.sku == str(focus_slug)).limit(1)
-			).first()
+			if catalog is not None:
+				rowi = catalog.item_for_sku(str(focus_slug))
+			else:
+				rowi = session.exec(
+					select(Item).where(Item.sku == str(focus_slug)).limit(1)
+				).first()
 		except Exception:
 			rowi = None
 		pid: Optional[int] = None
@@ -727,9 +837,12 @@ def _load_focus_product_and_stock(conversation_id: int) -> Tuple[Optional[Dict[s
 		# If no product id yet, resolve Product by slug or name
 		if pid is None:
 			try:
-				rowp = session.exec(
-					select(Product).where((Product.slug == str(focus_slug)) | (Product.name == str(focus_slug))).limit(1)
-				).first()
+				if catalog is not None:
+					rowp = catalog.find_product(str(focus_slug))
+				else:
+					rowp = session.exec(
+						select(Product).where((Product.slug == str(focus_slug)) | (Product.name == str(focus_slug))).limit(1)
+					).first()
 			except Exception:
 				rowp = None
 			if rowp:
@@ -740,9 +853,12 @@ def _load_focus_product_and_stock(conversation_id: int) -> Tuple[Optional[Dict[s
 		# Load siblings / variants for that product id
 		if pid is not None:
 			try:
-				rows_it = session.exec(
-					select(Item).where(Item.product_id == pid).limit(200)
-				).all()
+				if catalog is not None:
+					rows_it = catalog.product_items(pid)
+				else:
+					rows_it = session.exec(
+						select(Item).where(Item.product_id == pid).limit(200)
+					).all()
 			except Exception:
 				rows_it = []
 			for r in rows_it:
@@ -768,7 +884,9 @@ def _load_focus_product_and_stock(conversation_id: int) -> Tuple[Optional[Dict[s
 		p_id_val: Optional[int] = pid
 		p_slug: Optional[str] = None
 		try:
-			if pid is not None:
+			if catalog is not None:
+				rowp2 = catalog.product(pid) if pid is not None else catalog.find_product(str(focus_slug))
+			elif pid is not None:
 				rowp2 = session.exec(select(Product).where(Product.id == pid).limit(1)).first()
 			else:
 				rowp2 = session.exec(
@@ -923,6 +1041,10 @@ def _load_customer_info(conversation_id: int) -> Dict[str, Any]:
 		"contact_phone": None,
 		"contact_address": None,
 	}
+	snapshot = get_conversation_snapshot(int(conversation_id))
+	if snapshot is not None:
+		customer_info.update(snapshot.customer_info)
+		return customer_info
 	try:
 		with get_session() as session:
 			# Get conversation to find ig_user_id
@@ -972,80 +1094,88 @@ def _load_history(conversation_id: int, *, limit: int = 40) -> Tuple[List[Dict[s
 				return 0
 		return 0
 
-	with get_session() as session:
-		try:
-			conv_row = session.exec(
-				select(Conversation.ig_user_id)
-				.where(Conversation.id == int(conversation_id))
-				.limit(1)
-			).first()
-			if conv_row:
-				if isinstance(conv_row, str):
-					ig_user_id = conv_row
-				else:
-					ig_user_id = (
-						conv_row.ig_user_id
-						if hasattr(conv_row, "ig_user_id")
-						else (conv_row[0] if len(conv_row) > 0 else None)
-					)
-				if ig_user_id and str(ig_user_id).startswith("mock_"):
-					is_mock_conversation = True
-		except Exception:
-			is_mock_conversation = False
-
-		# For REAL conversations: Only include messages actually sent to client
-		# For MOCK conversations: Include all messages (they're simulated)
-		if is_mock_conversation:
-			# Mock: include all messages
-			msgs = (
-				session.exec(
-					select(Message)
-					.where(Message.conversation_id == int(conversation_id))
-					.order_by(Message.timestamp_ms.asc())
-					.limit(limit_val)
-				).all()
-			)
-		else:
-			# Real: Only include inbound messages OR outbound messages that were actually sent
-			from sqlalchemy import or_
-			msgs = (
-				session.exec(
-					select(Message)
-					.where(Message.conversation_id == int(conversation_id))
-					.where(
-						# Include all inbound messages (from customer)
-						(Message.direction == "in")
-						|
-						# Include outbound messages that were actually sent
-						(
-							(Message.direction == "out")
-							& (
-								(Message.ai_status == "sent")
-								| (Message.ai_status.is_(None))  # Manual messages (no ai_status)
+	snapshot = get_conversation_snapshot(int(conversation_id))
+	if snapshot is not None and not snapshot.is_mock:
+		# Snapshot rows use the same filter/order as the real-conversation query below
+		msgs = [
+			SimpleNamespace(direction=row.get("dir"), text=row.get("text"), timestamp_ms=row.get("timestamp_ms"))
+			for row in snapshot.history_rows[:limit_val]
+		]
+	else:
+		with get_session() as session:
+			try:
+				conv_row = session.exec(
+					select(Conversation.ig_user_id)
+					.where(Conversation.id == int(conversation_id))
+					.limit(1)
+				).first()
+				if conv_row:
+					if isinstance(conv_row, str):
+						ig_user_id = conv_row
+					else:
+						ig_user_id = (
+							conv_row.ig_user_id
+							if hasattr(conv_row, "ig_user_id")
+							else (conv_row[0] if len(conv_row) > 0 else None)
+						)
+					if ig_user_id and str(ig_user_id).startswith("mock_"):
+						is_mock_conversation = True
+			except Exception:
+				is_mock_conversation = False
+
+			# For REAL conversations: Only include messages actually sent to client
+			# For MOCK conversations: Include all messages (they're simulated)
+			if is_mock_conversation:
+				# Mock: include all messages
+				msgs = (
+					session.exec(
+						select(Message)
+						.where(Message.conversation_id == int(conversation_id))
+						.order_by(Message.timestamp_ms.asc())
+						.limit(limit_val)
+					).all()
+				)
+			else:
+				# Real: Only include inbound messages OR outbound messages that were actually sent
+				from sqlalchemy import or_
+				msgs = (
+					session.exec(
+						select(Message)
+						.where(Message.conversation_id == int(conversation_id))
+						.where(
+							# Include all inbound messages (from customer)
+							(Message.direction == "in")
+							|
+							# Include outbound messages that were actually sent
+							(
+								(Message.direction == "out")
+								& (
+									(Message.ai_status == "sent")
+									| (Message.ai_status.is_(None))  # Manual messages (no ai_status)
+								)
 							)
 						)
-					)
-					.order_by(Message.timestamp_ms.asc())
-					.limit(limit_val)
-				).all()
-			)
+						.order_by(Message.timestamp_ms.asc())
+						.limit(limit_val)
+					).all()
+				)
 
-		# For mock conversations, also load shadow replies
-		if is_mock_conversation:
-			try:
-				shadow_query = (
-					select(AiShadowReply)
-					.where(AiShadowReply.conversation_id == int(conversation_id))
-					.where(
-						(AiShadowReply.status.is_(None))
-						| (AiShadowReply.status.in_(("sent", "suggested")))
+			# For mock conversations, also load shadow replies
+			if is_mock_conversation:
+				try:
+					shadow_query = (
+						select(AiShadowReply)
+						.where(AiShadowReply.conversation_id == int(conversation_id))
+						.where(
+							(AiShadowReply.status.is_(None))
+							| (AiShadowReply.status.in_(("sent", "suggested")))
+						)
+						.order_by(AiShadowReply.created_at.asc())
+						.limit(limit_val)
 					)
-					.order_by(AiShadowReply.created_at.asc())
-					.limit(limit_val)
-				)
-				shadow_rows = session.exec(shadow_query).all() or []
-			except Exception:
-				shadow_rows = []
+					shadow_rows = session.exec(shadow_query).all() or []
+				except Exception:
+					shadow_rows = []
 
 	for m in msgs:
 		try:
@@ -1215,6 +1345,9 @@ def _normalize_state(value: Any, *, fallback: Optional[Dict[str, Any]] = None) -
 
 def _has_any_ai_sent_outbound(conversation_id: int) -> bool:
 	"""True if we have at least one outbound message that was sent by AI (ai_status='sent')."""
+	snapshot = get_conversation_snapshot(int(conversation_id))
+	if snapshot is not None:
+		return snapshot.has_ai_sent_outbound
 	try:
 		with get_session() as session:
 			row = session.exec(
@@ -1615,10 +1748,12 @@ Döndürülecek alanlar: reply_text (string, satırlar \\n ile ayrılmış), con
 
 	temperature = get_shadow_temperature_setting()
 	temp_opt_out = is_shadow_temperature_opt_out()
+	intro_timings: Dict[str, Any] = {}
 	kwargs: Dict[str, Any] = {
 		"system_prompt": sys_prompt,
 		"user_prompt": user_prompt,
 		"temperature": None if temp_opt_out else temperature,
+		"timings": intro_timings,
 	}
 	if include_meta:
 		kwargs["include_raw"] = True
@@ -1684,6 +1819,7 @@ Döndürülecek alanlar: reply_text (string, satırlar \\n ile ayrılmış), con
 			"raw_response": raw_response,
 			"serializer_request_payload": api_request_payload,
 			"api_request_payload": api_request_payload,
+			"stage_timings": {"mode": "intro_only", "agent": intro_timings},
 		}
 	return reply
 
@@ -1705,6 +1841,7 @@ def draft_reply(
 	  - reason: str         (short explanation for debugging)
 	  - notes: str|null
 	"""
+	draft_started = time.perf_counter()
 	# Hard safety: once a human agent participates, avoid mixing human+AI histories.
 	# We intentionally do not attempt to "continue" the AI in such threads.
 	if _has_any_human_agent_outbound(int(conversation_id)):
@@ -3124,11 +3261,32 @@ Mesaj sırası ÇOK ÖNEMLİDİR. Her zaman kullanıcının cevap verilmemiş me
 	temperature = get_shadow_temperature_setting()
 	temp_opt_out = is_shadow_temperature_opt_out()
 
+	pipeline_mode = _get_reply_pipeline_mode()
+	stage_timings: Dict[str, Any] = {
+		"mode": pipeline_mode,
+		"context_ms": int((time.perf_counter() - draft_started) * 1000),
+	}
+	agent_timings: Dict[str, Any] = {}
+	agent_started = time.perf_counter()
+	reply_text_stream = JSONFieldStreamExtractor("reply_text") if pipeline_mode == "fused" else None
+	agent_sys_prompt = sys_prompt
+	if pipeline_mode == "fused":
+		agent_sys_prompt = (sys_prompt + "\n\n" + FUSED_OUTPUT_INSTRUCTIONS).strip()
+
+	def _on_agent_delta(piece: str) -> None:
+		if reply_text_stream is None:
+			return
+		if reply_text_stream.feed(piece) and "reply_first_byte_ms" not in agent_timings:
+			agent_timings["reply_first_byte_ms"] = int((time.perf_counter() - agent_started) * 1000)
+
 	def _build_agent_kwargs(include_raw: bool = False, include_request_payload: bool = False) -> Dict[str, Any]:
 		kwargs: Dict[str, Any] = {
-			"system_prompt": sys_prompt,
+			"system_prompt": agent_sys_prompt,
 			"user_prompt": agent_user_prompt,
 			"temperature": None if temp_opt_out else temperature,
+			"stream": True,
+			"on_delta": _on_agent_delta,
+			"timings": agent_timings,
 		}
 		if tools:
 			kwargs["tools"] = tools
@@ -3159,6 +3317,22 @@ Mesaj sırası ÇOK ÖNEMLİDİR. Her zaman kullanıcının cevap verilmemiş me
 			agent_reply_text = agent_result
 	else:
 		agent_reply_text = client.generate_chat(**_build_agent_kwargs())
+	agent_timings.setdefault("total_ms", int((time.perf_counter() - agent_started) * 1000))
+	stage_timings["agent"] = agent_timings
+	tracing.record_perf_span("reply.agent", agent_started, stage=True, calls=agent_timings.get("calls"))
+
+	fused_data: Optional[Dict[str, Any]] = None
+	if pipeline_mode == "fused":
+		fused_data = parse_json_object_loose(agent_reply_text or "")
+		if fused_data is not None and not isinstance(fused_data.get("reply_text"), str):
+			fused_data = None
+		if fused_data is not None:
+			agent_reply_text = fused_data.get("reply_text") or ""
+		else:
+			try:
+				log.warning("fused_agent_unparsed conversation_id=%s; running serializer", conversation_id)
+			except Exception:
+				pass
 
 	agent_reply_text = _sanitize_reply_text(_decode_escape_sequences(agent_reply_text or ""))
 
@@ -3184,6 +3358,7 @@ Mesaj sırası ÇOK ÖNEMLİDİR. Her zaman kullanıcının cevap verilmemiş me
 			"system_prompt": serializer_prompt,
 			"user_prompt": serializer_user_prompt,
 			"temperature": None if temp_opt_out else temperature,
+			"timings": serializer_timings,
 		}
 		if include_raw:
 			kwargs["include_raw"] = True
@@ -3193,7 +3368,13 @@ Mesaj sırası ÇOK ÖNEMLİDİR. Her zaman kullanıcının cevap verilmemiş me
 
 	raw_response: Any = None
 	api_request_payload: Any = None
-	if include_meta:
+	serializer_timings: Dict[str, Any] = {}
+	serializer_started = time.perf_counter()
+	if fused_data is not None:
+		data = fused_data
+		raw_response = agent_raw
+		serializer_timings["skipped"] = True
+	elif include_meta:
 		serializer_result = client.generate_json(**_build_serializer_kwargs(include_raw=True, include_request_payload=True))
 		if isinstance(serializer_result, tuple):
 			if len(serializer_result) == 3:
@@ -3209,6 +3390,15 @@ Mesaj sırası ÇOK ÖNEMLİDİR. Her zaman kullanıcının cevap verilmemiş me
 			data = serializer_result
 	else:
 		data = client.generate_json(**_build_serializer_kwargs())
+	if fused_data is None:
+		serializer_timings["total_ms"] = int((time.perf_counter() - serializer_started) * 1000)
+		tracing.record_perf_span("reply.serializer", serializer_started, stage=True)
+	stage_timings["serializer"] = serializer_timings
+	stage_timings["total_ms"] = int((time.perf_counter() - draft_started) * 1000)
+	try:
+		log.info("draft_reply stage_timings conversation_id=%s timings=%s", conversation_id, stage_timings)
+	except Exception:
+		pass
 
 	# Handle non-dict responses gracefully
 	if data is None or not isinstance(data, dict):
@@ -3491,6 +3681,7 @@ Mesaj sırası ÇOK ÖNEMLİDİR. Her zaman kullanıcının cevap verilmemiş me
 				"agent_raw": agent_raw,
 				"agent_request_payload": agent_request_payload,
 				"serializer_request_payload": api_request_payload,
+				"stage_timings": stage_timings,
 			}
 			reply["debug_meta"] = debug_meta
 		except Exception:
@@ -99,6 +99,16 @@ def touch_shadow_state(
 	force_release = debounce_seconds == 0
 	debounce_sec = max(1, int(debounce_seconds)) if not force_release else 0
 
+	# Hand the active pipeline trace (if any) to worker_reply through the state row
+	trace_ctx = None
+	try:
+		from . import tracing
+
+		trace_ctx = tracing.inject()
+		tracing.link_conversation(cid_int)
+	except Exception:
+		trace_ctx = None
+
 	with get_session() as session:
 		keep_needs_link = False
 		keep_needs_admin = False
@@ -151,12 +161,14 @@ def touch_shadow_state(
 					        WHEN :keep_admin = 1 AND status='needs_admin' THEN status
 					        ELSE 'pending'
 					    END,
+					    trace_ctx=:tp,
 					    updated_at=CURRENT_TIMESTAMP
 					WHERE conversation_id=:cid
 					"""
 				).params(
 					ms=int(last_inbound_ms or 0),
 					cid=cid_int,
+					tp=trace_ctx,
 					keep_link=(1 if keep_needs_link else 0),
 					keep_admin=(1 if keep_needs_admin else 0),
 				)
@@ -8,6 +8,7 @@ from sqlmodel import select
 
 from ..db import get_session
 from ..models import Product, Item, ProductSizeChart, SizeChartEntry
+from .catalog_snapshot import get_catalog
 
 size_log = logging.getLogger("ai.size_matrix")
 DECIMAL_HEIGHT_PATTERN = re.compile(r'(?<!\d)1[\s\.,/-]+([5-9][0-9])(?!\d)', re.IGNORECASE)
@@ -289,14 +290,32 @@ def calculate_size_suggestion(height_cm: int, weight_kg: int, product_id: int) -
 	# Get product to check available sizes
 	with get_session() as session:
 		try:
-			product = session.get(Product, product_id)
-			if not product:
-				return None
-			
-			# Get all available sizes for this product
-			items = session.exec(
-				select(Item).where(Item.product_id == product_id)
-			).all()
+			catalog = get_catalog()
+			cat_product = catalog.product(product_id) if catalog is not None else None
+			if cat_product is not None:
+				items = catalog.product_items(product_id, limit=None)
+				entries = list(catalog.size_chart_entries(product_id))
+			else:
+				product = session.get(Product, product_id)
+				if not product:
+					return None
+				
+				# Get all available sizes for this product
+				items = session.exec(
+					select(Item).where(Item.product_id == product_id)
+				).all()
+				
+				# Product-specific size chart entries
+				entries = []
+				psc = session.exec(
+					select(ProductSizeChart).where(ProductSizeChart.product_id == product_id)
+				).first()
+				if psc and psc.size_chart_id:
+					entries = session.exec(
+						select(SizeChartEntry)
+						.where(SizeChartEntry.size_chart_id == psc.size_chart_id)
+						.order_by(SizeChartEntry.id.asc())
+					).all()
 			
 			available_sizes = set()
 			for item in items:
@@ -304,54 +323,45 @@ def calculate_size_suggestion(height_cm: int, weight_kg: int, product_id: int) -
 					available_sizes.add(item.size.strip().upper())
 			
 			# Check product-specific size chart first
-			psc = session.exec(
-				select(ProductSizeChart).where(ProductSizeChart.product_id == product_id)
-			).first()
-			if psc and psc.size_chart_id:
-				entries = session.exec(
-					select(SizeChartEntry)
-					.where(SizeChartEntry.size_chart_id == psc.size_chart_id)
-					.order_by(SizeChartEntry.id.asc())
-				).all()
-				if entries:
-					def _match_entry(e: SizeChartEntry) -> bool:
-						if e.height_min and height_cm < e.height_min:
-							return False
-						if e.height_max and height_cm > e.height_max:
-							return False
-						if e.weight_min and weight_kg < e.weight_min:
-							return False
-						if e.weight_max and weight_kg > e.weight_max:
-							return False
-						return True
-					
-					def _span(e: SizeChartEntry) -> int:
-						# smaller span wins; treat None as wide range
-						h_span = (e.height_max - e.height_min) if (e.height_max and e.height_min) else 1000
-						w_span = (e.weight_max - e.weight_min) if (e.weight_max and e.weight_min) else 1000
-						return h_span + w_span
-					
-					matches: list[tuple[int, str]] = []
-					matches_relaxed: list[tuple[int, str]] = []
-					for e in entries:
-						size_label = (e.size_label or "").strip()
-						if not size_label:
-							continue
-						size_norm = size_label.upper()
-						if not _match_entry(e):
-							continue
-						entry_span = _span(e)
-						if available_sizes:
-							if size_norm in available_sizes:
-								matches.append((entry_span, size_norm))
-							else:
-								matches_relaxed.append((entry_span, size_norm))
-						else:
+			if entries:
+				def _match_entry(e: SizeChartEntry) -> bool:
+					if e.height_min and height_cm < e.height_min:
+						return False
+					if e.height_max and height_cm > e.height_max:
+						return False
+					if e.weight_min and weight_kg < e.weight_min:
+						return False
+					if e.weight_max and weight_kg > e.weight_max:
+						return False
+					return True
+				
+				def _span(e: SizeChartEntry) -> int:
+					# smaller span wins; treat None as wide range
+					h_span = (e.height_max - e.height_min) if (e.height_max and e.height_min) else 1000
+					w_span = (e.weight_max - e.weight_min) if (e.weight_max and e.weight_min) else 1000
+					return h_span + w_span
+				
+				matches: list[tuple[int, str]] = []
+				matches_relaxed: list[tuple[int, str]] = []
+				for e in entries:
+					size_label = (e.size_label or "").strip()
+					if not size_label:
+						continue
+					size_norm = size_label.upper()
+					if not _match_entry(e):
+						continue
+					entry_span = _span(e)
+					if available_sizes:
+						if size_norm in available_sizes:
 							matches.append((entry_span, size_norm))
-					if matches:
-						return sorted(matches, key=lambda x: (x[0], x[1]))[0][1]
-					if matches_relaxed:
-						return sorted(matches_relaxed, key=lambda x: (x[0], x[1]))[0][1]
+						else:
+							matches_relaxed.append((entry_span, size_norm))
+					else:
+						matches.append((entry_span, size_norm))
+				if matches:
+					return sorted(matches, key=lambda x: (x[0], x[1]))[0][1]
+				if matches_relaxed:
+					return sorted(matches_relaxed, key=lambda x: (x[0], x[1]))[0][1]
 			
 			if not available_sizes:
 				return None
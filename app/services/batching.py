@@ -0,0 +1,308 @@
+"""
+Batch-processing toolkit for backfill / maintenance scans.
+
+Large scans used to `.all()` an unbounded query and then update row by row inside one
+transaction, holding memory proportional to the table and row locks for the whole run.
+The helpers here keep both constant:
+
+- keyset_batches(stmt, key)       read-only keyset pagination (WHERE key > :last ORDER BY
+                                  key LIMIT n), each page in its own short session.
+- run_keyset(stmt, key, handler)  keyset pagination where handler(session, rows) writes in
+                                  the same short session; committed per batch.
+- stream_rows(sql)                server-side cursor (stream_results) for one-pass reads
+                                  that cannot be keyset-paginated.
+- BulkWriter                      collects parameter dicts for one statement and flushes
+                                  them as executemany + commit every `chunk` rows.
+- Throttle                        pause between batches (fixed and/or duty cycle) to leave
+                                  room for the live app; BATCH_SLEEP / BATCH_DUTY env.
+- Checkpoint                      last processed key in system_settings, so an interrupted
+                                  run resumes with --resume.
+- Progress                        periodic "done/total rate eta" lines.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from sqlalchemy import text as _text
+from sqlmodel import select
+
+from ..db import engine, get_session
+from ..models import SystemSetting
+
+
+DEFAULT_BATCH = 500
+_CHECKPOINT_PREFIX = "batch_checkpoint:"
+
+
+def _float_env(name: str, default: float) -> float:
+	try:
+		return float(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def _key_of(row: Any, name: str) -> Any:
+	mapping = getattr(row, "_mapping", None)
+	if mapping is not None:
+		if name in mapping:
+			return mapping[name]
+		# single-entity rows (select(Model)) expose the object as the first element
+		return getattr(row[0], name)
+	if not hasattr(row, name):
+		# single-column selects come back as plain scalars
+		return row
+	return getattr(row, name)
+
+
+class Throttle:
+	"""Sleep between batches: at least `sleep` seconds, or enough to keep DB work at `duty` (0-1]."""
+
+	def __init__(self, sleep: Optional[float] = None, duty: Optional[float] = None) -> None:
+		self.sleep = max(0.0, _float_env("BATCH_SLEEP", 0.05) if sleep is None else float(sleep))
+		d = _float_env("BATCH_DUTY", 1.0) if duty is None else float(duty)
+		self.duty = min(1.0, max(0.05, d))
+		self._started = time.monotonic()
+
+	def start(self) -> None:
+		self._started = time.monotonic()
+
+	def pause(self) -> float:
+		"""Call after each batch; returns the time slept."""
+		busy = time.monotonic() - self._started
+		wait = self.sleep
+		if self.duty < 1.0:
+			wait = max(wait, busy * (1.0 - self.duty) / self.duty)
+		if wait > 0:
+			time.sleep(wait)
+		self._started = time.monotonic()
+		return wait
+
+
+class Progress:
+	"""Prints `label: done/total (pct) rate/s eta` at most every `every` seconds."""
+
+	def __init__(self, label: str, total: Optional[int] = None, every: float = 5.0, stream: Any = None) -> None:
+		self.label = label
+		self.total = total
+		self.every = every
+		self.stream = stream or sys.stdout
+		self.done = 0
+		self._t0 = time.monotonic()
+		self._last = 0.0
+
+	def update(self, n: int = 1, **extra: Any) -> None:
+		self.done += int(n)
+		now = time.monotonic()
+		if now - self._last >= self.every:
+			self._last = now
+			self._emit(now, extra)
+
+	def finish(self, **extra: Any) -> None:
+		self._emit(time.monotonic(), extra, final=True)
+
+	def line(self, now: Optional[float] = None, extra: Optional[Dict[str, Any]] = None, final: bool = False) -> str:
+		elapsed = max(1e-6, (now or time.monotonic()) - self._t0)
+		rate = self.done / elapsed
+		parts = [f"{self.label}: {self.done}"]
+		if self.total:
+			parts[0] += f"/{self.total} ({100.0 * self.done / self.total:.1f}%)"
+		parts.append(f"{rate:.1f}/s")
+		if final:
+			parts.append(f"done in {elapsed:.1f}s")
+		elif self.total and rate > 0:
+			parts.append(f"eta {max(0.0, (self.total - self.done) / rate):.0f}s")
+		for k, v in (extra or {}).items():
+			parts.append(f"{k}={v}")
+		return " ".join(parts)
+
+	def _emit(self, now: float, extra: Dict[str, Any], final: bool = False) -> None:
+		print(self.line(now, extra, final), file=self.stream, flush=True)
+
+
+class Checkpoint:
+	"""Last processed key of a named job, stored in system_settings (survives pod restarts)."""
+
+	def __init__(self, name: str) -> None:
+		self.key = f"{_CHECKPOINT_PREFIX}{name}"
+
+	def load(self, cast: Callable[[str], Any] = int) -> Any:
+		with get_session() as session:
+			row = session.exec(select(SystemSetting).where(SystemSetting.key == self.key)).first()
+			if row is None or row.value in (None, ""):
+				return None
+			try:
+				return cast(row.value)
+			except Exception:
+				return None
+
+	def save(self, value: Any) -> None:
+		with get_session() as session:
+			row = session.exec(select(SystemSetting).where(SystemSetting.key == self.key)).first()
+			if row is None:
+				row = SystemSetting(key=self.key, value="", description="batch job resume point")
+			row.value = str(value)
+			row.updated_at = dt.datetime.utcnow()
+			session.add(row)
+
+	def clear(self) -> None:
+		with get_session() as session:
+			row = session.exec(select(SystemSetting).where(SystemSetting.key == self.key)).first()
+			if row is not None:
+				session.delete(row)
+
+
+def _page(stmt: Any, key: Any, last: Any, size: int, descending: bool) -> Any:
+	if descending:
+		page = stmt.order_by(key.desc()).limit(size)
+		return page.where(key < last) if last is not None else page
+	page = stmt.order_by(key).limit(size)
+	return page.where(key > last) if last is not None else page
+
+
+def keyset_batches(
+	stmt: Any,
+	key: Any,
+	*,
+	batch_size: int = DEFAULT_BATCH,
+	after: Any = None,
+	throttle: Optional[Throttle] = None,
+	descending: bool = False,
+) -> Iterator[List[Any]]:
+	"""
+	Yield pages of `stmt` ordered by the unique column `key` (highest first with
+	descending), each fetched in its own short session (objects stay readable: sessions do
+	not expire on commit). Read-only: write via run_keyset or BulkWriter.
+	"""
+	name = key.key
+	last = after
+	size = max(1, int(batch_size))
+	while True:
+		page = _page(stmt, key, last, size, descending)
+		with get_session() as session:
+			rows = list(session.exec(page).all())
+		if not rows:
+			return
+		last = _key_of(rows[-1], name)
+		yield rows
+		if len(rows) < size:
+			return
+		if throttle is not None:
+			throttle.pause()
+
+
+def run_keyset(
+	stmt: Any,
+	key: Any,
+	handler: Callable[[Any, List[Any]], Optional[int]],
+	*,
+	batch_size: int = DEFAULT_BATCH,
+	checkpoint: Optional[Checkpoint] = None,
+	resume: bool = False,
+	throttle: Optional[Throttle] = None,
+	progress: Optional[Progress] = None,
+	dry_run: bool = False,
+	descending: bool = False,
+) -> int:
+	"""
+	Keyset-paginate `stmt` by `key` and call handler(session, rows) per page in one short
+	transaction (committed per batch; rolled back instead with dry_run). The handler may
+	return how many rows it changed. With a checkpoint the last key is saved after every
+	committed batch and cleared when the scan completes; resume=True starts after it.
+	descending=True walks the key from the highest value down (when later pages must win
+	over earlier ones, as in a newest-first loop). Returns the summed handler results.
+	"""
+	name = key.key
+	last = checkpoint.load() if (checkpoint is not None and resume) else None
+	size = max(1, int(batch_size))
+	throttle = throttle or Throttle()
+	changed = 0
+	while True:
+		throttle.start()
+		page = _page(stmt, key, last, size, descending)
+		with get_session() as session:
+			rows = list(session.exec(page).all())
+			if rows:
+				changed += int(handler(session, rows) or 0)
+			if dry_run:
+				session.rollback()
+		if not rows:
+			break
+		last = _key_of(rows[-1], name)
+		if checkpoint is not None and not dry_run:
+			checkpoint.save(last)
+		if progress is not None:
+			progress.update(len(rows), changed=changed, last=last)
+		if len(rows) < size:
+			break
+		throttle.pause()
+	if checkpoint is not None and not dry_run:
+		checkpoint.clear()
+	if progress is not None:
+		progress.finish(changed=changed)
+	return changed
+
+
+def stream_rows(sql: str, params: Optional[Dict[str, Any]] = None, *, batch_size: int = DEFAULT_BATCH) -> Iterator[Sequence[Any]]:
+	"""
+	One-pass read through a server-side cursor (unbuffered; memory bounded by batch_size).
+	Keep the consumer quick and do writes on another connection: the cursor's connection
+	stays busy until the iteration ends.
+	"""
+	size = max(1, int(batch_size))
+	with engine.connect() as conn:
+		result = conn.execution_options(stream_results=True, yield_per=size).execute(_text(sql), params or {})
+		for partition in result.partitions(size):
+			yield partition
+
+
+class BulkWriter:
+	"""
+	Buffer parameter dicts for one statement and flush them as executemany + commit every
+	`chunk` rows (own short transactions), optionally throttled. Use as a context manager
+	so the tail is flushed; dry_run counts without writing.
+	"""
+
+	def __init__(
+		self,
+		statement: Any,
+		*,
+		chunk: int = DEFAULT_BATCH,
+		throttle: Optional[Throttle] = None,
+		dry_run: bool = False,
+	) -> None:
+		self.statement = _text(statement) if isinstance(statement, str) else statement
+		self.chunk = max(1, int(chunk))
+		self.throttle = throttle
+		self.dry_run = dry_run
+		self.pending: List[Dict[str, Any]] = []
+		self.written = 0
+		self.flushes = 0
+
+	def add(self, params: Dict[str, Any]) -> None:
+		self.pending.append(params)
+		if len(self.pending) >= self.chunk:
+			self.flush()
+
+	def flush(self) -> None:
+		if not self.pending:
+			return
+		batch, self.pending = self.pending, []
+		if not self.dry_run:
+			with engine.begin() as conn:
+				conn.execute(self.statement, batch)
+		self.written += len(batch)
+		self.flushes += 1
+		if self.throttle is not None:
+			self.throttle.pause()
+
+	def __enter__(self) -> "BulkWriter":
+		return self
+
+	def __exit__(self, exc_type, exc, tb) -> bool:  # noqa: ANN001
+		if exc_type is None:
+			self.flush()
+		return False
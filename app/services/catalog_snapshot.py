@@ -0,0 +1,512 @@
+"""
+Versioned in-memory product catalog used by AI context builders.
+
+Holds products, variants (items), prices, size chart entries and on-hand counts as compact
+__slots__ records so prompt building does not hit MySQL for every draft.
+
+Versioning (Redis, shared by web and workers):
+- catalog:version      INCR on every committed catalog write
+- catalog:changes      sorted set member=<entity key>, score=version of its last change
+                       keys: p:<product_id>, i:<item_id>, s:<item_id> (stock), c:<size_chart_id>,
+                       pc:<product_id> (chart assignment)
+- catalog:changes:floor versions at or below this were trimmed -> full reload
+The INCR and the ZADD of its keys run in one Lua script, so a version is never visible
+without its change keys.
+
+Readers compare versions at most every AI_CATALOG_RECHECK_SECONDS and reload only the
+entities that changed. A full reload happens on first use, when the change log was
+trimmed past our version, and every AI_CATALOG_MAX_AGE seconds (covers raw SQL writers
+and Redis outages).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as _OrmSession
+from sqlmodel import select
+
+from ..db import get_session
+from ..models import Item, Product, ProductSizeChart, SizeChart, SizeChartEntry, StockMovement
+
+
+log = logging.getLogger("catalog")
+
+_VERSION_KEY = "catalog:version"
+_CHANGES_KEY = "catalog:changes"
+_FLOOR_KEY = "catalog:changes:floor"
+_CHANGES_KEEP = 5000
+# INCR the version and ZADD the change keys under it in one atomic step, so a reader that
+# sees version N also sees N's keys. KEYS: version, changes, floor; ARGV: keep, keys...
+_PUBLISH_LUA = """
+local v = redis.call('INCR', KEYS[1])
+local batch = {}
+for i = 2, #ARGV do
+	batch[#batch + 1] = v
+	batch[#batch + 1] = ARGV[i]
+	if #batch >= 1000 then
+		redis.call('ZADD', KEYS[2], unpack(batch))
+		batch = {}
+	end
+end
+if #batch > 0 then
+	redis.call('ZADD', KEYS[2], unpack(batch))
+end
+if v % 100 == 0 then
+	local floor = v - tonumber(ARGV[1])
+	if floor > 0 then
+		redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', floor)
+		redis.call('SET', KEYS[3], floor)
+	end
+end
+return v
+"""
+PRODUCT_ITEMS_LIMIT = 200
+
+
+def _parse_tags(raw: Any) -> Tuple[str, ...]:
+	"""ai_tags JSON array -> lowercased tuple (focus detection keywords)."""
+	if not raw:
+		return ()
+	try:
+		tags = json.loads(raw) if isinstance(raw, str) else raw
+	except Exception:
+		return ()
+	if not isinstance(tags, list):
+		return ()
+	return tuple(t.lower() for t in tags if isinstance(t, str) and t)
+
+
+class ProductRecord:
+	__slots__ = (
+		"id",
+		"name",
+		"slug",
+		"default_price",
+		"default_color",
+		"ai_system_msg",
+		"ai_prompt_msg",
+		"ai_variant_exclusions",
+		"ai_tags",
+	)
+
+	def __init__(self, row: Product):
+		self.id = int(row.id)
+		self.name = row.name
+		self.slug = row.slug
+		self.default_price = row.default_price
+		self.default_color = row.default_color
+		self.ai_system_msg = getattr(row, "ai_system_msg", None)
+		self.ai_prompt_msg = getattr(row, "ai_prompt_msg", None)
+		self.ai_variant_exclusions = getattr(row, "ai_variant_exclusions", None)
+		self.ai_tags = _parse_tags(getattr(row, "ai_tags", None))
+
+
+class ItemRecord:
+	__slots__ = ("id", "product_id", "sku", "name", "color", "size", "price")
+
+	def __init__(self, row: Item):
+		self.id = int(row.id)
+		self.product_id = int(row.product_id) if row.product_id is not None else None
+		self.sku = row.sku
+		self.name = row.name
+		self.color = row.color
+		self.size = row.size
+		self.price = row.price
+
+
+class SizeChartEntryRecord:
+	__slots__ = ("id", "size_label", "height_min", "height_max", "weight_min", "weight_max")
+
+	def __init__(self, row: SizeChartEntry):
+		self.id = int(row.id)
+		self.size_label = row.size_label
+		self.height_min = row.height_min
+		self.height_max = row.height_max
+		self.weight_min = row.weight_min
+		self.weight_max = row.weight_max
+
+
+class Catalog:
+	"""One immutable-by-convention catalog version; refreshes build a new instance."""
+
+	__slots__ = (
+		"version",
+		"loaded_at",
+		"checked_at",
+		"products",
+		"items",
+		"product_by_slug",
+		"product_by_name",
+		"item_by_sku",
+		"items_by_product",
+		"chart_by_product",
+		"chart_entries",
+		"on_hand",
+	)
+
+	def __init__(self) -> None:
+		self.version: Optional[int] = None
+		self.loaded_at = 0.0
+		self.checked_at = 0.0
+		self.products: Dict[int, ProductRecord] = {}
+		self.items: Dict[int, ItemRecord] = {}
+		self.product_by_slug: Dict[str, int] = {}
+		self.product_by_name: Dict[str, int] = {}
+		self.item_by_sku: Dict[str, int] = {}
+		self.items_by_product: Dict[int, List[int]] = {}
+		self.chart_by_product: Dict[int, int] = {}
+		self.chart_entries: Dict[int, Tuple[SizeChartEntryRecord, ...]] = {}
+		self.on_hand: Dict[int, int] = {}
+
+	def copy(self) -> "Catalog":
+		c = Catalog()
+		c.version = self.version
+		c.loaded_at = self.loaded_at
+		c.checked_at = self.checked_at
+		c.products = dict(self.products)
+		c.items = dict(self.items)
+		c.product_by_slug = dict(self.product_by_slug)
+		c.product_by_name = dict(self.product_by_name)
+		c.item_by_sku = dict(self.item_by_sku)
+		c.items_by_product = {k: list(v) for k, v in self.items_by_product.items()}
+		c.chart_by_product = dict(self.chart_by_product)
+		c.chart_entries = dict(self.chart_entries)
+		c.on_hand = dict(self.on_hand)
+		return c
+
+	# --- lookups -----------------------------------------------------------------
+
+	def product(self, product_id: Optional[int]) -> Optional[ProductRecord]:
+		if product_id is None:
+			return None
+		return self.products.get(int(product_id))
+
+	def find_product(self, slug_or_name: Optional[str]) -> Optional[ProductRecord]:
+		"""Same precedence as the SQL lookups: slug match, then exact name."""
+		if not slug_or_name:
+			return None
+		key = str(slug_or_name)
+		pid = self.product_by_slug.get(key)
+		if pid is None:
+			pid = self.product_by_name.get(key)
+		return self.products.get(pid) if pid is not None else None
+
+	def item_for_sku(self, sku: Optional[str]) -> Optional[ItemRecord]:
+		if not sku:
+			return None
+		iid = self.item_by_sku.get(str(sku))
+		return self.items.get(iid) if iid is not None else None
+
+	def product_items(self, product_id: Optional[int], limit: Optional[int] = PRODUCT_ITEMS_LIMIT) -> List[ItemRecord]:
+		"""Variants of a product in id order (limit=None for all)."""
+		if product_id is None:
+			return []
+		ids = self.items_by_product.get(int(product_id)) or []
+		if limit is not None:
+			ids = ids[:limit]
+		return [self.items[i] for i in ids if i in self.items]
+
+	def size_chart_entries(self, product_id: Optional[int]) -> Tuple[SizeChartEntryRecord, ...]:
+		if product_id is None:
+			return ()
+		chart_id = self.chart_by_product.get(int(product_id))
+		if chart_id is None:
+			return ()
+		return self.chart_entries.get(chart_id, ())
+
+	def on_hand_for(self, item_id: int) -> int:
+		return int(self.on_hand.get(int(item_id), 0))
+
+	# --- mutation (only on a fresh copy) -----------------------------------------
+
+	def _put_product(self, rec: Optional[ProductRecord], product_id: int) -> None:
+		old = self.products.pop(product_id, None)
+		if old is not None:
+			if self.product_by_slug.get(old.slug) == product_id:
+				self.product_by_slug.pop(old.slug, None)
+			if self.product_by_name.get(old.name) == product_id:
+				self.product_by_name.pop(old.name, None)
+		if rec is None:
+			return
+		self.products[product_id] = rec
+		if rec.slug:
+			self.product_by_slug[rec.slug] = product_id
+		if rec.name:
+			# keep the lowest id for duplicate names (stable, like LIMIT 1 on the PK index)
+			current = self.product_by_name.get(rec.name)
+			if current is None or product_id < current:
+				self.product_by_name[rec.name] = product_id
+
+	def _put_item(self, rec: Optional[ItemRecord], item_id: int) -> None:
+		old = self.items.pop(item_id, None)
+		if old is not None:
+			if self.item_by_sku.get(old.sku) == item_id:
+				self.item_by_sku.pop(old.sku, None)
+			if old.product_id is not None:
+				ids = self.items_by_product.get(old.product_id)
+				if ids and item_id in ids:
+					ids.remove(item_id)
+		if rec is None:
+			return
+		self.items[item_id] = rec
+		if rec.sku:
+			self.item_by_sku[rec.sku] = item_id
+		if rec.product_id is not None:
+			ids = self.items_by_product.setdefault(rec.product_id, [])
+			ids.append(item_id)
+			ids.sort()
+
+
+_current: Optional[Catalog] = None
+_refresh_lock = threading.Lock()
+_local_changes: Set[str] = set()
+_stats: Dict[str, int] = {"full_loads": 0, "incremental": 0, "hits": 0}
+
+
+def _recheck_seconds() -> float:
+	return float(os.getenv("AI_CATALOG_RECHECK_SECONDS", "2"))
+
+
+def _max_age_seconds() -> float:
+	return float(os.getenv("AI_CATALOG_MAX_AGE", "300"))
+
+
+def _redis():
+	from .monitoring import _get_redis
+
+	return _get_redis()
+
+
+def _on_hand(session, item_ids: Iterable[int]) -> Dict[int, int]:
+	from .inventory import compute_on_hand_for_items
+
+	return compute_on_hand_for_items(session, list(item_ids))
+
+
+def _on_hand_all(session) -> Dict[int, int]:
+	from .inventory import get_stock_map
+
+	return get_stock_map(session)
+
+
+def _load_full() -> Catalog:
+	cat = Catalog()
+	with get_session() as session:
+		for p in session.exec(select(Product).order_by(Product.id.asc())).all():
+			cat._put_product(ProductRecord(p), int(p.id))
+		for it in session.exec(select(Item).order_by(Item.id.asc())).all():
+			cat._put_item(ItemRecord(it), int(it.id))
+		for psc in session.exec(select(ProductSizeChart)).all():
+			cat.chart_by_product[int(psc.product_id)] = int(psc.size_chart_id)
+		entries: Dict[int, List[SizeChartEntryRecord]] = {}
+		for e in session.exec(select(SizeChartEntry).order_by(SizeChartEntry.id.asc())).all():
+			entries.setdefault(int(e.size_chart_id), []).append(SizeChartEntryRecord(e))
+		cat.chart_entries = {k: tuple(v) for k, v in entries.items()}
+		cat.on_hand = _on_hand_all(session)
+	_stats["full_loads"] += 1
+	return cat
+
+
+def _apply_changes(base: Catalog, keys: Set[str]) -> Catalog:
+	"""Reload only the entities named by change keys, on a copy of base."""
+	product_ids: Set[int] = set()
+	item_ids: Set[int] = set()
+	stock_ids: Set[int] = set()
+	chart_ids: Set[int] = set()
+	assign_pids: Set[int] = set()
+	for key in keys:
+		kind, _, raw = key.partition(":")
+		if not raw.isdigit():
+			continue
+		val = int(raw)
+		if kind == "p":
+			product_ids.add(val)
+		elif kind == "i":
+			item_ids.add(val)
+		elif kind == "s":
+			stock_ids.add(val)
+		elif kind == "c":
+			chart_ids.add(val)
+		elif kind == "pc":
+			assign_pids.add(val)
+	cat = base.copy()
+	with get_session() as session:
+		if product_ids:
+			found = {int(p.id): p for p in session.exec(select(Product).where(Product.id.in_(product_ids))).all()}
+			for pid in product_ids:
+				row = found.get(pid)
+				cat._put_product(ProductRecord(row) if row else None, pid)
+		if item_ids:
+			found_items = {int(i.id): i for i in session.exec(select(Item).where(Item.id.in_(item_ids))).all()}
+			for iid in item_ids:
+				row = found_items.get(iid)
+				cat._put_item(ItemRecord(row) if row else None, iid)
+			stock_ids |= item_ids
+		if stock_ids:
+			fresh = _on_hand(session, stock_ids)
+			for iid in stock_ids:
+				cat.on_hand[iid] = int(fresh.get(iid, 0))
+		if assign_pids:
+			rows = session.exec(select(ProductSizeChart).where(ProductSizeChart.product_id.in_(assign_pids))).all()
+			for pid in assign_pids:
+				cat.chart_by_product.pop(pid, None)
+			for psc in rows:
+				cat.chart_by_product[int(psc.product_id)] = int(psc.size_chart_id)
+				chart_ids.add(int(psc.size_chart_id))
+		if chart_ids:
+			rows_e = session.exec(
+				select(SizeChartEntry).where(SizeChartEntry.size_chart_id.in_(chart_ids)).order_by(SizeChartEntry.id.asc())
+			).all()
+			grouped: Dict[int, List[SizeChartEntryRecord]] = {cid: [] for cid in chart_ids}
+			for e in rows_e:
+				grouped.setdefault(int(e.size_chart_id), []).append(SizeChartEntryRecord(e))
+			for cid, recs in grouped.items():
+				if recs:
+					cat.chart_entries[cid] = tuple(recs)
+				else:
+					cat.chart_entries.pop(cid, None)
+	_stats["incremental"] += 1
+	return cat
+
+
+def _read_remote(since: Optional[int]) -> Tuple[Optional[int], Optional[Set[str]]]:
+	"""
+	Return (remote_version, changed_keys_since). changed_keys is None when a full reload is
+	needed; remote_version is None when Redis is unavailable.
+	"""
+	try:
+		r = _redis()
+		raw = r.get(_VERSION_KEY)
+		remote = int(raw or 0)
+		if since is None or remote == since:
+			return remote, set()
+		floor = int(r.get(_FLOOR_KEY) or 0)
+		if since < floor or remote < since:
+			return remote, None
+		members = r.zrangebyscore(_CHANGES_KEY, f"({since}", "+inf")
+		return remote, {m.decode() if isinstance(m, bytes) else str(m) for m in members}
+	except Exception:
+		return None, None
+
+
+def get_catalog() -> Optional[Catalog]:
+	"""Current catalog (refreshed if stale), or None if it cannot be loaded."""
+	global _current
+	cat = _current
+	now = time.monotonic()
+	if cat is not None and (now - cat.loaded_at) < _max_age_seconds() and (now - cat.checked_at) < _recheck_seconds() and not _local_changes:
+		_stats["hits"] += 1
+		return cat
+	with _refresh_lock:
+		cat = _current
+		now = time.monotonic()
+		try:
+			if cat is None or (now - cat.loaded_at) >= _max_age_seconds():
+				remote, _ = _read_remote(None)
+				fresh = _load_full()
+				fresh.version = remote
+				fresh.loaded_at = fresh.checked_at = now
+				_local_changes.clear()
+				_current = fresh
+				return fresh
+			if (now - cat.checked_at) < _recheck_seconds() and not _local_changes:
+				return cat
+			remote, keys = _read_remote(cat.version)
+			local = set(_local_changes)
+			_local_changes.clear()
+			if remote is not None and keys is None:
+				fresh = _load_full()
+				fresh.loaded_at = now
+			elif keys or local:
+				fresh = _apply_changes(cat, (keys or set()) | local)
+			else:
+				fresh = cat.copy()
+			fresh.version = remote if remote is not None else cat.version
+			fresh.checked_at = now
+			_current = fresh
+			return fresh
+		except Exception as exc:
+			try:
+				log.warning("catalog refresh failed error=%s", str(exc)[:200])
+			except Exception:
+				pass
+			return cat
+
+
+def get_catalog_stats() -> Dict[str, Any]:
+	cat = _current
+	stats: Dict[str, Any] = dict(_stats)
+	stats["version"] = cat.version if cat else None
+	stats["products"] = len(cat.products) if cat else 0
+	stats["items"] = len(cat.items) if cat else 0
+	return stats
+
+
+def note_catalog_changed(keys: Iterable[str], session: Any = None) -> None:
+	"""
+	Publish catalog change keys (p:<id>, i:<id>, s:<item_id>, c:<chart_id>, pc:<product_id>).
+	With a session the keys are published when it commits (for raw SQL writers).
+	"""
+	keys = {str(k) for k in keys if k}
+	if not keys:
+		return
+	if session is not None:
+		try:
+			session.info.setdefault("catalog_changes", set()).update(keys)
+			return
+		except Exception:
+			pass
+	_local_changes.update(keys)
+	try:
+		publish = _redis().register_script(_PUBLISH_LUA)
+		publish(keys=[_VERSION_KEY, _CHANGES_KEY, _FLOOR_KEY], args=[_CHANGES_KEEP, *sorted(keys)])
+	except Exception:
+		pass
+
+
+def _change_keys(obj: Any) -> List[str]:
+	if isinstance(obj, Product) and obj.id:
+		return [f"p:{int(obj.id)}"]
+	if isinstance(obj, Item) and obj.id:
+		return [f"i:{int(obj.id)}"]
+	if isinstance(obj, StockMovement) and obj.item_id:
+		return [f"s:{int(obj.item_id)}"]
+	if isinstance(obj, SizeChartEntry) and obj.size_chart_id:
+		return [f"c:{int(obj.size_chart_id)}"]
+	if isinstance(obj, SizeChart) and obj.id:
+		return [f"c:{int(obj.id)}"]
+	if isinstance(obj, ProductSizeChart) and obj.product_id:
+		return [f"pc:{int(obj.product_id)}"]
+	return []
+
+
+@event.listens_for(_OrmSession, "after_flush")
+def _collect_catalog_changes(session, flush_context) -> None:
+	try:
+		pending: Optional[Set[str]] = None
+		for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+			keys = _change_keys(obj)
+			if keys:
+				if pending is None:
+					pending = session.info.setdefault("catalog_changes", set())
+				pending.update(keys)
+	except Exception:
+		pass
+
+
+@event.listens_for(_OrmSession, "after_commit")
+def _publish_catalog_changes(session) -> None:
+	pending = session.info.pop("catalog_changes", None)
+	if pending:
+		note_catalog_changed(pending)
+
+
+@event.listens_for(_OrmSession, "after_rollback")
+def _discard_catalog_changes(session) -> None:
+	session.info.pop("catalog_changes", None)
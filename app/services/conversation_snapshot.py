@@ -0,0 +1,427 @@
+"""
+Per-conversation context snapshot used by AI reply drafting.
+
+draft_reply used to open a fresh session for every piece of conversation context
+(human-agent check, AI-sent check, customer info, history). The snapshot loads all of
+it with two statements and keeps it in a small per-process LRU.
+
+Freshness is tracked with Redis counters that writers bump after commit:
+- ctxsnap:conv:<id>  hash {ins, upd}: new messages -> incremental append,
+  updated/deleted messages -> full rebuild
+- ctxsnap:user:<ig_user_id>: IGUser profile/contact changes -> customer info reload
+
+ORM writes are picked up automatically via session events; raw SQL writers call
+note_conversation_changed / note_ig_user_changed.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event, text as _text
+from sqlalchemy.orm import Session as _OrmSession
+
+from ..db import get_session
+from ..models import IGUser, Message
+
+
+log = logging.getLogger("ai.snapshot")
+
+# Upper bound of history rows kept per conversation (draft_reply caps its limit at 100)
+HISTORY_CAP = 100
+
+_CONV_KEY = "ctxsnap:conv:{}"
+_USER_KEY = "ctxsnap:user:{}"
+_KEY_TTL_SECONDS = 7 * 24 * 60 * 60
+
+
+@dataclass
+class ConversationSnapshot:
+	conversation_id: int
+	ig_user_id: Optional[str]
+	is_mock: bool
+	customer_info: Dict[str, Any]
+	has_human_agent_outbound: bool
+	has_ai_sent_outbound: bool
+	# History-eligible rows (inbound, or outbound sent/manual), ascending by timestamp
+	history_rows: List[Dict[str, Any]] = field(default_factory=list)
+	max_message_id: int = 0
+	conv_version: Optional[Tuple[str, str]] = None
+	user_version: Optional[str] = None
+	built_at: float = 0.0
+	checked_at: float = 0.0
+
+
+_cache: "OrderedDict[int, ConversationSnapshot]" = OrderedDict()
+_cache_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "builds": 0, "incremental": 0, "user_reloads": 0}
+
+
+def _recheck_seconds() -> float:
+	return float(os.getenv("AI_CONTEXT_SNAPSHOT_RECHECK_MS", "1000")) / 1000.0
+
+
+def _max_age_seconds() -> float:
+	return float(os.getenv("AI_CONTEXT_SNAPSHOT_TTL", "300"))
+
+
+def _max_entries() -> int:
+	return int(os.getenv("AI_CONTEXT_SNAPSHOT_MAX", "512"))
+
+
+def _redis():
+	from .monitoring import _get_redis
+
+	return _get_redis()
+
+
+def _read_versions(conversation_id: int, ig_user_id: Optional[str]) -> Tuple[Optional[Tuple[str, str]], Optional[str]]:
+	"""Return ((ins, upd), user_version) in one round-trip; (None, None) if Redis is unavailable."""
+	try:
+		r = _redis()
+		with r.pipeline() as p:
+			p.hmget(_CONV_KEY.format(int(conversation_id)), "ins", "upd")
+			p.get(_USER_KEY.format(ig_user_id or "-"))
+			conv_vals, user_val = p.execute()
+		conv_version = (str(conv_vals[0] or "0"), str(conv_vals[1] or "0"))
+		return conv_version, str(user_val or "0")
+	except Exception:
+		return None, None
+
+
+def _is_human_outbound(direction: Optional[str], sender_type: Optional[str], ai_status: Optional[str]) -> bool:
+	if direction != "out":
+		return False
+	if sender_type in ("human", "unknown"):
+		return True
+	return sender_type is None and ai_status != "sent"
+
+
+def _is_history_row(direction: Optional[str], ai_status: Optional[str]) -> bool:
+	return direction == "in" or (direction == "out" and (ai_status is None or ai_status == "sent"))
+
+
+def _row_get(row: Any, name: str, idx: int) -> Any:
+	if hasattr(row, name):
+		return getattr(row, name)
+	try:
+		return row[idx]
+	except Exception:
+		return None
+
+
+def _load_customer(session, ig_user_id: Optional[str]) -> Dict[str, Any]:
+	info: Dict[str, Any] = {
+		"username": None,
+		"name": None,
+		"contact_name": None,
+		"contact_phone": None,
+		"contact_address": None,
+	}
+	if not ig_user_id:
+		return info
+	row = session.exec(
+		_text(
+			"""
+			SELECT username, name, contact_name, contact_phone, contact_address
+			FROM ig_users
+			WHERE ig_user_id=:uid
+			LIMIT 1
+			"""
+		).params(uid=str(ig_user_id))
+	).first()
+	if row:
+		for idx, key in enumerate(("username", "name", "contact_name", "contact_phone", "contact_address")):
+			info[key] = _row_get(row, key, idx)
+	return info
+
+
+def _build(conversation_id: int) -> Optional[ConversationSnapshot]:
+	"""Full build: conversation + customer + flags in one statement, history in a second."""
+	with get_session() as session:
+		head = session.exec(
+			_text(
+				"""
+				SELECT
+					c.ig_user_id,
+					u.username, u.name, u.contact_name, u.contact_phone, u.contact_address,
+					EXISTS(
+						SELECT 1 FROM message m
+						WHERE m.conversation_id=c.id
+						  AND m.direction='out'
+						  AND (
+								m.sender_type IN ('human','unknown')
+								OR (m.sender_type IS NULL AND (m.ai_status IS NULL OR m.ai_status != 'sent'))
+						  )
+					) AS has_human,
+					EXISTS(
+						SELECT 1 FROM message m
+						WHERE m.conversation_id=c.id AND m.direction='out' AND m.ai_status='sent'
+					) AS has_ai_sent,
+					(SELECT MAX(m.id) FROM message m WHERE m.conversation_id=c.id) AS max_id
+				FROM conversations c
+				LEFT JOIN ig_users u ON u.ig_user_id = c.ig_user_id
+				WHERE c.id=:cid
+				LIMIT 1
+				"""
+			).params(cid=int(conversation_id))
+		).first()
+		if not head:
+			return None
+		ig_user_id = _row_get(head, "ig_user_id", 0)
+		customer_info = {
+			"username": _row_get(head, "username", 1),
+			"name": _row_get(head, "name", 2),
+			"contact_name": _row_get(head, "contact_name", 3),
+			"contact_phone": _row_get(head, "contact_phone", 4),
+			"contact_address": _row_get(head, "contact_address", 5),
+		}
+		rows = session.exec(
+			_text(
+				"""
+				SELECT id, direction, text, timestamp_ms
+				FROM message
+				WHERE conversation_id=:cid
+				  AND (direction='in' OR (direction='out' AND (ai_status='sent' OR ai_status IS NULL)))
+				ORDER BY timestamp_ms ASC
+				LIMIT :cap
+				"""
+			).params(cid=int(conversation_id), cap=HISTORY_CAP)
+		).all()
+	history_rows: List[Dict[str, Any]] = []
+	for r in rows:
+		history_rows.append(
+			{
+				"id": int(_row_get(r, "id", 0) or 0),
+				"dir": _row_get(r, "direction", 1) or "in",
+				"text": _row_get(r, "text", 2) or "",
+				"timestamp_ms": int(_row_get(r, "timestamp_ms", 3) or 0),
+			}
+		)
+	return ConversationSnapshot(
+		conversation_id=int(conversation_id),
+		ig_user_id=str(ig_user_id) if ig_user_id else None,
+		is_mock=bool(ig_user_id and str(ig_user_id).startswith("mock_")),
+		customer_info=customer_info,
+		has_human_agent_outbound=bool(_row_get(head, "has_human", 6)),
+		has_ai_sent_outbound=bool(_row_get(head, "has_ai_sent", 7)),
+		history_rows=history_rows,
+		max_message_id=int(_row_get(head, "max_id", 8) or 0),
+	)
+
+
+def _apply_new_messages(snap: ConversationSnapshot) -> None:
+	"""Append messages inserted after the snapshot was built (id > max_message_id)."""
+	with get_session() as session:
+		rows = session.exec(
+			_text(
+				"""
+				SELECT id, direction, text, timestamp_ms, ai_status, sender_type
+				FROM message
+				WHERE conversation_id=:cid AND id > :max_id
+				ORDER BY id ASC
+				"""
+			).params(cid=int(snap.conversation_id), max_id=int(snap.max_message_id))
+		).all()
+	if not rows:
+		return
+	added = False
+	for r in rows:
+		mid = int(_row_get(r, "id", 0) or 0)
+		direction = _row_get(r, "direction", 1)
+		ai_status = _row_get(r, "ai_status", 4)
+		sender_type = _row_get(r, "sender_type", 5)
+		snap.max_message_id = max(snap.max_message_id, mid)
+		if _is_human_outbound(direction, sender_type, ai_status):
+			snap.has_human_agent_outbound = True
+		if direction == "out" and ai_status == "sent":
+			snap.has_ai_sent_outbound = True
+		if _is_history_row(direction, ai_status):
+			snap.history_rows.append(
+				{
+					"id": mid,
+					"dir": direction or "in",
+					"text": _row_get(r, "text", 2) or "",
+					"timestamp_ms": int(_row_get(r, "timestamp_ms", 3) or 0),
+				}
+			)
+			added = True
+	if added:
+		snap.history_rows.sort(key=lambda item: (item.get("timestamp_ms") or 0, item.get("id") or 0))
+		del snap.history_rows[HISTORY_CAP:]
+
+
+def _store(snap: ConversationSnapshot) -> None:
+	with _cache_lock:
+		_cache[snap.conversation_id] = snap
+		_cache.move_to_end(snap.conversation_id)
+		while len(_cache) > _max_entries():
+			_cache.popitem(last=False)
+
+
+def get_conversation_snapshot(conversation_id: int) -> Optional[ConversationSnapshot]:
+	"""
+	Return a fresh snapshot for the conversation, or None when it cannot be loaded
+	(callers fall back to their direct queries).
+	"""
+	try:
+		cid = int(conversation_id)
+	except Exception:
+		return None
+	now = time.monotonic()
+	with _cache_lock:
+		snap = _cache.get(cid)
+	try:
+		if snap is not None and (now - snap.built_at) < _max_age_seconds():
+			if (now - snap.checked_at) < _recheck_seconds():
+				_stats["hits"] += 1
+				return snap
+			conv_version, user_version = _read_versions(cid, snap.ig_user_id)
+			if conv_version is not None and snap.conv_version is not None:
+				if conv_version[1] == snap.conv_version[1]:
+					if conv_version[0] != snap.conv_version[0]:
+						_apply_new_messages(snap)
+						_stats["incremental"] += 1
+					if user_version != snap.user_version:
+						with get_session() as session:
+							snap.customer_info = _load_customer(session, snap.ig_user_id)
+						_stats["user_reloads"] += 1
+					snap.conv_version = conv_version
+					snap.user_version = user_version
+					snap.checked_at = now
+					_stats["hits"] += 1
+					return snap
+		# Read versions before building so writes racing with the build trigger a refresh
+		conv_version, user_version = _read_versions(cid, snap.ig_user_id if snap else None)
+		fresh = _build(cid)
+		if fresh is None:
+			return None
+		if snap is None or fresh.ig_user_id != snap.ig_user_id:
+			_, user_version = _read_versions(cid, fresh.ig_user_id)
+		fresh.conv_version = conv_version
+		fresh.user_version = user_version
+		fresh.built_at = now
+		fresh.checked_at = now
+		_stats["builds"] += 1
+		_store(fresh)
+		return fresh
+	except Exception as exc:
+		try:
+			log.warning("conversation snapshot failed conversation_id=%s error=%s", cid, str(exc)[:200])
+		except Exception:
+			pass
+		return None
+
+
+def get_snapshot_stats() -> Dict[str, Any]:
+	stats: Dict[str, Any] = dict(_stats)
+	stats["size"] = len(_cache)
+	return stats
+
+
+def _drop_local(conversation_ids: Set[int]) -> None:
+	with _cache_lock:
+		for cid in conversation_ids:
+			_cache.pop(int(cid), None)
+
+
+def _publish(inserted: Set[int], updated: Set[int], users: Set[str]) -> None:
+	if not (inserted or updated or users):
+		return
+	# Local entries for updated conversations are dropped even without Redis
+	if updated:
+		_drop_local(updated)
+	try:
+		r = _redis()
+		with r.pipeline() as p:
+			for cid in inserted:
+				key = _CONV_KEY.format(int(cid))
+				p.hincrby(key, "ins", 1)
+				p.expire(key, _KEY_TTL_SECONDS)
+			for cid in updated:
+				key = _CONV_KEY.format(int(cid))
+				p.hincrby(key, "upd", 1)
+				p.expire(key, _KEY_TTL_SECONDS)
+			for uid in users:
+				key = _USER_KEY.format(uid)
+				p.incr(key)
+				p.expire(key, _KEY_TTL_SECONDS)
+			p.execute()
+	except Exception:
+		# Without Redis, other processes rely on AI_CONTEXT_SNAPSHOT_TTL
+		_drop_local(set(inserted) | set(updated))
+
+
+def note_conversation_changed(conversation_id: Optional[int], *, inserted: bool = True, session: Any = None) -> None:
+	"""
+	For raw SQL writers: inserted=True for new messages, False for edits/deletes. With a
+	session the bump is deferred until it commits.
+	"""
+	try:
+		cid = int(conversation_id)
+	except Exception:
+		return
+	if session is not None:
+		try:
+			pending = session.info.setdefault("ctxsnap_pending", {"ins": set(), "upd": set(), "users": set()})
+			pending["ins" if inserted else "upd"].add(cid)
+			return
+		except Exception:
+			pass
+	if inserted:
+		_publish({cid}, set(), set())
+	else:
+		_publish(set(), {cid}, set())
+
+
+def note_ig_user_changed(ig_user_id: Optional[str], session: Any = None) -> None:
+	"""Bump the customer version; with a session the bump is deferred until it commits."""
+	if not ig_user_id:
+		return
+	if session is not None:
+		try:
+			pending = session.info.setdefault("ctxsnap_pending", {"ins": set(), "upd": set(), "users": set()})
+			pending["users"].add(str(ig_user_id))
+			return
+		except Exception:
+			pass
+	_publish(set(), set(), {str(ig_user_id)})
+
+
+@event.listens_for(_OrmSession, "after_flush")
+def _collect_orm_changes(session, flush_context) -> None:
+	try:
+		pending = session.info.setdefault("ctxsnap_pending", {"ins": set(), "upd": set(), "users": set()})
+		for obj in session.new:
+			if isinstance(obj, Message) and obj.conversation_id:
+				pending["ins"].add(int(obj.conversation_id))
+			elif isinstance(obj, IGUser) and obj.ig_user_id:
+				pending["users"].add(str(obj.ig_user_id))
+		for obj in list(session.dirty) + list(session.deleted):
+			if isinstance(obj, Message) and obj.conversation_id:
+				pending["upd"].add(int(obj.conversation_id))
+			elif isinstance(obj, IGUser) and obj.ig_user_id:
+				pending["users"].add(str(obj.ig_user_id))
+	except Exception:
+		pass
+
+
+@event.listens_for(_OrmSession, "after_commit")
+def _publish_orm_changes(session) -> None:
+	pending = session.info.pop("ctxsnap_pending", None)
+	if not pending:
+		return
+	try:
+		_publish(pending["ins"], pending["upd"], pending["users"])
+	except Exception:
+		pass
+
+
+@event.listens_for(_OrmSession, "after_rollback")
+def _discard_orm_changes(session) -> None:
+	session.info.pop("ctxsnap_pending", None)
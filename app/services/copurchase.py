@@ -0,0 +1,549 @@
+"""
+Precomputed product co-purchase matrix (upsell suggestions).
+
+product_copurchase holds, for every product pair bought in the same order, the order
+count and a recency-weighted score; the diagonal (a,a) is the number of orders that
+contain a, which gives lift without scanning orders:
+
+	lift(a,b) = count(a,b) * total_orders / (count(a,a) * count(b,b))
+
+Maintenance:
+- ORM writes to OrderItem/Order mark their order ids dirty (session events, after commit).
+- Dirty orders are queued in Redis and drained in small batches (on lookup and by
+  refresh_dirty_orders callers); without Redis they are refreshed right after commit.
+- product_copurchase_order stores each order's product set as last applied, so a refresh
+  subtracts the old contribution and adds the new one; refreshing the same order twice is a no-op.
+- rebuild_copurchase() recomputes everything from the full order history.
+
+Recency weighting: each order contributes 2 ** ((order_date - epoch) / half_life) to
+weighted_score (undated orders count as SCORE_EPOCH). Scores only ever get compared or
+rescaled to "today", so a fixed epoch keeps incremental updates exact while older orders
+decay relative to newer ones. The epoch rolls forward (system_settings.copurchase_score_epoch)
+once today's weight passes 2 ** RENORM_EXP: every stored score is rescaled in the same
+transaction, and refreshes read the epoch under a shared lock, so deltas never mix epochs
+and the exponent stays far from float overflow whatever the half-life.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, event, inspect as _inspect, text as _text, update
+from sqlalchemy.orm import Session as _OrmSession
+from sqlmodel import select
+
+from ..db import get_session
+from ..models import Item, Order, OrderItem, ProductCopurchase, ProductCopurchaseOrder, SystemSetting
+
+
+log = logging.getLogger("copurchase")
+
+EXCLUDED_ORDER_STATUSES = ("iptal", "iade", "refunded", "cancelled")
+SCORE_EPOCH = dt.date(2020, 1, 1)
+EPOCH_SETTING_KEY = "copurchase_score_epoch"
+# move the epoch once today's weight passes 2 ** RENORM_EXP; weights are clamped to
+# 2 ** +-_MAX_EXP (a float overflows past 2 ** 1023)
+RENORM_EXP = 64.0
+_MAX_EXP = 1000.0
+# Order columns that change an order's contribution
+_ORDER_FIELDS = ("status", "shipment_date", "data_date")
+
+_DIRTY_KEY = "copurchase:dirty"
+_drain_lock = threading.Lock()
+_last_drain_at = 0.0
+_total_orders_cache: Tuple[float, int] = (0.0, 0)
+_epoch_checked_on: Optional[dt.date] = None
+
+
+def _half_life_days() -> float:
+	try:
+		return max(1.0, float(os.getenv("UPSELL_COPURCHASE_HALF_LIFE_DAYS", "90")))
+	except Exception:
+		return 90.0
+
+
+def order_weight(order_date: Optional[dt.date], epoch: dt.date = SCORE_EPOCH) -> float:
+	"""Recency weight of one order relative to the score epoch (undated orders count as SCORE_EPOCH)."""
+	days = ((order_date or SCORE_EPOCH) - epoch).days
+	return 2.0 ** max(-_MAX_EXP, min(_MAX_EXP, days / _half_life_days()))
+
+
+def _score_now(weighted_score: float, today: Optional[dt.date] = None, epoch: dt.date = SCORE_EPOCH) -> float:
+	"""Rescale a stored score to 'orders as of today' (an order from today weighs 1.0)."""
+	today = today or dt.date.today()
+	return float(weighted_score or 0.0) / order_weight(today, epoch)
+
+
+def _parse_epoch(value: Any) -> dt.date:
+	try:
+		return dt.date.fromisoformat(str(value).strip())
+	except Exception:
+		return SCORE_EPOCH
+
+
+def _load_epoch(session, lock: Optional[str] = None) -> dt.date:
+	"""Current score epoch; lock="share" for writers of scores, "update" to move it."""
+	q = select(SystemSetting).where(SystemSetting.key == EPOCH_SETTING_KEY)
+	if lock == "share":
+		q = q.with_for_update(read=True)
+	elif lock == "update":
+		q = q.with_for_update()
+	row = session.exec(q).first()
+	return _parse_epoch(row.value) if row is not None else SCORE_EPOCH
+
+
+def _ensure_epoch_row() -> None:
+	# the row must exist before it is locked: row locks serialize refresh vs. renormalize,
+	# gap locks on a missing key would not
+	try:
+		with get_session() as session:
+			if session.get(SystemSetting, EPOCH_SETTING_KEY) is None:
+				session.add(
+					SystemSetting(
+						key=EPOCH_SETTING_KEY,
+						value=SCORE_EPOCH.isoformat(),
+						description="product_copurchase weighted_score epoch (services.copurchase)",
+					)
+				)
+	except Exception:
+		# created concurrently
+		pass
+
+
+def renormalize_scores(today: Optional[dt.date] = None, force: bool = False) -> bool:
+	"""
+	Move the epoch to today and rescale every stored score accordingly, once today's weight
+	has passed 2 ** RENORM_EXP (or always with force). Returns True when it moved.
+	"""
+	today = today or dt.date.today()
+	_ensure_epoch_row()
+	with get_session() as session:
+		row = session.exec(
+			select(SystemSetting).where(SystemSetting.key == EPOCH_SETTING_KEY).with_for_update()
+		).first()
+		epoch = _parse_epoch(row.value) if row is not None else SCORE_EPOCH
+		days = (today - epoch).days
+		if days <= 0 or (not force and days / _half_life_days() <= RENORM_EXP):
+			return False
+		factor = 2.0 ** max(-_MAX_EXP, -days / _half_life_days())
+		session.exec(update(ProductCopurchase).values(weighted_score=ProductCopurchase.weighted_score * factor))
+		if row is None:
+			row = SystemSetting(key=EPOCH_SETTING_KEY, value="")
+		row.value = today.isoformat()
+		row.updated_at = dt.datetime.utcnow()
+		session.add(row)
+	log.info("copurchase score epoch moved from %s to %s", epoch, today)
+	return True
+
+
+def _maybe_renormalize() -> None:
+	"""Checked at most once per day per process, before scores are written."""
+	global _epoch_checked_on
+	today = dt.date.today()
+	if _epoch_checked_on == today:
+		return
+	try:
+		renormalize_scores(today)
+		_epoch_checked_on = today
+	except Exception as exc:
+		log.warning("copurchase renormalize failed error=%s", str(exc)[:200])
+
+
+def _encode_products(pids: Iterable[int]) -> str:
+	return ",".join(str(p) for p in sorted(set(int(x) for x in pids)))
+
+
+def _decode_products(value: Optional[str]) -> Set[int]:
+	out: Set[int] = set()
+	for part in (value or "").split(","):
+		part = part.strip()
+		if part.isdigit():
+			out.add(int(part))
+	return out
+
+
+def _pair_contributions(pids: Set[int]) -> List[Tuple[int, int]]:
+	"""All ordered pairs (including the diagonal) an order with these products contributes to."""
+	return [(a, b) for a in pids for b in pids]
+
+
+def _load_order_product_sets(session, order_ids: List[int]) -> Dict[int, Tuple[Set[int], Optional[dt.date]]]:
+	"""Current product set and date of each order; cancelled/returned/missing orders are absent."""
+	out: Dict[int, Tuple[Set[int], Optional[dt.date]]] = {}
+	if not order_ids:
+		return out
+	rows = session.exec(
+		select(OrderItem.order_id, Item.product_id, Order.shipment_date, Order.data_date, Order.status)
+		.join(Item, OrderItem.item_id == Item.id)
+		.join(Order, OrderItem.order_id == Order.id)
+		.where(OrderItem.order_id.in_(order_ids))
+		.where(Item.product_id.is_not(None))
+	).all()
+	for oid, pid, shipment_date, data_date, status in rows:
+		if status in EXCLUDED_ORDER_STATUSES:
+			continue
+		entry = out.get(int(oid))
+		if entry is None:
+			entry = (set(), shipment_date or data_date)
+			out[int(oid)] = entry
+		entry[0].add(int(pid))
+	return out
+
+
+def _apply_pair_deltas(session, deltas: Dict[Tuple[int, int], List[Any]]) -> None:
+	"""deltas[(a,b)] = [count_delta, score_delta, max_order_date]"""
+	if not deltas:
+		return
+	now = dt.datetime.utcnow()
+	params = []
+	for (a, b), (dcount, dscore, last_date) in deltas.items():
+		if dcount == 0 and abs(dscore) < 1e-12:
+			continue
+		params.append(
+			{
+				"a": int(a),
+				"b": int(b),
+				"c": int(dcount),
+				"s": float(dscore),
+				"d": last_date,
+				"now": now,
+			}
+		)
+	if not params:
+		return
+	session.exec(
+		_text(
+			"""
+			INSERT INTO product_copurchase(product_id, other_product_id, order_count, weighted_score, last_order_date, updated_at)
+			VALUES (:a, :b, :c, :s, :d, :now)
+			ON DUPLICATE KEY UPDATE
+			  order_count = order_count + VALUES(order_count),
+			  weighted_score = weighted_score + VALUES(weighted_score),
+			  last_order_date = CASE
+			    WHEN VALUES(last_order_date) IS NULL THEN last_order_date
+			    WHEN last_order_date IS NULL OR VALUES(last_order_date) > last_order_date THEN VALUES(last_order_date)
+			    ELSE last_order_date
+			  END,
+			  updated_at = VALUES(updated_at)
+			"""
+		),
+		params=params,
+	)
+	if any(p["c"] < 0 for p in params):
+		touched = sorted({p["a"] for p in params if p["c"] < 0})
+		session.exec(
+			delete(ProductCopurchase)
+			.where(ProductCopurchase.product_id.in_(touched))
+			.where(ProductCopurchase.order_count <= 0)
+		)
+
+
+def refresh_orders(order_ids: Iterable[int]) -> int:
+	"""
+	Bring product_copurchase in line with the current contents of the given orders.
+	Returns the number of orders whose contribution changed.
+	"""
+	ids = sorted({int(o) for o in order_ids if o})
+	if not ids:
+		return 0
+	changed = 0
+	_maybe_renormalize()
+	with get_session() as session:
+		# shared lock: a concurrent renormalize_scores waits until these deltas are applied
+		epoch = _load_epoch(session, lock="share")
+		current = _load_order_product_sets(session, ids)
+		applied_rows = session.exec(
+			select(ProductCopurchaseOrder).where(ProductCopurchaseOrder.order_id.in_(ids))
+		).all()
+		applied = {int(r.order_id): r for r in applied_rows}
+		deltas: Dict[Tuple[int, int], List[Any]] = defaultdict(lambda: [0, 0.0, None])
+		for oid in ids:
+			new_pids, new_date = current.get(oid, (set(), None))
+			row = applied.get(oid)
+			old_pids = _decode_products(row.product_ids) if row else set()
+			old_date = row.order_date if row else None
+			if new_pids == old_pids and new_date == old_date:
+				continue
+			changed += 1
+			if old_pids:
+				w_old = order_weight(old_date, epoch)
+				for pair in _pair_contributions(old_pids):
+					deltas[pair][0] -= 1
+					deltas[pair][1] -= w_old
+			if new_pids:
+				w_new = order_weight(new_date, epoch)
+				for pair in _pair_contributions(new_pids):
+					d = deltas[pair]
+					d[0] += 1
+					d[1] += w_new
+					if new_date and (d[2] is None or new_date > d[2]):
+						d[2] = new_date
+			if new_pids:
+				if row is None:
+					row = ProductCopurchaseOrder(order_id=oid)
+				row.product_ids = _encode_products(new_pids)
+				row.order_date = new_date
+				row.updated_at = dt.datetime.utcnow()
+				session.add(row)
+			elif row is not None:
+				session.delete(row)
+		_apply_pair_deltas(session, deltas)
+	return changed
+
+
+def mark_orders_dirty(order_ids: Iterable[int], session: Any = None) -> None:
+	"""
+	Queue orders for refresh (raw SQL writers call this directly).
+	With a session the orders are queued when that session commits.
+	"""
+	ids = [int(o) for o in order_ids if o]
+	if not ids:
+		return
+	if session is not None:
+		try:
+			session.info.setdefault("copurchase_dirty", set()).update(ids)
+			return
+		except Exception:
+			pass
+	try:
+		from .monitoring import _get_redis
+
+		_get_redis().sadd(_DIRTY_KEY, *ids)
+		return
+	except Exception:
+		pass
+	try:
+		refresh_orders(ids)
+	except Exception as exc:
+		try:
+			log.warning("copurchase refresh failed orders=%s error=%s", ids[:20], str(exc)[:200])
+		except Exception:
+			pass
+
+
+def refresh_dirty_orders(max_orders: int = 500) -> int:
+	"""Drain up to max_orders queued order ids; returns how many were taken. Safe to call concurrently."""
+	try:
+		from .monitoring import _get_redis
+
+		r = _get_redis()
+		raw = r.spop(_DIRTY_KEY, max_orders) or []
+	except Exception:
+		return 0
+	ids = [int(x) for x in raw if str(x).strip().isdigit()]
+	if not ids:
+		return 0
+	try:
+		refresh_orders(ids)
+		return len(ids)
+	except Exception as exc:
+		# Put them back so the next drain retries
+		try:
+			r.sadd(_DIRTY_KEY, *ids)
+		except Exception:
+			pass
+		try:
+			log.warning("copurchase drain failed count=%s error=%s", len(ids), str(exc)[:200])
+		except Exception:
+			pass
+		return 0
+
+
+def _maybe_drain() -> None:
+	global _last_drain_at
+	interval = float(os.getenv("UPSELL_COPURCHASE_DRAIN_INTERVAL", "5"))
+	now = time.monotonic()
+	if now - _last_drain_at < interval:
+		return
+	if not _drain_lock.acquire(blocking=False):
+		return
+	try:
+		_last_drain_at = now
+		refresh_dirty_orders(max_orders=200)
+	finally:
+		_drain_lock.release()
+
+
+def _total_orders(session) -> int:
+	global _total_orders_cache
+	cached_at, total = _total_orders_cache
+	if time.monotonic() - cached_at < 60 and total > 0:
+		return total
+	row = session.exec(_text("SELECT COUNT(*) FROM product_copurchase_order")).first()
+	total = int(row[0] or 0) if row else 0
+	_total_orders_cache = (time.monotonic(), total)
+	return total
+
+
+def get_copurchase(
+	product_id: int,
+	*,
+	limit: int = 3,
+	min_count: int = 2,
+	order_by: str = "score",
+) -> Optional[List[Dict[str, Any]]]:
+	"""
+	Products most often bought together with product_id.
+
+	Returns None when the matrix has not been built yet (callers may fall back to a scan),
+	otherwise a list of {product_id, order_count, score, lift, last_order_date}.
+	order_by: score (recency-weighted, default) | count | lift
+	"""
+	if not product_id:
+		return []
+	_maybe_drain()
+	order_sql = {
+		"count": "c.order_count DESC, c.weighted_score DESC",
+		"lift": "c.order_count * 1.0 / NULLIF(d.order_count, 0) DESC, c.order_count DESC",
+	}.get(order_by, "c.weighted_score DESC, c.order_count DESC")
+	with get_session() as session:
+		total = _total_orders(session)
+		if total <= 0:
+			return None
+		epoch = _load_epoch(session)
+		rows = session.exec(
+			_text(
+				f"""
+				SELECT c.other_product_id, c.order_count, c.weighted_score, c.last_order_date,
+				       s.order_count AS self_orders, d.order_count AS other_orders
+				FROM product_copurchase c
+				LEFT JOIN product_copurchase s ON s.product_id=c.product_id AND s.other_product_id=c.product_id
+				LEFT JOIN product_copurchase d ON d.product_id=c.other_product_id AND d.other_product_id=c.other_product_id
+				WHERE c.product_id=:pid AND c.other_product_id<>:pid AND c.order_count>=:min_count
+				ORDER BY {order_sql}
+				LIMIT :lim
+				"""
+			).params(pid=int(product_id), min_count=int(min_count), lim=int(limit))
+		).all()
+	today = dt.date.today()
+	out: List[Dict[str, Any]] = []
+	for other_pid, count, score, last_date, self_orders, other_orders in rows:
+		lift = None
+		if self_orders and other_orders:
+			lift = round(float(count) * total / (float(self_orders) * float(other_orders)), 3)
+		out.append(
+			{
+				"product_id": int(other_pid),
+				"order_count": int(count or 0),
+				"score": round(_score_now(score, today, epoch), 4),
+				"lift": lift,
+				"last_order_date": last_date.isoformat() if hasattr(last_date, "isoformat") else last_date,
+			}
+		)
+	return out
+
+
+def rebuild_copurchase(*, batch_size: int = 2000, progress: Optional[Any] = None) -> Dict[str, int]:
+	"""
+	Recompute the whole matrix from order history. Orders changed while this runs stay in
+	the dirty queue and are reconciled by the next drain (refresh is idempotent).
+	"""
+	global _total_orders_cache
+	# scores are recomputed against a fresh epoch, stored with them below
+	epoch = dt.date.today()
+	pairs: Dict[Tuple[int, int], List[Any]] = defaultdict(lambda: [0, 0.0, None])
+	applied: Dict[int, Tuple[str, Optional[dt.date]]] = {}
+	last_id = 0
+	scanned = 0
+	while True:
+		with get_session() as session:
+			order_ids = [
+				int(x)
+				for x in session.exec(
+					select(Order.id).where(Order.id > last_id).order_by(Order.id.asc()).limit(batch_size)
+				).all()
+			]
+			if not order_ids:
+				break
+			sets = _load_order_product_sets(session, order_ids)
+		last_id = order_ids[-1]
+		scanned += len(order_ids)
+		for oid, (pids, order_date) in sets.items():
+			if not pids:
+				continue
+			w = order_weight(order_date, epoch)
+			for pair in _pair_contributions(pids):
+				d = pairs[pair]
+				d[0] += 1
+				d[1] += w
+				if order_date and (d[2] is None or order_date > d[2]):
+					d[2] = order_date
+			applied[oid] = (_encode_products(pids), order_date)
+		if progress:
+			try:
+				progress(scanned)
+			except Exception:
+				pass
+	now = dt.datetime.utcnow()
+	_ensure_epoch_row()
+	with get_session() as session:
+		setting = session.exec(
+			select(SystemSetting).where(SystemSetting.key == EPOCH_SETTING_KEY).with_for_update()
+		).first()
+		if setting is None:
+			setting = SystemSetting(key=EPOCH_SETTING_KEY, value="")
+		setting.value = epoch.isoformat()
+		setting.updated_at = now
+		session.add(setting)
+		session.exec(delete(ProductCopurchase))
+		session.exec(delete(ProductCopurchaseOrder))
+		batch: List[Any] = []
+		for (a, b), (count, score, last_date) in pairs.items():
+			batch.append(
+				ProductCopurchase(
+					product_id=a,
+					other_product_id=b,
+					order_count=count,
+					weighted_score=score,
+					last_order_date=last_date,
+					updated_at=now,
+				)
+			)
+		for oid, (encoded, order_date) in applied.items():
+			batch.append(ProductCopurchaseOrder(order_id=oid, product_ids=encoded, order_date=order_date, updated_at=now))
+		session.add_all(batch)
+	_total_orders_cache = (0.0, 0)
+	return {"orders_scanned": scanned, "orders_applied": len(applied), "pairs": len(pairs)}
+
+
+@event.listens_for(_OrmSession, "after_flush")
+def _collect_dirty_orders(session, flush_context) -> None:
+	try:
+		pending: Set[int] = session.info.setdefault("copurchase_dirty", set())
+		for obj in list(session.new) + list(session.deleted):
+			if isinstance(obj, OrderItem) and obj.order_id:
+				pending.add(int(obj.order_id))
+			elif isinstance(obj, Order) and obj.id and obj in session.deleted:
+				pending.add(int(obj.id))
+		for obj in session.dirty:
+			if isinstance(obj, OrderItem):
+				attrs = _inspect(obj).attrs
+				if obj.order_id:
+					pending.add(int(obj.order_id))
+				# moved between orders: the previous order changes too
+				for oid in attrs.order_id.history.deleted or ():
+					if oid:
+						pending.add(int(oid))
+			elif isinstance(obj, Order) and obj.id:
+				attrs = _inspect(obj).attrs
+				if any(getattr(attrs, name).history.has_changes() for name in _ORDER_FIELDS):
+					pending.add(int(obj.id))
+	except Exception:
+		pass
+
+
+@event.listens_for(_OrmSession, "after_commit")
+def _publish_dirty_orders(session) -> None:
+	pending = session.info.pop("copurchase_dirty", None)
+	if pending:
+		mark_orders_dirty(pending)
+
+
+@event.listens_for(_OrmSession, "after_rollback")
+def _discard_dirty_orders(session) -> None:
+	session.info.pop("copurchase_dirty", None)
@@ -0,0 +1,165 @@
+"""
+Image derivatives (resized JPEG/WebP variants) rendered in a process pool.
+
+Derivatives are produced lazily on first request and cached on disk under
+THUMBS_ROOT/derived/<aa>/<sha256>_<spec>.<fmt>, keyed by the source blob hash, so a
+product photo shared by many attachments is rendered once per spec. JPEG sources are
+decoded with Pillow's draft mode (DCT scaling), which decodes at 1/2, 1/4 or 1/8 size
+instead of full resolution. Decoding runs in worker processes so it never holds the GIL
+of the web process or the ingest worker.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+
+log = logging.getLogger("media.derivatives")
+
+# name -> (max_width, max_height, quality)
+SPECS: Dict[str, Tuple[int, int, int]] = {
+	"avatar": (96, 96, 80),
+	"preview": (512, 512, 82),
+	"card": (800, 800, 85),
+}
+FORMATS = ("jpg", "webp")
+
+_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_inflight: Dict[str, "concurrent.futures.Future[bool]"] = {}
+_inflight_lock = threading.Lock()
+
+
+def render(src: str, dst: str, max_w: int, max_h: int, fmt: str, quality: int) -> bool:
+	"""Decode src at reduced scale and write a bounded-size derivative to dst (runs in a worker process)."""
+	from PIL import Image, ImageOps
+
+	tmp = f"{dst}.{os.getpid()}.tmp"
+	try:
+		with Image.open(src) as im:
+			if im.format == "JPEG":
+				# DCT-domain downscale: decode at the smallest scale still >= target size
+				im.draft("RGB", (max_w, max_h))
+			im = ImageOps.exif_transpose(im)
+			im.thumbnail((max_w, max_h), Image.LANCZOS)
+			if fmt == "webp":
+				if im.mode not in ("RGB", "RGBA"):
+					im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+				Path(dst).parent.mkdir(parents=True, exist_ok=True)
+				im.save(tmp, format="WEBP", quality=quality, method=4)
+			else:
+				if im.mode not in ("RGB", "L"):
+					im = im.convert("RGB")
+				Path(dst).parent.mkdir(parents=True, exist_ok=True)
+				im.save(tmp, format="JPEG", quality=quality, optimize=True, progressive=True)
+		os.replace(tmp, dst)
+		return True
+	except Exception:
+		try:
+			os.unlink(tmp)
+		except Exception:
+			pass
+		return False
+
+
+def _get_pool() -> concurrent.futures.ProcessPoolExecutor:
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			try:
+				workers = max(1, int(os.getenv("DERIVATIVE_WORKERS", "2")))
+			except Exception:
+				workers = 2
+			# spawn: the web process and workers are multi-threaded, forking them is unsafe
+			_pool = concurrent.futures.ProcessPoolExecutor(
+				max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+			)
+		return _pool
+
+
+def derivative_path(sha256: str, spec: str, fmt: str) -> Path:
+	root = Path(os.getenv("THUMBS_ROOT", "data/thumbs")).resolve() / "derived"
+	return root / sha256[:2] / f"{sha256}_{spec}.{fmt}"
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+	return "webp" if accept and "image/webp" in accept else "jpg"
+
+
+def submit(src: Path, dst: Path, spec: str, fmt: str) -> "concurrent.futures.Future[bool]":
+	"""Queue a render (deduplicated per destination) and return its future."""
+	max_w, max_h, quality = SPECS[spec]
+	key = str(dst)
+	with _inflight_lock:
+		fut = _inflight.get(key)
+		if fut is not None:
+			return fut
+		fut = _get_pool().submit(render, str(src), key, max_w, max_h, fmt, quality)
+		_inflight[key] = fut
+
+	def _done(_f: "concurrent.futures.Future[bool]") -> None:
+		with _inflight_lock:
+			_inflight.pop(key, None)
+
+	fut.add_done_callback(_done)
+	return fut
+
+
+async def get_derivative(src: Path, sha256: str, spec: str, fmt: str) -> Optional[Path]:
+	"""Return the cached derivative path, rendering it in the pool on first request."""
+	if spec not in SPECS or fmt not in FORMATS:
+		return None
+	dst = derivative_path(sha256, spec, fmt)
+	if dst.exists():
+		return dst
+	ok = await asyncio.wrap_future(submit(src, dst, spec, fmt))
+	if not ok:
+		log.warning("derivative render failed src=%s spec=%s fmt=%s", src, spec, fmt)
+		return None
+	return dst
+
+
+def schedule(
+	src: Path,
+	dst: Path,
+	spec: str = "preview",
+	fmt: str = "jpg",
+	on_done: Optional[Callable[[Path], None]] = None,
+) -> None:
+	"""
+	Fire-and-forget render for callers on the ingest path (no waiting on decode).
+	on_done(dst) is called only once dst exists: right away when it already does, else
+	from the pool's callback thread after a successful render (keep it short).
+	"""
+	try:
+		if dst.exists():
+			if on_done is not None:
+				on_done(dst)
+			return
+		fut = submit(src, dst, spec, fmt)
+	except Exception as e:
+		log.warning("derivative schedule failed src=%s err=%s", src, e)
+		return
+	if on_done is None:
+		return
+
+	def _rendered(f: "concurrent.futures.Future[bool]") -> None:
+		try:
+			ok = bool(f.result())
+		except Exception:
+			ok = False
+		if not ok:
+			log.warning("derivative render failed src=%s spec=%s fmt=%s", src, spec, fmt)
+			return
+		try:
+			on_done(dst)
+		except Exception as e:
+			log.warning("derivative callback failed dst=%s err=%s", dst, e)
+
+	fut.add_done_callback(_rendered)
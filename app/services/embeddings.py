@@ -4,22 +4,24 @@ import json
 import logging
 import math
 import os
-from typing import Any, Dict, List, Optional, Tuple
-
-from openai import OpenAI
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 from ..db import get_session
 from ..models import ProductQA
+from .ai import get_pooled_openai_client
+
+if TYPE_CHECKING:
+	from openai import OpenAI
 
 log = logging.getLogger("embeddings")
 
 
 def _get_openai_client() -> Optional[OpenAI]:
-	"""Get OpenAI client if API key is configured."""
+	"""Get the process-wide pooled OpenAI client if API key is configured."""
 	api_key = os.getenv("OPENAI_API_KEY")
 	if not api_key:
 		return None
-	return OpenAI(api_key=api_key)
+	return get_pooled_openai_client(api_key)
 
 
 def generate_embedding(text: str) -> Optional[List[float]]:
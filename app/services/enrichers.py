@@ -6,8 +6,8 @@ from sqlalchemy import text
 import logging
 
 from ..db import get_session
+from .conversation_snapshot import note_ig_user_changed
 from .instagram_api import fetch_user_username, _get_base_token_and_id, GRAPH_VERSION, _get as graph_get
-import httpx
 
 _log = logging.getLogger("enricher")
 
@@ -49,13 +49,10 @@ async def enrich_user(ig_user_id: str) -> bool:
 				return False
 	# Fetch username and name; profile picture URL is not available for all node types (e.g., IGBusinessScopedID)
 	try:
-		from .instagram_api import _get as graph_get, GRAPH_VERSION, _get_base_token_and_id
-		import httpx
 		token, _, _ = _get_base_token_and_id()
 		base = f"https://graph.facebook.com/{GRAPH_VERSION}"
 		# Fetch username and name only (avoid profile_picture_url to prevent Graph 400 on some node types)
-		async with httpx.AsyncClient() as client:
-			data_basic = await graph_get(client, base + f"/{ig_user_id}", {"access_token": token, "fields": "username,name"})
+		data_basic = await graph_get(None, base + f"/{ig_user_id}", {"access_token": token, "fields": "username,name"})
 		username = data_basic.get("username") or data_basic.get("name")
 		name = data_basic.get("name")
 		profile_pic_url = data_basic.get("profile_picture_url")
@@ -106,6 +103,7 @@ async def enrich_user(ig_user_id: str) -> bool:
 				"""
 			).params(u=username, n=name, p=profile_pic_url, id=ig_user_id)
 		)
+		note_ig_user_changed(ig_user_id, session=session)
 	try:
 		updated = 0
 		try:
@@ -147,10 +145,9 @@ async def enrich_page(igba_id: str) -> bool:
 	base = f"https://graph.facebook.com/{GRAPH_VERSION}"
 	path = f"/{igba_id}"
 	params = {"access_token": token, "fields": "username,name"}
-	async with httpx.AsyncClient() as client:
-		data = await graph_get(client, base + path, params)
-		username = data.get("username")
-		name = data.get("name")
+	data = await graph_get(None, base + path, params)
+	username = data.get("username")
+	name = data.get("name")
 	with get_session() as session:
 		# Try UPDATE first; if no row affected, INSERT
 		res = session.exec(
@@ -0,0 +1,266 @@
+"""
+Cross-process realtime events for the inbox/thread websockets.
+
+Publishers (ingest, worker_reply, order endpoints) call publish() with a small dict;
+it is trimmed to a compact envelope and PUBLISHed on a Redis channel. Every web process
+runs one subscriber (started with the first websocket) and fans events out to its own
+sockets through InboxHub:
+
+- each connection has a bounded send queue (WS_SEND_QUEUE_MAX) drained by its own task,
+  so the broadcast loop never awaits a socket;
+- a connection whose queue is full, or whose send takes longer than WS_SEND_TIMEOUT_SEC,
+  is dropped (closed with 1013) instead of slowing everyone else down;
+- a connection may subscribe to specific conversations; without subscriptions it
+  receives everything (inbox view).
+
+When Redis is unreachable, events published from the web process are still delivered to
+that process's sockets.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Optional, Set
+
+from sqlalchemy import event as _sa_event
+
+
+log = logging.getLogger("event.bus")
+
+CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "events:inbox")
+
+# keys forwarded to browsers; anything else stays server-side
+_EVENT_KEYS = (
+	"type",
+	"conversation_id",
+	"conversation_pk",
+	"message_id",
+	"direction",
+	"text",
+	"timestamp_ms",
+	"source",
+	"order_id",
+	"status",
+)
+_TEXT_MAX = 280
+
+
+def _int_env(name: str, default: int) -> int:
+	try:
+		return int(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def compact_event(event: Dict[str, Any]) -> Dict[str, Any]:
+	out: Dict[str, Any] = {}
+	for k in _EVENT_KEYS:
+		v = event.get(k)
+		if v is None:
+			continue
+		if k == "text" and isinstance(v, str) and len(v) > _TEXT_MAX:
+			v = v[:_TEXT_MAX]
+		out[k] = v
+	return out
+
+
+def publish(event: Dict[str, Any]) -> bool:
+	"""Publish to every web process. Returns False when Redis was unavailable."""
+	data = compact_event(event)
+	try:
+		from .monitoring import _get_redis
+
+		_get_redis().publish(CHANNEL, json.dumps(data, ensure_ascii=False))
+		return True
+	except Exception as e:
+		log.debug("event publish failed: %s", e)
+		hub.dispatch_threadsafe(data)
+		return False
+
+
+async def publish_async(event: Dict[str, Any]) -> bool:
+	import anyio.to_thread
+
+	return await anyio.to_thread.run_sync(publish, event)
+
+
+def publish_after_commit(session: Any, event: Dict[str, Any]) -> None:
+	"""Publish once the session's transaction commits (never for rolled back work)."""
+	try:
+		_sa_event.listen(session, "after_commit", lambda _s: publish(event), once=True)
+	except Exception:
+		publish(event)
+
+
+def publish_message(
+	conversation_pk: Optional[int],
+	*,
+	conversation_id: Optional[str] = None,
+	message_id: Optional[int] = None,
+	direction: Optional[str] = None,
+	text: Optional[str] = None,
+	timestamp_ms: Optional[int] = None,
+	source: Optional[str] = None,
+) -> bool:
+	return publish(
+		{
+			"type": "ig_message",
+			"conversation_pk": int(conversation_pk) if conversation_pk is not None else None,
+			"conversation_id": conversation_id,
+			"message_id": message_id,
+			"direction": direction,
+			"text": text,
+			"timestamp_ms": timestamp_ms,
+			"source": source,
+		}
+	)
+
+
+class _Client:
+	__slots__ = ("ws", "queue", "conversations", "task")
+
+	def __init__(self, ws: Any, maxsize: int, conversations: Iterable[str] = ()) -> None:
+		self.ws = ws
+		self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+		self.conversations: Set[str] = {str(c) for c in conversations if str(c)}
+		self.task: Optional[asyncio.Task] = None
+
+	def wants(self, event: Dict[str, Any]) -> bool:
+		if not self.conversations:
+			return True
+		pk = event.get("conversation_pk")
+		cid = event.get("conversation_id")
+		if pk is None and cid is None:
+			return True
+		return (pk is not None and str(pk) in self.conversations) or (cid is not None and str(cid) in self.conversations)
+
+
+class InboxHub:
+	"""Per-process registry of websocket clients plus the Redis subscriber task."""
+
+	def __init__(self) -> None:
+		self.clients: Set[_Client] = set()
+		self._listener: Optional[asyncio.Task] = None
+		self._loop: Optional[asyncio.AbstractEventLoop] = None
+		self.stats: Dict[str, int] = {"delivered": 0, "dropped_clients": 0, "received": 0}
+
+	async def register(self, ws: Any, conversations: Iterable[str] = ()) -> _Client:
+		client = _Client(ws, max(1, _int_env("WS_SEND_QUEUE_MAX", 100)), conversations)
+		self._loop = asyncio.get_running_loop()
+		client.task = asyncio.create_task(self._sender(client))
+		self.clients.add(client)
+		self._ensure_listener()
+		return client
+
+	async def unregister(self, client: _Client) -> None:
+		self.clients.discard(client)
+		if client.task is not None and client.task is not asyncio.current_task():
+			client.task.cancel()
+
+	def dispatch(self, event: Dict[str, Any]) -> None:
+		for client in list(self.clients):
+			if not client.wants(event):
+				continue
+			try:
+				client.queue.put_nowait(event)
+			except asyncio.QueueFull:
+				self._drop(client, "queue_full")
+
+	def dispatch_threadsafe(self, event: Dict[str, Any]) -> None:
+		loop = self._loop
+		if loop is None or loop.is_closed() or not self.clients:
+			return
+		try:
+			if asyncio.get_running_loop() is loop:
+				self.dispatch(event)
+				return
+		except RuntimeError:
+			pass
+		loop.call_soon_threadsafe(self.dispatch, event)
+
+	def _drop(self, client: _Client, reason: str) -> None:
+		if client not in self.clients:
+			return
+		self.clients.discard(client)
+		self.stats["dropped_clients"] += 1
+		log.info("ws client dropped reason=%s", reason)
+		if client.task is not None and client.task is not asyncio.current_task():
+			client.task.cancel()
+
+		async def _close() -> None:
+			try:
+				await client.ws.close(code=1013)
+			except Exception:
+				pass
+
+		try:
+			asyncio.get_running_loop().create_task(_close())
+		except RuntimeError:
+			pass
+
+	async def _sender(self, client: _Client) -> None:
+		timeout = float(os.getenv("WS_SEND_TIMEOUT_SEC", "5"))
+		while True:
+			event = await client.queue.get()
+			try:
+				await asyncio.wait_for(client.ws.send_json(event), timeout=timeout)
+				self.stats["delivered"] += 1
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				self._drop(client, "send_failed")
+				return
+
+	def _ensure_listener(self) -> None:
+		if self._listener is None or self._listener.done():
+			self._listener = asyncio.create_task(self._listen())
+
+	async def _listen(self) -> None:
+		from redis.asyncio import Redis as _AsyncRedis
+
+		backoff = 1.0
+		while True:
+			client = None
+			try:
+				client = _AsyncRedis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+				pubsub = client.pubsub(ignore_subscribe_messages=True)
+				await pubsub.subscribe(CHANNEL)
+				backoff = 1.0
+				async for msg in pubsub.listen():
+					if not msg or msg.get("type") != "message":
+						continue
+					try:
+						event = json.loads(msg.get("data") or "{}")
+					except Exception:
+						continue
+					if isinstance(event, dict):
+						self.stats["received"] += 1
+						self.dispatch(event)
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				log.warning("event bus subscriber error: %s", e)
+			finally:
+				if client is not None:
+					try:
+						await client.aclose()
+					except Exception:
+						pass
+			await asyncio.sleep(backoff)
+			backoff = min(backoff * 2, 10.0)
+
+	def get_stats(self) -> Dict[str, Any]:
+		return {
+			"clients": len(self.clients),
+			"subscriber": bool(self._listener is not None and not self._listener.done()),
+			**self.stats,
+		}
+
+
+hub = InboxHub()
+
+
+def get_event_bus_stats() -> Dict[str, Any]:
+	return hub.get_stats()
@@ -5,7 +5,7 @@ import os
 from collections import defaultdict
 
 from sqlmodel import Session, select, func
-from sqlalchemy import case, text
+from sqlalchemy import case, insert, text
 
 from ..models import (
 	Account,
@@ -17,6 +17,8 @@ from ..models import (
 	Payment,
 	SystemSetting,
 )
+# importing account_ledger registers its after_flush hook (income/cost -> running balances)
+from .account_ledger import account_ledger_ready, aggregate_totals, read_balances, read_net_before
 
 
 def calculate_account_balance(session: Session, account_id: int) -> float:
@@ -24,37 +26,51 @@ def calculate_account_balance(session: Session, account_id: int) -> float:
 	
 	Balance = initial_balance + sum(income) - sum(expenses linked to account)
 	"""
+	if account_ledger_ready(session):
+		# One joined row from the running ledger
+		return read_balances(session, [account_id]).get(int(account_id), 0.0)
 	account = session.exec(select(Account).where(Account.id == account_id)).first()
 	if not account:
 		return 0.0
-	
-	balance = float(account.initial_balance or 0.0)
-	
-	# Add all income entries
+	income_total, expense_total = aggregate_totals(session, [int(account_id)]).get(int(account_id), (0.0, 0.0))
+	return float(account.initial_balance or 0.0) + income_total - expense_total
+
+
+def get_account_balances(session: Session) -> Dict[int, float]:
+	"""Get current balances for all active accounts."""
+	if account_ledger_ready(session):
+		return read_balances(session)
+	accounts = session.exec(select(Account).where(Account.is_active == True)).all()
+	ids = [int(acc.id) for acc in accounts if acc.id is not None]
+	# Not rebuilt yet: two grouped SUMs instead of two per account
+	totals = aggregate_totals(session, ids)
+	return {
+		int(acc.id): float(acc.initial_balance or 0.0) + totals.get(int(acc.id), (0.0, 0.0))[0] - totals.get(int(acc.id), (0.0, 0.0))[1]
+		for acc in accounts
+		if acc.id is not None
+	}
+
+
+def opening_balance(session: Session, account: Account, day: dt.date) -> float:
+	"""Balance at the start of `day` (initial_balance + entries booked before it)."""
+	base = float(account.initial_balance or 0.0)
+	if account.id is None:
+		return base
+	if account_ledger_ready(session):
+		return base + read_net_before(session, int(account.id), day)
 	income_total = session.exec(
 		select(func.sum(Income.amount))
-		.where(Income.account_id == account_id)
-		.where((Income.deleted_at.is_(None)))
+		.where(Income.account_id == account.id)
+		.where(Income.deleted_at.is_(None))
+		.where(func.coalesce(Income.date, func.date(Income.created_at)) < day)
 	).first()
-	if income_total:
-		balance += float(income_total or 0.0)
-	
-	# Subtract all expenses linked to this account (exclude soft-deleted)
 	expense_total = session.exec(
 		select(func.sum(Cost.amount))
-		.where(Cost.account_id == account_id)
+		.where(Cost.account_id == account.id)
 		.where(Cost.deleted_at.is_(None))
+		.where(func.coalesce(Cost.date, func.date(Cost.created_at)) < day)
 	).first()
-	if expense_total:
-		balance -= float(expense_total or 0.0)
-	
-	return balance
-
-
-def get_account_balances(session: Session) -> Dict[int, float]:
-	"""Get current balances for all active accounts."""
-	accounts = session.exec(select(Account).where(Account.is_active == True)).all()
-	return {acc.id: calculate_account_balance(session, acc.id) for acc in accounts if acc.id is not None}
+	return base + float(income_total or 0.0) - float(expense_total or 0.0)
 
 
 def _find_or_create_garanti_account(session: Session) -> Optional[Account]:
@@ -187,16 +203,9 @@ def ensure_iban_income(session: Session, order: Order, amount: float) -> Optiona
 
 def get_unpaid_orders(session: Session, start_date: Optional[dt.date] = None, end_date: Optional[dt.date] = None) -> List[Order]:
 	"""Get orders that haven't been marked as collected yet."""
-	# Get all order IDs that have been collected
-	collected_order_ids = session.exec(
-		select(OrderPayment.order_id).distinct()
-	).all()
-	collected_set = set(collected_order_ids) if collected_order_ids else set()
-	
-	# Build query for unpaid orders
-	q = select(Order)
-	if collected_set:
-		q = q.where(~Order.id.in_(collected_set))
+	# Anti-join instead of shipping every collected order id through Python
+	collected = select(OrderPayment.id).where(OrderPayment.order_id == Order.id)
+	q = select(Order).where(~collected.exists())
 	
 	# Optional date filtering
 	if start_date:
@@ -211,6 +220,41 @@ def get_unpaid_orders(session: Session, start_date: Optional[dt.date] = None, en
 	return session.exec(q.order_by(Order.shipment_date.desc(), Order.id.desc())).all()
 
 
+_EXPECTED_CHUNK = 1000
+
+
+def expected_payments(session: Session, order_ids: List[int]) -> Dict[int, float]:
+	"""Expected payment per order for a whole selection (two aggregate queries per chunk).
+	
+	Expected = total_amount - shipping_fee - platform fees (Payment fee_* columns), floored at 0.
+	Unknown order ids are left out of the result.
+	"""
+	ids = sorted({int(i) for i in order_ids if i is not None})
+	out: Dict[int, float] = {}
+	fees_expr = func.sum(
+		func.coalesce(Payment.fee_komisyon, 0)
+		+ func.coalesce(Payment.fee_hizmet, 0)
+		+ func.coalesce(Payment.fee_kargo, 0)
+		+ func.coalesce(Payment.fee_iade, 0)
+		+ func.coalesce(Payment.fee_erken_odeme, 0)
+	)
+	for start in range(0, len(ids), _EXPECTED_CHUNK):
+		chunk = ids[start : start + _EXPECTED_CHUNK]
+		fees = {
+			int(oid): float(total or 0.0)
+			for oid, total in session.exec(
+				select(Payment.order_id, fees_expr).where(Payment.order_id.in_(chunk)).group_by(Payment.order_id)
+			).all()
+			if oid is not None
+		}
+		for oid, total, shipping in session.exec(
+			select(Order.id, Order.total_amount, Order.shipping_fee).where(Order.id.in_(chunk))
+		).all():
+			expected = float(total or 0.0) - float(shipping or 0.0) - fees.get(int(oid), 0.0)
+			out[int(oid)] = max(0.0, expected)
+	return out
+
+
 def calculate_expected_payment(session: Session, order_id: int) -> float:
 	"""Calculate expected payment amount for an order.
 	
@@ -218,33 +262,67 @@ def calculate_expected_payment(session: Session, order_id: int) -> float:
 	For now, we'll use total_amount - shipping_fee as base.
 	Platform fees are tracked separately in Payment model.
 	"""
-	order = session.exec(select(Order).where(Order.id == order_id)).first()
-	if not order:
-		return 0.0
-	
-	total = float(order.total_amount or 0.0)
-	shipping = float(order.shipping_fee or 0.0)
-	
-	# Get platform fees from Payment records
-	payments = session.exec(select(Payment).where(Payment.order_id == order_id)).all()
-	total_fees = 0.0
-	for p in payments:
-		total_fees += float(p.fee_komisyon or 0.0)
-		total_fees += float(p.fee_hizmet or 0.0)
-		total_fees += float(p.fee_kargo or 0.0)
-		total_fees += float(p.fee_iade or 0.0)
-		total_fees += float(p.fee_erken_odeme or 0.0)
+	return expected_payments(session, [order_id]).get(int(order_id), 0.0)
+
+
+def plan_collection(
+	session: Session,
+	order_ids: List[int],
+	collected_amounts: Optional[Dict[int, float]] = None,
+	amount: Optional[float] = None,
+) -> Dict:
+	"""Preview of a bulk collection, computed set-wise without writing anything.
 	
-	# Expected payment = total - shipping - fees
-	expected = total - shipping - total_fees
-	return max(0.0, expected)
+	Returns the rows that would be written (expected vs collected per order) plus the
+	orders that are skipped (unknown or already linked to an income), and - when the
+	income amount is given - the difference between it and the collected total.
+	"""
+	ids: List[int] = []
+	seen = set()
+	for oid in order_ids:
+		if oid is not None and int(oid) not in seen:
+			seen.add(int(oid))
+			ids.append(int(oid))
+	expected = expected_payments(session, ids)
+	already: set = set()
+	for start in range(0, len(ids), _EXPECTED_CHUNK):
+		chunk = ids[start : start + _EXPECTED_CHUNK]
+		already.update(
+			int(oid)
+			for oid in session.exec(select(OrderPayment.order_id).where(OrderPayment.order_id.in_(chunk)).distinct()).all()
+			if oid is not None
+		)
+	rows: List[Dict] = []
+	for oid in ids:
+		if oid not in expected or oid in already:
+			continue
+		exp = expected[oid]
+		collected = exp
+		if collected_amounts and oid in collected_amounts:
+			collected = float(collected_amounts[oid])
+		rows.append({"order_id": oid, "expected_amount": exp, "collected_amount": collected, "diff": round(collected - exp, 2)})
+	expected_total = sum(r["expected_amount"] for r in rows)
+	collected_total = sum(r["collected_amount"] for r in rows)
+	plan = {
+		"rows": rows,
+		"count": len(rows),
+		"expected_total": round(expected_total, 2),
+		"collected_total": round(collected_total, 2),
+		"already_collected": [oid for oid in ids if oid in already],
+		"missing": [oid for oid in ids if oid not in expected],
+	}
+	if amount is not None:
+		plan["income_amount"] = float(amount)
+		plan["unallocated"] = round(float(amount) - collected_total, 2)
+	return plan
 
 
 def mark_orders_collected(
 	session: Session,
 	order_ids: List[int],
 	income_id: int,
-	collected_amounts: Optional[Dict[int, float]] = None
+	collected_amounts: Optional[Dict[int, float]] = None,
+	plan: Optional[Dict] = None,
 ) -> int:
 	"""Mark multiple orders as collected and link them to an income entry.
 	
@@ -253,35 +331,33 @@ def mark_orders_collected(
 		order_ids: List of order IDs to mark as collected
 		income_id: Income entry ID that represents the bulk payment
 		collected_amounts: Optional dict mapping order_id -> actual collected amount
+		plan: Optional result of plan_collection() for the same selection (skips recomputing)
 		
 	Returns:
-		Number of OrderPayment records created
+		Number of OrderPayment records created (orders already collected are skipped)
 	"""
-	count = 0
+	if plan is None:
+		plan = plan_collection(session, order_ids, collected_amounts)
+	rows = plan["rows"]
+	if not rows:
+		return 0
 	now = dt.datetime.utcnow()
-	
-	for order_id in order_ids:
-		# Calculate expected amount
-		expected = calculate_expected_payment(session, order_id)
-		
-		# Get actual collected amount (use provided or expected)
-		collected = expected
-		if collected_amounts and order_id in collected_amounts:
-			collected = collected_amounts[order_id]
-		
-		# Create OrderPayment record
-		op = OrderPayment(
-			income_id=income_id,
-			order_id=order_id,
-			expected_amount=expected,
-			collected_amount=collected,
-			collected_at=now
-		)
-		session.add(op)
-		count += 1
-	
-	session.flush()
-	return count
+	# One executemany INSERT for the whole selection, in the caller's transaction
+	session.execute(
+		insert(OrderPayment),
+		[
+			{
+				"income_id": income_id,
+				"order_id": r["order_id"],
+				"expected_amount": r["expected_amount"],
+				"collected_amount": r["collected_amount"],
+				"collected_at": now,
+				"created_at": now,
+			}
+			for r in rows
+		],
+	)
+	return len(rows)
 
 
 def detect_payment_leaks(session: Session, min_days_old: int = 7) -> List[Dict]:
@@ -388,6 +464,9 @@ def detect_payment_leaks(session: Session, min_days_old: int = 7) -> List[Dict]:
 		if "paid_amount" not in order_map[order_id]:
 			order_map[order_id]["paid_amount"] = paid_map.get(order_id, 0.0)
 	
+	# Expected payments for every candidate in one pass instead of one lookup per order
+	expected_map = expected_payments(session, [oid for oid in order_map if oid not in excluded_order_ids])
+	
 	leaks = []
 	for order_id, order_data in order_map.items():
 		# Skip excluded orders (non-primary orders in partial payment groups)
@@ -406,7 +485,7 @@ def detect_payment_leaks(session: Session, min_days_old: int = 7) -> List[Dict]:
 			continue
 		
 		# Calculate expected payment (total - shipping - fees)
-		expected = calculate_expected_payment(session, order_id)
+		expected = expected_map.get(order_id, 0.0)
 		
 		if expected > 0:
 			leaks.append({
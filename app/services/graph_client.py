@@ -0,0 +1,410 @@
+"""
+Shared Graph API transport: pooled clients, usage-driven rate limiting, GET coalescing
+and the batch endpoint.
+
+- One keep-alive AsyncClient per event loop (get_graph_client; one-shot loops close it
+  with closing()/close_graph_client()) and one thread-safe sync Client
+  (graph_request_sync) instead of a fresh connection per call.
+- GraphRateLimiter is a token bucket (GRAPH_RATE_PER_SEC / GRAPH_RATE_BURST) whose refill
+  rate is scaled down from the X-App-Usage / X-Business-Use-Case-Usage headers Meta
+  returns on every response: above GRAPH_USAGE_SOFT_PCT we slow down proportionally, at
+  GRAPH_USAGE_HARD_PCT (or when estimated_time_to_regain_access is set) we pause.
+- coalesce() shares one in-flight request between identical GETs on the same loop.
+- graph_batch()/fetch_users_batch() fold up to 50 lookups into one POST to the batch
+  endpoint.
+- gather_bounded() runs independent fetches (per-conversation pages, candidate scans)
+  with a concurrency cap.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, TypeVar
+
+import httpx
+
+from . import tracing
+
+
+log = logging.getLogger("graph.client")
+
+T = TypeVar("T")
+
+BATCH_MAX = 50
+# Graph error codes meaning "throttled": app (4), user (17), page/account (32), action (613);
+# 80001-80014 are the business-use-case family
+RATE_LIMIT_CODES = {4, 17, 32, 613}
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_sync_client: Optional[httpx.Client] = None
+_sync_lock = threading.Lock()
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+
+
+def _float_env(name: str, default: float) -> float:
+	try:
+		return float(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def _limits() -> httpx.Limits:
+	try:
+		max_conn = int(os.getenv("GRAPH_HTTP_MAX_CONNECTIONS", "20"))
+	except Exception:
+		max_conn = 20
+	return httpx.Limits(max_connections=max_conn, max_keepalive_connections=max(1, max_conn // 2), keepalive_expiry=60.0)
+
+
+def get_graph_client() -> httpx.AsyncClient:
+	"""Shared keep-alive AsyncClient for graph.facebook.com, one per event loop."""
+	loop = asyncio.get_running_loop()
+	client = _clients.get(loop)
+	if client is None or client.is_closed:
+		# pooled connections keep their loop referenced, so entries of loops that were
+		# closed without close_graph_client() are dropped here rather than by the weak key
+		for stale in [lp for lp in list(_clients.keys()) if lp.is_closed()]:
+			_clients.pop(stale, None)
+			log.debug("dropped graph client of a closed loop (not closed via close_graph_client)")
+		client = httpx.AsyncClient(
+			limits=_limits(),
+			timeout=httpx.Timeout(20.0, connect=10.0),
+			# child spans for traced pipeline work (no-op otherwise)
+			event_hooks={"request": [tracing.httpx_request_hook], "response": [tracing.httpx_response_hook]},
+		)
+		_clients[loop] = client
+	return client
+
+
+async def close_graph_client() -> None:
+	"""Close the running loop's client; call before a short-lived loop ends."""
+	client = _clients.pop(asyncio.get_running_loop(), None)
+	if client is not None:
+		try:
+			await client.aclose()
+		except Exception:
+			pass
+
+
+async def closing(aw: Awaitable[T]) -> T:
+	"""Await aw, then close this loop's client: asyncio.run(closing(job())) for one-shot loops."""
+	try:
+		return await aw
+	finally:
+		await close_graph_client()
+
+
+class GraphRateLimited(RuntimeError):
+	"""Raised instead of waiting when the limiter's pause exceeds the caller's max wait."""
+
+	def __init__(self, wait_seconds: float) -> None:
+		super().__init__(f"Graph API rate limited; retry in {wait_seconds:.0f}s")
+		self.wait_seconds = wait_seconds
+
+
+def _usage_pct(entry: Mapping[str, Any]) -> float:
+	vals = []
+	for k in ("call_count", "total_cputime", "total_time"):
+		try:
+			vals.append(float(entry.get(k) or 0))
+		except Exception:
+			pass
+	return max(vals) if vals else 0.0
+
+
+def parse_usage_headers(headers: Mapping[str, str]) -> Tuple[float, float]:
+	"""
+	Return (max usage percent, seconds until access is regained) from Graph usage headers.
+	X-App-Usage: {"call_count": 12, "total_cputime": 3, "total_time": 5}
+	X-Business-Use-Case-Usage: {"<id>": [{"type": "...", "call_count": 80, ..., "estimated_time_to_regain_access": 0}]}
+	"""
+	usage = 0.0
+	regain = 0.0
+	raw_app = headers.get("x-app-usage")
+	if raw_app:
+		try:
+			usage = max(usage, _usage_pct(json.loads(raw_app)))
+		except Exception:
+			pass
+	raw_buc = headers.get("x-business-use-case-usage")
+	if raw_buc:
+		try:
+			for entries in (json.loads(raw_buc) or {}).values():
+				for e in entries or []:
+					usage = max(usage, _usage_pct(e))
+					try:
+						# minutes
+						regain = max(regain, float(e.get("estimated_time_to_regain_access") or 0) * 60.0)
+					except Exception:
+						pass
+		except Exception:
+			pass
+	return usage, regain
+
+
+def is_rate_limit_error(status_code: Optional[int], body: Optional[str]) -> bool:
+	if status_code == 429:
+		return True
+	if not body:
+		return False
+	try:
+		err = (json.loads(body) or {}).get("error") or {}
+		code = int(err.get("code") or 0)
+	except Exception:
+		return False
+	return code in RATE_LIMIT_CODES or 80001 <= code <= 80014
+
+
+def is_oauth_error(status_code: Optional[int], body: Optional[str]) -> bool:
+	"""Invalid/expired token or missing permission (OAuthException), as opposed to throttling."""
+	if not body or is_rate_limit_error(status_code, body):
+		return False
+	try:
+		err = (json.loads(body) or {}).get("error") or {}
+	except Exception:
+		return False
+	return err.get("type") == "OAuthException" or int(err.get("code") or 0) in (102, 190)
+
+
+class GraphRateLimiter:
+	"""Token bucket shared by every Graph call in the process; thread- and loop-safe."""
+
+	def __init__(
+		self,
+		rate_per_sec: float = 10.0,
+		burst: float = 20.0,
+		soft_pct: float = 75.0,
+		hard_pct: float = 95.0,
+		pause_seconds: float = 60.0,
+	) -> None:
+		self.base_rate = max(0.1, rate_per_sec)
+		self.burst = max(1.0, burst)
+		self.soft_pct = soft_pct
+		self.hard_pct = hard_pct
+		self.pause_seconds = pause_seconds
+		self.rate = self.base_rate
+		self.usage_pct = 0.0
+		self.paused_until = 0.0
+		self.throttled = 0
+		self.waited_ms = 0
+		self._tokens = self.burst
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _refill(self, now: float) -> None:
+		self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+		self._last = now
+
+	def reserve(self, cost: float = 1.0) -> float:
+		"""Take `cost` tokens (possibly going negative) and return how long the caller must wait."""
+		with self._lock:
+			now = time.monotonic()
+			self._refill(now)
+			wait = max(0.0, self.paused_until - now)
+			self._tokens -= cost
+			if self._tokens < 0:
+				wait = max(wait, -self._tokens / self.rate)
+			if wait > 0:
+				self.waited_ms += int(wait * 1000)
+			return wait
+
+	def _check(self, wait: float, cost: float, max_wait: Optional[float]) -> None:
+		if max_wait is not None and wait > max_wait:
+			with self._lock:
+				# give back the reservation; the caller is not going to use it
+				self._tokens = min(self.burst, self._tokens + cost)
+			raise GraphRateLimited(wait)
+
+	async def acquire(self, cost: float = 1.0, max_wait: Optional[float] = None) -> None:
+		wait = self.reserve(cost)
+		self._check(wait, cost, max_wait)
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	def acquire_sync(self, cost: float = 1.0, max_wait: Optional[float] = None) -> None:
+		wait = self.reserve(cost)
+		self._check(wait, cost, max_wait)
+		if wait > 0:
+			time.sleep(wait)
+
+	def update_from_headers(self, headers: Mapping[str, str]) -> None:
+		if not headers.get("x-app-usage") and not headers.get("x-business-use-case-usage"):
+			return
+		usage, regain = parse_usage_headers(headers)
+		with self._lock:
+			now = time.monotonic()
+			self._refill(now)
+			self.usage_pct = usage
+			if usage >= self.hard_pct or regain > 0:
+				self.paused_until = max(self.paused_until, now + (regain or self.pause_seconds))
+			if usage <= self.soft_pct:
+				self.rate = self.base_rate
+			else:
+				# linear slowdown from full rate at soft_pct to 10% of it at 100%
+				span = max(1.0, 100.0 - self.soft_pct)
+				frac = max(0.1, 1.0 - 0.9 * (usage - self.soft_pct) / span)
+				self.rate = self.base_rate * frac
+
+	def note_throttled(self, retry_after: Optional[float] = None) -> None:
+		"""Graph rejected a call as throttled: pause everyone for retry_after (or the default)."""
+		with self._lock:
+			self.throttled += 1
+			self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or self.pause_seconds))
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			now = time.monotonic()
+			return {
+				"rate_per_sec": round(self.rate, 2),
+				"base_rate_per_sec": self.base_rate,
+				"usage_pct": round(self.usage_pct, 1),
+				"paused_for_s": round(max(0.0, self.paused_until - now), 1),
+				"throttled": self.throttled,
+				"waited_ms": self.waited_ms,
+			}
+
+
+limiter = GraphRateLimiter(
+	rate_per_sec=_float_env("GRAPH_RATE_PER_SEC", 10.0),
+	burst=_float_env("GRAPH_RATE_BURST", 20.0),
+	soft_pct=_float_env("GRAPH_USAGE_SOFT_PCT", 75.0),
+	hard_pct=_float_env("GRAPH_USAGE_HARD_PCT", 95.0),
+	pause_seconds=_float_env("GRAPH_THROTTLE_PAUSE_SEC", 60.0),
+)
+
+
+def max_wait_seconds() -> float:
+	"""Longest a caller will sleep on the limiter before failing fast with GraphRateLimited."""
+	return _float_env("GRAPH_MAX_WAIT_SEC", 30.0)
+
+
+def coalesce_key(url: str, params: Optional[Mapping[str, Any]]) -> str:
+	items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+	return url + "?" + "&".join(f"{k}={v}" for k, v in items)
+
+
+async def coalesce(key: str, factory: Callable[[], Awaitable[T]]) -> T:
+	"""Run factory() once per key at a time; concurrent callers with the same key share the result."""
+	loop = asyncio.get_running_loop()
+	pending = _inflight.setdefault(loop, {})
+	fut = pending.get(key)
+	if fut is not None:
+		return await asyncio.shield(fut)
+	fut = loop.create_future()
+	pending[key] = fut
+	try:
+		result = await factory()
+	except BaseException as e:
+		if not fut.done():
+			fut.set_exception(e)
+			# mark retrieved so an unshared failure does not log "exception never retrieved"
+			fut.exception()
+		raise
+	else:
+		if not fut.done():
+			fut.set_result(result)
+		return result
+	finally:
+		pending.pop(key, None)
+
+
+def graph_request_sync(method: str, url: str, **kwargs: Any) -> httpx.Response:
+	"""Limiter-aware request on the shared sync client (for sync service code)."""
+	global _sync_client
+	with _sync_lock:
+		if _sync_client is None:
+			_sync_client = httpx.Client(limits=_limits(), timeout=httpx.Timeout(20.0, connect=10.0))
+		client = _sync_client
+	limiter.acquire_sync(max_wait=max_wait_seconds())
+	with tracing.span("graph", method=method, path=httpx.URL(url).path[:120]):
+		resp = client.request(method, url, **kwargs)
+	limiter.update_from_headers(resp.headers)
+	if resp.status_code >= 400 and is_rate_limit_error(resp.status_code, resp.text):
+		limiter.note_throttled()
+	return resp
+
+
+async def gather_bounded(factories: Iterable[Callable[[], Awaitable[T]]], limit: int = 4) -> List[T]:
+	"""Run coroutine factories with at most `limit` in flight; results keep input order."""
+	sem = asyncio.Semaphore(max(1, limit))
+
+	async def _one(f: Callable[[], Awaitable[T]]) -> T:
+		async with sem:
+			return await f()
+
+	return await asyncio.gather(*(_one(f) for f in factories))
+
+
+async def graph_batch(
+	relative_urls: Sequence[str],
+	token: str,
+	base: str = "https://graph.facebook.com",
+	client: Optional[httpx.AsyncClient] = None,
+) -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+	"""
+	GET many relative URLs ("v21.0/<id>?fields=...") through the batch endpoint, 50 per POST.
+	Returns one (status_code, body) per input in order; (0, None) when Meta returned null
+	for an item (it timed out inside the batch).
+	"""
+	client = client or get_graph_client()
+	out: List[Tuple[int, Optional[Dict[str, Any]]]] = []
+	for i in range(0, len(relative_urls), BATCH_MAX):
+		chunk = relative_urls[i:i + BATCH_MAX]
+		# every item counts against the usage quota, so charge the bucket per item
+		await limiter.acquire(cost=float(len(chunk)), max_wait=max_wait_seconds())
+		batch = [{"method": "GET", "relative_url": u} for u in chunk]
+		r = await client.post(base + "/", data={"access_token": token, "batch": json.dumps(batch), "include_headers": "false"})
+		limiter.update_from_headers(r.headers)
+		if r.status_code >= 400:
+			if is_rate_limit_error(r.status_code, r.text):
+				limiter.note_throttled()
+			r.raise_for_status()
+		for item in r.json() or []:
+			if not item:
+				out.append((0, None))
+				continue
+			try:
+				body = json.loads(item.get("body") or "null")
+			except Exception:
+				body = None
+			code = int(item.get("code") or 0)
+			if code >= 400 and is_rate_limit_error(code, item.get("body")):
+				limiter.note_throttled()
+			out.append((code, body if isinstance(body, dict) else None))
+	return out
+
+
+async def fetch_users_batch(
+	user_ids: Sequence[str],
+	token: str,
+	graph_version: str,
+	fields: str = "username,name",
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+	"""Look up many IG users in as few requests as possible. Returns (found, errors) keyed by id."""
+	ids = list(dict.fromkeys(str(u) for u in user_ids if u))
+	found: Dict[str, Dict[str, Any]] = {}
+	errors: Dict[str, str] = {}
+	if not ids:
+		return found, errors
+	results = await graph_batch([f"{graph_version}/{uid}?fields={fields}" for uid in ids], token)
+	for uid, (code, body) in zip(ids, results):
+		if code == 200 and body is not None:
+			found[uid] = body
+		else:
+			detail = json.dumps((body or {}).get("error") or {})[:300] if body else "no response"
+			errors[uid] = f"HTTP {code}: {detail}"
+	return found, errors
+
+
+def get_graph_stats() -> Dict[str, Any]:
+	out = limiter.stats()
+	try:
+		out["coalescing"] = sum(len(v) for v in list(_inflight.values()))
+	except Exception:
+		pass
+	return out
@@ -9,10 +9,10 @@ import logging
 import os
 from typing import Any, Dict, List, Optional
 
-import httpx
 
 from ..db import get_session
 from ..models import IGCommentActionLog
+from .graph_client import graph_request_sync
 from .instagram_api import GRAPH_VERSION, _get_base_token_and_id
 
 _log = logging.getLogger("instagram.comments")
@@ -45,10 +45,9 @@ def fetch_comments(media_id: str, limit: int = 50, after: Optional[str] = None)
 	if after:
 		params["after"] = after
 	url = _build_url(f"/{media_id}/comments")
-	with httpx.Client(timeout=20) as client:
-		resp = client.get(url, params=params)
-		resp.raise_for_status()
-		return resp.json()
+	resp = graph_request_sync("GET", url, params=params, timeout=20)
+	resp.raise_for_status()
+	return resp.json()
 
 
 def list_recent_media(limit: int = 25) -> List[Dict[str, Any]]:
@@ -64,21 +63,19 @@ def list_recent_media(limit: int = 25) -> List[Dict[str, Any]]:
 		"fields": "id,caption,media_type,media_product_type,permalink,timestamp,comments_count",
 	}
 	url = _build_url(f"/{ig_user_id}/media")
-	with httpx.Client(timeout=20) as client:
-		resp = client.get(url, params=params)
-		resp.raise_for_status()
-		data = resp.json()
-		return data.get("data", []) or []
+	resp = graph_request_sync("GET", url, params=params, timeout=20)
+	resp.raise_for_status()
+	data = resp.json()
+	return data.get("data", []) or []
 
 
 def reply_to_comment(comment_id: str, message: str, actor_user_id: Optional[int] = None) -> Dict[str, Any]:
 	token, _, _ = _get_base_token_and_id()
 	url = _build_url(f"/{comment_id}/replies")
 	payload = {"access_token": token, "message": message}
-	with httpx.Client(timeout=20) as client:
-		resp = client.post(url, data=payload)
-		resp.raise_for_status()
-		data = resp.json()
+	resp = graph_request_sync("POST", url, data=payload, timeout=20)
+	resp.raise_for_status()
+	data = resp.json()
 	_log_action("reply", media_id=None, comment_id=comment_id, actor_user_id=actor_user_id, payload={"message": message, "response": data})
 	return data
 
@@ -87,10 +84,9 @@ def hide_comment(comment_id: str, hide: bool = True, actor_user_id: Optional[int
 	token, _, _ = _get_base_token_and_id()
 	url = _build_url(f"/{comment_id}")
 	payload = {"access_token": token, "hide": "true" if hide else "false"}
-	with httpx.Client(timeout=20) as client:
-		resp = client.post(url, data=payload)
-		resp.raise_for_status()
-		data = resp.json()
+	resp = graph_request_sync("POST", url, data=payload, timeout=20)
+	resp.raise_for_status()
+	data = resp.json()
 	_log_action("hide" if hide else "unhide", media_id=None, comment_id=comment_id, actor_user_id=actor_user_id, payload={"response": data})
 	return data
 
@@ -99,10 +95,9 @@ def delete_comment(comment_id: str, actor_user_id: Optional[int] = None) -> Dict
 	token, _, _ = _get_base_token_and_id()
 	url = _build_url(f"/{comment_id}")
 	params = {"access_token": token}
-	with httpx.Client(timeout=20) as client:
-		resp = client.delete(url, params=params)
-		resp.raise_for_status()
-		data = resp.json()
+	resp = graph_request_sync("DELETE", url, params=params, timeout=20)
+	resp.raise_for_status()
+	data = resp.json()
 	_log_action("delete", media_id=None, comment_id=comment_id, actor_user_id=actor_user_id, payload={"response": data})
 	return data
 
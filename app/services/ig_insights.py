@@ -14,11 +14,11 @@ import logging
 import os
 from typing import Any, Dict, Iterable, Optional
 
-import httpx
 from sqlmodel import select
 
 from ..db import get_session
 from ..models import IGInsightsSnapshot
+from .graph_client import graph_request_sync
 from .instagram_api import GRAPH_VERSION, _get_base_token_and_id
 
 _log = logging.getLogger("instagram.insights")
@@ -97,10 +97,9 @@ def fetch_insights(scope: str, subject_id: Optional[str], metrics: Iterable[str]
 		"platform": "instagram",
 	}
 	query.update(params)
-	with httpx.Client(timeout=30) as client:
-		resp = client.get(url, params=query)
-		resp.raise_for_status()
-		payload = resp.json()
+	resp = graph_request_sync("GET", url, params=query, timeout=30)
+	resp.raise_for_status()
+	payload = resp.json()
 	cache_key = _build_cache_key(scope, str(target_id), metric_list, params)
 	snapshot = _cache_insights(scope, str(target_id), cache_key, payload, ttl_seconds or DEFAULT_INSIGHTS_TTL)
 	try:
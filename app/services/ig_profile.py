@@ -13,11 +13,11 @@ import logging
 import os
 from typing import Any, Dict, Optional
 
-import httpx
 from sqlmodel import select
 
 from ..db import get_session
 from ..models import IGProfileSnapshot
+from .graph_client import graph_request_sync
 from .instagram_api import GRAPH_VERSION, _get_base_token_and_id
 
 _log = logging.getLogger("instagram.profile")
@@ -68,10 +68,9 @@ def refresh_profile_snapshot(force: bool = False, timeout: int = 20) -> IGProfil
 		"fields": ",".join(PROFILE_FIELDS),
 		"platform": "instagram",
 	}
-	with httpx.Client(timeout=timeout) as client:
-		resp = client.get(url, params=params)
-		resp.raise_for_status()
-		data: Dict[str, Any] = resp.json()
+	resp = graph_request_sync("GET", url, params=params, timeout=timeout)
+	resp.raise_for_status()
+	data: Dict[str, Any] = resp.json()
 
 	expires_at = _now() + dt.timedelta(seconds=DEFAULT_CACHE_TTL_SECONDS)
 	snapshot = IGProfileSnapshot(
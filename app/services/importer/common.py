@@ -4,8 +4,6 @@ import os
 from datetime import datetime, date
 from typing import Any, Iterable, List, Dict
 
-from openpyxl import load_workbook
-
 from ...utils.normalize import normalize_text
 
 # re-export for convenience
@@ -63,6 +61,8 @@ def parse_date(value: Any) -> date | None:
 
 
 def read_sheet_rows(file_path: str) -> tuple[list[str], list[list[Any]]]:
+	from openpyxl import load_workbook
+
 	wb = load_workbook(filename=file_path, data_only=True)
 	ws = wb.active
 	headers: list[str] = []
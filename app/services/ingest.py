@@ -1,7 +1,6 @@
 import base64
 import datetime as dt
 import hashlib
-import io
 import json
 import os
 from dataclasses import dataclass
@@ -17,6 +16,9 @@ import logging as _lg
 _log = _lg.getLogger("ingest")
 _log_up = _lg.getLogger("ingest.upsert")
 from .queue import enqueue
+from .conversation_snapshot import note_conversation_changed, note_ig_user_changed
+from .payload_archive import load_raw_event_payload, store_raw
+from .event_bus import publish_message
 from sqlalchemy import text as _sql_text
 import httpx
 from ..services.admin_notifications import create_admin_notification
@@ -555,14 +557,35 @@ def _write_story_file(path: Path, content: bytes) -> None:
 	path.write_bytes(content)
 
 
-def _make_story_thumb(content: bytes, thumb_path: Path) -> None:
+def _record_story_thumb(story_id: str, media_path: Path, thumb_path: Path) -> None:
+	try:
+		with get_session() as session:
+			session.exec(
+				_sql_text("UPDATE stories SET media_thumb_path=:thumb WHERE story_id=:sid AND media_path=:path").bindparams(
+					thumb=str(thumb_path), sid=str(story_id), path=str(media_path)
+				)
+			)
+	except Exception as exc:
+		try:
+			_log_up.warning("story thumb path update failed story_id=%s err=%s", story_id, str(exc)[:200])
+		except Exception:
+			pass
+
+
+def _make_story_thumb(story_id: str, src_path: Path, thumb_path: Path) -> None:
 	if not _PIL_STORY_AVAILABLE:
 		return
+	# Rendered in the derivative process pool; the ingest path does not wait on decoding.
+	# The row gets media_thumb_path only once the file exists.
 	try:
-		thumb_path.parent.mkdir(parents=True, exist_ok=True)
-		img = _PILImage.open(io.BytesIO(content))  # type: ignore[arg-type]
-		img.thumbnail((512, 512))
-		img.save(thumb_path, format="JPEG", quality=85)
+		from .derivatives import schedule as _schedule_derivative
+		_schedule_derivative(
+			src_path,
+			thumb_path,
+			"preview",
+			"jpg",
+			on_done=lambda p: _record_story_thumb(story_id, src_path, p),
+		)
 	except Exception:
 		pass
 
@@ -623,11 +646,11 @@ def _ensure_story_media_cached(session, story_id: str, story_url: Optional[str],
 	path, thumb = _story_media_paths(story_id, mime)
 	try:
 		_write_story_file(path, content)
-		if thumb:
-			_make_story_thumb(content, thumb)
 	except Exception:
 		return None
 	checksum = hashlib.sha256(content).hexdigest()
+	# a thumb that is not rendered yet is recorded by _record_story_thumb on success
+	ready_thumb = thumb if (thumb and thumb.exists()) else None
 	try:
 		session.exec(
 			_sql_text(
@@ -640,11 +663,15 @@ def _ensure_story_media_cached(session, story_id: str, story_url: Optional[str],
 				    media_fetched_at=CURRENT_TIMESTAMP
 				WHERE story_id=:sid
 				"""
-			).bindparams(path=str(path), thumb=(str(thumb) if thumb else None), mime=mime, chk=checksum, sid=str(story_id))
+			).bindparams(path=str(path), thumb=(str(ready_thumb) if ready_thumb else None), mime=mime, chk=checksum, sid=str(story_id))
 		)
 	except Exception:
 		pass
-	return _StoryMediaResult(path=path, thumb_path=thumb, mime=mime, data_url=_encode_story_data_url(content, mime))
+	# scheduled after the UPDATE: the callback's write waits on this row lock, so it lands
+	# after (not under) the NULL written above
+	if thumb and ready_thumb is None:
+		_make_story_thumb(str(story_id), path, thumb)
+	return _StoryMediaResult(path=path, thumb_path=ready_thumb, mime=mime, data_url=_encode_story_data_url(content, mime))
 
 
 def _ensure_story_cached_in_ads(session, story_id: str, story_url: Optional[str]) -> None:
@@ -754,7 +781,10 @@ def _fetch_message_details_sync(mid: str) -> Optional[Dict[str, Any]]:
 		loop = asyncio.new_event_loop()
 		try:
 			asyncio.set_event_loop(loop)
-			return loop.run_until_complete(fetch_message_details(str(mid)))
+			from .graph_client import closing
+
+			# one-shot loop: close its pooled Graph client before the loop goes away
+			return loop.run_until_complete(closing(fetch_message_details(str(mid))))
 		finally:
 			asyncio.set_event_loop(None)
 			loop.close()
@@ -811,53 +841,31 @@ def _ensure_ig_user(conn, ig_user_id: str) -> None:
 
 
 def _ensure_ig_user_with_data(ig_user_id: str, igba_id: str | None = None) -> None:
-	"""Ensure IG user exists with data (username, name, etc.) without holding long DB transactions."""
+	"""
+	Ensure the IG user row exists and, when it lacks data, hand the id to the enrichment
+	batcher (user_enrich_batch) instead of calling Graph inline.
+	"""
 	if not ig_user_id:
 		return
 
-	def _needs_enrichment() -> bool:
-		with get_session() as session:
-			row = session.exec(
-				text("SELECT ig_user_id, username, fetch_status FROM ig_users WHERE ig_user_id=:id LIMIT 1").params(
-					id=str(ig_user_id)
-				)
-			).first()
-			if not row:
-				return True
+	with get_session() as session:
+		row = session.exec(
+			text("SELECT ig_user_id, username, fetch_status FROM ig_users WHERE ig_user_id=:id LIMIT 1").params(
+				id=str(ig_user_id)
+			)
+		).first()
+		if not row:
+			session.exec(text("INSERT IGNORE INTO ig_users(ig_user_id) VALUES (:id)").params(id=str(ig_user_id)))
+		else:
 			username = getattr(row, "username", None) or (row[1] if len(row) > 1 else None)
 			fetch_status = getattr(row, "fetch_status", None) or (row[2] if len(row) > 2 else None)
-			return not (username and str(fetch_status or "").lower() == "ok")
-
-	if not _needs_enrichment():
-		return
-
-	try:
-		import asyncio
-
-		# Create new event loop if one doesn't exist (same pattern as _fetch_message_details_sync)
-		try:
-			loop = asyncio.get_event_loop()
-		except RuntimeError:
-			loop = asyncio.new_event_loop()
-			asyncio.set_event_loop(loop)
-		
-		from .enrichers import enrich_user
+			if username and str(fetch_status or "").lower() == "ok":
+				return
 
-		result = loop.run_until_complete(enrich_user(ig_user_id))
-		if result:
-			_log.info("ingest: user %s enriched synchronously", ig_user_id)
-		else:
-			_log.debug("ingest: user %s already had data or fetch failed", ig_user_id)
-		return
-	except Exception as e:
-		_log.warning("ingest: failed to enrich user %s synchronously: %s", ig_user_id, e)
+	from .user_enrich_batch import mark_needs_enrichment
 
-	# Fallback: ensure at least the row exists
-	try:
-		with get_session() as session:
-			session.exec(text("INSERT IGNORE INTO ig_users(ig_user_id) VALUES (:id)").params(id=str(ig_user_id)))
-	except Exception:
-		pass
+	if mark_needs_enrichment([str(ig_user_id)]):
+		_log.debug("ingest: user %s queued for batch enrichment", ig_user_id)
 
 
 def _extract_graph_conversation_id_from_message_id(mid: str, page_id: Optional[str] = None) -> Optional[str]:
@@ -1142,23 +1150,16 @@ def _insert_message(session, event: Dict[str, Any], igba_id: str, platform: str
 	if not mid:
 		return None
 	# idempotency by ig_message_id - use INSERT IGNORE to avoid race conditions
-	# Check if message already exists - if so, only update raw_json (preserve existing text)
+	# Check if message already exists - if so, only archive the payload (preserve existing text)
 	exists_row = session.exec(
 		text("SELECT id, text FROM message WHERE ig_message_id = :mid AND COALESCE(platform, 'instagram') = :platform LIMIT 1")
 		.params(mid=str(mid), platform=str(platform or "instagram"))
 	).first()
 	if exists_row:
-		# Message already exists - update raw_json but preserve existing text
-		# This handles status callbacks (delivered/read) that don't include message text
-		raw_json_data = json.dumps(event, ensure_ascii=False)
+		# Message already exists - keep the latest callback payload in the archive only;
+		# status callbacks (delivered/read) never rewrite the message row itself
 		try:
-			session.exec(
-				text("UPDATE message SET raw_json = :raw_json WHERE ig_message_id = :mid AND COALESCE(platform, 'instagram') = :platform").params(
-					raw_json=raw_json_data,
-					mid=str(mid),
-					platform=str(platform or "instagram"),
-				)
-			)
+			store_raw(session, int(exists_row.id if hasattr(exists_row, "id") else exists_row[0]), json.dumps(event, ensure_ascii=False))
 		except Exception:
 			pass
 		# Return None to indicate message was already processed (no new insert)
@@ -1399,7 +1400,7 @@ def _insert_message(session, event: Dict[str, Any], igba_id: str, platform: str
 			text=text_val,
 			attachments_json=json.dumps(attachments, ensure_ascii=False) if attachments is not None else None,
 			timestamp_ms=int(timestamp_ms) if isinstance(timestamp_ms, (int, float, str)) and str(timestamp_ms).isdigit() else None,
-			raw_json=json.dumps(event, ensure_ascii=False),
+			raw_json=None,  # payload goes to message_payload (see payload_archive)
 			conversation_id=int(conversation_pk) if conversation_pk is not None else None,
 			direction=direction,
 			sender_username=None,  # Will be set by enricher if needed
@@ -1414,6 +1415,9 @@ def _insert_message(session, event: Dict[str, Any], igba_id: str, platform: str
 		)
 		result = session.exec(stmt)
 		session.flush()
+		if getattr(result, "rowcount", 0) and result.rowcount > 0:
+			# raw SQL skips the ORM hooks; bump the context snapshot once this commits
+			note_conversation_changed(conversation_pk, session=session)
 		
 		# Check if insert actually happened (INSERT IGNORE returns 0 rows if duplicate)
 		# Fetch the message ID
@@ -1426,19 +1430,13 @@ def _insert_message(session, event: Dict[str, Any], igba_id: str, platform: str
 			return None
 		message_id = int(msg_row.id if hasattr(msg_row, "id") else msg_row[0])
 		
-		# Always update raw_json with the latest callback data (even if message already existed)
+		# Always archive the latest callback data (even if message already existed)
 		# This ensures we capture all callback data including reply_to for investigation
 		raw_json_data = json.dumps(event, ensure_ascii=False)
 		try:
-			session.exec(
-				text("UPDATE message SET raw_json = :raw_json WHERE ig_message_id = :mid AND COALESCE(platform, 'instagram') = :platform").params(
-					raw_json=raw_json_data,
-					mid=str(mid),
-					platform=str(platform or "instagram"),
-				)
-			)
+			store_raw(session, message_id, raw_json_data)
 		except Exception:
-			# Best-effort; don't fail if update fails
+			# Best-effort; don't fail if the archive write fails
 			pass
 		
 		# Categorize inbound message based on content
@@ -1495,18 +1493,13 @@ def _insert_message(session, event: Dict[str, Any], igba_id: str, platform: str
 			# Insert failed and message doesn't exist - return None
 			return None
 		message_id = int(msg_row.id if hasattr(msg_row, "id") else msg_row[0])
-		# Always update raw_json with the latest callback data (even if message already existed)
+		# Always archive the latest callback data (even if message already existed)
 		# This ensures we capture all callback data including reply_to for investigation
 		raw_json_data = json.dumps(event, ensure_ascii=False)
 		try:
-			session.exec(
-				text("UPDATE message SET raw_json = :raw_json WHERE ig_message_id = :mid").params(
-					raw_json=raw_json_data,
-					mid=str(mid)
-				)
-			)
+			store_raw(session, message_id, raw_json_data)
 		except Exception:
-			# Best-effort; don't fail if update fails
+			# Best-effort; don't fail if the archive write fails
 			pass
 		# Fetch full row for return value
 		row = session.get(Message, message_id)
@@ -2466,18 +2459,13 @@ def upsert_message_from_ig_event(session, event: Dict[str, Any] | str, igba_id:
 	if exists:
 		row = exists
 		message_id = int(row.id if hasattr(row, "id") else row[0])
-		# Always update raw_json with the latest callback data (even if message already existed)
+		# Always archive the latest callback data (even if message already existed)
 		# This ensures we capture all callback data including reply_to for investigation
 		raw_json_data = json.dumps(event, ensure_ascii=False)
 		try:
-			session.exec(
-				text("UPDATE message SET raw_json = :raw_json WHERE ig_message_id = :mid").params(
-					raw_json=raw_json_data,
-					mid=str(mid)
-				)
-			)
+			store_raw(session, message_id, raw_json_data)
 		except Exception:
-			# Best-effort; don't fail if update fails
+			# Best-effort; don't fail if the archive write fails
 			pass
 		return message_id
 	sender_id = (event.get("from") or event.get("sender") or {}).get("id")
@@ -2703,7 +2691,7 @@ def upsert_message_from_ig_event(session, event: Dict[str, Any] | str, igba_id:
 		text=text_val,
 		attachments_json=json.dumps(attachments, ensure_ascii=False) if attachments is not None else None,
 		timestamp_ms=int(ts_ms) if ts_ms is not None else None,
-		raw_json=json.dumps(event, ensure_ascii=False),
+		raw_json=None,  # archived below
 		conversation_id=int(conversation_pk) if conversation_pk is not None else None,
 		direction=direction,
 		product_id=product_id_for_message,  # Store product focus for this message
@@ -2721,6 +2709,10 @@ def upsert_message_from_ig_event(session, event: Dict[str, Any] | str, igba_id:
 	)
 	session.add(row)
 	session.flush()
+	try:
+		store_raw(session, int(row.id), json.dumps(event, ensure_ascii=False))  # type: ignore[arg-type]
+	except Exception:
+		pass
 	if attachments:
 		_create_attachment_stubs(session, int(row.id), str(mid), attachments)  # type: ignore[arg-type]
 	# Upsert conversations last-* fields (summary) keyed by internal id
@@ -2792,6 +2784,8 @@ def _ensure_platform_user(
 				name=(str(name) if name else None),
 			)
 		)
+		if username or name:
+			note_ig_user_changed(str(user_id), session=session)
 	except Exception:
 		pass
 
@@ -2876,15 +2870,30 @@ def _collect_whatsapp_events(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
 	return normalized
 
 
+def _publish_inserted(insert_result: _InsertResult) -> None:
+	"""Live update for inbox/thread websockets (after commit; never fails ingestion)."""
+	try:
+		publish_message(
+			insert_result.conversation_id,
+			message_id=insert_result.message_id,
+			direction=insert_result.direction,
+			text=insert_result.message_text,
+			timestamp_ms=insert_result.timestamp_ms,
+			source="ingest",
+		)
+	except Exception:
+		pass
+
+
 def handle(raw_event_id: int) -> int:
 	"""Ingest one raw_event id. Return number of messages inserted.
 
 	This implementation keeps database transactions as small as possible:
 	- One short read to fetch the raw_events payload.
 	- Then, for each entry/message, a separate short-lived session/transaction
-	  is used for DB writes. Graph API calls are done outside those
-	  transactions via _ensure_ig_user_with_data, which manages its own
-	  persistence if needed.
+	  is used for DB writes. Unknown users are only marked for enrichment
+	  (_ensure_ig_user_with_data); Graph lookups happen in the batcher of
+	  worker_enrich, never on the ingest path.
 
 	This reduces lock hold times in MySQL and makes lock wait timeouts less likely.
 	"""
@@ -2893,11 +2902,11 @@ def handle(raw_event_id: int) -> int:
 	# Step 1: load raw_events payload in its own short transaction
 	with get_session() as session:
 		row = session.exec(
-			text("SELECT id, payload FROM raw_events WHERE id = :id").params(id=raw_event_id)
+			text("SELECT id, payload, payload_z FROM raw_events WHERE id = :id").params(id=raw_event_id)
 		).first()
 		if not row:
 			return 0
-		payload_text = row.payload if hasattr(row, "payload") else row[1]
+		payload_text = load_raw_event_payload(row)
 
 	try:
 		payload: Dict[str, Any] = json.loads(payload_text)
@@ -2933,6 +2942,8 @@ def handle(raw_event_id: int) -> int:
 				)
 				if insert_result:
 					inserted += 1
+			if insert_result:
+				_publish_inserted(insert_result)
 		return inserted
 
 	entries: List[Dict[str, Any]] = payload.get("entry", [])
@@ -2962,8 +2973,8 @@ def handle(raw_event_id: int) -> int:
 			sender_id = (event.get("sender") or {}).get("id")
 			recipient_id = (event.get("recipient") or {}).get("id")
 
-			# Determine which user to enrich (the one that's NOT the page) - max 1 Graph API request.
-			# This function manages its own DB usage; we avoid holding our own long transaction here.
+			# Determine which user to enrich (the one that's NOT the page); it is queued for the
+			# enrichment batcher. This function manages its own DB usage; we avoid holding our own long transaction here.
 			user_to_enrich = None
 			if sender_id and str(sender_id) != str(igba_id):
 				user_to_enrich = str(sender_id)
@@ -2971,8 +2982,7 @@ def handle(raw_event_id: int) -> int:
 				user_to_enrich = str(recipient_id)
 
 			if user_to_enrich:
-				# Enrich IG user info without keeping the current transaction open.
-				# Never let enrichment failure (e.g. expired token, 403) block message insert.
+				# Never let enrichment bookkeeping block message insert.
 				try:
 					_ensure_ig_user_with_data(user_to_enrich, str(igba_id))
 				except Exception as e:
@@ -3011,6 +3021,7 @@ def handle(raw_event_id: int) -> int:
 
 			# Run slow/remote follow-ups outside the DB transaction
 			if insert_result:
+				_publish_inserted(insert_result)
 				try:
 					dir_norm = (insert_result.direction or "").lower()
 					if (
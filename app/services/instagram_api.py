@@ -9,6 +9,15 @@ import logging
 from sqlalchemy import text as _text
 
 from ..db import get_session
+from .graph_client import (
+    coalesce,
+    coalesce_key,
+    gather_bounded,
+    get_graph_client,
+    is_rate_limit_error,
+    limiter,
+    max_wait_seconds,
+)
 
 
 GRAPH_VERSION = os.getenv("IG_GRAPH_API_VERSION", "v21.0")
@@ -31,14 +40,28 @@ def _get_base_token_and_id() -> tuple[str, str, bool]:
     return ig_token, ig_user_id, False
 
 
-async def _get(client: httpx.AsyncClient, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+async def _get(client: Optional[httpx.AsyncClient], url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Rate-limited GET; identical concurrent GETs (same url + params) share one request.
+
+    `client` may be None to use the shared keep-alive Graph client.
+    """
+    return await coalesce(
+        coalesce_key(url, params),
+        lambda: _get_uncoalesced(client or get_graph_client(), url, params),
+    )
+
+
+async def _get_uncoalesced(client: httpx.AsyncClient, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """GET with small retry/backoff to handle transient DNS/egress hiccups."""
     last_err: Optional[Exception] = None
     last_body: Optional[str] = None
     safe_url = url.split("?")[0]
     for attempt in range(3):
+        # waits while the app is near its usage quota; raises GraphRateLimited if the pause is long
+        await limiter.acquire(max_wait=max_wait_seconds())
         try:
             r = await client.get(url, params=params, timeout=20)
+            limiter.update_from_headers(r.headers)
             r.raise_for_status()
             return r.json()
         except httpx.HTTPStatusError as e:
@@ -48,6 +71,21 @@ async def _get(client: httpx.AsyncClient, url: str, params: Dict[str, Any]) -> D
                 last_body = e.response.text
             except Exception:
                 last_body = None
+
+            # Throttled: pause the shared limiter and let the next attempt wait on it
+            if is_rate_limit_error(status_code, last_body):
+                retry_after: Optional[float] = None
+                try:
+                    retry_after = float(e.response.headers.get("retry-after") or 0) or None
+                except Exception:
+                    retry_after = None
+                limiter.note_throttled(retry_after)
+                try:
+                    _log.warning("graph throttled attempt=%s code=%s url=%s body_snip=%s",
+                                attempt+1, status_code, safe_url, (last_body[:160] if last_body else None))
+                except Exception:
+                    pass
+                continue
             
             # Don't retry 403 errors - they're permission issues, not transient
             if status_code == 403:
@@ -101,9 +139,9 @@ async def fetch_conversations(limit: int = 25) -> List[Dict[str, Any]]:
     params = {"access_token": token, "limit": limit, "fields": fields}
     # Explicitly set platform for Instagram; some accounts require this even with IG User ID
     params["platform"] = "instagram"
-    async with httpx.AsyncClient() as client:
-        data = await _get(client, base + path, params)
-        return data.get("data", [])
+    client = get_graph_client()
+    data = await _get(client, base + path, params)
+    return data.get("data", [])
 
 
 async def fetch_messages(conversation_id: str, limit: int = 50) -> List[Dict[str, Any]]:
@@ -129,52 +167,51 @@ async def fetch_messages(conversation_id: str, limit: int = 50) -> List[Dict[str
     max_pages = 50  # Safety limit to prevent infinite loops
     page_count = 0
     
-    async with httpx.AsyncClient() as client:
-        while page_count < max_pages:
-            if next_url:
-                # Use the pagination URL directly
+    client = get_graph_client()
+    while page_count < max_pages:
+        if next_url:
+            # Use the pagination URL directly
+            try:
+                data = await _get(client, next_url, {})
+            except Exception as e:
                 try:
-                    data = await _get(client, next_url, {})
-                except Exception as e:
-                    try:
-                        _log.warning("fetch_messages pagination failed url=%s err=%s", next_url[:100], str(e)[:200])
-                    except Exception:
-                        pass
-                    break
-            else:
-                # First request
-                data = await _get(client, base + path, params)
-            
-            msgs = data.get("data", []) or []
-            # Annotate each message with the Graph conversation id so downstream ingestion
-            # can persist Message.conversation_id using this stable identifier.
-            for m in msgs:
-                if isinstance(m, dict):
-                    m["__graph_conversation_id"] = str(conversation_id)
-            all_msgs.extend(msgs)
-            
-            # Check for pagination
-            paging = data.get("paging", {})
-            next_url = paging.get("next")
-            if not next_url:
-                break
-            
-            # If limit was specified and we've reached it, stop
-            if limit > 0 and len(all_msgs) >= limit:
-                all_msgs = all_msgs[:limit]
+                    _log.warning("fetch_messages pagination failed url=%s err=%s", next_url[:100], str(e)[:200])
+                except Exception:
+                    pass
                 break
-            
-            page_count += 1
-            # Small delay to avoid rate limiting
-            await asyncio.sleep(0.2)
+        else:
+            # First request
+            data = await _get(client, base + path, params)
         
-        if page_count >= max_pages:
-            try:
-                _log.warning("fetch_messages hit max_pages limit conv_id=%s total_msgs=%s", str(conversation_id)[:50], len(all_msgs))
-            except Exception:
-                pass
+        msgs = data.get("data", []) or []
+        # Annotate each message with the Graph conversation id so downstream ingestion
+        # can persist Message.conversation_id using this stable identifier.
+        for m in msgs:
+            if isinstance(m, dict):
+                m["__graph_conversation_id"] = str(conversation_id)
+        all_msgs.extend(msgs)
         
-        return all_msgs
+        # Check for pagination
+        paging = data.get("paging", {})
+        next_url = paging.get("next")
+        if not next_url:
+            break
+        
+        # If limit was specified and we've reached it, stop
+        if limit > 0 and len(all_msgs) >= limit:
+            all_msgs = all_msgs[:limit]
+            break
+        
+        page_count += 1
+        # pacing comes from the shared Graph limiter in _get (no fixed sleep between pages)
+    
+    if page_count >= max_pages:
+        try:
+            _log.warning("fetch_messages hit max_pages limit conv_id=%s total_msgs=%s", str(conversation_id)[:50], len(all_msgs))
+        except Exception:
+            pass
+    
+    return all_msgs
 
 
 async def fetch_message_details(message_id: str, include_referral: bool = True) -> Dict[str, Any]:
@@ -193,19 +230,19 @@ async def fetch_message_details(message_id: str, include_referral: bool = True)
         fields.insert(-1, "referral")
     path = f"/{message_id}"
     params = {"access_token": token, "fields": ",".join(fields), "platform": "instagram"}
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await _get(client, base + path, params)
-            return data
-        except RuntimeError as err:
-            detail = str(err)
-            if include_referral and "nonexisting field (referral)" in detail:
-                try:
-                    _log.warning("fetch_message_details: retrying without referral mid=%s", str(message_id)[:60])
-                except Exception:
-                    pass
-                return await fetch_message_details(message_id, include_referral=False)
-            raise
+    client = get_graph_client()
+    try:
+        data = await _get(client, base + path, params)
+        return data
+    except RuntimeError as err:
+        detail = str(err)
+        if include_referral and "nonexisting field (referral)" in detail:
+            try:
+                _log.warning("fetch_message_details: retrying without referral mid=%s", str(message_id)[:60])
+            except Exception:
+                pass
+            return await fetch_message_details(message_id, include_referral=False)
+        raise
 
 
 async def fetch_thread_messages(igba_id: str, ig_user_id: str, limit: int = 200, graph_conversation_id: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -281,85 +318,97 @@ async def fetch_thread_messages(igba_id: str, ig_user_id: str, limit: int = 200,
     # Page through up to max_pages of conversations to find the matching participant set
     max_pages = 10
     page_no = 0
-    async with httpx.AsyncClient() as client:
-        next_url: Optional[str] = base + path
-        next_params: Dict[str, Any] = params
-        # Owner candidates: page id (entity_id) and IG business user id when available
-        owner_candidates = {str(entity_id)}
+    client = get_graph_client()
+    next_url: Optional[str] = base + path
+    next_params: Dict[str, Any] = params
+    # Owner candidates: page id (entity_id) and IG business user id when available
+    owner_candidates = {str(entity_id)}
+    try:
+        ig_business_id = os.getenv("IG_USER_ID")
+        if ig_business_id:
+            owner_candidates.add(str(ig_business_id))
+    except Exception:
+        pass
+    # Potential candidates to deep-check via messages (fallback)
+    convo_candidates: list[str] = []
+    while page_no < max_pages and next_url:
+        page_no += 1
         try:
-            ig_business_id = os.getenv("IG_USER_ID")
-            if ig_business_id:
-                owner_candidates.add(str(ig_business_id))
+            data = await _get(client, next_url, next_params)
+        except Exception:
+            data = {}
+        convs = data.get("data", []) or []
+        try:
+            _log.info("ftm.page page=%s convs=%s", page_no, len(convs))
         except Exception:
             pass
-        # Potential candidates to deep-check via messages (fallback)
-        convo_candidates: list[str] = []
-        while page_no < max_pages and next_url:
-            page_no += 1
-            try:
-                data = await _get(client, next_url, next_params)
-            except Exception:
-                data = {}
-            convs = data.get("data", []) or []
+        for c in convs:
+            cid = str(c.get("id"))
+            parts = ((c.get("participants") or {}).get("data") or [])
+            ids = {str(p.get("id")) for p in parts if p.get("id")}
+            # Prefer exact match: user + one of owner ids
+            if (ig_user_id in ids) and (ids & owner_candidates):
+                try:
+                    _log.info("ftm.match participants ids_size=%s found_cid=%s", len(ids), cid)
+                except Exception:
+                    pass
+                conv_id = cid
+                break
+            # Fallback candidate: at least the user is a participant; verify by fetching messages later
+            if ig_user_id in ids:
+                try:
+                    _log.info("ftm.candidate cid=%s ids_size=%s", cid, len(ids))
+                except Exception:
+                    pass
+                convo_candidates.append(cid)
+        if conv_id:
+            break
+        # advance pagination
+        paging = data.get("paging") or {}
+        nurl = paging.get("next")
+        if nurl and isinstance(nurl, str) and nurl.strip():
+            next_url = nurl
+            next_params = {}  # the 'next' URL already contains the token and fields
+        else:
+            next_url = None
+    # Fallback: scan a limited number of candidate conversations by checking their messages
+    if not conv_id and convo_candidates:
+        try:
+            _log.info("ftm.scan candidates=%s", len(convo_candidates))
+        except Exception:
+            pass
+        async def _sample(cid: str) -> List[Dict[str, Any]]:
             try:
-                _log.info("ftm.page page=%s convs=%s", page_no, len(convs))
+                return await fetch_messages(cid, limit=10)
             except Exception:
-                pass
-            for c in convs:
-                cid = str(c.get("id"))
-                parts = ((c.get("participants") or {}).get("data") or [])
-                ids = {str(p.get("id")) for p in parts if p.get("id")}
-                # Prefer exact match: user + one of owner ids
-                if (ig_user_id in ids) and (ids & owner_candidates):
+                return []
+
+        def _matches(sample: List[Dict[str, Any]]) -> bool:
+            for m in (sample or []):
+                frm = ((m.get("from") or {}) or {}).get("id")
+                to = (((m.get("to") or {}) or {}).get("data") or [])
+                recips = {str(x.get("id")) for x in to if x.get("id")}
+                if str(ig_user_id) == str(frm) or str(ig_user_id) in recips:
+                    return True
+            return False
+
+        # Fetch candidate samples a wave at a time (GRAPH_SCAN_CONCURRENCY) and stop after the
+        # wave with the first match, keeping discovery order; at most 20 candidates
+        scan = convo_candidates[:20]
+        wave = max(1, int(os.getenv("GRAPH_SCAN_CONCURRENCY", "4")))
+        for i in range(0, len(scan), wave):
+            chunk = scan[i:i + wave]
+            samples = await gather_bounded([lambda cid=cid: _sample(cid) for cid in chunk], limit=wave)
+            for cid, sample in zip(chunk, samples):
+                if _matches(sample):
                     try:
-                        _log.info("ftm.match participants ids_size=%s found_cid=%s", len(ids), cid)
+                        _log.info("ftm.scan found cid=%s", cid)
                     except Exception:
                         pass
                     conv_id = cid
                     break
-                # Fallback candidate: at least the user is a participant; verify by fetching messages later
-                if ig_user_id in ids:
-                    try:
-                        _log.info("ftm.candidate cid=%s ids_size=%s", cid, len(ids))
-                    except Exception:
-                        pass
-                    convo_candidates.append(cid)
             if conv_id:
                 break
-            # advance pagination
-            paging = data.get("paging") or {}
-            nurl = paging.get("next")
-            if nurl and isinstance(nurl, str) and nurl.strip():
-                next_url = nurl
-                next_params = {}  # the 'next' URL already contains the token and fields
-            else:
-                next_url = None
-        # Fallback: scan a limited number of candidate conversations by checking their messages
-        if not conv_id and convo_candidates:
-            try:
-                _log.info("ftm.scan candidates=%s", len(convo_candidates))
-            except Exception:
-                pass
-            for cid in convo_candidates[:20]:
-                try:
-                    sample = await fetch_messages(cid, limit=10)
-                except Exception:
-                    sample = []
-                found = False
-                for m in (sample or []):
-                    frm = ((m.get("from") or {}) or {}).get("id")
-                    to = (((m.get("to") or {}) or {}).get("data") or [])
-                    recips = {str(x.get("id")) for x in to if x.get("id")}
-                    if str(ig_user_id) == str(frm) or str(ig_user_id) in recips:
-                        try:
-                            _log.info("ftm.scan found cid=%s", cid)
-                        except Exception:
-                            pass
-                        conv_id = cid
-                        found = True
-                        break
-                if found:
-                    break
     if not conv_id:
         try:
             _log.info("ftm.end no_conversation_found igba=%s ig_user_id=%s", str(igba_id), str(ig_user_id))
@@ -413,9 +462,9 @@ async def fetch_user_username(user_id: str) -> Optional[str]:
     base = f"https://graph.facebook.com/{GRAPH_VERSION}"
     path = f"/{user_id}"
     params = {"access_token": token, "fields": "username,name"}
-    async with httpx.AsyncClient() as client:
-        data = await _get(client, base + path, params)
-        return data.get("username") or data.get("name")
+    client = get_graph_client()
+    data = await _get(client, base + path, params)
+    return data.get("username") or data.get("name")
 
 
 async def sync_latest_conversations(limit: int = 25) -> int:
@@ -426,13 +475,19 @@ async def sync_latest_conversations(limit: int = 25) -> int:
     or other sync jobs do not raise duplicate-key errors on `ig_message_id`.
     """
     conversations = await fetch_conversations(limit=limit)
+    # Page conversations in parallel (bounded) before opening the DB session, so the
+    # session is not held across Graph round trips.
+    conv_ids = [str(conv.get("id")) for conv in conversations]
+    pages = await gather_bounded(
+        [lambda cid=cid: fetch_messages(cid, limit=50) for cid in conv_ids],
+        limit=int(os.getenv("GRAPH_SYNC_CONCURRENCY", "4")),
+    )
     saved = 0
     with get_session() as session:
+        from .conversation_snapshot import note_conversation_changed
         from .ingest import _get_or_create_conversation_id as _get_conv_id
 
-        for conv in conversations:
-            cid = str(conv.get("id"))
-            msgs = await fetch_messages(cid, limit=50)
+        for cid, msgs in zip(conv_ids, pages):
             for m in reversed(msgs):  # oldest first for stable inserts
                 mid = str(m.get("id")) if m.get("id") else None
                 if not mid:
@@ -513,6 +568,8 @@ async def sync_latest_conversations(limit: int = 25) -> int:
                     # rowcount > 0 only when a new row was actually inserted
                     if getattr(result, "rowcount", 0) and result.rowcount > 0:
                         saved += 1
+                        # published after commit (raw SQL skips the ORM hooks)
+                        note_conversation_changed(convo_pk, session=session)
                 except Exception:
                     # Best-effort: skip problematic rows rather than failing the whole sync
                     continue
@@ -603,12 +660,14 @@ async def send_message(conversation_id: str, text: str, image_urls: Optional[Lis
         }
         for attempt in range(2):  # İlk deneme + 1 retry
             try:
+                await limiter.acquire(max_wait=max_wait_seconds())
                 r_img = await client.post(
                     url,
                     params={"access_token": token},
                     json=img_payload,
                     timeout=25,
                 )
+                limiter.update_from_headers(r_img.headers)
                 r_img.raise_for_status()
                 resp_img = r_img.json()
                 if resp_img.get("message_id"):
@@ -641,95 +700,97 @@ async def send_message(conversation_id: str, text: str, image_urls: Optional[Lis
                     await asyncio.sleep(1.0)
         return False
 
-    async with httpx.AsyncClient() as client:
-        # 1) Send TEXT first so the user always gets the welcome message even if images hit rate limit
-        if text and text.strip():
-            text_lines = [line.strip() for line in text.split('\n') if line.strip()]
-            if not text_lines:
-                text_lines = [text.strip()]
-            _log.info(
-                "Instagram send_message: sending %d text line(s) first recipient_id=%s",
-                len(text_lines),
-                recipient_id[:20] if recipient_id else "",
-            )
-            for idx, line_text in enumerate(text_lines):
-                payload = {
-                    "recipient": {"id": recipient_id},
-                    "messaging_type": "RESPONSE",
-                    "message": {"text": line_text},
-                }
+    client = get_graph_client()
+    # 1) Send TEXT first so the user always gets the welcome message even if images hit rate limit
+    if text and text.strip():
+        text_lines = [line.strip() for line in text.split('\n') if line.strip()]
+        if not text_lines:
+            text_lines = [text.strip()]
+        _log.info(
+            "Instagram send_message: sending %d text line(s) first recipient_id=%s",
+            len(text_lines),
+            recipient_id[:20] if recipient_id else "",
+        )
+        for idx, line_text in enumerate(text_lines):
+            payload = {
+                "recipient": {"id": recipient_id},
+                "messaging_type": "RESPONSE",
+                "message": {"text": line_text},
+            }
+            try:
+                await limiter.acquire(max_wait=max_wait_seconds())
+                r = await client.post(url, params={"access_token": token}, json=payload, timeout=20)
+                limiter.update_from_headers(r.headers)
+                r.raise_for_status()
+                resp = r.json()
+                if resp.get("message_id"):
+                    if idx == 0:
+                        results["message_id"] = resp["message_id"]
+                    results["message_ids"].append(resp["message_id"])
+                if idx < len(text_lines) - 1:
+                    await asyncio.sleep(0.3)
+            except httpx.HTTPStatusError as e:
                 try:
-                    r = await client.post(url, params={"access_token": token}, json=payload, timeout=20)
-                    r.raise_for_status()
-                    resp = r.json()
-                    if resp.get("message_id"):
-                        if idx == 0:
-                            results["message_id"] = resp["message_id"]
-                        results["message_ids"].append(resp["message_id"])
-                    if idx < len(text_lines) - 1:
-                        await asyncio.sleep(0.3)
-                except httpx.HTTPStatusError as e:
-                    try:
-                        detail = e.response.text
-                    except Exception:
-                        detail = str(e)
-                    raise RuntimeError(f"Graph send failed (message {idx + 1}/{len(text_lines)}): {detail}")
-                except Exception as e:
-                    raise RuntimeError(f"Graph send failed (message {idx + 1}/{len(text_lines)}): {e}")
-        elif (image_urls or []) and not (text or "").strip():
-            _log.warning(
-                "Instagram send_message: text empty, sending only images recipient_id=%s",
-                recipient_id[:20] if recipient_id else "",
-            )
+                    detail = e.response.text
+                except Exception:
+                    detail = str(e)
+                raise RuntimeError(f"Graph send failed (message {idx + 1}/{len(text_lines)}): {detail}")
+            except Exception as e:
+                raise RuntimeError(f"Graph send failed (message {idx + 1}/{len(text_lines)}): {e}")
+    elif (image_urls or []) and not (text or "").strip():
+        _log.warning(
+            "Instagram send_message: text empty, sending only images recipient_id=%s",
+            recipient_id[:20] if recipient_id else "",
+        )
 
-        # 2) Then send images; short delay after text to reduce rate limit
-        n_images = len(absolute_image_urls)
-        if n_images:
-            await asyncio.sleep(0.5)
-            _log.info(
-                "Instagram send_message: recipient_id=%s image_count=%d (from %d requested)",
-                recipient_id[:20] if recipient_id else "",
-                n_images,
-                len(image_urls or []),
-            )
-            sent_count = 0
-            for i, img_url in enumerate(absolute_image_urls):
-                if i > 0 and image_delay_sec > 0:
-                    await asyncio.sleep(image_delay_sec)
-                ok = await _send_one_image(img_url)
-                if ok:
-                    sent_count += 1
-                    mid = results["message_ids"][-1] if results["message_ids"] else None
-                    _log.info(
-                        "Instagram image sent idx=%d/%d message_id=%s url=%s",
-                        i + 1,
-                        n_images,
-                        mid,
-                        (img_url[:60] + "..." if len(img_url) > 60 else img_url),
-                    )
-                else:
-                    _log.warning(
-                        "Instagram image failed idx=%d/%d url=%s",
-                        i + 1,
-                        n_images,
-                        (img_url[:60] + "..." if len(img_url) > 60 else img_url),
-                    )
-                    if image_delay_after_fail_sec > 0:
-                        await asyncio.sleep(image_delay_after_fail_sec)
-            results["image_message_count"] = sent_count
-            _log.info(
-                "Instagram send_message: image summary sent=%d requested=%d recipient_id=%s",
-                sent_count,
-                n_images,
-                recipient_id[:20] if recipient_id else "",
-            )
-            if sent_count < n_images:
+    # 2) Then send images; short delay after text to reduce rate limit
+    n_images = len(absolute_image_urls)
+    if n_images:
+        await asyncio.sleep(0.5)
+        _log.info(
+            "Instagram send_message: recipient_id=%s image_count=%d (from %d requested)",
+            recipient_id[:20] if recipient_id else "",
+            n_images,
+            len(image_urls or []),
+        )
+        sent_count = 0
+        for i, img_url in enumerate(absolute_image_urls):
+            if i > 0 and image_delay_sec > 0:
+                await asyncio.sleep(image_delay_sec)
+            ok = await _send_one_image(img_url)
+            if ok:
+                sent_count += 1
+                mid = results["message_ids"][-1] if results["message_ids"] else None
+                _log.info(
+                    "Instagram image sent idx=%d/%d message_id=%s url=%s",
+                    i + 1,
+                    n_images,
+                    mid,
+                    (img_url[:60] + "..." if len(img_url) > 60 else img_url),
+                )
+            else:
                 _log.warning(
-                    "Instagram images partial send: %d/%d succeeded (check logs above for API errors)",
-                    sent_count,
+                    "Instagram image failed idx=%d/%d url=%s",
+                    i + 1,
                     n_images,
+                    (img_url[:60] + "..." if len(img_url) > 60 else img_url),
                 )
-    
+                if image_delay_after_fail_sec > 0:
+                    await asyncio.sleep(image_delay_after_fail_sec)
+        results["image_message_count"] = sent_count
+        _log.info(
+            "Instagram send_message: image summary sent=%d requested=%d recipient_id=%s",
+            sent_count,
+            n_images,
+            recipient_id[:20] if recipient_id else "",
+        )
+        if sent_count < n_images:
+            _log.warning(
+                "Instagram images partial send: %d/%d succeeded (check logs above for API errors)",
+                sent_count,
+                n_images,
+            )
+
     return results
 
 
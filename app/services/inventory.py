@@ -11,6 +11,8 @@ from sqlalchemy.exc import IntegrityError
 
 from ..models import Item, StockMovement, Product, ImportRow, ImportRun, Order, OrderItem, StockUnit
 from .mapping import find_or_create_variant, resolve_mapping
+from .copurchase import mark_orders_dirty
+from .item_stock import apply_deleted_movements, item_stock_ready, read_all_on_hand, read_on_hand
 from .stock_units import sync_units_after_movement
 from sqlmodel import select as _select
 
@@ -19,6 +21,9 @@ def compute_on_hand_for_items(session: Session, item_ids: Iterable[int]) -> Dict
 	ids = [i for i in item_ids if i is not None]
 	if not ids:
 		return {}
+	if item_stock_ready(session):
+		# Primary-key reads from the item_stock counters
+		return read_on_hand(session, ids)
 	# Use a single SQL aggregation instead of Python-side accumulation
 	qty_expr = func.sum(case((StockMovement.direction == "in", StockMovement.quantity), else_=-StockMovement.quantity))
 	rows = session.exec(
@@ -28,6 +33,8 @@ def compute_on_hand_for_items(session: Session, item_ids: Iterable[int]) -> Dict
 
 
 def get_stock_map(session: Session) -> Dict[int, int]:
+	if item_stock_ready(session):
+		return read_all_on_hand(session)
 	ids = [it for it in session.exec(select(Item.id)).all() if it is not None]
 	return compute_on_hand_for_items(session, [i for i in ids if i is not None])
 
@@ -496,15 +503,14 @@ def recalc_orders_from_mappings(session: Session, *, product_id: Optional[int] =
             continue
 
         # Delete existing "out" stock movements for this order in bulk
-        session.exec(
-            delete(StockMovement).where(
-                (StockMovement.related_order_id == oid) & (StockMovement.direction == "out")
-            )
-        )
+        out_filter = (StockMovement.related_order_id == oid) & (StockMovement.direction == "out")
+        apply_deleted_movements(session, session.exec(select(StockMovement).where(out_filter)).all())
+        session.exec(delete(StockMovement).where(out_filter))
         # Delete existing OrderItem rows for this order in bulk
         session.exec(
             delete(OrderItem).where(OrderItem.order_id == oid)
         )
+        mark_orders_dirty([oid], session=session)
 
         for iid, qty in agg.items():
             session.add(OrderItem(order_id=oid, item_id=iid, quantity=int(qty)))
@@ -0,0 +1,285 @@
+"""
+Materialized per-item stock counters (item_stock).
+
+Every StockMovement insert/delete/update flushed through the ORM adjusts item_stock in
+the same transaction (after_flush hook), so adjust_stock, create_movement, delete_movement
+and the order edit paths stay consistent without touching each call site. Bulk deletes
+must go through apply_deleted_movements first.
+
+Reads use the counters only after a full rebuild has marked them ready
+(system_settings.item_stock_ready); until then callers fall back to aggregating
+stockmovement. rebuild_item_stock() is safe while the app is running: each batch locks
+its counter rows, so concurrent writers either commit before the recount (and are
+included) or block until after it (and apply their delta on top).
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, event, func, inspect as _inspect, text as _text
+from sqlalchemy.orm import Session as _OrmSession
+from sqlmodel import select
+
+from ..db import get_session
+from ..models import Item, ItemStock, StockMovement, SystemSetting
+
+
+log = logging.getLogger("item_stock")
+
+READY_SETTING_KEY = "item_stock_ready"
+
+_ready = False
+_ready_checked_at = 0.0
+
+# deltas[item_id] = [on_hand_delta, sold_delta, last_movement_at]
+_Deltas = Dict[int, List[Any]]
+
+
+def _movement_effect(direction: Optional[str], quantity: Optional[int], related_order_id: Optional[int]) -> Tuple[int, int]:
+	"""(on_hand_delta, sold_delta) contributed by one movement."""
+	qty = int(quantity or 0)
+	signed = qty if direction == "in" else -qty
+	sold = -signed if related_order_id is not None else 0
+	return signed, sold
+
+
+def _accumulate(deltas: _Deltas, item_id: Optional[int], on_hand: int, sold: int, at: Optional[dt.datetime]) -> None:
+	if item_id is None or (on_hand == 0 and sold == 0 and at is None):
+		return
+	d = deltas.setdefault(int(item_id), [0, 0, None])
+	d[0] += on_hand
+	d[1] += sold
+	if at is not None and (d[2] is None or at > d[2]):
+		d[2] = at
+
+
+_UPSERT_SQL = _text(
+	"""
+	INSERT INTO item_stock(item_id, on_hand, reserved, sold_all_time, last_movement_at, updated_at)
+	VALUES (:item_id, :on_hand, 0, :sold, :at, :now)
+	ON DUPLICATE KEY UPDATE
+	  on_hand = on_hand + VALUES(on_hand),
+	  sold_all_time = sold_all_time + VALUES(sold_all_time),
+	  last_movement_at = CASE
+	    WHEN VALUES(last_movement_at) IS NULL THEN last_movement_at
+	    WHEN last_movement_at IS NULL OR VALUES(last_movement_at) > last_movement_at THEN VALUES(last_movement_at)
+	    ELSE last_movement_at
+	  END,
+	  updated_at = VALUES(updated_at)
+	"""
+)
+
+
+def _apply(connection: Any, deltas: _Deltas) -> None:
+	if not deltas:
+		return
+	now = dt.datetime.utcnow()
+	params = [
+		{"item_id": iid, "on_hand": int(d[0]), "sold": int(d[1]), "at": d[2], "now": now}
+		for iid, d in sorted(deltas.items())
+	]
+	# sorted by item_id so concurrent writers lock counter rows in the same order
+	connection.execute(_UPSERT_SQL, params)
+
+
+def apply_deleted_movements(session, movements: Iterable[Any]) -> None:
+	"""
+	Reverse the counters for movements about to be removed with a bulk DELETE
+	(rows need item_id, direction, quantity, related_order_id).
+	"""
+	deltas: _Deltas = {}
+	for mv in movements:
+		on_hand, sold = _movement_effect(mv.direction, mv.quantity, mv.related_order_id)
+		_accumulate(deltas, mv.item_id, -on_hand, -sold, None)
+	_apply(session.connection(), deltas)
+
+
+def _history_value(state: Any, name: str) -> Any:
+	hist = state.attrs[name].history
+	if hist.deleted:
+		return hist.deleted[0]
+	if hist.unchanged:
+		return hist.unchanged[0]
+	return getattr(state.object, name)
+
+
+@event.listens_for(_OrmSession, "after_flush")
+def _item_stock_after_flush(session, flush_context) -> None:
+	deltas: _Deltas = {}
+	for obj in session.new:
+		if isinstance(obj, StockMovement):
+			on_hand, sold = _movement_effect(obj.direction, obj.quantity, obj.related_order_id)
+			_accumulate(deltas, obj.item_id, on_hand, sold, obj.created_at or dt.datetime.utcnow())
+	for obj in session.deleted:
+		if isinstance(obj, StockMovement):
+			state = _inspect(obj)
+			on_hand, sold = _movement_effect(
+				_history_value(state, "direction"),
+				_history_value(state, "quantity"),
+				_history_value(state, "related_order_id"),
+			)
+			_accumulate(deltas, _history_value(state, "item_id"), -on_hand, -sold, None)
+	for obj in session.dirty:
+		if not isinstance(obj, StockMovement):
+			continue
+		state = _inspect(obj)
+		names = ("item_id", "direction", "quantity", "related_order_id")
+		if not any(state.attrs[n].history.has_changes() for n in names):
+			continue
+		old_on_hand, old_sold = _movement_effect(
+			_history_value(state, "direction"),
+			_history_value(state, "quantity"),
+			_history_value(state, "related_order_id"),
+		)
+		_accumulate(deltas, _history_value(state, "item_id"), -old_on_hand, -old_sold, None)
+		new_on_hand, new_sold = _movement_effect(obj.direction, obj.quantity, obj.related_order_id)
+		_accumulate(deltas, obj.item_id, new_on_hand, new_sold, None)
+	if deltas:
+		_apply(session.connection(), deltas)
+
+
+def item_stock_ready(session) -> bool:
+	"""True once a full rebuild has populated the counters (cached; rechecked every 30s until then)."""
+	global _ready, _ready_checked_at
+	if _ready:
+		return True
+	now = time.monotonic()
+	if now - _ready_checked_at < 30:
+		return False
+	_ready_checked_at = now
+	try:
+		row = session.exec(select(SystemSetting).where(SystemSetting.key == READY_SETTING_KEY)).first()
+		_ready = bool(row and str(row.value).strip() == "1")
+	except Exception:
+		_ready = False
+	return _ready
+
+
+def read_on_hand(session, item_ids: Iterable[int]) -> Dict[int, int]:
+	ids = sorted({int(i) for i in item_ids if i is not None})
+	if not ids:
+		return {}
+	rows = session.exec(select(ItemStock.item_id, ItemStock.on_hand).where(ItemStock.item_id.in_(ids))).all()
+	return {int(iid): int(on_hand or 0) for iid, on_hand in rows}
+
+
+def read_all_on_hand(session) -> Dict[int, int]:
+	rows = session.exec(select(ItemStock.item_id, ItemStock.on_hand)).all()
+	return {int(iid): int(on_hand or 0) for iid, on_hand in rows}
+
+
+def _aggregate(session, item_ids: List[int]) -> Dict[int, Tuple[int, int, Optional[dt.datetime]]]:
+	on_hand_expr = func.sum(case((StockMovement.direction == "in", StockMovement.quantity), else_=-StockMovement.quantity))
+	sold_expr = func.sum(
+		case(
+			(StockMovement.related_order_id.is_(None), 0),
+			(StockMovement.direction == "in", -StockMovement.quantity),
+			else_=StockMovement.quantity,
+		)
+	)
+	rows = session.exec(
+		select(StockMovement.item_id, on_hand_expr, sold_expr, func.max(StockMovement.created_at))
+		.where(StockMovement.item_id.in_(item_ids))
+		.group_by(StockMovement.item_id)
+	).all()
+	return {int(iid): (int(oh or 0), int(sold or 0), last_at) for iid, oh, sold, last_at in rows if iid is not None}
+
+
+def _all_item_ids(session) -> List[int]:
+	return sorted(int(i) for i in session.exec(select(Item.id)).all() if i is not None)
+
+
+def check_item_stock(*, batch_size: int = 1000, limit: int = 200) -> Dict[str, Any]:
+	"""Compare counters with a fresh aggregation; returns up to `limit` mismatching items."""
+	with get_session() as session:
+		ids = _all_item_ids(session)
+	mismatches: List[Dict[str, Any]] = []
+	mismatch_count = 0
+	for start in range(0, len(ids), batch_size):
+		batch = ids[start : start + batch_size]
+		with get_session() as session:
+			expected = _aggregate(session, batch)
+			stored = {
+				int(r.item_id): r for r in session.exec(select(ItemStock).where(ItemStock.item_id.in_(batch))).all()
+			}
+		for iid in batch:
+			exp_on_hand, exp_sold, _ = expected.get(iid, (0, 0, None))
+			row = stored.get(iid)
+			got_on_hand = int(row.on_hand) if row else 0
+			got_sold = int(row.sold_all_time) if row else 0
+			if (exp_on_hand, exp_sold) != (got_on_hand, got_sold):
+				mismatch_count += 1
+				if len(mismatches) < limit:
+					mismatches.append(
+						{
+							"item_id": iid,
+							"on_hand": got_on_hand,
+							"expected_on_hand": exp_on_hand,
+							"sold_all_time": got_sold,
+							"expected_sold_all_time": exp_sold,
+							"missing_row": row is None,
+						}
+					)
+	return {"items_checked": len(ids), "mismatch_count": mismatch_count, "mismatches": mismatches}
+
+
+def rebuild_item_stock(item_ids: Optional[Iterable[int]] = None, *, batch_size: int = 500) -> Dict[str, int]:
+	"""
+	Recount counters from stockmovement (all items, or only item_ids). A full rebuild marks
+	the counters ready for reads.
+	"""
+	global _ready
+	full = item_ids is None
+	if full:
+		with get_session() as session:
+			ids = _all_item_ids(session)
+	else:
+		ids = sorted({int(i) for i in item_ids if i is not None})
+	now = dt.datetime.utcnow()
+	updated = 0
+	for start in range(0, len(ids), batch_size):
+		batch = ids[start : start + batch_size]
+		with get_session() as session:
+			session.exec(
+				_text(
+					"INSERT IGNORE INTO item_stock(item_id, on_hand, reserved, sold_all_time, updated_at) VALUES (:item_id, 0, 0, 0, :now)"
+				),
+				params=[{"item_id": iid, "now": now} for iid in batch],
+			)
+		with get_session() as session:
+			# Lock counter rows first: writers touching these items wait for the recount
+			session.exec(select(ItemStock.item_id).where(ItemStock.item_id.in_(batch)).with_for_update()).all()
+			agg = _aggregate(session, batch)
+			session.exec(
+				_text(
+					"""
+					UPDATE item_stock
+					SET on_hand=:on_hand, sold_all_time=:sold, last_movement_at=:at, updated_at=:now
+					WHERE item_id=:item_id
+					"""
+				),
+				params=[
+					{
+						"item_id": iid,
+						"on_hand": agg.get(iid, (0, 0, None))[0],
+						"sold": agg.get(iid, (0, 0, None))[1],
+						"at": agg.get(iid, (0, 0, None))[2],
+						"now": now,
+					}
+					for iid in batch
+				],
+			)
+		updated += len(batch)
+	if full:
+		with get_session() as session:
+			row = session.exec(select(SystemSetting).where(SystemSetting.key == READY_SETTING_KEY)).first()
+			if row is None:
+				row = SystemSetting(key=READY_SETTING_KEY, value="1", description="item_stock counters populated")
+			row.value = "1"
+			row.updated_at = dt.datetime.utcnow()
+			session.add(row)
+		_ready = True
+	return {"items": updated}
@@ -0,0 +1,176 @@
+"""
+HTTP serving helpers for stored media: strong ETags, conditional GET (304), single
+byte-range requests (206/416) and a small in-process LRU of attachment id -> file so
+repeat thumbnail/video requests skip the DB lookup.
+
+URLs that carry the content hash (?v=<sha256> matching the stored checksum) are served
+as immutable for a year; plain URLs get a shorter max-age and revalidate via ETag.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CHUNK = 64 * 1024
+
+# (storage_path, mime, checksum)
+AttachmentFile = Tuple[str, Optional[str], Optional[str]]
+
+
+class AttachmentPathCache:
+	"""Thread-safe LRU of attachment id -> (path, mime, checksum) with a TTL."""
+
+	def __init__(self, max_entries: int = 4096, ttl_seconds: float = 300.0) -> None:
+		self.max_entries = max(1, max_entries)
+		self.ttl = ttl_seconds
+		self._data: "OrderedDict[int, Tuple[float, AttachmentFile]]" = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, attachment_id: int, loader: Callable[[int], Optional[AttachmentFile]]) -> Optional[AttachmentFile]:
+		now = time.monotonic()
+		with self._lock:
+			hit = self._data.get(attachment_id)
+			if hit is not None and now - hit[0] < self.ttl:
+				self._data.move_to_end(attachment_id)
+				self.hits += 1
+				return hit[1]
+			self.misses += 1
+		val = loader(attachment_id)
+		if val is not None:
+			with self._lock:
+				self._data[attachment_id] = (now, val)
+				self._data.move_to_end(attachment_id)
+				while len(self._data) > self.max_entries:
+					self._data.popitem(last=False)
+		return val
+
+	def invalidate(self, attachment_id: int) -> None:
+		with self._lock:
+			self._data.pop(attachment_id, None)
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+def _env_int(name: str, default: int) -> int:
+	try:
+		return int(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+attachment_cache = AttachmentPathCache(
+	max_entries=_env_int("MEDIA_PATH_CACHE_SIZE", 4096),
+	ttl_seconds=float(_env_int("MEDIA_PATH_CACHE_TTL", 300)),
+)
+
+
+def file_etag(path: Path, checksum: Optional[str] = None, variant: str = "") -> str:
+	"""Strong ETag: the stored content hash when known, else size+mtime of the file."""
+	if checksum:
+		return f'"{checksum}{("-" + variant) if variant else ""}"'
+	st = path.stat()
+	return f'"{st.st_size:x}-{st.st_mtime_ns:x}{("-" + variant) if variant else ""}"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+	if not header:
+		return False
+	if header.strip() == "*":
+		return True
+	candidates = [c.strip() for c in header.split(",")]
+	bare = etag[2:] if etag.startswith("W/") else etag
+	return any((c[2:] if c.startswith("W/") else c) == bare for c in candidates)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+	"""
+	Parse a single `bytes=` range into an inclusive (start, end).
+	Returns None when absent or not a single range (serve full), raises ValueError when unsatisfiable.
+	"""
+	if not header:
+		return None
+	m = _RANGE_RE.match(header.strip())
+	if not m:
+		return None
+	first, last = m.group(1), m.group(2)
+	if first == "" and last == "":
+		return None
+	if first == "":
+		length = int(last)
+		if length == 0:
+			raise ValueError("empty suffix range")
+		return max(0, size - length), size - 1
+	start = int(first)
+	end = int(last) if last else size - 1
+	if start >= size or end < start:
+		raise ValueError("unsatisfiable range")
+	return start, min(end, size - 1)
+
+
+def _iter_file(path: Path, start: int, length: int) -> Iterator[bytes]:
+	with path.open("rb") as fh:
+		fh.seek(start)
+		remaining = length
+		while remaining > 0:
+			chunk = fh.read(min(_CHUNK, remaining))
+			if not chunk:
+				break
+			remaining -= len(chunk)
+			yield chunk
+
+
+def serve_file(
+	request: Request,
+	path: Path,
+	media_type: str,
+	*,
+	etag: Optional[str] = None,
+	cache_control: str = "private, max-age=86400",
+	extra_headers: Optional[dict] = None,
+) -> Response:
+	"""FileResponse with ETag / 304 / single-range (206) support."""
+	st = path.stat()
+	size = st.st_size
+	tag = etag or file_etag(path)
+	headers = {"ETag": tag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+	if extra_headers:
+		headers.update(extra_headers)
+	if _etag_matches(request.headers.get("if-none-match"), tag):
+		return Response(status_code=304, headers=headers)
+	range_header = request.headers.get("range")
+	if_range = request.headers.get("if-range")
+	if range_header and (not if_range or if_range.strip() == tag):
+		try:
+			rng = parse_range(range_header, size)
+		except ValueError:
+			return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+		if rng is not None:
+			start, end = rng
+			length = end - start + 1
+			headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(length)})
+			return StreamingResponse(_iter_file(path, start, length), status_code=206, media_type=media_type, headers=headers)
+	return FileResponse(str(path), media_type=media_type, headers=headers, stat_result=st)
+
+
+def attachment_cache_control(request: Request, checksum: Optional[str]) -> str:
+	"""Immutable for hash-versioned URLs (?v=<sha256>), revalidating otherwise."""
+	v = request.query_params.get("v")
+	if v and checksum and v == checksum:
+		return IMMUTABLE_CACHE
+	return "private, max-age=86400"
@@ -0,0 +1,297 @@
+"""
+Content-addressed media storage.
+
+Downloads are streamed to a temp file under MEDIA_ROOT/blobs/.tmp while hashing, then
+moved to MEDIA_ROOT/blobs/<aa>/<bb>/<sha256>.<ext>. A media_blobs row per distinct hash
+carries ref_count (number of attachments pointing at it), so the same product photo
+forwarded into many conversations is stored once. Unreferenced blobs are removed by
+gc_unreferenced_blobs() after a grace period.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import bindparam, text
+
+from ..db import get_session
+
+
+log = logging.getLogger("media.store")
+
+_CHUNK = 64 * 1024
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class MediaTooLarge(Exception):
+	pass
+
+
+def _max_bytes() -> int:
+	try:
+		return int(os.getenv("MEDIA_MAX_BYTES", str(200 * 1024 * 1024)))
+	except Exception:
+		return 200 * 1024 * 1024
+
+
+def get_http_client() -> httpx.AsyncClient:
+	"""Shared AsyncClient for the running loop (connection pooling across attachments)."""
+	global _client, _client_loop
+	loop = asyncio.get_running_loop()
+	if _client is None or _client_loop is not loop or _client.is_closed:
+		try:
+			max_conn = int(os.getenv("MEDIA_HTTP_MAX_CONNECTIONS", "20"))
+		except Exception:
+			max_conn = 20
+		_client = httpx.AsyncClient(
+			limits=httpx.Limits(max_connections=max_conn, max_keepalive_connections=max(1, max_conn // 2)),
+			timeout=httpx.Timeout(60.0, connect=10.0),
+			follow_redirects=True,
+		)
+		_client_loop = loop
+	return _client
+
+
+async def close_http_client() -> None:
+	global _client, _client_loop
+	if _client is not None:
+		try:
+			await _client.aclose()
+		except Exception:
+			pass
+	_client = None
+	_client_loop = None
+
+
+def _roots() -> Tuple[Path, Path]:
+	media_root = Path(os.getenv("MEDIA_ROOT", "data/media")).resolve()
+	thumbs_root = Path(os.getenv("THUMBS_ROOT", "data/thumbs")).resolve()
+	return media_root, thumbs_root
+
+
+def ext_for_mime(mime: Optional[str]) -> str:
+	ext = "bin"
+	if mime:
+		base = mime.split(";", 1)[0].strip()
+		if "/" in base:
+			ext = base.split("/")[-1] or "bin"
+		elif base.startswith("image"):
+			ext = "jpg"
+	if ext == "jpeg":
+		ext = "jpg"
+	return "".join(ch for ch in ext if ch.isalnum())[:10] or "bin"
+
+
+def kind_for_mime(mime: Optional[str]) -> str:
+	if mime and mime.startswith("image"):
+		return "image"
+	if mime and mime.startswith("video"):
+		return "video"
+	if mime and mime.startswith("audio"):
+		return "audio"
+	return "file"
+
+
+def blob_paths(sha256: str, mime: Optional[str]) -> Tuple[Path, Path]:
+	media_root, thumbs_root = _roots()
+	sub = Path("blobs") / sha256[:2] / sha256[2:4]
+	return media_root / sub / f"{sha256}.{ext_for_mime(mime)}", thumbs_root / sub / f"{sha256}_thumb.jpg"
+
+
+async def download_to_temp(url: str, client: Optional[httpx.AsyncClient] = None) -> Tuple[Path, str, int, Optional[str]]:
+	"""Stream url into a temp file; returns (tmp_path, sha256, size, content_type)."""
+	media_root, _ = _roots()
+	tmp_dir = media_root / "blobs" / ".tmp"
+	tmp_dir.mkdir(parents=True, exist_ok=True)
+	client = client or get_http_client()
+	limit = _max_bytes()
+	h = hashlib.sha256()
+	size = 0
+	fd, tmp_name = tempfile.mkstemp(dir=str(tmp_dir), suffix=".part")
+	tmp_path = Path(tmp_name)
+	try:
+		with os.fdopen(fd, "wb") as fh:
+			async with client.stream("GET", url) as r:
+				r.raise_for_status()
+				content_type = r.headers.get("content-type")
+				async for chunk in r.aiter_bytes(_CHUNK):
+					size += len(chunk)
+					if size > limit:
+						raise MediaTooLarge(f"media exceeds {limit} bytes")
+					h.update(chunk)
+					fh.write(chunk)
+	except BaseException:
+		try:
+			tmp_path.unlink()
+		except Exception:
+			pass
+		raise
+	return tmp_path, h.hexdigest(), size, content_type
+
+
+def commit_blob(tmp_path: Path, sha256: str, size: int, mime: Optional[str]) -> Tuple[int, Path, Path, bool]:
+	"""
+	Move a downloaded temp file into place and upsert its media_blobs row.
+	Returns (blob_id, storage_path, thumb_path, created_file).
+
+	The file check runs under the blob row lock, so gc_unreferenced_blobs (which deletes
+	the row before unlinking, under the same key) cannot remove an existing file that this
+	call then relies on.
+	"""
+	final_path, thumb_path = blob_paths(sha256, mime)
+	created = False
+	try:
+		with get_session() as session:
+			session.exec(
+				text(
+					"""
+					INSERT INTO media_blobs(sha256, size_bytes, mime, storage_path, ref_count, created_at, last_ref_at)
+					VALUES (:sha, :size, :mime, :sp, 0, :now, :now)
+					ON DUPLICATE KEY UPDATE last_ref_at = VALUES(last_ref_at)
+					"""
+				).params(sha=sha256, size=int(size), mime=mime, sp=str(final_path), now=dt.datetime.utcnow())
+			)
+			row = session.exec(text("SELECT id FROM media_blobs WHERE sha256=:sha FOR UPDATE").params(sha=sha256)).first()
+			if not final_path.exists():
+				final_path.parent.mkdir(parents=True, exist_ok=True)
+				os.replace(tmp_path, final_path)
+				created = True
+	finally:
+		if not created:
+			try:
+				tmp_path.unlink()
+			except Exception:
+				pass
+	return int(row[0]), final_path, thumb_path, created
+
+
+def set_blob_thumb(blob_id: int, thumb_path: Path) -> None:
+	with get_session() as session:
+		session.exec(
+			text("UPDATE media_blobs SET thumb_path=:tp WHERE id=:id").params(tp=str(thumb_path), id=int(blob_id))
+		)
+
+
+def link_attachment(session: Any, attachment_id: int, blob_id: int, old_blob_id: Optional[int]) -> None:
+	"""Point an attachment at a blob and move the reference count accordingly."""
+	if old_blob_id is not None and int(old_blob_id) == int(blob_id):
+		return
+	session.exec(
+		text(
+			"UPDATE media_blobs SET ref_count = ref_count + 1, last_ref_at = CURRENT_TIMESTAMP WHERE id=:id"
+		).params(id=int(blob_id))
+	)
+	if old_blob_id is not None:
+		release_blobs(session, [int(old_blob_id)])
+
+
+def release_blobs(session: Any, blob_ids: Iterable[int]) -> None:
+	"""Drop one reference per occurrence in blob_ids (files are removed later by GC)."""
+	counts: Dict[int, int] = {}
+	for bid in blob_ids:
+		if bid is not None:
+			counts[int(bid)] = counts.get(int(bid), 0) + 1
+	for bid in sorted(counts):
+		session.exec(
+			text("UPDATE media_blobs SET ref_count = GREATEST(ref_count - :n, 0) WHERE id=:id").params(n=counts[bid], id=bid)
+		)
+
+
+def release_message_attachments(session: Any, message_ids: List[int]) -> None:
+	"""Release blob references of attachments about to be deleted with their messages."""
+	if not message_ids:
+		return
+	rows = session.exec(
+		text("SELECT blob_id FROM attachments WHERE message_id IN :ids AND blob_id IS NOT NULL").bindparams(
+			bindparam("ids", expanding=True)
+		).params(ids=[int(m) for m in message_ids])
+	).all()
+	release_blobs(session, [r[0] for r in rows])
+
+
+def release_all_attachments(session: Any) -> None:
+	"""Release the blob references of every attachment (before a full attachments wipe)."""
+	session.exec(
+		text(
+			"""
+			UPDATE media_blobs b
+			JOIN (SELECT blob_id, COUNT(*) AS n FROM attachments WHERE blob_id IS NOT NULL GROUP BY blob_id) a
+			  ON a.blob_id = b.id
+			SET b.ref_count = GREATEST(b.ref_count - a.n, 0)
+			"""
+		)
+	)
+
+
+def recount_blob_refs() -> int:
+	"""Recompute ref_count from attachments (repairs drift from raw deletes). Returns rows changed."""
+	with get_session() as session:
+		res = session.exec(
+			text(
+				"""
+				UPDATE media_blobs b
+				LEFT JOIN (SELECT blob_id, COUNT(*) AS n FROM attachments WHERE blob_id IS NOT NULL GROUP BY blob_id) a
+				  ON a.blob_id = b.id
+				SET b.ref_count = COALESCE(a.n, 0)
+				WHERE b.ref_count <> COALESCE(a.n, 0)
+				"""
+			)
+		)
+		return int(getattr(res, "rowcount", 0) or 0)
+
+
+def gc_unreferenced_blobs(grace_hours: int = 24, limit: int = 500) -> Dict[str, int]:
+	"""
+	Delete rows + files of blobs with ref_count=0 not referenced for grace_hours. Rows are
+	deleted (and committed) first; each file is unlinked afterwards only while a locking
+	read confirms no commit_blob has re-created the row for that hash meanwhile.
+	"""
+	cutoff = dt.datetime.utcnow() - dt.timedelta(hours=grace_hours)
+	doomed: List[Tuple[str, Any, Any, Any]] = []
+	with get_session() as session:
+		rows = session.exec(
+			text(
+				"""
+				SELECT id, sha256, storage_path, thumb_path, size_bytes FROM media_blobs
+				WHERE ref_count = 0 AND COALESCE(last_ref_at, created_at) < :cutoff
+				ORDER BY id LIMIT :lim
+				"""
+			).params(cutoff=cutoff, lim=int(limit))
+		).all()
+		for bid, sha, sp, tp, size in rows:
+			# re-check under the row lock: an attachment or a new download may have touched it meanwhile
+			still = session.exec(
+				text("SELECT ref_count, COALESCE(last_ref_at, created_at) FROM media_blobs WHERE id=:id FOR UPDATE").params(id=int(bid))
+			).first()
+			if not still or int(still[0] or 0) > 0 or (still[1] is not None and still[1] >= cutoff):
+				continue
+			session.exec(text("DELETE FROM media_blobs WHERE id=:id").params(id=int(bid)))
+			doomed.append((str(sha), sp, tp, size))
+	removed = 0
+	freed = 0
+	for sha, sp, tp, size in doomed:
+		with get_session() as session:
+			# blocks a concurrent commit_blob insert for this hash until the files are gone
+			again = session.exec(text("SELECT id FROM media_blobs WHERE sha256=:sha FOR UPDATE").params(sha=sha)).first()
+			if again is not None:
+				continue
+			for p in (sp, tp):
+				if p:
+					try:
+						Path(p).unlink()
+					except FileNotFoundError:
+						pass
+					except Exception as e:
+						log.warning("blob gc unlink failed path=%s err=%s", p, e)
+		removed += 1
+		freed += int(size or 0)
+	return {"removed": removed, "bytes_freed": freed}
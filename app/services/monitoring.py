@@ -1,5 +1,7 @@
 import os
+import re
 import json
+import bisect
 import socket
 import datetime as dt
 from typing import Any, Dict, List, Optional, Tuple
@@ -59,9 +61,10 @@ def get_worker_statuses() -> List[Dict[str, Any]]:
     r = _get_redis()
     out: List[Dict[str, Any]] = []
     now = _now_ts()
-    for key in r.scan_iter("hb:worker:*"):
+    keys = list(r.scan_iter("hb:worker:*", count=500))
+    values = r.mget(keys) if keys else []
+    for key, data_raw in zip(keys, values):
         try:
-            data_raw = r.get(key)
             if not data_raw:
                 continue
             data = json.loads(data_raw)
@@ -76,35 +79,284 @@ def get_worker_statuses() -> List[Dict[str, Any]]:
     return out
 
 
+# Counters and histograms are rolled up at write time into three levels so a query
+# never has to touch more than a few hashes, whatever the window:
+#   m: one hash per hour   (field = minute), kept METRICS_MINUTE_TTL_DAYS
+#   h: one hash per day    (field = hour),   kept METRICS_HOUR_TTL_DAYS
+#   d: one hash per month  (field = day),    kept METRICS_DAY_TTL_DAYS
+# A window is split into whole days, whole hours and the leftover minutes at both
+# edges (see _window_slots); a 24h window is at most four HMGETs per metric.
+# Histogram fields are "<slot>|<bucket index>", "<slot>|s" (sum) and "<slot>|n" (count).
+# Running totals for the Prometheus endpoint live in metrics:total / metrics:hist:total.
+_LEVELS: Tuple[Tuple[str, str, str, str, int], ...] = (
+    ("m", "%Y%m%d%H", "%M", "METRICS_MINUTE_TTL_DAYS", 8),
+    ("h", "%Y%m%d", "%H", "METRICS_HOUR_TTL_DAYS", 40),
+    ("d", "%Y%m", "%d", "METRICS_DAY_TTL_DAYS", 400),
+)
+_TOTALS_KEY = "metrics:total"
+_HIST_TOTALS_KEY = "metrics:hist:total"
+
+# Latency buckets in milliseconds (upper bounds; the last implicit bucket is +Inf)
+HISTOGRAM_BUCKETS_MS: Tuple[float, ...] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+def _ttl_days(env: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(env, str(default))))
+    except Exception:
+        return default
+
+
+def _level_retention(level: str) -> dt.timedelta:
+    for lv, _c, _s, env, default in _LEVELS:
+        if lv == level:
+            # a container outlives its last write by the TTL; one day of margin
+            return dt.timedelta(days=max(0, _ttl_days(env, default) - 1))
+    return dt.timedelta(0)
+
+
+def _slot_keys(kind: str, name: str, ts: dt.datetime) -> List[Tuple[str, str, int]]:
+    """(hash key, field, ttl seconds) for each rollup level of one timestamp."""
+    out: List[Tuple[str, str, int]] = []
+    for level, container_fmt, slot_fmt, env, default in _LEVELS:
+        key = f"metrics:{kind}:{level}:{name}:{ts.strftime(container_fmt)}"
+        out.append((key, ts.strftime(slot_fmt), _ttl_days(env, default) * 24 * 60 * 60))
+    return out
+
+
+def _window_slots(minutes: int, now: Optional[dt.datetime] = None) -> List[Tuple[str, str, List[str]]]:
+    """
+    Cover the last `minutes` minutes (current minute included) with the coarsest slots
+    available: [(level, container, [slot, ...])]. An edge older than the minute (or hour)
+    retention is widened to the enclosing hour (or day).
+    """
+    end = (now or dt.datetime.utcnow()).replace(second=0, microsecond=0)
+    start = end - dt.timedelta(minutes=max(1, int(minutes)) - 1)
+    if end - start >= _level_retention("m"):
+        start = start.replace(minute=0)
+    if end - start >= _level_retention("h"):
+        start = start.replace(hour=0, minute=0)
+    day = dt.timedelta(days=1)
+    hour = dt.timedelta(hours=1)
+    minute = dt.timedelta(minutes=1)
+    groups: Dict[Tuple[str, str], List[str]] = {}
+    cur = start
+    while cur <= end:
+        if cur.hour == 0 and cur.minute == 0 and cur + day - minute <= end:
+            level, step = "d", day
+        elif cur.minute == 0 and cur + hour - minute <= end:
+            level, step = "h", hour
+        else:
+            level, step = "m", minute
+        _lv, container_fmt, slot_fmt, _env, _default = next(x for x in _LEVELS if x[0] == level)
+        groups.setdefault((level, cur.strftime(container_fmt)), []).append(cur.strftime(slot_fmt))
+        cur += step
+    return [(level, container, slots) for (level, container), slots in groups.items()]
+
+
 def increment_counter(name: str, delta: int = 1) -> None:
     r = _get_redis()
-    now = dt.datetime.utcnow().replace(second=0, microsecond=0)
-    bucket = now.strftime("%Y%m%d%H%M")
-    key = f"metrics:count:{name}:{bucket}"
-    with r.pipeline() as p:
-        p.incrby(key, int(delta))
-        p.expire(key, 7 * 24 * 60 * 60)
+    now = dt.datetime.utcnow()
+    with r.pipeline(transaction=False) as p:
+        for key, field, ttl in _slot_keys("c", name, now):
+            p.hincrby(key, field, int(delta))
+            p.expire(key, ttl)
+        p.hincrby(_TOTALS_KEY, name, int(delta))
         p.execute()
 
 
+def sum_counters_many(names: List[str], minutes: int) -> Dict[str, int]:
+    """Window totals for several counters in one round trip."""
+    if not names:
+        return {}
+    r = _get_redis()
+    plan = _window_slots(minutes)
+    with r.pipeline(transaction=False) as p:
+        for name in names:
+            for level, container, slots in plan:
+                p.hmget(f"metrics:c:{level}:{name}:{container}", slots)
+        results = p.execute()
+    out: Dict[str, int] = {}
+    i = 0
+    for name in names:
+        total = 0
+        for _ in plan:
+            for val in results[i] or []:
+                try:
+                    total += int(val or 0)
+                except Exception:
+                    continue
+            i += 1
+        out[name] = total
+    return out
+
+
 def sum_counters(name: str, minutes: int) -> int:
+    return sum_counters_many([name], minutes).get(name, 0)
+
+
+def _bucket_index(value: float) -> int:
+    return bisect.bisect_left(HISTOGRAM_BUCKETS_MS, float(value))
+
+
+def observe(name: str, value_ms: float) -> None:
+    """Record one latency sample (milliseconds) into the rolled-up histogram `name`."""
+    observe_many([(name, value_ms)])
+
+
+def observe_many(samples: List[Tuple[str, float]]) -> None:
+    """Record several (name, value_ms) samples in one round trip."""
+    if not samples:
+        return
     r = _get_redis()
-    now = dt.datetime.utcnow().replace(second=0, microsecond=0)
-    keys: List[str] = []
-    for i in range(minutes):
-        ts = now - dt.timedelta(minutes=i)
-        bucket = ts.strftime("%Y%m%d%H%M")
-        keys.append(f"metrics:count:{name}:{bucket}")
-    total = 0
-    if not keys:
-        return 0
-    vals = r.mget(keys)
-    for val in vals:
-        try:
-            total += int(val or 0)
-        except Exception:
-            continue
-    return total
+    now = dt.datetime.utcnow()
+    with r.pipeline(transaction=False) as p:
+        for name, value_ms in samples:
+            b = _bucket_index(value_ms)
+            v = float(value_ms)
+            for key, slot, ttl in _slot_keys("h", name, now):
+                p.hincrby(key, f"{slot}|{b}", 1)
+                p.hincrbyfloat(key, f"{slot}|s", v)
+                p.hincrby(key, f"{slot}|n", 1)
+                p.expire(key, ttl)
+            p.hincrby(_HIST_TOTALS_KEY, f"{name}|{b}", 1)
+            p.hincrbyfloat(_HIST_TOTALS_KEY, f"{name}|s", v)
+            p.hincrby(_HIST_TOTALS_KEY, f"{name}|n", 1)
+        p.execute()
+
+
+def safe_observe(name: str, value_ms: float) -> None:
+    try:
+        observe(name, value_ms)
+    except Exception:
+        pass
+
+
+def safe_observe_many(samples: List[Tuple[str, float]]) -> None:
+    try:
+        observe_many(samples)
+    except Exception:
+        pass
+
+
+def histogram_quantile(q: float, buckets: List[int]) -> Optional[float]:
+    """Quantile estimate from per-bucket counts (linear within a bucket, like PromQL)."""
+    total = sum(buckets)
+    if total <= 0:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(buckets):
+        if n and seen + n >= rank:
+            lower = HISTOGRAM_BUCKETS_MS[i - 1] if i > 0 else 0.0
+            if i >= len(HISTOGRAM_BUCKETS_MS):
+                return float(HISTOGRAM_BUCKETS_MS[-1])
+            upper = HISTOGRAM_BUCKETS_MS[i]
+            return round(lower + (upper - lower) * ((rank - seen) / n), 1)
+        seen += n
+    return float(HISTOGRAM_BUCKETS_MS[-1])
+
+
+def histogram_summary_many(names: List[str], minutes: int) -> Dict[str, Dict[str, Any]]:
+    """count/avg/p50/p95/p99 per histogram over the window, one round trip."""
+    if not names:
+        return {}
+    r = _get_redis()
+    plan = _window_slots(minutes)
+    nb = len(HISTOGRAM_BUCKETS_MS) + 1
+    suffixes = [str(b) for b in range(nb)] + ["s", "n"]
+    with r.pipeline(transaction=False) as p:
+        for name in names:
+            for level, container, slots in plan:
+                p.hmget(f"metrics:h:{level}:{name}:{container}", [f"{s}|{x}" for s in slots for x in suffixes])
+        results = p.execute()
+    out: Dict[str, Dict[str, Any]] = {}
+    i = 0
+    for name in names:
+        buckets = [0] * nb
+        total_sum = 0.0
+        count = 0
+        for _ in plan:
+            vals = results[i] or []
+            i += 1
+            for j, val in enumerate(vals):
+                if val is None:
+                    continue
+                x = suffixes[j % len(suffixes)]
+                try:
+                    if x == "s":
+                        total_sum += float(val)
+                    elif x == "n":
+                        count += int(val)
+                    else:
+                        buckets[int(x)] += int(val)
+                except Exception:
+                    continue
+        out[name] = {
+            "count": count,
+            "avg_ms": round(total_sum / count, 1) if count else None,
+            "p50_ms": histogram_quantile(0.50, buckets),
+            "p95_ms": histogram_quantile(0.95, buckets),
+            "p99_ms": histogram_quantile(0.99, buckets),
+        }
+    return out
+
+
+_PROM_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _prom_name(name: str, prefix: str) -> str:
+    return f"{prefix}_{_PROM_NAME.sub('_', name)}".strip("_")
+
+
+def _prom_float(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render_prometheus(prefix: str = "hm") -> str:
+    """Prometheus text exposition (0.0.4) of counter totals, histograms and queue gauges."""
+    r = _get_redis()
+    with r.pipeline(transaction=False) as p:
+        p.hgetall(_TOTALS_KEY)
+        p.hgetall(_HIST_TOTALS_KEY)
+        totals, hist_totals = p.execute()
+    lines: List[str] = []
+    for name in sorted(totals or {}):
+        metric = _prom_name(name, prefix) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {int(float(totals[name] or 0))}")
+
+    hists: Dict[str, Dict[str, str]] = {}
+    for field, val in (hist_totals or {}).items():
+        name, _, part = str(field).rpartition("|")
+        if name:
+            hists.setdefault(name, {})[part] = val
+    for name in sorted(hists):
+        parts = hists[name]
+        metric = _prom_name(name, prefix)
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            cumulative += int(parts.get(str(i)) or 0)
+            lines.append(f'{metric}_bucket{{le="{_prom_float(bound)}"}} {cumulative}')
+        cumulative += int(parts.get(str(len(HISTOGRAM_BUCKETS_MS))) or 0)
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{metric}_sum {_prom_float(float(parts.get('s') or 0))}")
+        lines.append(f"{metric}_count {int(parts.get('n') or 0)}")
+
+    try:
+        queues = get_queue_stats()
+    except Exception:
+        queues = []
+    if queues:
+        lines.append(f"# TYPE {prefix}_queue_depth gauge")
+        for q in queues:
+            lines.append(f'{prefix}_queue_depth{{kind="{q["kind"]}"}} {int(q["depth"] or 0)}')
+        lines.append(f"# TYPE {prefix}_queue_oldest_age_seconds gauge")
+        for q in queues:
+            if q.get("oldest_age_seconds") is not None:
+                lines.append(f'{prefix}_queue_oldest_age_seconds{{kind="{q["kind"]}"}} {int(q["oldest_age_seconds"])}')
+    return "\n".join(lines) + "\n"
 
 
 def queue_enqueue_time_add(kind: str, job_id: int, ts: Optional[float] = None) -> None:
@@ -136,15 +388,23 @@ def get_queue_stats(kinds: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     ks = kinds or discover_queue_kinds()
     out: List[Dict[str, Any]] = []
     now = _now_ts()
-    for kind in ks:
+    try:
+        with r.pipeline(transaction=False) as p:
+            for kind in ks:
+                p.llen(f"jobs:{kind}")
+                p.zrange(f"qtime:{kind}", 0, 0, withscores=True)
+            results = p.execute(raise_on_error=False)
+    except Exception:
+        results = [None, None] * len(ks)
+    for i, kind in enumerate(ks):
+        depth_raw, z = results[2 * i], results[2 * i + 1]
         try:
-            depth = int(r.llen(f"jobs:{kind}"))
+            depth = int(depth_raw)
         except Exception:
             depth = 0
         oldest_age_seconds: Optional[int] = None
         try:
-            z = r.zrange(f"qtime:{kind}", 0, 0, withscores=True)
-            if z:
+            if z and not isinstance(z, Exception):
                 _, score = z[0]
                 oldest_age_seconds = max(0, int(now - float(score)))
         except Exception:
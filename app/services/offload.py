@@ -0,0 +1,226 @@
+"""
+Execution model for blocking work called from async code.
+
+- Plain `def` routes already run in Starlette's threadpool; configure_threadpool() sizes it
+  (APP_THREADPOOL_SIZE) instead of relying on the anyio default of 40.
+- `async def` routes that must await something (form parsing, Graph calls) hand their DB
+  work to run_db(), which uses a dedicated limiter sized to the DB connection pool
+  (DB_THREADPOOL_SIZE, default pool_size + max_overflow) so DB calls queue for a thread
+  instead of piling up on pool checkout.
+- LoopWatchdog detects event-loop stalls: a loop-side heartbeat is checked from a
+  separate thread; when it is late by more than LOOP_BLOCK_WARN_MS the loop thread's
+  current stack and the in-flight routes are logged and kept in a small ring buffer.
+- find_blocking_async_routes() is the static side of the same check (used by tests).
+"""
+from __future__ import annotations
+
+import ast
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import anyio
+import anyio.to_thread
+
+
+log = logging.getLogger("offload")
+
+T = TypeVar("T")
+
+_db_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def _int_env(name: str, default: int) -> int:
+	try:
+		return int(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def _db_threads() -> int:
+	try:
+		from ..db import max_overflow, pool_size
+
+		default = int(pool_size) + int(max_overflow)
+	except Exception:
+		default = 15
+	return max(1, _int_env("DB_THREADPOOL_SIZE", default))
+
+
+def configure_threadpool() -> None:
+	"""Size the default threadpool used by sync routes (call from startup, inside the loop)."""
+	size = _int_env("APP_THREADPOOL_SIZE", 0)
+	if size > 0:
+		try:
+			anyio.to_thread.current_default_thread_limiter().total_tokens = size
+		except Exception as e:
+			log.warning("threadpool resize failed: %s", e)
+
+
+def _limiter() -> anyio.CapacityLimiter:
+	global _db_limiter
+	if _db_limiter is None:
+		_db_limiter = anyio.CapacityLimiter(_db_threads())
+	return _db_limiter
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+	"""Run blocking (DB) work on the dedicated DB thread pool and await its result."""
+	return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=_limiter())
+
+
+class LoopWatchdog:
+	def __init__(self, threshold_ms: int = 200, interval_ms: int = 50, keep: int = 100) -> None:
+		self.threshold = max(1, threshold_ms) / 1000.0
+		self.interval = max(5, interval_ms) / 1000.0
+		self.events: Deque[Dict[str, Any]] = deque(maxlen=keep)
+		self.inflight: Dict[int, Tuple[str, str, float]] = {}
+		self.max_lag_ms = 0
+		self._beat = time.monotonic()
+		self._loop_thread_id: Optional[int] = None
+		self._loop: Optional[asyncio.AbstractEventLoop] = None
+		self._stalled = False
+		self._started = False
+		self.sink: Optional[Callable[[Dict[str, Any]], None]] = None
+
+	async def _heartbeat(self) -> None:
+		self._loop_thread_id = threading.get_ident()
+		while True:
+			self._beat = time.monotonic()
+			await asyncio.sleep(self.interval)
+
+	def _watch(self) -> None:
+		while True:
+			time.sleep(self.interval)
+			if self._loop is not None and self._loop.is_closed():
+				return
+			lag = time.monotonic() - self._beat - self.interval
+			if lag < self.threshold:
+				if self._stalled:
+					self._stalled = False
+				continue
+			lag_ms = int(lag * 1000)
+			if lag_ms > self.max_lag_ms:
+				self.max_lag_ms = lag_ms
+			if self._stalled:
+				# report each stall once, with the stack captured when first seen
+				if self.events:
+					self.events[-1]["ms"] = max(self.events[-1]["ms"], lag_ms)
+				continue
+			self._stalled = True
+			self._record(lag_ms)
+
+	def _record(self, lag_ms: int) -> None:
+		stack = ""
+		try:
+			frame = sys._current_frames().get(self._loop_thread_id or -1)
+			if frame is not None:
+				stack = "".join(traceback.format_stack(frame, limit=12))
+		except Exception:
+			pass
+		now = time.monotonic()
+		routes = [f"{m} {p} ({int((now - t0) * 1000)}ms)" for m, p, t0 in list(self.inflight.values())]
+		entry = {"ts": int(time.time()), "ms": lag_ms, "kind": "loop_block", "routes": routes, "stack": stack}
+		self.events.append(entry)
+		try:
+			log.warning("event loop blocked >=%dms routes=%s\n%s", lag_ms, routes, stack)
+		except Exception:
+			pass
+		if self.sink is not None:
+			try:
+				self.sink(entry)
+			except Exception:
+				pass
+		try:
+			from .monitoring import increment_counter
+
+			increment_counter("loop_blocked", 1)
+		except Exception:
+			pass
+
+	def start(self) -> None:
+		"""Start heartbeat + watcher; must be called from the running event loop."""
+		if self._started:
+			return
+		self._started = True
+		self._loop = asyncio.get_running_loop()
+		self._loop.create_task(self._heartbeat())
+		threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"threshold_ms": int(self.threshold * 1000),
+			"max_lag_ms": self.max_lag_ms,
+			"recent": [{k: v for k, v in e.items() if k != "stack"} for e in list(self.events)[-10:]],
+		}
+
+
+_watchdog: Optional[LoopWatchdog] = None
+
+
+def get_watchdog() -> Optional[LoopWatchdog]:
+	return _watchdog
+
+
+def install_loop_watchdog(sink: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[LoopWatchdog]:
+	"""Create and start the process watchdog (LOOP_WATCHDOG=0 disables)."""
+	global _watchdog
+	if os.getenv("LOOP_WATCHDOG", "1") in ("0", "false", "False"):
+		return None
+	if _watchdog is None:
+		_watchdog = LoopWatchdog(threshold_ms=_int_env("LOOP_BLOCK_WARN_MS", 200))
+		_watchdog.sink = sink
+		_watchdog.start()
+	return _watchdog
+
+
+def get_offload_stats() -> Dict[str, Any]:
+	out: Dict[str, Any] = {"db_threads": _db_threads()}
+	try:
+		lim = _limiter()
+		out["db_threads_busy"] = int(lim.borrowed_tokens)
+	except Exception:
+		pass
+	if _watchdog is not None:
+		out["loop"] = _watchdog.stats()
+	return out
+
+
+_BLOCKING_CALLS = ("get_session",)
+_ROUTE_DECORATORS = ("get", "post", "put", "delete", "patch")
+
+
+def find_blocking_async_routes(path: str) -> List[Tuple[str, int]]:
+	"""
+	Static check: `async def` route handlers in `path` that call get_session() directly
+	(not through run_db / a nested sync function). Returns [(name, lineno)].
+	"""
+	with open(path, "r", encoding="utf-8") as fh:
+		tree = ast.parse(fh.read())
+	found: List[Tuple[str, int]] = []
+	for node in ast.walk(tree):
+		if not isinstance(node, ast.AsyncFunctionDef):
+			continue
+		is_route = any(
+			isinstance(d, ast.Call) and isinstance(d.func, ast.Attribute) and d.func.attr in _ROUTE_DECORATORS
+			for d in node.decorator_list
+		)
+		if not is_route:
+			continue
+		stack: List[ast.AST] = list(node.body)
+		while stack:
+			cur = stack.pop()
+			if isinstance(cur, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+				continue
+			if isinstance(cur, ast.Call) and isinstance(cur.func, ast.Name) and cur.func.id in _BLOCKING_CALLS:
+				found.append((node.name, node.lineno))
+				break
+			stack.extend(ast.iter_child_nodes(cur))
+	return found
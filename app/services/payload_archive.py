@@ -0,0 +1,258 @@
+"""
+Cold storage for raw webhook/Graph payloads.
+
+message.raw_json used to hold the full event JSON inline and was rewritten on every
+delivery/read callback, which kept the hottest table wide and dirty. The payload now
+lives compressed in message_payload (one row per message, keyed by message id) and is
+only read when something actually needs it (load_raw). Status callbacks for messages
+that already exist only replace the archive row, never the message row.
+
+raw_events is compacted the same way: rows older than RAW_EVENTS_COMPACT_AFTER_HOURS get
+their payload moved into payload_z (compressed) and rows older than
+RAW_EVENTS_RETENTION_DAYS are deleted in small batches. compact_raw_events() runs from
+a daemon thread in worker_ingest (one replica at a time) and from
+scripts/compact_payloads.py.
+
+Blobs are self-describing (zstd frame magic or zlib header), so the codec can change
+(PAYLOAD_CODEC=zstd|zlib) without touching old rows.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+
+from ..db import engine
+
+try:
+	import zstandard as _zstd  # optional
+except Exception:
+	_zstd = None  # type: ignore
+
+
+log = logging.getLogger("payload.archive")
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_COMPACT_LOCK_KEY = "raw_events:compact:lock"
+
+_compactor_started = False
+_compactor_lock = threading.Lock()
+
+
+def _codec() -> str:
+	val = (os.getenv("PAYLOAD_CODEC") or "zstd").strip().lower()
+	if val == "zstd" and _zstd is None:
+		return "zlib"
+	return "zstd" if val == "zstd" else "zlib"
+
+
+def compress(raw: str) -> bytes:
+	data = raw.encode("utf-8")
+	if _codec() == "zstd":
+		return _zstd.ZstdCompressor(level=6).compress(data)  # type: ignore[union-attr]
+	return zlib.compress(data, 6)
+
+
+def decompress(blob: Optional[bytes]) -> Optional[str]:
+	if blob is None:
+		return None
+	data = bytes(blob)
+	if data.startswith(_ZSTD_MAGIC):
+		if _zstd is None:
+			raise RuntimeError("zstandard is required to read this payload")
+		return _zstd.ZstdDecompressor().decompress(data).decode("utf-8")
+	return zlib.decompress(data).decode("utf-8")
+
+
+def store_raw(session: Any, message_id: int, raw: Optional[str]) -> None:
+	"""Upsert the archived payload of one message (latest callback wins, as raw_json did)."""
+	if raw is None or not message_id:
+		return
+	session.exec(
+		text(
+			"INSERT INTO message_payload (message_id, raw_z) VALUES (:mid, :z) "
+			"ON DUPLICATE KEY UPDATE raw_z = VALUES(raw_z)"
+		).bindparams(mid=int(message_id), z=compress(raw))
+	)
+
+
+def load_raw(session: Any, message_id: int, inline: Optional[str] = None) -> Optional[str]:
+	"""Payload of a message: archive first, then the legacy inline column."""
+	try:
+		row = session.exec(
+			text("SELECT raw_z FROM message_payload WHERE message_id = :mid").bindparams(mid=int(message_id))
+		).first()
+	except Exception:
+		row = None
+	if row is not None:
+		return decompress(row.raw_z if hasattr(row, "raw_z") else row[0])
+	if inline is not None:
+		return inline
+	row = session.exec(text("SELECT raw_json FROM message WHERE id = :mid").bindparams(mid=int(message_id))).first()
+	return (row.raw_json if hasattr(row, "raw_json") else row[0]) if row else None
+
+
+def load_raw_many(session: Any, message_ids: Iterable[int]) -> Dict[int, str]:
+	"""Batch variant of load_raw (archive + inline fallback) for scans over many messages."""
+	ids = sorted({int(i) for i in message_ids if i})
+	if not ids:
+		return {}
+	out: Dict[int, str] = {}
+	rows = session.exec(
+		text("SELECT message_id, raw_z FROM message_payload WHERE message_id IN :ids").bindparams(
+			bindparam("ids", expanding=True)
+		).params(ids=ids)
+	).all()
+	for r in rows:
+		out[int(r[0])] = decompress(r[1]) or ""
+	missing = [i for i in ids if i not in out]
+	if missing:
+		rows = session.exec(
+			text("SELECT id, raw_json FROM message WHERE id IN :ids AND raw_json IS NOT NULL").bindparams(
+				bindparam("ids", expanding=True)
+			).params(ids=missing)
+		).all()
+		for r in rows:
+			out[int(r[0])] = r[1]
+	return out
+
+
+def load_raw_event_payload(row: Any) -> Optional[str]:
+	"""raw_events row (payload, payload_z) -> JSON text, whichever column holds it."""
+	payload = getattr(row, "payload", None)
+	blob = getattr(row, "payload_z", None)
+	if blob is not None:
+		return decompress(blob)
+	return payload
+
+
+def archive_inline_messages(batch: int = 500, after_id: int = 0) -> Tuple[int, int]:
+	"""
+	Move one batch of legacy message.raw_json values into message_payload and NULL the
+	column. Returns (moved, last_id); last_id == after_id means nothing was left.
+	"""
+	with engine.begin() as conn:
+		rows = conn.execute(
+			text(
+				"SELECT id, raw_json FROM message WHERE id > :after AND raw_json IS NOT NULL "
+				"ORDER BY id LIMIT :n"
+			),
+			{"after": int(after_id), "n": int(batch)},
+		).fetchall()
+		if not rows:
+			return 0, after_id
+		conn.execute(
+			text(
+				"INSERT INTO message_payload (message_id, raw_z) VALUES (:mid, :z) "
+				"ON DUPLICATE KEY UPDATE raw_z = raw_z"
+			),
+			[{"mid": int(r[0]), "z": compress(r[1])} for r in rows],
+		)
+		ids = [int(r[0]) for r in rows]
+		conn.execute(
+			text("UPDATE message SET raw_json = NULL WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+			{"ids": ids},
+		)
+	return len(rows), ids[-1]
+
+
+def _int_env(name: str, default: int) -> int:
+	try:
+		return int(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def compact_raw_events(
+	compact_after_hours: Optional[int] = None,
+	retention_days: Optional[int] = None,
+	batch: int = 500,
+	max_batches: int = 200,
+) -> Dict[str, int]:
+	"""
+	Compress payloads of raw_events older than compact_after_hours into payload_z and
+	delete rows older than retention_days (0 disables either step). Works in short
+	id-ordered batches so it never holds long locks on the webhook insert path.
+	"""
+	if compact_after_hours is None:
+		compact_after_hours = _int_env("RAW_EVENTS_COMPACT_AFTER_HOURS", 24)
+	if retention_days is None:
+		retention_days = _int_env("RAW_EVENTS_RETENTION_DAYS", 30)
+	now = dt.datetime.utcnow()
+	stats = {"compacted": 0, "deleted": 0, "bytes_before": 0, "bytes_after": 0}
+
+	if retention_days > 0:
+		cutoff = now - dt.timedelta(days=retention_days)
+		for _ in range(max_batches):
+			with engine.begin() as conn:
+				res = conn.execute(
+					text("DELETE FROM raw_events WHERE received_at < :cut ORDER BY id LIMIT :n"),
+					{"cut": cutoff, "n": int(batch)},
+				)
+				n = int(res.rowcount or 0)
+			stats["deleted"] += n
+			if n < batch:
+				break
+
+	if compact_after_hours > 0:
+		cutoff = now - dt.timedelta(hours=compact_after_hours)
+		last_id = 0
+		for _ in range(max_batches):
+			with engine.begin() as conn:
+				rows = conn.execute(
+					text(
+						"SELECT id, payload FROM raw_events WHERE id > :after AND received_at < :cut "
+						"AND payload_z IS NULL ORDER BY id LIMIT :n"
+					),
+					{"after": last_id, "cut": cutoff, "n": int(batch)},
+				).fetchall()
+				if not rows:
+					break
+				updates: List[Dict[str, Any]] = []
+				for r in rows:
+					payload = r[1] or ""
+					blob = compress(payload)
+					stats["bytes_before"] += len(payload.encode("utf-8"))
+					stats["bytes_after"] += len(blob)
+					updates.append({"id": int(r[0]), "z": blob})
+				conn.execute(text("UPDATE raw_events SET payload_z = :z, payload = '' WHERE id = :id"), updates)
+				last_id = int(rows[-1][0])
+			stats["compacted"] += len(rows)
+			if len(rows) < batch:
+				break
+	return stats
+
+
+def _compactor_loop() -> None:
+	interval = max(60, _int_env("RAW_EVENTS_COMPACT_INTERVAL_SEC", 3600))
+	while True:
+		try:
+			from .monitoring import _get_redis
+
+			# one replica per interval
+			if _get_redis().set(_COMPACT_LOCK_KEY, str(os.getpid()), nx=True, ex=interval):
+				stats = compact_raw_events()
+				log.info("raw_events compaction %s", stats)
+		except Exception as e:
+			log.warning("raw_events compaction failed: %s", e)
+		time.sleep(interval)
+
+
+def start_compactor_thread() -> bool:
+	"""Start the periodic raw_events compaction once per process (daemon thread)."""
+	global _compactor_started
+	if os.getenv("RAW_EVENTS_COMPACT", "1") in ("0", "false", "False"):
+		return False
+	with _compactor_lock:
+		if _compactor_started:
+			return False
+		t = threading.Thread(target=_compactor_loop, name="raw-events-compactor", daemon=True)
+		t.start()
+		_compactor_started = True
+	return True
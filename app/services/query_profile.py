@@ -0,0 +1,320 @@
+"""
+Per-request / per-job SQL profiling.
+
+install(engine) hooks before/after_cursor_execute. While a profile is active (the HTTP
+timing middleware opens one per request, workers open one per job) every statement is
+timed and grouped by its normalized shape (literals and IN lists folded), giving:
+
+- statement count and total DB time of the request/job,
+- the top shapes by time,
+- N+1 suspects: one shape executed more than QUERY_N1_THRESHOLD times.
+
+Web requests: the summary is attached to the slowlog entry and folded into per-route
+totals (route_totals) shown by /admin/slowlog. Worker jobs: slow or N+1 jobs are pushed
+to a short Redis list (slowlog:jobs) plus per-kind totals so the web process can show
+them too. With no profile active the hooks cost one contextvar lookup per statement.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+log = logging.getLogger("query.profile")
+
+_JOBS_KEY = "slowlog:jobs"
+_JOB_TOTALS_KEY = "slowlog:job_totals"
+_ROUTES_MAX = 300
+
+_current: contextvars.ContextVar[Optional["QueryStats"]] = contextvars.ContextVar("query_stats", default=None)
+_installed: "set[int]" = set()
+
+_routes_lock = threading.Lock()
+route_totals: Dict[str, Dict[str, float]] = {}
+
+
+def _int_env(name: str, default: int) -> int:
+	try:
+		return int(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def enabled() -> bool:
+	return os.getenv("QUERY_PROFILE", "1") not in ("0", "false", "False")
+
+
+def n1_threshold() -> int:
+	return max(2, _int_env("QUERY_N1_THRESHOLD", 10))
+
+
+_RE_WS = re.compile(r"\s+")
+_RE_STR = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_RE_NUM = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+_RE_IN = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_RE_VALUES = re.compile(r"(\bVALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+
+
+def normalize_statement(sql: str, limit: int = 300) -> str:
+	"""Shape of a statement: literals/params -> ?, IN lists and multi-row VALUES folded."""
+	s = _RE_WS.sub(" ", str(sql or "")).strip()
+	s = _RE_STR.sub("?", s)
+	s = _RE_PARAM.sub("?", s)
+	s = _RE_NUM.sub("?", s)
+	s = _RE_IN.sub("IN (...)", s)
+	s = _RE_VALUES.sub(r"\1, ...", s)
+	return s[:limit]
+
+
+class QueryStats:
+	__slots__ = ("label", "count", "db_ms", "shapes", "started")
+
+	def __init__(self, label: str = "") -> None:
+		self.label = label
+		self.count = 0
+		self.db_ms = 0.0
+		# shape -> [count, total ms]
+		self.shapes: Dict[str, List[float]] = {}
+		self.started = time.perf_counter()
+
+	def add(self, statement: str, ms: float) -> None:
+		self.count += 1
+		self.db_ms += ms
+		shape = normalize_statement(statement)
+		entry = self.shapes.get(shape)
+		if entry is None:
+			self.shapes[shape] = [1, ms]
+		else:
+			entry[0] += 1
+			entry[1] += ms
+
+	def n_plus_one(self, threshold: Optional[int] = None) -> List[Dict[str, Any]]:
+		n = threshold or n1_threshold()
+		out = [
+			{"sql": shape, "count": int(c), "ms": round(ms, 1)}
+			for shape, (c, ms) in self.shapes.items()
+			if c > n
+		]
+		out.sort(key=lambda d: d["count"], reverse=True)
+		return out
+
+	def summary(self, top: int = 5) -> Dict[str, Any]:
+		ranked = sorted(self.shapes.items(), key=lambda kv: kv[1][1], reverse=True)[:top]
+		return {
+			"queries": self.count,
+			"db_ms": round(self.db_ms, 1),
+			"shapes": len(self.shapes),
+			"top": [{"sql": shape, "count": int(c), "ms": round(ms, 1)} for shape, (c, ms) in ranked],
+			"n_plus_one": self.n_plus_one(),
+		}
+
+
+def current() -> Optional[QueryStats]:
+	return _current.get()
+
+
+@contextmanager
+def profile(label: str = "") -> Iterator[QueryStats]:
+	"""Collect statements executed in this context (threads started via anyio/run_db inherit it)."""
+	stats = QueryStats(label)
+	token = _current.set(stats)
+	try:
+		yield stats
+	finally:
+		_current.reset(token)
+
+
+def install(engine: Any) -> None:
+	if id(engine) in _installed or not enabled():
+		return
+	from sqlalchemy import event as _sa_event
+
+	def _before(conn, cursor, statement, parameters, context, executemany):  # noqa: ANN001
+		if _current.get() is not None:
+			conn.info.setdefault("_qp_t0", []).append(time.perf_counter())
+
+	def _after(conn, cursor, statement, parameters, context, executemany):  # noqa: ANN001
+		stats = _current.get()
+		if stats is None:
+			return
+		stack = conn.info.get("_qp_t0")
+		if not stack:
+			return
+		stats.add(statement, (time.perf_counter() - stack.pop()) * 1000.0)
+
+	def _error(exception_context):  # noqa: ANN001
+		conn = getattr(exception_context, "connection", None)
+		stack = conn.info.get("_qp_t0") if conn is not None else None
+		if stack:
+			stack.pop()
+
+	_sa_event.listen(engine, "before_cursor_execute", _before)
+	_sa_event.listen(engine, "after_cursor_execute", _after)
+	_sa_event.listen(engine, "handle_error", _error)
+	_installed.add(id(engine))
+
+
+def record_route(route: str, stats: QueryStats, wall_ms: float) -> None:
+	"""Fold one request into the in-process per-route totals."""
+	flagged = 1 if stats.n_plus_one() else 0
+	with _routes_lock:
+		agg = route_totals.get(route)
+		if agg is None:
+			if len(route_totals) >= _ROUTES_MAX:
+				# drop the cheapest route to stay bounded
+				cheapest = min(route_totals, key=lambda k: route_totals[k]["db_ms"])
+				route_totals.pop(cheapest, None)
+			agg = route_totals[route] = {"requests": 0, "queries": 0, "db_ms": 0.0, "wall_ms": 0.0, "max_queries": 0, "n_plus_one": 0}
+		agg["requests"] += 1
+		agg["queries"] += stats.count
+		agg["db_ms"] += stats.db_ms
+		agg["wall_ms"] += wall_ms
+		agg["max_queries"] = max(agg["max_queries"], stats.count)
+		agg["n_plus_one"] += flagged
+
+
+def top_routes(sort: str = "db_ms", limit: int = 50) -> List[Dict[str, Any]]:
+	key = sort if sort in ("db_ms", "queries", "requests", "max_queries", "n_plus_one", "wall_ms") else "db_ms"
+	with _routes_lock:
+		items = [(r, dict(v)) for r, v in route_totals.items()]
+	out = []
+	for route, v in items:
+		n = max(1, int(v["requests"]))
+		out.append(
+			{
+				"route": route,
+				"requests": int(v["requests"]),
+				"queries": int(v["queries"]),
+				"db_ms": round(v["db_ms"], 1),
+				"avg_queries": round(v["queries"] / n, 1),
+				"avg_db_ms": round(v["db_ms"] / n, 1),
+				"avg_wall_ms": round(v["wall_ms"] / n, 1),
+				"db_share": round(v["db_ms"] / v["wall_ms"], 2) if v["wall_ms"] else None,
+				"max_queries": int(v["max_queries"]),
+				"n_plus_one": int(v["n_plus_one"]),
+			}
+		)
+	out.sort(key=lambda d: d[key], reverse=True)
+	return out[: max(1, int(limit))]
+
+
+def reset_routes() -> None:
+	with _routes_lock:
+		route_totals.clear()
+
+
+@contextmanager
+def job_profile(kind: str) -> Iterator[QueryStats]:
+	"""Worker-side profile of one job; slow or N+1 jobs are reported to Redis on exit."""
+	with profile(f"job:{kind}") as stats:
+		try:
+			yield stats
+		finally:
+			_finish(kind, stats)
+
+
+_local = threading.local()
+
+
+def start_job(kind: str) -> None:
+	"""Loop-friendly job_profile: profile until finish_job() or the next start_job()."""
+	finish_job()
+	if not enabled():
+		return
+	stats = QueryStats(f"job:{kind}")
+	_local.job = (kind, stats, _current.set(stats))
+
+
+def finish_job() -> None:
+	job = getattr(_local, "job", None)
+	if job is None:
+		return
+	_local.job = None
+	kind, stats, token = job
+	try:
+		_current.reset(token)
+	except Exception:
+		_current.set(None)
+	_finish(kind, stats)
+
+
+def _finish(kind: str, stats: QueryStats) -> None:
+	if not stats.count:
+		return
+	wall_ms = (time.perf_counter() - stats.started) * 1000.0
+	try:
+		record_job(kind, stats, wall_ms)
+	except Exception as e:
+		log.debug("job profile record failed: %s", e)
+
+
+def record_job(kind: str, stats: QueryStats, wall_ms: float) -> None:
+	from .monitoring import _get_redis
+
+	r = _get_redis()
+	summary = stats.summary()
+	slow = wall_ms >= _int_env("JOB_SLOW_MS", 2000) or summary["db_ms"] >= _int_env("JOB_SLOW_DB_MS", 1000)
+	key = str(kind)
+	with r.pipeline(transaction=False) as p:
+		p.hincrby(_JOB_TOTALS_KEY, f"{key}|jobs", 1)
+		p.hincrby(_JOB_TOTALS_KEY, f"{key}|queries", int(stats.count))
+		p.hincrbyfloat(_JOB_TOTALS_KEY, f"{key}|db_ms", round(stats.db_ms, 1))
+		p.hincrbyfloat(_JOB_TOTALS_KEY, f"{key}|wall_ms", round(wall_ms, 1))
+		if summary["n_plus_one"]:
+			p.hincrby(_JOB_TOTALS_KEY, f"{key}|n_plus_one", 1)
+		if slow or summary["n_plus_one"]:
+			entry = {"ts": int(time.time()), "kind": kind, "ms": int(wall_ms), "pid": os.getpid(), "db": summary}
+			p.lpush(_JOBS_KEY, json.dumps(entry, ensure_ascii=False))
+			p.ltrim(_JOBS_KEY, 0, max(10, _int_env("SLOWLOG_JOBS_SIZE", 200)) - 1)
+		p.execute()
+
+
+def recent_jobs(limit: int = 50) -> List[Dict[str, Any]]:
+	from .monitoring import _get_redis
+
+	out: List[Dict[str, Any]] = []
+	for raw in _get_redis().lrange(_JOBS_KEY, 0, max(1, int(limit)) - 1) or []:
+		try:
+			out.append(json.loads(raw))
+		except Exception:
+			continue
+	return out
+
+
+def job_totals() -> List[Dict[str, Any]]:
+	from .monitoring import _get_redis
+
+	kinds: Dict[str, Dict[str, float]] = {}
+	for field, val in (_get_redis().hgetall(_JOB_TOTALS_KEY) or {}).items():
+		kind, _, metric = str(field).rpartition("|")
+		try:
+			kinds.setdefault(kind, {})[metric] = float(val)
+		except Exception:
+			continue
+	out = []
+	for kind, v in kinds.items():
+		n = max(1.0, v.get("jobs", 0.0))
+		out.append(
+			{
+				"kind": kind,
+				"jobs": int(v.get("jobs", 0)),
+				"avg_queries": round(v.get("queries", 0.0) / n, 1),
+				"avg_db_ms": round(v.get("db_ms", 0.0) / n, 1),
+				"avg_wall_ms": round(v.get("wall_ms", 0.0) / n, 1),
+				"n_plus_one": int(v.get("n_plus_one", 0)),
+			}
+		)
+	out.sort(key=lambda d: d["avg_db_ms"] * d["jobs"], reverse=True)
+	return out
+
+
+def server_timing(stats: QueryStats) -> Tuple[str, str]:
+	return ("Server-Timing", f'db;dur={stats.db_ms:.1f};desc="{stats.count} queries"')
@@ -1,16 +1,17 @@
 import os
 import json
 import datetime as dt
-from typing import Any, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import time
 
 from redis import Redis
 from redis.exceptions import TimeoutError as RedisTimeoutError, ConnectionError as RedisConnectionError
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from sqlalchemy.exc import OperationalError
 
 from ..db import get_session
 from .monitoring import queue_enqueue_time_add, queue_enqueue_time_remove
+from . import tracing
 
 
 _redis_client: Optional[Redis] = None
@@ -98,7 +99,8 @@ def enqueue(kind: str, key: str, payload: Optional[dict] = None, max_attempts: i
 			job_id = _ensure_job(kind=kind, key=key, payload=payload, max_attempts=max_attempts)
 			msg = json.dumps({"id": job_id, "kind": kind, "key": key})
 			try:
-				_get_redis().lpush(f"jobs:{kind}", msg)
+				with tracing.span("redis", op="lpush", queue=kind):
+					_get_redis().lpush(f"jobs:{kind}", msg)
 			except (RedisTimeoutError, RedisConnectionError) as re:
 				raise RuntimeError(f"queue unavailable: {re}")
 			try:
@@ -121,6 +123,58 @@ def enqueue(kind: str, key: str, payload: Optional[dict] = None, max_attempts: i
 	raise RuntimeError("enqueue failed: unknown error")
 
 
+def enqueue_many(kind: str, jobs: List[Tuple[str, Optional[dict]]], max_attempts: int = 8) -> List[int]:
+	"""
+	Bulk variant of enqueue: one multi-row INSERT for the jobs rows, one id lookup and one
+	Redis pipeline for the pushes. jobs is a list of (key, payload); duplicate keys collapse.
+	"""
+	uniq: Dict[str, Optional[dict]] = {}
+	for key, payload in jobs:
+		uniq.setdefault(str(key), payload)
+	if not uniq:
+		return []
+	keys = list(uniq.keys())
+	with get_session() as session:
+		session.exec(
+			text(
+				"""
+				INSERT INTO `jobs`(`kind`, `key`, `run_after`, `attempts`, `max_attempts`, `payload`)
+				VALUES (:kind, :key, CURRENT_TIMESTAMP, 0, :max_attempts, :payload)
+				ON DUPLICATE KEY UPDATE id = id
+				"""
+			),
+			params=[
+				{"kind": kind, "key": k, "max_attempts": max_attempts, "payload": json.dumps(uniq[k] or {})}
+				for k in keys
+			],
+		)
+		rows = session.exec(
+			text("SELECT `id`, `key` FROM `jobs` WHERE `kind`=:kind AND `key` IN :keys").bindparams(
+				bindparam("keys", expanding=True)
+			).params(kind=kind, keys=keys)
+		).all()
+	ids_by_key = {str(r[1]): int(r[0]) for r in rows}
+	job_ids = [ids_by_key[k] for k in keys if k in ids_by_key]
+	if not job_ids:
+		return []
+	try:
+		r = _get_redis()
+		with r.pipeline() as p:
+			for k in keys:
+				if k in ids_by_key:
+					p.lpush(f"jobs:{kind}", json.dumps({"id": ids_by_key[k], "kind": kind, "key": k}))
+			p.execute()
+	except (RedisTimeoutError, RedisConnectionError) as re:
+		raise RuntimeError(f"queue unavailable: {re}")
+	try:
+		now = time.time()
+		for jid in job_ids:
+			queue_enqueue_time_add(kind, jid, now)
+	except Exception:
+		pass
+	return job_ids
+
+
 def delete_job(job_id: int) -> None:
 	with get_session() as session:
 		session.exec(text("DELETE FROM jobs WHERE id = :id").params(id=job_id))
@@ -1,24 +1,21 @@
 import datetime as dt
-from sqlalchemy import text
+from sqlalchemy import or_, text
+from sqlmodel import select
 
 from ..db import get_session
+from ..models import IGUser
+from .batching import keyset_batches
 from .queue import enqueue
 
 
-def enqueue_stale_users(hours: int = 48) -> int:
+def enqueue_stale_users(hours: int = 48, batch_size: int = 1000) -> int:
 	cut = dt.datetime.utcnow() - dt.timedelta(hours=hours)
 	count = 0
-	with get_session() as session:
-		rows = session.exec(
-			text(
-				"""
-				SELECT ig_user_id FROM ig_users
-				WHERE fetched_at IS NULL OR fetched_at < :cut
-				"""
-			)
-		).params(cut=cut).all()
+	# keyset pages of ids instead of materializing every stale user at once
+	stmt = select(IGUser.id, IGUser.ig_user_id).where(or_(IGUser.fetched_at.is_(None), IGUser.fetched_at < cut))
+	for rows in keyset_batches(stmt, IGUser.id, batch_size=batch_size):
 		for r in rows:
-			uid = r.ig_user_id if hasattr(r, "ig_user_id") else r[0]
+			uid = r.ig_user_id
 			enqueue("enrich_user", key=str(uid), payload={"ig_user_id": str(uid)})
 			count += 1
 	return count
@@ -1,12 +1,170 @@
 from __future__ import annotations
-from typing import Optional
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import json
+import math
+import os
+import threading
+import time
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session as _OrmSession
 from sqlmodel import Session, select
 
 from ..models import ShippingCompanyRate
 
 
+DEFAULT_BASE_FEE = 89.0
+
+
+class RateTable:
+	"""Compiled rate table of one company: sorted tier thresholds + bisect lookup.
+	
+	tiers: [{"max": 500, "fee": 17.81}, ..., {"max": None, "fee_percent": 1.5}]
+	An amount falls into the first tier whose max is >= amount (max None = no limit);
+	no matching tier means base fee only. compiled=False (missing/invalid rates_json or a
+	tier that does not compile) keeps the legacy behaviour: IBAN uses this company's base
+	fee, everything else the default Sürat table.
+	"""
+	__slots__ = ("company_code", "base_fee", "thresholds", "fixed", "percent", "compiled")
+
+	def __init__(self, company_code: str, base_fee: float, tiers: Optional[Sequence[dict]]) -> None:
+		self.company_code = company_code
+		self.base_fee = float(base_fee)
+		self.thresholds: List[float] = []
+		self.fixed: List[float] = []
+		# fraction of the amount (fee_percent / 100) or None for fixed tiers
+		self.percent: List[Optional[float]] = []
+		self.compiled = tiers is not None
+		rows = []
+		for i, tier in enumerate(tiers or []):
+			max_val = tier.get("max")
+			limit = math.inf if max_val is None else float(max_val)
+			fee = tier.get("fee")
+			fee_percent = tier.get("fee_percent")
+			rows.append((limit, i, float(fee) if fee is not None else 0.0, fee_percent / 100.0 if fee_percent is not None else None))
+		# stable on equal limits: the earlier tier wins, as in a linear scan
+		rows.sort(key=lambda r: (r[0], r[1]))
+		for limit, _i, fee, pct in rows:
+			if self.thresholds and limit == self.thresholds[-1]:
+				continue
+			self.thresholds.append(limit)
+			self.fixed.append(fee)
+			self.percent.append(pct)
+
+	@classmethod
+	def from_row(cls, rate: ShippingCompanyRate) -> "RateTable":
+		tiers = None
+		if rate.rates_json:
+			try:
+				parsed = json.loads(rate.rates_json)
+				if isinstance(parsed, list) and all(isinstance(t, dict) for t in parsed):
+					tiers = parsed
+			except Exception:
+				tiers = None
+		base_fee = float(rate.base_fee or DEFAULT_BASE_FEE)
+		try:
+			return cls(rate.company_code, base_fee, tiers)
+		except Exception:
+			# a tier that does not compile (e.g. a string fee_percent) falls back like invalid JSON
+			return cls(rate.company_code, base_fee, None)
+
+	def fee(self, amount: float, paid_by_bank_transfer: bool = False) -> float:
+		if paid_by_bank_transfer:
+			return round(self.base_fee, 2)
+		if not self.compiled:
+			return DEFAULT_RATES.fee(amount)
+		a = float(amount or 0.0)
+		# Zero or negative totals still incur base fee only
+		if a <= 0:
+			return round(self.base_fee, 2)
+		idx = bisect_left(self.thresholds, a)
+		if idx >= len(self.thresholds):
+			return round(self.base_fee, 2)
+		pct = self.percent[idx]
+		frac = round(a * pct, 2) if pct is not None else self.fixed[idx]
+		return round(self.base_fee + frac, 2)
+
+
+# Default Sürat Kargo rates (same as the old MNG rates)
+DEFAULT_RATES = RateTable(
+	"surat",
+	DEFAULT_BASE_FEE,
+	[
+		{"max": 500, "fee": 17.81},
+		{"max": 1000, "fee": 31.46},
+		{"max": 2000, "fee": 58.76},
+		{"max": 3000, "fee": 86.06},
+		{"max": 4000, "fee": 113.36},
+		{"max": 5000, "fee": 140.66},
+		{"max": None, "fee_percent": 1.5},
+	],
+)
+
+
+_tables_lock = threading.Lock()
+_tables: Optional[Dict[str, RateTable]] = None
+_tables_loaded_at = 0.0
+# bumped by invalidate_rate_tables; a load that raced an invalidation is not cached
+_tables_generation = 0
+
+
+def _tables_ttl() -> float:
+	# other processes only see rate edits after this many seconds
+	try:
+		return float(os.getenv("SHIPPING_RATES_TTL", "60"))
+	except Exception:
+		return 60.0
+
+
+def get_rate_tables(session: Session) -> Dict[str, RateTable]:
+	"""Active companies' compiled tables, cached in-process (one query per TTL / edit)."""
+	global _tables, _tables_loaded_at
+	now = time.monotonic()
+	tables = _tables
+	if tables is not None and now - _tables_loaded_at < _tables_ttl():
+		return tables
+	generation = _tables_generation
+	rows = session.exec(select(ShippingCompanyRate).where(ShippingCompanyRate.is_active == True)).all()
+	tables = {}
+	for rate in rows:
+		if rate.company_code and rate.company_code not in tables:
+			tables[rate.company_code] = RateTable.from_row(rate)
+	with _tables_lock:
+		# an edit committed while we were loading: serve these once, do not cache them
+		if generation == _tables_generation:
+			_tables = tables
+			_tables_loaded_at = now
+	return tables
+
+
+def invalidate_rate_tables() -> None:
+	global _tables, _tables_generation
+	with _tables_lock:
+		_tables = None
+		_tables_generation += 1
+
+
+@event.listens_for(_OrmSession, "after_flush")
+def _shipping_rates_after_flush(session, flush_context) -> None:
+	for obj in (*session.new, *session.dirty, *session.deleted):
+		if isinstance(obj, ShippingCompanyRate):
+			session.info["shipping_rates_changed"] = True
+			return
+
+
+@event.listens_for(_OrmSession, "after_commit")
+def _shipping_rates_after_commit(session) -> None:
+	# drop the cache only once the edit is visible to the next reader
+	if session.info.pop("shipping_rates_changed", False):
+		invalidate_rate_tables()
+
+
+@event.listens_for(_OrmSession, "after_rollback")
+def _shipping_rates_after_rollback(session) -> None:
+	session.info.pop("shipping_rates_changed", None)
+
+
 def _compute_shipping_fee_mng(amount: float) -> float:
 	"""Compute MNG shipping fee (default/legacy rates).
 	
@@ -23,26 +181,7 @@ def _compute_shipping_fee_mng(amount: float) -> float:
 
 	Returns total rounded to 2 decimals.
 	"""
-	base = 89.0
-	a = float(amount or 0.0)
-	# Zero or negative totals still incur base fee only
-	if a <= 0:
-		return round(base, 2)
-	if a <= 500:
-		frac = 17.81
-	elif a <= 1000:
-		frac = 31.46
-	elif a <= 2000:
-		frac = 58.76
-	elif a <= 3000:
-		frac = 86.06
-	elif a <= 4000:
-		frac = 113.36
-	elif a <= 5000:
-		frac = 140.66
-	else:
-		frac = round(a * 0.015, 2)
-	return round(base + frac, 2)
+	return DEFAULT_RATES.fee(amount)
 
 
 def compute_shipping_fee(
@@ -62,63 +201,28 @@ def compute_shipping_fee(
 	Returns:
 		Total shipping fee rounded to 2 decimals.
 	"""
-	a = float(amount or 0.0)
-	
-	# IBAN ödemelerinde sadece base fee (kargo firmasına göre değişebilir)
-	if paid_by_bank_transfer:
-		if company_code and session:
-			# Kargo firmasının base fee'sini kullan
-			rate = session.exec(
-				select(ShippingCompanyRate)
-				.where(ShippingCompanyRate.company_code == company_code)
-				.where(ShippingCompanyRate.is_active == True)
-			).first()
-			if rate:
-				return round(float(rate.base_fee or 89.0), 2)
-		# Default Sürat Kargo base
-		return 89.0
-	
-	# Company-specific rates
-	if company_code and session:
-		rate = session.exec(
-			select(ShippingCompanyRate)
-			.where(ShippingCompanyRate.company_code == company_code)
-			.where(ShippingCompanyRate.is_active == True)
-		).first()
-		
-		if rate and rate.rates_json:
-			try:
-				rates = json.loads(rate.rates_json)
-				base = float(rate.base_fee or 89.0)
-				
-				# Zero or negative totals still incur base fee only
-				if a <= 0:
-					return round(base, 2)
-				
-				# Find matching rate tier
-				for tier in rates:
-					max_val = tier.get("max")
-					fee = tier.get("fee")
-					fee_percent = tier.get("fee_percent")
-					
-					if max_val is None or a <= max_val:
-						if fee_percent is not None:
-							# Percentage-based fee
-							frac = round(a * (fee_percent / 100.0), 2)
-						elif fee is not None:
-							# Fixed fee
-							frac = float(fee)
-						else:
-							frac = 0.0
-						return round(base + frac, 2)
-				
-				# Fallback: if no tier matches, use base only
-				return round(base, 2)
-			except Exception:
-				# JSON parse error or invalid structure, fall back to Sürat
-				pass
-	
-	# Default Sürat Kargo rates (backward compatibility - same rates as old MNG)
-	return _compute_shipping_fee_mng(a)
+	return compute_shipping_fees([(amount, company_code, paid_by_bank_transfer)], session=session if company_code else None)[0]
 
 
+def compute_shipping_fees(
+	items: Iterable[Tuple[float, Optional[str], bool]],
+	session: Optional[Session] = None,
+) -> List[float]:
+	"""Batch compute_shipping_fee over (amount, company_code, paid_by_bank_transfer) tuples.
+	
+	Rate tables are resolved once (cached), so any number of orders is a single pass
+	without DB round-trips. Without a session the default Sürat rates apply, as in
+	compute_shipping_fee.
+	"""
+	tables = get_rate_tables(session) if session is not None else {}
+	out: List[float] = []
+	for amount, company_code, iban in items:
+		table = tables.get(company_code) if company_code else None
+		if table is not None:
+			out.append(table.fee(amount, bool(iban)))
+		elif iban:
+			# IBAN ödemelerinde sadece base fee (default Sürat Kargo)
+			out.append(DEFAULT_BASE_FEE)
+		else:
+			out.append(DEFAULT_RATES.fee(amount))
+	return out
@@ -0,0 +1,267 @@
+"""
+Coalescing IG user enrichment.
+
+Ingest no longer calls Graph inline for unknown senders: mark_needs_enrichment() adds the
+id to the Redis set `enrich:users:dirty` (SADD, so repeats are free) and returns. The
+batcher thread in worker_enrich wakes every ENRICH_BATCH_WINDOW_MS, pops up to
+ENRICH_BATCH_MAX ids, drops ids that are fresh in ig_users, blocked by a permission
+error, or in the in-memory negative cache, resolves the rest with one Graph batch request
+and writes all results with a single multi-row upsert.
+"""
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from sqlalchemy import bindparam, text
+
+from ..db import get_session
+
+
+log = logging.getLogger("enrich.batch")
+
+DIRTY_KEY = "enrich:users:dirty"
+
+_negative: Dict[str, float] = {}
+_negative_lock = threading.Lock()
+_batcher_started = False
+_batcher_lock = threading.Lock()
+
+
+def _int_env(name: str, default: int) -> int:
+	try:
+		return int(os.getenv(name, str(default)))
+	except Exception:
+		return default
+
+
+def mark_needs_enrichment(ig_user_ids: Iterable[str]) -> int:
+	"""Record ids for the batcher. Returns how many were newly added (0 when Redis is down)."""
+	ids = [str(u) for u in ig_user_ids if u]
+	if not ids:
+		return 0
+	try:
+		from .monitoring import _get_redis
+
+		return int(_get_redis().sadd(DIRTY_KEY, *ids) or 0)
+	except Exception as e:
+		# reconcile re-enqueues users still missing a username, nothing is lost
+		log.debug("mark_needs_enrichment failed ids=%s err=%s", ids[:3], e)
+		return 0
+
+
+def _negative_ttl() -> int:
+	return _int_env("ENRICH_NEGATIVE_TTL_SEC", 900)
+
+
+def note_failed(ig_user_ids: Iterable[str]) -> None:
+	until = time.monotonic() + _negative_ttl()
+	with _negative_lock:
+		for uid in ig_user_ids:
+			_negative[str(uid)] = until
+		if len(_negative) > 10000:
+			now = time.monotonic()
+			for k in [k for k, v in _negative.items() if v <= now]:
+				_negative.pop(k, None)
+
+
+def recently_failed(ig_user_id: str) -> bool:
+	with _negative_lock:
+		until = _negative.get(str(ig_user_id))
+		if until is None:
+			return False
+		if until <= time.monotonic():
+			_negative.pop(str(ig_user_id), None)
+			return False
+		return True
+
+
+def _is_permission_error(err: Optional[str]) -> bool:
+	e = str(err or "")
+	return "403" in e or "230" in e or "consent" in e.lower()
+
+
+def select_due(ig_user_ids: List[str]) -> List[str]:
+	"""Keep ids whose ig_users row is missing, stale or failed (same rules as enrich_user)."""
+	if not ig_user_ids:
+		return []
+	ttl = dt.timedelta(hours=_int_env("USER_TTL_HOURS", 48))
+	now = dt.datetime.utcnow()
+	with get_session() as session:
+		rows = session.exec(
+			text(
+				"SELECT ig_user_id, fetched_at, fetch_status, fetch_error FROM ig_users WHERE ig_user_id IN :ids"
+			).bindparams(bindparam("ids", expanding=True)).params(ids=list(ig_user_ids))
+		).all()
+	skip = set()
+	for uid, fetched_at, status, err in rows:
+		if status == "error" and _is_permission_error(err):
+			skip.add(str(uid))
+		elif fetched_at and str(status or "").lower() == "ok" and now - fetched_at < ttl:
+			skip.add(str(uid))
+	return [u for u in ig_user_ids if u not in skip]
+
+
+def _username_from_messages(ig_user_id: str) -> Optional[str]:
+	with get_session() as session:
+		row = session.exec(
+			text(
+				"SELECT sender_username FROM message WHERE ig_sender_id=:u AND sender_username IS NOT NULL ORDER BY timestamp_ms DESC, id DESC LIMIT 1"
+			).params(u=str(ig_user_id))
+		).first()
+	val = row[0] if row else None
+	return val.strip() if isinstance(val, str) and val.strip() else None
+
+
+def upsert_results(found: Dict[str, Dict[str, Any]], errors: Dict[str, str]) -> int:
+	"""Write every fetched profile and every error in one multi-row upsert."""
+	rows: List[Dict[str, Any]] = []
+	for uid, data in found.items():
+		username = data.get("username") or data.get("name")
+		if not username:
+			try:
+				username = _username_from_messages(uid)
+			except Exception:
+				username = None
+		rows.append({"id": uid, "u": username, "n": data.get("name"), "p": data.get("profile_picture_url"), "s": "ok", "e": None})
+	for uid, err in errors.items():
+		rows.append({"id": uid, "u": None, "n": None, "p": None, "s": "error", "e": err[:500]})
+	if not rows:
+		return 0
+	values = ", ".join(
+		f"('instagram', :id{i}, :u{i}, :n{i}, :p{i}, CURRENT_TIMESTAMP, :s{i}, :e{i})" for i in range(len(rows))
+	)
+	params: Dict[str, Any] = {}
+	for i, r in enumerate(rows):
+		for k, v in r.items():
+			params[f"{k}{i}"] = v
+	with get_session() as session:
+		# errors keep previously fetched username/name; successes overwrite them
+		session.exec(
+			text(
+				f"""
+				INSERT INTO ig_users(platform, ig_user_id, username, name, profile_pic_url, fetched_at, fetch_status, fetch_error)
+				VALUES {values}
+				ON DUPLICATE KEY UPDATE
+					username = IF(VALUES(fetch_status)='ok', VALUES(username), username),
+					name = IF(VALUES(fetch_status)='ok', VALUES(name), name),
+					profile_pic_url = IF(VALUES(fetch_status)='ok', VALUES(profile_pic_url), profile_pic_url),
+					fetched_at = IF(VALUES(fetch_status)='ok', VALUES(fetched_at), fetched_at),
+					fetch_status = VALUES(fetch_status),
+					fetch_error = VALUES(fetch_error)
+				"""
+			).params(**params)
+		)
+		from .conversation_snapshot import note_ig_user_changed
+
+		for uid in found:
+			note_ig_user_changed(uid, session=session)
+	return len(rows)
+
+
+async def enrich_batch(ig_user_ids: List[str]) -> Dict[str, int]:
+	"""Resolve a batch of ids via the Graph batch endpoint and persist the results."""
+	from .graph_client import fetch_users_batch, is_oauth_error
+	from .instagram_api import GRAPH_VERSION, _get_base_token_and_id
+
+	ids = [u for u in dict.fromkeys(str(x) for x in ig_user_ids if x) if not recently_failed(u)]
+	ids = select_due(ids)
+	if not ids:
+		return {"fetched": 0, "ok": 0, "error": 0}
+	token, _, _ = _get_base_token_and_id()
+	try:
+		found, errors = await fetch_users_batch(ids, token, GRAPH_VERSION)
+	except httpx.HTTPStatusError as e:
+		if not is_oauth_error(e.response.status_code, e.response.text):
+			raise
+		# bad/expired token: recorded per user like enrich_user does, and kept out of the
+		# next windows by the negative cache instead of being re-queued every few seconds
+		detail = f"HTTP {e.response.status_code}: {e.response.text[:300]}"
+		found, errors = {}, {uid: detail for uid in ids}
+	upsert_results(found, errors)
+	if errors:
+		note_failed(errors.keys())
+	try:
+		from .monitoring import increment_counter
+
+		increment_counter("enrich_user", len(found) + len(errors))
+		increment_counter("enrich_success", len(found))
+	except Exception:
+		pass
+	log.info("enrich batch ids=%d ok=%d error=%d", len(ids), len(found), len(errors))
+	return {"fetched": len(ids), "ok": len(found), "error": len(errors)}
+
+
+async def _batcher_loop() -> None:
+	from .graph_client import GraphRateLimited
+	from .monitoring import _get_redis
+
+	window = max(50, _int_env("ENRICH_BATCH_WINDOW_MS", 1500)) / 1000.0
+	max_batch = max(1, min(50, _int_env("ENRICH_BATCH_MAX", 50)))
+	failures = 0
+	while True:
+		ids: List[str] = []
+		try:
+			ids = [str(u) for u in (_get_redis().spop(DIRTY_KEY, max_batch) or [])]
+		except Exception as e:
+			log.warning("enrich batch pop failed: %s", e)
+		if not ids:
+			await asyncio.sleep(window)
+			continue
+		try:
+			await enrich_batch(ids)
+			failures = 0
+		except Exception as e:
+			# whole batch failed (network, throttling): put the ids back and back off,
+			# exponentially while it keeps failing (5s .. ENRICH_BATCH_MAX_BACKOFF_SEC)
+			mark_needs_enrichment(ids)
+			failures += 1
+			backoff = min(float(_int_env("ENRICH_BATCH_MAX_BACKOFF_SEC", 300)), 5.0 * 2 ** min(failures - 1, 10))
+			wait = max(e.wait_seconds, backoff) if isinstance(e, GraphRateLimited) else backoff
+			log.warning("enrich batch failed ids=%d failures=%d retry_in=%.0fs err=%s", len(ids), failures, wait, e)
+			await asyncio.sleep(wait)
+			continue
+		if len(ids) < max_batch:
+			# let the next window collect more ids instead of sending tiny batches
+			await asyncio.sleep(window)
+
+
+def _run_batcher() -> None:
+	from .graph_client import closing
+
+	while True:
+		try:
+			asyncio.run(closing(_batcher_loop()))
+		except Exception as e:
+			log.warning("enrich batcher crashed: %s", e)
+			time.sleep(1.0)
+
+
+def start_batcher_thread() -> bool:
+	"""Start the batcher once per process (daemon thread with its own event loop)."""
+	global _batcher_started
+	with _batcher_lock:
+		if _batcher_started:
+			return False
+		threading.Thread(target=_run_batcher, name="enrich-batcher", daemon=True).start()
+		_batcher_started = True
+	return True
+
+
+def get_batch_stats() -> Dict[str, Any]:
+	out: Dict[str, Any] = {}
+	try:
+		from .monitoring import _get_redis
+
+		out["dirty"] = int(_get_redis().scard(DIRTY_KEY))
+	except Exception as e:
+		out["error"] = str(e)
+	with _negative_lock:
+		out["negative_cache"] = len(_negative)
+	return out
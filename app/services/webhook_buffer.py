@@ -0,0 +1,337 @@
+"""
+Webhook fast path: buffer raw webhook bodies in a Redis stream and group-commit them.
+
+The webhook route only validates the signature and XADDs the raw body to
+`webhooks:raw` (a few hundred microseconds), so it never touches MySQL or the disk on
+the event loop. flush_raw_events() reads the stream through a consumer group, inserts
+the batch into raw_events with one multi-row INSERT (deduped on uniq_hash), enqueues the
+ingest jobs in bulk and only then acks the entries, so a crash between the insert and
+the ack replays the batch idempotently. Entries left pending by a dead consumer are
+reclaimed after WEBHOOK_FLUSH_RECLAIM_MS; an entry that fails on its own on
+WEBHOOK_FLUSH_MAX_DELIVERIES deliveries is moved to `webhooks:raw:dead` and acked.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+
+from ..db import get_session
+
+
+log = logging.getLogger("webhook.buffer")
+
+STREAM_KEY = "webhooks:raw"
+DEAD_STREAM_KEY = "webhooks:raw:dead"
+GROUP_NAME = "raw_flush"
+
+_group_ready = False
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+
+def fast_path_enabled() -> bool:
+	return os.getenv("IG_WEBHOOK_FAST_PATH", "1") not in ("0", "false", "False", "")
+
+
+def _stream_maxlen() -> int:
+	try:
+		return max(1000, int(os.getenv("WEBHOOK_STREAM_MAXLEN", "200000")))
+	except Exception:
+		return 200000
+
+
+def append_raw_event(body: bytes, signature: Optional[str], obj: str, trace: Optional[str] = None) -> bool:
+	"""
+	Append a verified webhook body to the stream. Returns False when Redis is unavailable
+	so the caller can fall back to the synchronous insert. `trace` is an injected trace
+	context carried on to the ingest job.
+	"""
+	try:
+		from .monitoring import _get_redis
+
+		fields = {
+			"object": obj,
+			"sig": signature or "",
+			"body": body.decode("utf-8"),
+			"ts": f"{time.time():.3f}",
+		}
+		if trace:
+			fields["tp"] = trace
+		_get_redis().xadd(
+			STREAM_KEY,
+			fields,
+			maxlen=_stream_maxlen(),
+			approximate=True,
+		)
+		return True
+	except Exception as e:
+		try:
+			log.warning("webhook buffer append failed, falling back to direct insert: %s", e)
+		except Exception:
+			pass
+		return False
+
+
+def store_raw_events(events: List[Dict[str, str]]) -> Dict[str, int]:
+	"""
+	Insert raw webhook bodies into raw_events (multi-row, duplicates skipped on uniq_hash)
+	and return {uniq_hash: raw_event_id} for every event, including already-stored ones.
+	"""
+	rows: Dict[str, Dict[str, Any]] = {}
+	for ev in events:
+		body = ev.get("body") or ""
+		h = hashlib.sha256(body.encode("utf-8")).hexdigest()
+		if h in rows:
+			continue
+		try:
+			payload_json = json.dumps(json.loads(body))
+		except Exception:
+			payload_json = body
+		rows[h] = {
+			"object": str(ev.get("object") or "instagram"),
+			"entry_id": "",
+			"payload": payload_json,
+			"sig256": ev.get("sig") or "",
+			"uniq_hash": h,
+		}
+	if not rows:
+		return {}
+	with get_session() as session:
+		session.exec(
+			text(
+				"""
+				INSERT INTO raw_events (object, entry_id, payload, sig256, uniq_hash)
+				VALUES (:object, :entry_id, :payload, :sig256, :uniq_hash)
+				ON DUPLICATE KEY UPDATE id = id
+				"""
+			),
+			params=list(rows.values()),
+		)
+		found = session.exec(
+			text("SELECT id, uniq_hash FROM raw_events WHERE uniq_hash IN :hashes").bindparams(
+				bindparam("hashes", expanding=True)
+			).params(hashes=list(rows.keys()))
+		).all()
+	return {str(h): int(rid) for rid, h in found}
+
+
+def _ensure_group(r: Any) -> None:
+	global _group_ready
+	if _group_ready:
+		return
+	try:
+		r.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+	except Exception as e:
+		if "BUSYGROUP" not in str(e):
+			raise
+	_group_ready = True
+
+
+def _consumer_name() -> str:
+	return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _read_batch(r: Any, max_batch: int, block_ms: int) -> List[Tuple[str, Dict[str, str]]]:
+	consumer = _consumer_name()
+	entries: List[Tuple[str, Dict[str, str]]] = []
+	try:
+		reclaim_ms = int(os.getenv("WEBHOOK_FLUSH_RECLAIM_MS", "60000"))
+	except Exception:
+		reclaim_ms = 60000
+	try:
+		res = r.xautoclaim(STREAM_KEY, GROUP_NAME, consumer, min_idle_time=reclaim_ms, start_id="0-0", count=max_batch)
+		claimed = res[1] if isinstance(res, (list, tuple)) and len(res) > 1 else []
+		entries.extend((eid, fields) for eid, fields in claimed if fields)
+	except Exception:
+		pass
+	if len(entries) < max_batch:
+		res = r.xreadgroup(GROUP_NAME, consumer, {STREAM_KEY: ">"}, count=max_batch - len(entries), block=block_ms)
+		for _stream, items in res or []:
+			entries.extend((eid, fields) for eid, fields in items if fields)
+	return entries
+
+
+def _ingest_payload(raw_event_id: int, trace: Optional[str]) -> Dict[str, Any]:
+	payload: Dict[str, Any] = {"raw_event_id": raw_event_id}
+	if trace:
+		payload["tp"] = trace
+	return payload
+
+
+def _entry_traces(entries: List[Tuple[str, Dict[str, str]]]) -> Dict[str, str]:
+	"""Close the buffer wait span of each traced entry; {uniq_hash: context for the ingest job}."""
+	from . import tracing
+
+	out: Dict[str, str] = {}
+	for _eid, fields in entries:
+		ctx = tracing.extract(fields.get("tp"))
+		if ctx is None:
+			continue
+		tracing.record_wait("webhook.buffer_wait", ctx)
+		out[hashlib.sha256((fields.get("body") or "").encode("utf-8")).hexdigest()] = tracing.inject(ctx) or ""
+	return out
+
+
+def _max_deliveries() -> int:
+	try:
+		return max(1, int(os.getenv("WEBHOOK_FLUSH_MAX_DELIVERIES", "5")))
+	except Exception:
+		return 5
+
+
+def _store_and_enqueue(entries: List[Tuple[str, Dict[str, str]]], traced: Dict[str, str]) -> int:
+	"""Insert the entries into raw_events and enqueue their ingest jobs; returns raw_event ids enqueued."""
+	from .queue import enqueue_many
+
+	ids_by_hash = store_raw_events([fields for _eid, fields in entries])
+	raw_ids = sorted(set(ids_by_hash.values()))
+	traces = {ids_by_hash[h]: tp for h, tp in traced.items() if h in ids_by_hash}
+	if raw_ids:
+		enqueue_many("ingest", [(str(rid), _ingest_payload(rid, traces.get(rid))) for rid in raw_ids])
+	return len(raw_ids)
+
+
+def _delivery_count(r: Any, entry_id: str) -> int:
+	try:
+		res = r.xpending_range(STREAM_KEY, GROUP_NAME, min=entry_id, max=entry_id, count=1)
+		return int((res or [{}])[0].get("times_delivered") or 0)
+	except Exception:
+		return 0
+
+
+def _dead_letter(r: Any, failed: List[Tuple[Tuple[str, Dict[str, str]], Exception]]) -> List[str]:
+	"""
+	Move entries that failed on their own and have been delivered WEBHOOK_FLUSH_MAX_DELIVERIES
+	times to DEAD_STREAM_KEY; the rest stay pending and are retried on reclaim. Returns the
+	entry ids moved (to be acked).
+	"""
+	limit = _max_deliveries()
+	dead: List[Tuple[str, Dict[str, str], Exception, int]] = []
+	for (eid, fields), err in failed:
+		n = _delivery_count(r, eid)
+		if n >= limit:
+			dead.append((eid, fields, err, n))
+	if not dead:
+		return []
+	with r.pipeline() as p:
+		for eid, fields, err, n in dead:
+			p.xadd(
+				DEAD_STREAM_KEY,
+				{**fields, "src_id": eid, "deliveries": str(n), "error": str(err)[:500]},
+				maxlen=_stream_maxlen(),
+				approximate=True,
+			)
+		p.execute()
+	for eid, _fields, err, n in dead:
+		log.error("webhook entry %s dead-lettered after %d deliveries: %s", eid, n, err)
+	try:
+		from .monitoring import increment_counter
+
+		increment_counter("webhook_dead_lettered", len(dead))
+	except Exception:
+		pass
+	return [eid for eid, _f, _e, _n in dead]
+
+
+def flush_raw_events(max_batch: int = 200, block_ms: int = 1000) -> int:
+	"""
+	Drain one batch from the stream into raw_events and the ingest queue. Returns entries
+	acked. When the batch insert fails the entries are retried one by one, so a single bad
+	entry (oversized body, invalid utf8mb4, ...) cannot hold back the ones around it; an
+	entry that keeps failing is dead-lettered once its delivery count reaches the cap.
+	"""
+	from .queue import _get_redis
+
+	r = _get_redis()
+	_ensure_group(r)
+	entries = _read_batch(r, max_batch, block_ms)
+	if not entries:
+		return 0
+	traced = _entry_traces(entries) if any(f.get("tp") for _e, f in entries) else {}
+	try:
+		stored = _store_and_enqueue(entries, traced)
+		entry_ids = [eid for eid, _fields in entries]
+	except Exception as e:
+		if len(entries) == 1:
+			failed = [(entries[0], e)]
+			stored, entry_ids = 0, []
+		else:
+			log.warning("webhook batch insert failed, retrying %d entries one by one: %s", len(entries), e)
+			stored, entry_ids, failed = 0, [], []
+			for entry in entries:
+				try:
+					stored += _store_and_enqueue([entry], traced)
+					entry_ids.append(entry[0])
+				except Exception as row_err:
+					failed.append((entry, row_err))
+		entry_ids.extend(_dead_letter(r, failed))
+		if not entry_ids:
+			# nothing went through (e.g. database down): leave everything pending and back off
+			raise e
+	with r.pipeline() as p:
+		p.xack(STREAM_KEY, GROUP_NAME, *entry_ids)
+		p.xdel(STREAM_KEY, *entry_ids)
+		p.execute()
+	try:
+		from .monitoring import increment_counter
+
+		increment_counter("webhook_flushed", len(entry_ids))
+	except Exception:
+		pass
+	log.info("flushed webhooks entries=%d raw_events=%d", len(entry_ids), stored)
+	return len(entry_ids)
+
+
+def _flusher_loop() -> None:
+	try:
+		max_batch = max(1, int(os.getenv("WEBHOOK_FLUSH_BATCH", "200")))
+	except Exception:
+		max_batch = 200
+	while True:
+		try:
+			flush_raw_events(max_batch=max_batch, block_ms=1000)
+		except Exception as e:
+			log.warning("webhook flush failed: %s", e)
+			time.sleep(1.0)
+
+
+def start_flusher_thread() -> bool:
+	"""Start the background flusher once per process (daemon thread)."""
+	global _flusher_started
+	with _flusher_lock:
+		if _flusher_started:
+			return False
+		t = threading.Thread(target=_flusher_loop, name="webhook-flusher", daemon=True)
+		t.start()
+		_flusher_started = True
+	return True
+
+
+def get_buffer_stats() -> Dict[str, Any]:
+	try:
+		from .monitoring import _get_redis
+
+		r = _get_redis()
+		length = int(r.xlen(STREAM_KEY))
+		pending = 0
+		try:
+			info = r.xpending(STREAM_KEY, GROUP_NAME)
+			pending = int((info or {}).get("pending") or 0)
+		except Exception:
+			pass
+		dead = 0
+		try:
+			dead = int(r.xlen(DEAD_STREAM_KEY))
+		except Exception:
+			pass
+		return {"stream_length": length, "pending": pending, "dead_letters": dead}
+	except Exception as e:
+		return {"error": str(e)}
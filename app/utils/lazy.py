@@ -0,0 +1,106 @@
+"""
+Deferred imports for heavy optional dependencies and rarely used routers.
+
+- lazy_module("openai") returns the module object without executing it; the real import
+  happens on first attribute access (importlib LazyLoader). Returns None when the package
+  is not installed, so callers keep their "optional dependency" checks.
+- include_lazy_router() registers a placeholder route for a router's path prefixes. The
+  first request under those prefixes imports the router module (off the event loop),
+  splices its routes in at the placeholder's position (so matching order is unchanged)
+  and re-dispatches the request. LAZY_ROUTERS=0 includes everything eagerly (useful for
+  /docs, which only lists routers that are already loaded).
+"""
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+from types import ModuleType
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from starlette.routing import BaseRoute, Match, NoMatchFound
+
+
+def lazy_module(name: str) -> Optional[ModuleType]:
+    """Module proxy that imports `name` on first attribute access; None if not installed."""
+    mod = sys.modules.get(name)
+    if mod is not None:
+        return mod
+    try:
+        spec = importlib.util.find_spec(name)
+    except Exception:
+        spec = None
+    if spec is None or spec.loader is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def lazy_routers_enabled() -> bool:
+    return os.getenv("LAZY_ROUTERS", "1") not in ("0", "false", "False")
+
+
+class LazyRouterRoute(BaseRoute):
+    """Placeholder that loads `module.router` on the first request under its prefixes."""
+
+    def __init__(self, app: Any, module: str, path_prefixes: Sequence[str], include_kwargs: Dict[str, Any]) -> None:
+        self.app = app
+        self.module = module
+        self.path_prefixes: Tuple[str, ...] = tuple(p.rstrip("/") for p in path_prefixes)
+        self.include_kwargs = include_kwargs
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def matches(self, scope: Dict[str, Any]) -> Tuple[Match, Dict[str, Any]]:
+        if self.loaded or scope.get("type") not in ("http", "websocket"):
+            return Match.NONE, {}
+        path = scope.get("path") or ""
+        for p in self.path_prefixes:
+            if path == p or path.startswith(p + "/"):
+                return Match.FULL, {}
+        return Match.NONE, {}
+
+    def url_path_for(self, name: str, /, **path_params: Any):
+        raise NoMatchFound(name, path_params)
+
+    def load(self) -> None:
+        with self._lock:
+            if self.loaded:
+                return
+            from fastapi import APIRouter
+
+            mod = importlib.import_module(self.module)
+            staging = APIRouter()
+            staging.include_router(mod.router, **self.include_kwargs)
+            routes = self.app.router.routes
+            try:
+                idx = routes.index(self)
+            except ValueError:
+                idx = len(routes)
+            routes[idx:idx + 1] = staging.routes
+            # regenerate /openapi.json with the new routes
+            self.app.openapi_schema = None
+            self.loaded = True
+
+    async def handle(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if not self.loaded:
+            import anyio.to_thread
+
+            await anyio.to_thread.run_sync(self.load)
+        await self.app.router(scope, receive, send)
+
+
+def include_lazy_router(app: Any, module: str, path_prefixes: Sequence[str], **include_kwargs: Any) -> Optional[LazyRouterRoute]:
+    """app.include_router(importlib.import_module(module).router, ...) deferred to first use."""
+    if not lazy_routers_enabled():
+        app.include_router(importlib.import_module(module).router, **include_kwargs)
+        return None
+    route = LazyRouterRoute(app, module, path_prefixes, include_kwargs)
+    app.router.routes.append(route)
+    return route
@@ -12,8 +12,16 @@ This script:
 3. Finds all payments created from that import run
 4. Updates payment.payment_date to the filename date
 5. Reports payments that couldn't be fixed (missing Excel or no date in filename)
+
+Runs are processed one per transaction (app.services.batching), so a long backfill
+holds no locks beyond the current run and can be resumed with --resume. They are walked
+newest first (ImportRun.id descending, ids follow started_at) as the original single
+transaction did, so for a payment matched by several runs the oldest run's date is
+written last and wins.
 """
 
+import ast
+import json
 import sys
 import re
 from pathlib import Path
@@ -27,8 +35,9 @@ sys.path.insert(0, str(PROJECT_ROOT))
 
 from app.db import get_session
 from app.models import ImportRun, ImportRow, Payment, Order
+from app.services.batching import Checkpoint, Progress, Throttle, keyset_batches, run_keyset
 from sqlmodel import select
-from sqlalchemy import text
+from sqlalchemy import bindparam, func, text
 
 
 def extract_date_from_filename(filename: str) -> date | None:
@@ -53,136 +62,141 @@ def extract_date_from_filename(filename: str) -> date | None:
     return None
 
 
-def backfill_payment_dates(dry_run: bool = True):
-    """Backfill payment_date for kargo payments from Excel filenames."""
+_IN_CHUNK = 500
+
+
+def _update_in_chunks(session, column: str, values, payment_date: date) -> int:
+    """UPDATE payment ... WHERE <column> IN (...) in bound chunks of _IN_CHUNK values."""
+    stmt = text(f"""
+        UPDATE payment
+        SET payment_date = :payment_date
+        WHERE {column} IN :vals
+          AND (payment_date IS NULL OR payment_date != :payment_date)
+    """).bindparams(bindparam("vals", expanding=True))
+    values = sorted(values)
+    affected = 0
+    for i in range(0, len(values), _IN_CHUNK):
+        result = session.execute(stmt, {"payment_date": payment_date, "vals": values[i : i + _IN_CHUNK]})
+        affected += int(result.rowcount or 0)
+    return affected
+
+
+def _tracking_no(mapped_json: str | None) -> str | None:
+    if not mapped_json:
+        return None
+    try:
+        mapped = json.loads(mapped_json)
+    except Exception:
+        try:
+            mapped = ast.literal_eval(mapped_json)
+        except Exception:
+            return None
+    tracking_no = mapped.get("tracking_no") if isinstance(mapped, dict) else None
+    return str(tracking_no) if tracking_no else None
+
+
+def backfill_payment_dates(dry_run: bool = True, resume: bool = False, sleep: float | None = None):
+    """Backfill payment_date for kargo payments from Excel filenames.
+
+    Each import run is handled in its own short transaction (rolled back in dry-run), its
+    import rows are read in keyset pages and updates go out as bound IN-list chunks.
+    Runs go newest first so the oldest run's date is the final write, as before.
+    With --resume a run interrupted earlier continues after the last committed run.
+    """
     updated_count = 0
     skipped_count = 0
     error_count = 0
     missing_excel = []
     no_date_in_filename = []
-    
+
     with get_session() as session:
-        # Get all kargo import runs
-        kargo_runs = session.exec(
-            select(ImportRun)
-            .where(ImportRun.source == "kargo")
-            .order_by(ImportRun.started_at.desc())
-        ).all()
-        
-        print(f"Found {len(kargo_runs)} kargo import runs")
-        
-        for run in kargo_runs:
+        total_runs = session.exec(
+            select(func.count(ImportRun.id)).where(ImportRun.source == "kargo")
+        ).one()
+    print(f"Found {total_runs} kargo import runs")
+
+    def _run(session, runs) -> int:
+        nonlocal skipped_count
+        affected = 0
+        for run in runs:
             # Extract date from filename
             filename_date = extract_date_from_filename(run.filename)
-            
+
             if not filename_date:
                 # No date in filename - track for reporting
                 no_date_in_filename.append(run.filename)
                 # Count payments from this run
-                payments_count = session.exec(
-                    select(Payment)
-                    .join(Order).where(Order.id == Payment.order_id)
-                    .join(ImportRow).where(
-                        ImportRow.import_run_id == run.id,
-                        ImportRow.matched_order_id == Order.id
-                    )
-                ).all()
-                skipped_count += len(payments_count)
+                skipped_count += int(session.exec(
+                    select(func.count(Payment.id))
+                    .join(Order, Order.id == Payment.order_id)
+                    .join(ImportRow, ImportRow.matched_order_id == Order.id)
+                    .where(ImportRow.import_run_id == run.id)
+                ).one() or 0)
                 continue
-            
+
             # Check if Excel file exists
             excel_file = PROJECT_ROOT / "kargocununexcelleri" / run.filename
             if not excel_file.exists():
                 missing_excel.append(run.filename)
                 # Still try to update payments from this run
-            
+
             print(f"\nProcessing run {run.id}: {run.filename}")
             print(f"  Extracted date from filename: {filename_date}")
-            
-            # Find all payments created from this import run
-            # Method 1: Payments linked to orders that were matched in this import run
-            import_rows = session.exec(
-                select(ImportRow)
-                .where(
-                    ImportRow.import_run_id == run.id,
-                    ImportRow.matched_order_id.is_not(None)
-                )
-            ).all()
-            
-            # Get orders from these import rows
-            order_ids = [ir.matched_order_id for ir in import_rows if ir.matched_order_id]
-            
-            # Method 2: Also find payments by reference (tracking_no) from this import run
-            # Extract tracking numbers from import rows' mapped_json
-            import json
-            import ast
+
+            # Method 1: payments linked to orders matched in this import run
+            # Method 2: payments by reference (tracking_no from mapped_json), even if for different orders
+            order_ids = set()
             tracking_nos = set()
-            for ir in import_rows:
-                try:
-                    mapped = json.loads(ir.mapped_json or "{}") if ir.mapped_json else {}
-                    tracking_no = mapped.get("tracking_no")
+            rows_stmt = select(ImportRow.id, ImportRow.matched_order_id, ImportRow.mapped_json).where(
+                ImportRow.import_run_id == run.id,
+                ImportRow.matched_order_id.is_not(None),
+            )
+            for rows in keyset_batches(rows_stmt, ImportRow.id, batch_size=1000):
+                for ir in rows:
+                    order_ids.add(int(ir.matched_order_id))
+                    tracking_no = _tracking_no(ir.mapped_json)
                     if tracking_no:
-                        tracking_nos.add(str(tracking_no))
-                except:
-                    try:
-                        mapped = ast.literal_eval(ir.mapped_json or "{}") if ir.mapped_json else {}
-                        tracking_no = mapped.get("tracking_no")
-                        if tracking_no:
-                            tracking_nos.add(str(tracking_no))
-                    except:
-                        pass
-            
-            # Update payments using raw SQL
-            # Method 1: Update by order_id (payments for orders matched in this run)
-            order_ids_to_update = set(order_ids)
-            rows_affected_1 = 0
-            
-            if order_ids_to_update:
-                order_ids_list = list(order_ids_to_update)
-                order_ids_tuple = tuple(order_ids_list)
-                if len(order_ids_list) == 1:
-                    order_ids_tuple = f"({order_ids_list[0]})"
-                else:
-                    order_ids_tuple = str(order_ids_tuple)
-                
-                result1 = session.execute(text(f"""
-                    UPDATE payment 
-                    SET payment_date = :payment_date
-                    WHERE order_id IN {order_ids_tuple}
-                      AND (payment_date IS NULL OR payment_date != :payment_date)
-                """), {"payment_date": filename_date})
-                rows_affected_1 = result1.rowcount
-            
-            # Method 2: Also update payments by reference/tracking_no (even if for different orders)
-            rows_affected_2 = 0
+                        tracking_nos.add(tracking_no)
+
+            rows_affected = 0
+            if order_ids:
+                rows_affected += _update_in_chunks(session, "order_id", order_ids, filename_date)
             if tracking_nos:
-                tracking_list = list(tracking_nos)
-                placeholders = ",".join([f"'{t}'" for t in tracking_list])
-                result2 = session.execute(text(f"""
-                    UPDATE payment 
-                    SET payment_date = :payment_date
-                    WHERE reference IN ({placeholders})
-                      AND (payment_date IS NULL OR payment_date != :payment_date)
-                """), {"payment_date": filename_date})
-                rows_affected_2 = result2.rowcount
-            
-            rows_affected = rows_affected_1 + rows_affected_2
-            
+                rows_affected += _update_in_chunks(session, "reference", tracking_nos, filename_date)
+
             if rows_affected > 0:
                 if dry_run:
                     print(f"    Would update {rows_affected} payments: payment_date -> {filename_date}")
                 else:
                     print(f"    Updated {rows_affected} payments: payment_date -> {filename_date}")
-                updated_count += rows_affected
+                affected += rows_affected
             else:
                 skipped_count += len(order_ids)
-        
-        if not dry_run:
-            session.commit()
-            print(f"\n✓ Committed changes to database")
-        else:
-            print(f"\n⚠ DRY RUN - No changes committed")
-    
+        return affected
+
+    # One run per transaction, newest first (the oldest run's date is written last and
+    # wins); dry-run rolls every run back
+    updated_count = run_keyset(
+        select(ImportRun).where(ImportRun.source == "kargo"),
+        ImportRun.id,
+        _run,
+        batch_size=1,
+        checkpoint=Checkpoint("backfill_payment_dates_from_kargo"),
+        resume=resume,
+        throttle=Throttle(sleep=sleep),
+        progress=Progress("runs", total=int(total_runs or 0), every=30.0),
+        dry_run=dry_run,
+        descending=True,
+    )
+
+    if not dry_run:
+        print(f"\n✓ Committed changes to database")
+    else:
+        print(f"\n⚠ DRY RUN - No changes committed")
+        print("  Counts are per run against the unchanged database (each run is rolled back),")
+        print("  so a payment matched by several runs is counted once per run; --execute")
+        print("  may update fewer rows than the dry-run total.")
+
     print(f"\nSummary:")
     print(f"  Updated: {updated_count}")
     print(f"  Skipped: {skipped_count}")
@@ -209,6 +223,8 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Backfill payment_date for kargo payments from Excel filenames")
     parser.add_argument("--execute", action="store_true", help="Actually update the database")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last committed import run")
+    parser.add_argument("--sleep", type=float, default=None, help="Pause between runs (default BATCH_SLEEP)")
     args = parser.parse_args()
     
     dry_run = not args.execute
@@ -218,5 +234,5 @@ if __name__ == "__main__":
         print("Use --execute to actually update the database")
         print("=" * 60)
     
-    backfill_payment_dates(dry_run=dry_run)
+    backfill_payment_dates(dry_run=dry_run, resume=args.resume, sleep=args.sleep)
 
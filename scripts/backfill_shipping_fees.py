@@ -14,7 +14,7 @@ if str(ROOT) not in sys.path:
 
 from app.db import engine
 from app.models import Payment
-from app.services.shipping import compute_shipping_fee
+from app.services.shipping import compute_shipping_fees
 
 
 def backfill(dry_run: bool = False, limit: int | None = None) -> tuple[int, int]:
@@ -29,14 +29,15 @@ def backfill(dry_run: bool = False, limit: int | None = None) -> tuple[int, int]
 		rows = s.exec(query).all()
 		if limit is not None:
 			rows = rows[: int(limit)]
-		for p in rows:
+		# one pass over the compiled default rate table for all rows
+		fees = compute_shipping_fees([(float(p.amount or 0.0), None, False) for p in rows])
+		for p, fee_kar in zip(rows, fees):
 			scanned += 1
 			amt = float(p.amount or 0.0)
 			fee_kom = float(p.fee_komisyon or 0.0)
 			fee_hiz = float(p.fee_hizmet or 0.0)
 			fee_iad = float(p.fee_iade or 0.0)
 			fee_eok = float(p.fee_erken_odeme or 0.0)
-			fee_kar = compute_shipping_fee(amt)
 			net = round(amt - sum([fee_kom, fee_hiz, fee_kar, fee_iad, fee_eok]), 2)
 			if (float(p.fee_kargo or 0.0) != fee_kar) or (float(p.net_amount or 0.0) != net):
 				updated += 1
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Ham payload arşivi bakımı.
+
+  --messages        message.raw_json değerlerini sıkıştırıp message_payload tablosuna taşır
+                    ve kolonu NULL yapar (eski kayıtlar için tek seferlik backfill).
+  --raw-events      raw_events: eski kayıtların payload'ını payload_z'ye sıkıştırır ve
+                    saklama süresini aşanları siler.
+  --compact-hours N Sıkıştırma eşiği (varsayılan RAW_EVENTS_COMPACT_AFTER_HOURS / 24).
+  --retention-days N Silme eşiği (varsayılan RAW_EVENTS_RETENTION_DAYS / 30; 0 = silme).
+  --batch N         Parti boyutu (varsayılan 500).
+
+Taşıma bittikten sonra alanı geri kazanmak için: OPTIMIZE TABLE message, raw_events;
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+# noqa: E402 — path sonra import
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Archive message payloads and compact raw_events")
+    parser.add_argument("--messages", action="store_true", help="Move message.raw_json into message_payload")
+    parser.add_argument("--raw-events", action="store_true", help="Compress/delete old raw_events")
+    parser.add_argument("--compact-hours", type=int, default=None)
+    parser.add_argument("--retention-days", type=int, default=None)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--sleep", type=float, default=0.05, help="Pause between message batches (seconds)")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+    if not args.messages and not args.raw_events:
+        parser.error("nothing to do: pass --messages and/or --raw-events")
+
+    from app.services.payload_archive import archive_inline_messages, compact_raw_events  # noqa: E402
+
+    if args.messages:
+        total = 0
+        last_id = 0
+        while True:
+            moved, new_last = archive_inline_messages(batch=max(1, args.batch), after_id=last_id)
+            if not moved:
+                break
+            total += moved
+            last_id = new_last
+            print(f"messages moved={total} last_id={last_id}", flush=True)
+            time.sleep(max(0.0, args.sleep))
+        print(f"messages done moved={total}")
+
+    if args.raw_events:
+        stats = compact_raw_events(
+            compact_after_hours=args.compact_hours,
+            retention_days=args.retention_days,
+            batch=max(1, args.batch),
+            max_batches=1_000_000,
+        )
+        print(f"raw_events {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,8 +1,20 @@
+"""
+message.timestamp_ms boş / taşmış kayıtları ham payload'daki timestamp ile düzeltir.
+
+  --batch N    Parti boyutu (varsayılan 500); her parti ayrı kısa transaction.
+  --sleep S    Partiler arası bekleme (varsayılan BATCH_SLEEP).
+  --resume     Kesilen çalışmaya son işlenen id'den devam eder.
+  --dry-run    Yazmaz, sadece sayar.
+"""
+import argparse
 import json
 import os
+import sys
 from typing import Optional
 
-from sqlmodel import create_engine
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
 
 
 def _extract_ts_ms(raw: Optional[str]) -> Optional[int]:
@@ -39,36 +51,65 @@ def _extract_ts_ms(raw: Optional[str]) -> Optional[int]:
         return None
 
 
+def _fix_batch(session, rows) -> int:
+    from sqlalchemy import bindparam, text
+
+    from app.services.payload_archive import decompress
+
+    ids = [int(r.id) for r in rows]
+    payloads = dict(
+        session.exec(
+            text("SELECT message_id, raw_z FROM message_payload WHERE message_id IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            params={"ids": ids},
+        ).all()
+    )
+    updates = []
+    for r in rows:
+        raw_z = payloads.get(int(r.id))
+        ts = _extract_ts_ms(decompress(raw_z) if raw_z is not None else r.raw_json)
+        if ts is not None:
+            updates.append({"ts": int(ts), "id": int(r.id)})
+    if updates:
+        session.exec(text("UPDATE message SET timestamp_ms = :ts WHERE id = :id"), params=updates)
+    return len(updates)
+
+
 def main() -> None:
-    db_url = os.getenv("DATABASE_URL") or os.getenv("MYSQL_URL")
-    if not db_url:
+    parser = argparse.ArgumentParser(description="Fill message.timestamp_ms from the raw payload")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--sleep", type=float, default=None, help="Pause between batches (default BATCH_SLEEP)")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last committed batch")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
         raise SystemExit("DATABASE_URL or MYSQL_URL is required")
-    engine = create_engine(db_url, pool_pre_ping=True)
-
-    fixed = 0
-    scanned = 0
-    with engine.begin() as conn:
-        rows = conn.exec_driver_sql(
-            "SELECT id, raw_json FROM message WHERE timestamp_ms IS NULL OR timestamp_ms >= 2147480000"
-        ).fetchall()
-        for mid, raw in rows:
-            scanned += 1
-            ts = _extract_ts_ms(raw)
-            if ts is None:
-                continue
-            try:
-                conn.exec_driver_sql(
-                    "UPDATE message SET timestamp_ms = :ts WHERE id = :id",
-                    {"ts": int(ts), "id": int(mid)},
-                )
-                fixed += 1
-            except Exception:
-                pass
-
-    print(f"fix_message_timestamps: scanned={scanned} fixed={fixed}")
 
+    from sqlalchemy import or_
+    from sqlmodel import select
 
-if __name__ == "__main__":
-    main()
+    from app.models import Message
+    from app.services.batching import Checkpoint, Progress, Throttle, run_keyset
+
+    # keyset pages, one short transaction each: constant memory, no table-long locks
+    stmt = select(Message.id, Message.raw_json).where(
+        or_(Message.timestamp_ms.is_(None), Message.timestamp_ms >= 2147480000)
+    )
+    fixed = run_keyset(
+        stmt,
+        Message.id,
+        _fix_batch,
+        batch_size=args.batch,
+        checkpoint=Checkpoint("fix_message_timestamps"),
+        resume=args.resume,
+        throttle=Throttle(sleep=args.sleep),
+        progress=Progress("fix_message_timestamps"),
+        dry_run=args.dry_run,
+    )
+    print(f"fix_message_timestamps: fixed={fixed}" + (" (dry-run)" if args.dry_run else ""))
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Content-addressed medya deposundaki (media_blobs) referanssız dosyaları temizler.
+
+  --recount        Önce ref_count değerlerini attachments tablosundan yeniden hesaplar.
+  --grace-hours N  Son referanstan bu yana en az N saat geçmiş blob'lar silinir (varsayılan 24).
+  --limit N        Tek çalıştırmada en fazla N blob (varsayılan 500).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# noqa: E402 — path sonra import
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from app.services.media_store import gc_unreferenced_blobs, recount_blob_refs  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Remove unreferenced media blobs")
+    parser.add_argument("--recount", action="store_true", help="Recompute ref_count from attachments first")
+    parser.add_argument("--grace-hours", type=int, default=24)
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+
+    if args.recount:
+        print(f"recount changed={recount_blob_refs()}")
+    res = gc_unreferenced_blobs(grace_hours=max(0, args.grace_hours), limit=max(1, args.limit))
+    print(f"removed={res['removed']} bytes_freed={res['bytes_freed']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Import süresi profili: web uygulaması ve worker'ların açılışta ne kadar sürede ve hangi
+modüller yüzünden import edildiğini raporlar (python -X importtime).
+
+  --target MOD      Profil alınacak modül (tekrar edilebilir; varsayılan app.main + worker'lar).
+  --top N           Kümülatif süresi en yüksek N modül (varsayılan 25).
+  --json PATH       Sonuçları JSON olarak yazar (CI'da benchmark olarak saklamak için).
+  --budget MOD=MS   MOD toplam import süresi MS'yi aşarsa çıkış kodu 2.
+  --forbid MOD=PKG  MOD import edilirken PKG yükleniyorsa çıkış kodu 2 (örn. worker_media=openai).
+
+Her hedef ayrı bir süreçte ölçülür; DATABASE_URL tanımlı olmalı (bağlantı kurulmaz).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_TARGETS = ["app.main", "worker_media", "worker_publish", "worker_ingest", "worker_enrich", "worker_reply"]
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def profile(target: str) -> List[Tuple[str, int, int, int]]:
+    """Import `target` in a fresh interpreter; returns [(module, self_us, cumulative_us, depth)]."""
+    code = f"import sys; sys.path.insert(0, {os.path.join(_ROOT, 'scripts')!r}); import {target}"
+    env = dict(os.environ)
+    env["PYTHONPATH"] = _ROOT + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=_ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {target} failed:\n{proc.stderr[-2000:]}")
+    rows: List[Tuple[str, int, int, int]] = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            depth = (len(m.group(3)) - 1) // 2
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), depth))
+    return rows
+
+
+def summarize(target: str, rows: List[Tuple[str, int, int, int]], top: int) -> Dict[str, object]:
+    total_us = next((cum for name, _self, cum, _d in rows if name == target), sum(r[1] for r in rows))
+    packages: Dict[str, int] = {}
+    for name, self_us, _cum, _d in rows:
+        pkg = name.split(".")[0]
+        packages[pkg] = packages.get(pkg, 0) + self_us
+    heaviest = sorted(rows, key=lambda r: r[2], reverse=True)[:top]
+    return {
+        "target": target,
+        "total_ms": round(total_us / 1000.0, 1),
+        "modules": len(rows),
+        "loaded": sorted({name for name, *_ in rows}),
+        "top": [{"module": n, "self_ms": round(s / 1000.0, 1), "cumulative_ms": round(c / 1000.0, 1)} for n, s, c, _d in heaviest],
+        "packages_ms": {k: round(v / 1000.0, 1) for k, v in sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:top]},
+    }
+
+
+def _pairs(values: List[str]) -> List[Tuple[str, str]]:
+    out = []
+    for v in values or []:
+        k, _, val = v.partition("=")
+        out.append((k.strip(), val.strip()))
+    return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Per-module import time report")
+    parser.add_argument("--target", action="append", help="Module to profile (repeatable)")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", dest="json_path", default=None)
+    parser.add_argument("--budget", action="append", default=[], help="MOD=MS")
+    parser.add_argument("--forbid", action="append", default=[], help="MOD=PKG")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+
+    reports = []
+    for target in args.target or DEFAULT_TARGETS:
+        rep = summarize(target, profile(target), max(1, args.top))
+        reports.append(rep)
+        print(f"== {target}: {rep['total_ms']} ms, {rep['modules']} modules")
+        for row in rep["top"]:
+            print(f"  {row['cumulative_ms']:>9.1f} ms  (self {row['self_ms']:>7.1f})  {row['module']}")
+        print("  by package: " + ", ".join(f"{k}={v}" for k, v in list(rep["packages_ms"].items())[:10]))
+
+    failed = []
+    by_target = {r["target"]: r for r in reports}
+    for target, ms in _pairs(args.budget):
+        rep = by_target.get(target)
+        if rep and float(rep["total_ms"]) > float(ms):
+            failed.append(f"{target} import {rep['total_ms']} ms > budget {ms} ms")
+    for target, pkg in _pairs(args.forbid):
+        rep = by_target.get(target)
+        if rep and any(m == pkg or m.startswith(pkg + ".") for m in rep["loaded"]):
+            failed.append(f"{target} imports {pkg}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump({"reports": [{k: v for k, v in r.items() if k != "loaded"} for r in reports], "failed": failed}, fh, indent=2)
+    for f in failed:
+        print(f"FAIL {f}", file=sys.stderr)
+    return 2 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
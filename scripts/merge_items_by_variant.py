@@ -1,15 +1,16 @@
 from __future__ import annotations
 
-from collections import defaultdict
-from typing import Dict, List, Tuple
+import argparse
 
+from sqlalchemy import func
 from sqlmodel import select
 
 from app.db import get_session
 from app.models import Item, StockMovement, OrderItem, Order
+from app.services.batching import Progress, Throttle
 
 
-def merge_items() -> None:
+def merge_items(sleep: float | None = None, dry_run: bool = False) -> None:
     """Merge Items that only differ by legacy pack fields into a canonical (product_id,size,color).
 
     Strategy:
@@ -18,29 +19,43 @@ def merge_items() -> None:
       - Repoint StockMovement.item_id and OrderItem.item_id to canonical.
       - If an Order directly references a merged Item via order.item_id, repoint.
       - Mark non-canonical items inactive.
+
+    Duplicate groups are found with one GROUP BY; each group is merged in its own short
+    transaction (throttled) instead of loading every item and holding one transaction.
+    Movements are repointed through the ORM so the item_stock counters follow.
     """
     with get_session() as session:
-        rows: List[Item] = session.exec(select(Item).order_by(Item.id.asc())).all()
-        groups: Dict[Tuple[int|None, str|None, str|None], List[Item]] = defaultdict(list)
-        for it in rows:
-            groups[(it.product_id, it.size, it.color)].append(it)
-
-        for key, items in groups.items():
+        keys = session.exec(
+            select(Item.product_id, Item.size, Item.color)
+            .group_by(Item.product_id, Item.size, Item.color)
+            .having(func.count(Item.id) > 1)
+        ).all()
+
+    throttle = Throttle(sleep=sleep)
+    progress = Progress("merge_items", total=len(keys))
+    merged_groups = 0
+    for product_id, size, color in keys:
+        throttle.start()
+        key = (product_id, size, color)
+        with get_session() as session:
+            items = session.exec(
+                select(Item)
+                .where(Item.product_id.is_not_distinct_from(product_id))
+                .where(Item.size.is_not_distinct_from(size))
+                .where(Item.color.is_not_distinct_from(color))
+                .order_by(Item.id.asc())
+            ).all()
             if len(items) <= 1:
+                progress.update(1)
                 continue
             # pick canonical: prefer one with product_id set and smallest id
             items_sorted = sorted(items, key=lambda x: (0 if x.product_id else 1, x.id or 10**9))
             canonical = items_sorted[0]
             others = [i for i in items_sorted[1:] if (i.id != canonical.id)]
-            if not others:
-                continue
-
             canon_id = canonical.id
-            if canon_id is None:
-                continue
-
             other_ids = [i.id for i in others if i.id is not None]
-            if not other_ids:
+            if canon_id is None or not other_ids:
+                progress.update(1)
                 continue
 
             # repoint stock movements
@@ -62,10 +77,18 @@ def merge_items() -> None:
             for it in others:
                 it.status = "inactive"
 
-            print(f"Merged group {key}: canonical {canon_id}, merged {other_ids}")
+            if dry_run:
+                session.rollback()
+            merged_groups += 1
+            print(f"Merged group {key}: canonical {canon_id}, merged {other_ids}" + (" (dry-run)" if dry_run else ""))
+        progress.update(1, merged=merged_groups)
+        throttle.pause()
+    progress.finish(merged=merged_groups)
 
 
 if __name__ == "__main__":
-    merge_items()
-
-
+    parser = argparse.ArgumentParser(description="Merge items that only differ by legacy pack fields")
+    parser.add_argument("--sleep", type=float, default=None, help="Pause between groups (default BATCH_SLEEP)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    merge_items(sleep=args.sleep, dry_run=args.dry_run)
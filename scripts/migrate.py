@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Şema migrasyonlarını uygular (deploy başına bir kez çalıştırılır).
+
+  --status      Mevcut ve hedef şema sürümünü, bekleyen adımları gösterir (yazmaz).
+  --to N        Yalnızca N sürümüne kadar uygular.
+
+Adımlar MySQL named lock (GET_LOCK) altında sırayla çalışır; aynı anda başlatılan
+birden fazla çalıştırma birbirini bekler. Uygulama podları açılışta yalnızca
+schema_version tablosundaki sürümü okur.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# noqa: E402 — path sonra import
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("--status", action="store_true", help="Show current/target version and pending steps")
+    parser.add_argument("--to", type=int, default=None, help="Migrate up to this version only")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+
+    from app.migrations import LATEST_VERSION, current_version, migrate, pending  # noqa: E402
+
+    version = current_version()
+    todo = pending(version, args.to)
+    if args.status:
+        print(f"current={version} latest={LATEST_VERSION} pending={len(todo)}")
+        for ver, name, _step in todo:
+            print(f"  {ver:04d} {name}")
+        return 0 if not todo else 2
+
+    applied = migrate(target=args.to)
+    print(f"applied={applied} current={current_version()} latest={LATEST_VERSION}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Hesap bakiyesi defterini (account_balance / account_balance_daily) gelir-giderden
+yeniden hesaplar / doğrular.
+
+  --check            Sadece karşılaştırır (yazmaz), sapma olan hesapları/günleri listeler.
+                     Sapma varsa çıkış kodu 2 (cron ile doğrulama işi olarak çalıştırılabilir).
+  --account-id N     Yalnızca verilen hesab(lar)ı yeniden hesaplar (tekrar edilebilir).
+
+Tam yeniden hesaplama sonrası system_settings.account_ledger_ready=1 yazılır ve bakiye
+okumaları deftere geçer. Uygulama çalışırken güvenle çalıştırılabilir.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# noqa: E402 — path sonra import
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from app.services.account_ledger import check_account_ledger, rebuild_account_ledger  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild or verify the account balance ledger")
+    parser.add_argument("--check", action="store_true", help="Only compare the ledger with income/cost")
+    parser.add_argument("--account-id", type=int, action="append", help="Rebuild only this account (repeatable)")
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+
+    if args.check:
+        res = check_account_ledger()
+        print(
+            f"accounts_checked={res['accounts_checked']} mismatches={res['mismatch_count']}"
+            f" day_mismatches={res['day_mismatch_count']}"
+        )
+        for m in res["mismatches"]:
+            print(
+                f"  account_id={m['account_id']} income={m['income_total']} expected={m['expected_income_total']}"
+                f" expense={m['expense_total']} expected={m['expected_expense_total']} drift={m['drift']}"
+                + (" (missing row)" if m["missing_row"] else "")
+            )
+        for m in res["day_mismatches"]:
+            print(f"  account_id={m['account_id']} day={m['day']} drift={m['drift']}")
+        return 0 if res["mismatch_count"] == 0 and res["day_mismatch_count"] == 0 else 2
+
+    res = rebuild_account_ledger(args.account_id or None)
+    print(f"rebuilt accounts={res['accounts']} days={res['days']}" + ("" if args.account_id else " (account_ledger_ready=1)"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
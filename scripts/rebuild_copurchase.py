@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+product_copurchase tablosunu tüm sipariş geçmişinden yeniden oluşturur (upsell önerileri).
+
+  --drain-only  Yeniden oluşturmaz; sadece Redis'te bekleyen (dirty) siparişleri işler.
+  --batch-size  Bir seferde okunacak sipariş sayısı (varsayılan 2000).
+
+Önkoşul: product_copurchase / product_copurchase_order tabloları (uygulama boot'ta create_all).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# noqa: E402 — path sonra import
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from app.services.copurchase import rebuild_copurchase, refresh_dirty_orders  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild product co-purchase matrix")
+    parser.add_argument("--drain-only", action="store_true", help="Only process queued dirty orders")
+    parser.add_argument("--batch-size", type=int, default=2000)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+
+    if args.drain_only:
+        total = 0
+        while True:
+            taken = refresh_dirty_orders(max_orders=500)
+            if not taken:
+                break
+            total += taken
+        print(f"drained orders={total}")
+        return 0
+
+    def _progress(scanned: int) -> None:
+        print(f"  scanned={scanned}", flush=True)
+
+    stats = rebuild_copurchase(batch_size=max(100, args.batch_size), progress=_progress)
+    # Orders touched while the rebuild ran are reconciled here
+    refresh_dirty_orders(max_orders=5000)
+    print(f"done orders_scanned={stats['orders_scanned']} orders_applied={stats['orders_applied']} pairs={stats['pairs']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+item_stock sayaçlarını stok hareketlerinden yeniden hesaplar / doğrular.
+
+  --check          Sadece karşılaştırır (yazmaz), uyumsuz ürünleri listeler.
+  --item-id N      Yalnızca verilen item(lar)ı yeniden hesaplar (tekrar edilebilir).
+  --batch-size N   Toplu işlem boyutu (varsayılan 500).
+
+Tam yeniden hesaplama sonrası system_settings.item_stock_ready=1 yazılır ve okumalar
+sayaçlara geçer. Uygulama çalışırken güvenle çalıştırılabilir.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+# noqa: E402 — path sonra import
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from app.services.item_stock import check_item_stock, rebuild_item_stock  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild or verify item_stock counters")
+    parser.add_argument("--check", action="store_true", help="Only compare counters with stockmovement")
+    parser.add_argument("--item-id", type=int, action="append", help="Rebuild only this item (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("MYSQL_URL"):
+        print("DATABASE_URL or MYSQL_URL required", file=sys.stderr)
+        return 1
+
+    if args.check:
+        res = check_item_stock(batch_size=max(1, args.batch_size))
+        print(f"items_checked={res['items_checked']} mismatches={res['mismatch_count']}")
+        for m in res["mismatches"]:
+            print(
+                f"  item_id={m['item_id']} on_hand={m['on_hand']} expected={m['expected_on_hand']}"
+                f" sold={m['sold_all_time']} expected_sold={m['expected_sold_all_time']}"
+                + (" (missing row)" if m["missing_row"] else "")
+            )
+        return 0 if res["mismatch_count"] == 0 else 2
+
+    res = rebuild_item_stock(args.item_id or None, batch_size=max(1, args.batch_size))
+    print(f"rebuilt items={res['items']}" + ("" if args.item_id else " (item_stock_ready=1)"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,6 +8,8 @@ from typing import Any, Optional
 
 from app.services.queue import dequeue, delete_job, increment_attempts
 from app.services.enrichers import enrich_user, enrich_page
+from app.services.graph_client import closing
+from app.services.user_enrich_batch import start_batcher_thread
 from app.services.ai_ig import process_run as ig_ai_process_run, analyze_conversation
 from app.services.monitoring import record_heartbeat, increment_counter, ai_run_log
 import os
@@ -37,6 +39,8 @@ def main() -> None:
         )
     except Exception as e:
         log.warning("redis diag failed: %s", e)
+    # Users seen by ingest are enriched here in batches (see app.services.user_enrich_batch)
+    start_batcher_thread()
     while True:
         # heartbeat when idle too
         try:
@@ -59,7 +63,7 @@ def main() -> None:
             if kind == "enrich_user":
                 uid = str(payload.get("ig_user_id") or job.get("key"))
                 log.info("enrich_user start uid=%s", uid)
-                asyncio.run(enrich_user(uid))
+                asyncio.run(closing(enrich_user(uid)))
                 try:
                     increment_counter("enrich_user", 1)
                     increment_counter("enrich_success", 1)
@@ -69,7 +73,7 @@ def main() -> None:
             elif kind == "enrich_page":
                 gid = str(payload.get("igba_id") or job.get("key"))
                 log.info("enrich_page start igba_id=%s", gid)
-                asyncio.run(enrich_page(gid))
+                asyncio.run(closing(enrich_page(gid)))
                 try:
                     increment_counter("enrich_page", 1)
                     increment_counter("enrich_success", 1)
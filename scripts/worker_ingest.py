@@ -11,6 +11,8 @@ from app.services.monitoring import increment_counter
 from app.db import get_session
 from sqlalchemy import text
 from app.services.monitoring import record_heartbeat, increment_counter
+from app.services import tracing
+from app.services import query_profile
 import os
 import socket
 from pymysql.err import OperationalError
@@ -43,7 +45,28 @@ def main() -> None:
 		log.info("redis ok=%s url=%s qdepth ingest=%s hydrate=%s", bool(pong), os.getenv("REDIS_URL"), llen_ing, llen_hyd)
 	except Exception as e:
 		log.warning("redis diag failed: %s", e)
+	# DB child spans for traced ingest jobs and per-job SQL profiles
+	try:
+		from app.db import engine as _engine
+		tracing.instrument_engine(_engine)
+		query_profile.install(_engine)
+	except Exception as e:
+		log.warning("tracing instrumentation failed: %s", e)
+	# Group-commit webhook bodies buffered by the web process into raw_events + ingest jobs
+	try:
+		from app.services.webhook_buffer import start_flusher_thread
+		start_flusher_thread()
+	except Exception as e:
+		log.warning("webhook flusher start failed: %s", e)
+	# Periodic raw_events compaction/retention (see app.services.payload_archive)
+	try:
+		from app.services.payload_archive import start_compactor_thread
+		start_compactor_thread()
+	except Exception as e:
+		log.warning("raw_events compactor start failed: %s", e)
 	while True:
+		# close the previous job's SQL profile (statement count / DB time / N+1 -> /admin/slowlog)
+		query_profile.finish_job()
 		# heartbeat even when idle
 		try:
 			record_heartbeat("ingest", os.getpid(), socket.gethostname())
@@ -63,6 +86,7 @@ def main() -> None:
 		jid = int(job["id"])  # type: ignore
 		payload = job.get("payload") or {}
 		kind = job.get("kind")
+		query_profile.start_job(str(kind))
 		try:
 			log.info("dequeued jid=%s kind=%s key=%s", jid, kind, job.get("key"))
 		except Exception:
@@ -73,7 +97,11 @@ def main() -> None:
 				if not raw_id:
 					delete_job(jid)
 					continue
-				inserted = handle_ingest(raw_id)
+				# continue the webhook's trace (if sampled): queue wait + ingest span
+				with tracing.activate(tracing.extract(payload.get("tp"))):
+					tracing.record_wait("ingest.queue_wait")
+					with tracing.span("ingest.handle", stage=True, raw_event_id=raw_id):
+						inserted = handle_ingest(raw_id)
 				log.info("ingest ok jid=%s raw=%s inserted=%s", jid, raw_id, inserted)
 				# counters: messages ingested
 				try:
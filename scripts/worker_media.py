@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
-import time
 import logging
+import asyncio
 
 from app.services.queue import dequeue, delete_job, increment_attempts
 from app.services.media import fetch_and_store
-from app.services.monitoring import record_heartbeat, increment_counter
+from app.services.media_store import close_http_client
+from app.services.monitoring import record_heartbeat
 import os
 import socket
 
@@ -24,75 +25,103 @@ def main() -> None:
 		log.info("redis ok=%s url=%s qdepth fetch_media=%s", bool(pong), os.getenv("REDIS_URL"), llen)
 	except Exception as e:
 		log.warning("redis diag failed: %s", e)
-	while True:
-		# heartbeat when idle
-		try:
-			record_heartbeat("media", os.getpid(), socket.gethostname())
-		except Exception:
-			pass
-		log.debug("waiting for jobs: fetch_media")
-		job = dequeue("fetch_media", timeout=5)
-		if not job:
-			time.sleep(0.25)
-			continue
-		jid = int(job["id"])  # type: ignore
-		payload = job.get("payload") or {}
-		att_id = int(payload.get("attachment_id") or 0)
-		try:
-			log.info("dequeued jid=%s kind=%s key=%s", jid, job.get("kind"), job.get("key"))
-		except Exception:
-			pass
-		# Backward compatibility: allow key format message_id:position
-		if not att_id:
-			key = job.get("key") or ""
-			if ":" in key:
-				# Find attachment row by message_id and position
-				try:
-					msg_id_s, pos_s = key.split(":", 1)
-					done = _fetch_by_message_and_pos(int(msg_id_s), int(pos_s))
-					if done:
-						delete_job(jid)
-						continue
-				except Exception:
-					pass
-		try:
-			if not att_id:
-				delete_job(jid)
+	# One long-lived loop so the pooled HTTP client is reused across jobs
+	asyncio.run(_run())
+
+
+async def _run() -> None:
+	try:
+		concurrency = max(1, int(os.getenv("MEDIA_FETCH_CONCURRENCY", "4")))
+	except Exception:
+		concurrency = 4
+	slots = asyncio.Semaphore(concurrency)
+	# strong references: the loop only keeps weak ones, so unreferenced tasks can be collected mid-download
+	running: set[asyncio.Task] = set()
+	try:
+		while True:
+			# heartbeat when idle
+			try:
+				record_heartbeat("media", os.getpid(), socket.gethostname())
+			except Exception:
+				pass
+			# wait for a free slot before taking a job off the queue
+			await slots.acquire()
+			log.debug("waiting for jobs: fetch_media")
+			job = await asyncio.to_thread(dequeue, "fetch_media", 5)
+			if not job:
+				slots.release()
+				await asyncio.sleep(0.25)
 				continue
-			done = fetch_and_store.__wrapped__(att_id) if hasattr(fetch_and_store, "__wrapped__") else None  # type: ignore
-			if done is None:
-				# async function; run via event loop
-				import asyncio
-				asyncio.run(fetch_and_store(att_id))
-			log.info("media ok jid=%s att=%s", jid, att_id)
-			# increment generic media fetch counter; fine-grained per kind will be handled after DB update by separate read if needed
+			task = asyncio.create_task(_process(job, slots))
+			running.add(task)
+			task.add_done_callback(running.discard)
+	finally:
+		await close_http_client()
+
+
+async def _process(job: dict, slots: asyncio.Semaphore) -> None:
+	try:
+		await _handle(job)
+	finally:
+		slots.release()
+
+
+async def _handle(job: dict) -> None:
+	jid = int(job["id"])  # type: ignore
+	payload = job.get("payload") or {}
+	att_id = int(payload.get("attachment_id") or 0)
+	try:
+		log.info("dequeued jid=%s kind=%s key=%s", jid, job.get("kind"), job.get("key"))
+	except Exception:
+		pass
+	# Backward compatibility: allow key format message_id:position
+	if not att_id:
+		key = job.get("key") or ""
+		if ":" in key:
+			# Find attachment row by message_id and position
 			try:
-				increment_counter("media_fetch", 1)
+				msg_id_s, pos_s = key.split(":", 1)
+				done = await _fetch_by_message_and_pos(int(msg_id_s), int(pos_s))
+				if done:
+					await asyncio.to_thread(delete_job, jid)
+					return
 			except Exception:
 				pass
-			delete_job(jid)
-		except Exception as e:
-			log.warning("media fail jid=%s att=%s err=%s", jid, att_id, e)
-			increment_attempts(jid)
-			time.sleep(1)
+	try:
+		if not att_id:
+			await asyncio.to_thread(delete_job, jid)
+			return
+		await fetch_and_store(att_id)
+		log.info("media ok jid=%s att=%s", jid, att_id)
+		await asyncio.to_thread(delete_job, jid)
+	except Exception as e:
+		log.warning("media fail jid=%s att=%s err=%s", jid, att_id, e)
+		try:
+			await asyncio.to_thread(increment_attempts, jid)
+		except Exception:
+			pass
+		await asyncio.sleep(1)
 
 
-def _fetch_by_message_and_pos(message_id: int, position: int) -> bool:
+async def _fetch_by_message_and_pos(message_id: int, position: int) -> bool:
 	from sqlalchemy import text
 	from app.db import get_session
-	from app.services.media import fetch_and_store
-	with get_session() as session:
-		row = session.exec(text("SELECT id FROM attachments WHERE message_id=:m AND position=:p"))\
-			.params(m=message_id, p=position).first()
-		if not row:
-			return False
-		att_id = row.id if hasattr(row, "id") else row[0]
-		import asyncio
-		asyncio.run(fetch_and_store(int(att_id)))
-		return True
 
+	def _lookup() -> int:
+		with get_session() as session:
+			row = session.exec(
+				text("SELECT id FROM attachments WHERE message_id=:m AND position=:p").params(m=message_id, p=position)
+			).first()
+			if not row:
+				return 0
+			return int(row.id if hasattr(row, "id") else row[0])
 
-if __name__ == "__main__":
-	main()
+	att_id = await asyncio.to_thread(_lookup)
+	if not att_id:
+		return False
+	await fetch_and_store(att_id)
+	return True
 
 
+if __name__ == "__main__":
+	main()
@@ -11,8 +11,12 @@ from app.db import get_session
 from sqlalchemy import text as _text
 from sqlmodel import select
 
+from app.services.ai import get_ai_client_pool_stats
 from app.services.ai_reply import draft_reply, draft_reply_intro_only, _sanitize_reply_text, _strip_technical_content_for_customer, _select_product_images_for_reply
 from app.services.channel_sender import send_message as send_channel_message
+from app.services.event_bus import publish_message
+from app.services import tracing
+from app.services import query_profile
 from app.services.image_urls import normalize_image_urls_for_send
 from app.services.ai_orders import get_candidate_snapshot, submit_candidate_order, mark_candidate_very_interested
 from app.models import SystemSetting, Product
@@ -593,9 +597,18 @@ def _coerce_state(raw: Any, fallback: Optional[dict[str, Any]] = None) -> dict[s
 
 def main() -> None:
 	log.info("worker_reply starting")
+	# DB child spans for traced replies and per-conversation SQL profiles
+	try:
+		from app.db import engine as _engine
+		tracing.instrument_engine(_engine)
+		query_profile.install(_engine)
+	except Exception as e:
+		log.warning("tracing instrumentation failed: %s", e)
 	loop_count = 0
 	while True:
 		loop_count += 1
+		tracing.set_current(None)
+		query_profile.finish_job()
 		# Pull due states
 		due: list[dict[str, Any]] = []
 		try:
@@ -610,7 +623,8 @@ def main() -> None:
 							ai_images_sent,
 							COALESCE(status,'pending') AS effective_status,
 							status AS raw_status,
-							state_json
+							state_json,
+							trace_ctx
 						FROM ai_shadow_state
 						WHERE (
 								(status = 'pending' OR status IS NULL)
@@ -643,6 +657,9 @@ def main() -> None:
 						"state_json": getattr(r, "state_json", None)
 						if hasattr(r, "state_json")
 						else (r[6] if len(r) > 6 else None),
+						"trace_ctx": getattr(r, "trace_ctx", None)
+						if hasattr(r, "trace_ctx")
+						else (r[7] if len(r) > 7 else None),
 					}
 					due.append(item)
 				
@@ -668,6 +685,7 @@ def main() -> None:
 						total_count = 0
 					try:
 						log.info("worker_reply: scan loop=%d found=%d due items total_in_queue=%d", loop_count, len(due), total_count)
+						log.info("worker_reply: ai client pool %s", get_ai_client_pool_stats())
 					except Exception:
 						pass
 		except Exception as e:
@@ -709,6 +727,10 @@ def main() -> None:
 				cid = None
 			if not cid:
 				continue
+			# continue the trace of the inbound message that triggered this state (if sampled)
+			tracing.set_current(tracing.extract(st.get("trace_ctx")))
+			# one SQL profile per conversation attempt (reported to /admin/slowlog when slow or N+1)
+			query_profile.start_job("ai_reply")
 			# Shadow scope guard: skip/exhaust when scope is off, or when linked_only and convo has no link.
 			if shadow_scope == "off":
 				try:
@@ -820,16 +842,18 @@ def main() -> None:
 					)
 			except Exception:
 				continue
+			tracing.record_wait("reply.debounce_wait")
 			# Generate draft (intro-only mode uses minimal context path when first outbound)
 			try:
 				try:
 					log.info("ai_shadow: generating draft for conversation_id=%s", cid)
 				except Exception:
 					pass
-				if intro_only_mode and is_first_outbound:
-					data = draft_reply_intro_only(int(cid), include_meta=True, state=current_state)
-				else:
-					data = draft_reply(int(cid), limit=40, include_meta=True, state=current_state)
+				with tracing.span("reply.draft", stage=True, conversation_id=int(cid), intro_only=bool(intro_only_mode and is_first_outbound)):
+					if intro_only_mode and is_first_outbound:
+						data = draft_reply_intro_only(int(cid), include_meta=True, state=current_state)
+					else:
+						data = draft_reply(int(cid), limit=40, include_meta=True, state=current_state)
 				function_callbacks = data.get("function_callbacks") or []
 				if function_callbacks:
 					try:
@@ -1351,15 +1375,17 @@ def main() -> None:
 								len(text_to_send or ""),
 								(image_urls_to_send[0][:80] + "..." if image_urls_to_send and len(image_urls_to_send[0]) > 80 else (image_urls_to_send[0] if image_urls_to_send else "")),
 							)
-							result = loop.run_until_complete(
-								send_channel_message(
-									platform=conversation_platform,
-									recipient_id=str(ig_user_id or ""),
-									conversation_id=conversation_id_for_send,
-									text=text_to_send,
-									image_urls=image_urls_to_send if image_urls_to_send else None,
+							with tracing.span("reply.send", stage=True, platform=conversation_platform, images=image_count_attempted):
+								result = loop.run_until_complete(
+									send_channel_message(
+										platform=conversation_platform,
+										recipient_id=str(ig_user_id or ""),
+										conversation_id=conversation_id_for_send,
+										text=text_to_send,
+										image_urls=image_urls_to_send if image_urls_to_send else None,
+									)
 								)
-							)
+							tracing.record_total(conversation_id=int(cid))
 							# Get all message IDs (send_message splits by newlines and sends multiple messages)
 							all_message_ids = result.get("message_ids") or []
 							if result.get("message_id") and result.get("message_id") not in all_message_ids:
@@ -1506,6 +1532,7 @@ def main() -> None:
 											)
 											session.add(msg)
 										session.commit()
+									publish_message(int(cid), direction="out", text=reply_text, timestamp_ms=now_ms, source="ai")
 								except Exception as persist_err:
 									try:
 										log.warning("persist sent messages error cid=%s err=%s", cid, persist_err)
@@ -0,0 +1,93 @@
+import datetime as dt
+
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel
+
+from app.models import Account, AccountBalance, AccountBalanceDaily, Cost, Income
+from app.services import account_ledger
+
+
+D1 = dt.date(2025, 3, 1)
+D2 = dt.date(2025, 3, 2)
+
+
+def _engine():
+	engine = create_engine("sqlite://")
+	SQLModel.metadata.create_all(
+		engine,
+		tables=[t.__table__ for t in (Account, Income, Cost, AccountBalance, AccountBalanceDaily)],
+	)
+	return engine
+
+
+def _capture(monkeypatch):
+	applied = []
+	monkeypatch.setattr(account_ledger, "_apply", lambda conn, deltas: applied.append(dict(deltas)))
+	return applied
+
+
+def test_flush_hook_tracks_create_update_soft_delete(monkeypatch):
+	applied = _capture(monkeypatch)
+	engine = _engine()
+	with Session(engine) as s:
+		inc = Income(account_id=1, amount=100.0, date=D1, source="other")
+		cost = Cost(type_id=1, account_id=1, amount=30.0, date=D1)
+		undated = Cost(type_id=1, account_id=None, amount=5.0)  # not paid from an account
+		s.add_all([inc, cost, undated])
+		s.commit()
+		assert applied.pop() == {(1, D1): [100.0, 30.0]}
+
+		# move the income to another account and day
+		inc.account_id = 2
+		inc.date = D2
+		s.add(inc)
+		s.commit()
+		assert applied.pop() == {(1, D1): [-100.0, 0.0], (2, D2): [100.0, 0.0]}
+
+		# notes-only edit does not touch the ledger
+		inc.notes = "x"
+		s.add(inc)
+		s.commit()
+		assert applied == []
+
+		cost.deleted_at = dt.datetime.utcnow()
+		s.add(cost)
+		s.commit()
+		assert applied.pop() == {(1, D1): [0.0, -30.0]}
+
+		s.delete(inc)
+		s.commit()
+		assert applied.pop() == {(2, D2): [-100.0, 0.0]}
+
+
+def test_aggregates_and_ledger_reads_agree(monkeypatch):
+	_capture(monkeypatch)
+	engine = _engine()
+	with Session(engine) as s:
+		s.add_all(
+			[
+				Account(id=1, name="Banka", type="bank", initial_balance=50.0),
+				Account(id=2, name="Kasa", type="safe", initial_balance=0.0),
+				Income(account_id=1, amount=100.0, date=D1, source="other"),
+				Income(account_id=1, amount=40.0, date=D2, source="other"),
+				Income(account_id=1, amount=999.0, date=D2, source="other", deleted_at=dt.datetime.utcnow()),
+				Cost(type_id=1, account_id=1, amount=30.0, date=D2),
+			]
+		)
+		s.commit()
+		assert account_ledger.aggregate_totals(s, [1, 2]) == {1: (140.0, 30.0), 2: (0.0, 0.0)}
+		daily = account_ledger._aggregate_daily(s, [1, 2])
+		assert daily == {(1, D1): [100.0, 0.0], (1, D2): [40.0, 30.0]}
+
+		s.add_all(
+			[
+				AccountBalance(account_id=1, income_total=140.0, expense_total=30.0),
+				AccountBalanceDaily(account_id=1, day=D1, income=100.0, expense=0.0),
+				AccountBalanceDaily(account_id=1, day=D2, income=40.0, expense=30.0),
+			]
+		)
+		s.commit()
+		# account 2 has no ledger row yet: its balance is just the initial balance
+		assert account_ledger.read_balances(s) == {1: 160.0, 2: 0.0}
+		assert account_ledger.read_net_before(s, 1, D2) == 100.0
+		assert account_ledger.read_net_before(s, 1, D1) == 0.0
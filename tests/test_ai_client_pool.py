@@ -0,0 +1,17 @@
+from app.services import ai
+
+
+def test_ai_clients_share_pooled_openai_client(monkeypatch):
+	monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+	monkeypatch.setattr(ai, "_client_registry", {})
+	first = ai.AIClient(model="gpt-4o-mini")
+	second = ai.AIClient(model="gpt-4.1-mini")
+	assert first._client is second._client
+	stats = ai.get_ai_client_pool_stats()
+	assert stats["registry_size"] == 1
+	assert stats["clients_reused"] >= 1
+
+
+def test_settings_cache_skips_db_within_poll_window(monkeypatch):
+	monkeypatch.setattr(ai, "_settings_cache", {"ai_shadow_model": ("gpt-4.1-mini", ai.time.monotonic(), "0")})
+	assert ai.get_ai_shadow_model_from_settings() == "gpt-4.1-mini"
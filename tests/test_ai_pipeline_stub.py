@@ -50,3 +50,40 @@ def test_draft_reply_two_stage_stub(monkeypatch):
 	assert reply["should_reply"] is True
 	assert reply["state"] == {"cart": []}
 
+
+
+class FusedClient(DummyClient):
+	serializer_calls = 0
+
+	def generate_chat(self, **kwargs: Any) -> str:
+		kwargs["on_delta"]('{"reply_text": "DM ')
+		kwargs["on_delta"]('cevap", "should_reply": true, "confidence": 0.8, "reason": "ok", "state": {"cart": []}}')
+		return '{"reply_text": "DM cevap", "should_reply": true, "confidence": 0.8, "reason": "ok", "state": {"cart": []}}'
+
+	def generate_json(self, **kwargs: Any) -> Dict[str, Any]:
+		FusedClient.serializer_calls += 1
+		return super().generate_json(**kwargs)
+
+
+def test_draft_reply_fused_skips_serializer(monkeypatch):
+	monkeypatch.setenv("AI_REPLY_PIPELINE_MODE", "fused")
+	monkeypatch.setattr(ai_reply, "AIClient", FusedClient)
+	monkeypatch.setattr(
+		ai_reply,
+		"_load_focus_product_and_stock",
+		lambda cid: ({"id": 1, "name": "KAŞE CEKET", "slug_or_sku": "kase-ceket"}, []),
+	)
+	monkeypatch.setattr(ai_reply, "_load_history", lambda cid, limit=40: ([], ""))
+	monkeypatch.setattr(ai_reply, "_select_product_images_for_reply", lambda pid, variant_key=None: [])
+	monkeypatch.setattr(ai_reply, "_load_customer_info", lambda cid: {"username": "test", "name": "Test", "contact_name": None})
+	monkeypatch.setattr(ai_reply, "get_candidate_snapshot", lambda cid: None)
+	monkeypatch.setattr(ai_reply, "get_ai_shadow_model_from_settings", lambda default="gpt-4o-mini": "dummy-model")
+
+	reply = ai_reply.draft_reply(1, limit=5, include_meta=True, state={})
+
+	assert reply["reply_text"] == "DM cevap"
+	assert FusedClient.serializer_calls == 0
+	timings = reply["debug_meta"]["stage_timings"]
+	assert timings["mode"] == "fused"
+	assert timings["serializer"] == {"skipped": True}
+	assert "reply_first_byte_ms" in timings["agent"]
@@ -0,0 +1,35 @@
+import json
+from types import SimpleNamespace as NS
+
+from app.services.ai import JSONFieldStreamExtractor, _collect_stream
+
+
+def _chunk(content=None, tool_calls=None):
+	return NS(choices=[NS(delta=NS(content=content, tool_calls=tool_calls))])
+
+
+def test_collect_stream_reassembles_text_and_tool_calls():
+	seen = []
+	timings = {}
+	stream = [
+		_chunk(tool_calls=[NS(index=0, id="call_1", type="function", function=NS(name="get_cart", arguments='{"a"'))]),
+		_chunk(tool_calls=[NS(index=0, id=None, type=None, function=NS(name=None, arguments=": 1}"))]),
+		_chunk(content="Mer"),
+		_chunk(content="haba"),
+	]
+	resp = _collect_stream(iter(stream), on_delta=seen.append, timings=timings)
+	msg = resp.choices[0].message
+	assert msg.content == "Merhaba"
+	assert seen == ["Mer", "haba"]
+	assert msg.tool_calls[0].function.name == "get_cart"
+	assert json.loads(msg.tool_calls[0].function.arguments) == {"a": 1}
+	assert "ttfb_ms" in timings
+
+
+def test_json_field_extractor_handles_split_escapes():
+	src = json.dumps({"state": {"x": 1}, "reply_text": "Merhaba \"abim\"\nÜrün 899₺"})
+	for step in (1, 2, 5):
+		extractor = JSONFieldStreamExtractor("reply_text")
+		out = "".join(extractor.feed(src[i : i + step]) for i in range(0, len(src), step))
+		assert out == json.loads(src)["reply_text"]
+		assert extractor.done
@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, select
+
+from app.models import SystemSetting
+from app.services import batching
+
+
+def _setup(monkeypatch):
+	engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+	SQLModel.metadata.create_all(engine, tables=[SystemSetting.__table__])
+	with engine.begin() as conn:
+		conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, v INTEGER)"))
+		conn.execute(text("INSERT INTO t (id, v) VALUES " + ", ".join(f"({i}, 0)" for i in range(1, 12))))
+
+	@contextmanager
+	def _get_session():
+		session = Session(engine, expire_on_commit=False)
+		try:
+			yield session
+			session.commit()
+		except Exception:
+			session.rollback()
+			raise
+		finally:
+			session.close()
+
+	monkeypatch.setattr(batching, "get_session", _get_session)
+	monkeypatch.setattr(batching, "engine", engine)
+	return engine
+
+
+def _values(engine):
+	with engine.connect() as conn:
+		return [v for (v,) in conn.execute(text("SELECT v FROM t ORDER BY id"))]
+
+
+def _table():
+	from sqlalchemy import column, table
+
+	return table("t", column("id"), column("v"))
+
+
+def test_keyset_batches_pages_by_key(monkeypatch):
+	_setup(monkeypatch)
+	t = _table()
+	pages = list(batching.keyset_batches(select(t.c.id).where(t.c.id != 5), t.c.id, batch_size=4))
+	assert pages == [[1, 2, 3, 4], [6, 7, 8, 9], [10, 11]]
+	pages = list(batching.keyset_batches(select(t.c.id).where(t.c.id != 5), t.c.id, batch_size=4, descending=True))
+	assert pages == [[11, 10, 9, 8], [7, 6, 4, 3], [2, 1]]
+
+
+def test_run_keyset_commits_per_batch_and_resumes(monkeypatch):
+	engine = _setup(monkeypatch)
+	t = _table()
+	cp = batching.Checkpoint("test")
+	calls = []
+
+	def _handler(session, rows):
+		calls.append(list(rows))
+		session.execute(text("UPDATE t SET v = v + 1 WHERE id IN (%s)" % ",".join(str(i) for i in rows)))
+		if rows[-1] == 8:
+			raise RuntimeError("boom")
+		return len(rows)
+
+	throttle = batching.Throttle(sleep=0)
+	try:
+		batching.run_keyset(select(t.c.id), t.c.id, _handler, batch_size=4, checkpoint=cp, throttle=throttle)
+	except RuntimeError:
+		pass
+	# first batch committed + checkpointed, failing batch rolled back
+	assert _values(engine) == [1, 1, 1, 1] + [0] * 7
+	assert cp.load() == 4
+
+	calls.clear()
+	n = batching.run_keyset(select(t.c.id).where(t.c.id != 8), t.c.id, _handler, batch_size=4, checkpoint=cp, resume=True, throttle=throttle)
+	assert calls == [[5, 6, 7, 9], [10, 11]]
+	assert n == 6
+	assert _values(engine) == [1] * 7 + [0] + [1] * 3
+	# completed scan clears its checkpoint
+	assert cp.load() is None
+
+	batching.run_keyset(select(t.c.id), t.c.id, _handler, batch_size=20, dry_run=True, throttle=throttle)
+	assert _values(engine) == [1] * 7 + [0] + [1] * 3
+
+
+def test_bulk_writer_and_stream_rows(monkeypatch):
+	engine = _setup(monkeypatch)
+	with batching.BulkWriter("UPDATE t SET v = :v WHERE id = :id", chunk=4) as w:
+		for i in range(1, 12):
+			w.add({"v": i * 10, "id": i})
+	assert (w.written, w.flushes) == (11, 3)
+	assert _values(engine) == [i * 10 for i in range(1, 12)]
+
+	parts = list(batching.stream_rows("SELECT id FROM t WHERE id > :n ORDER BY id", {"n": 6}, batch_size=2))
+	assert [[r[0] for r in p] for p in parts] == [[7, 8], [9, 10], [11]]
+
+
+def test_progress_line_and_duty_throttle(monkeypatch):
+	p = batching.Progress("orders", total=200, every=1e9)
+	p.update(50)
+	line = p.line(now=p._t0 + 10.0, extra={"changed": 3})
+	assert line == "orders: 50/200 (25.0%) 5.0/s eta 30s changed=3"
+
+	slept = []
+	monkeypatch.setattr(batching.time, "sleep", slept.append)
+	th = batching.Throttle(sleep=0.0, duty=0.5)
+	th._started -= 2.0  # the batch took 2s
+	th.pause()
+	assert slept and abs(slept[0] - 2.0) < 0.1
+
+
+def test_run_keyset_descending_resumes_below_checkpoint(monkeypatch):
+	engine = _setup(monkeypatch)
+	t = _table()
+	cp = batching.Checkpoint("test_desc")
+	seen = []
+
+	def _handler(session, rows):
+		seen.append(list(rows))
+		# later batches overwrite earlier ones: the lowest id writes last
+		session.execute(text("UPDATE t SET v = %d WHERE id = 1" % rows[-1]))
+		if 5 in rows:
+			raise RuntimeError("boom")
+		return len(rows)
+
+	throttle = batching.Throttle(sleep=0)
+	try:
+		batching.run_keyset(select(t.c.id), t.c.id, _handler, batch_size=3, checkpoint=cp, throttle=throttle, descending=True)
+	except RuntimeError:
+		pass
+	assert seen == [[11, 10, 9], [8, 7, 6], [5, 4, 3]]
+	assert cp.load() == 6
+
+	seen.clear()
+	batching.run_keyset(select(t.c.id).where(t.c.id != 5), t.c.id, _handler, batch_size=3, checkpoint=cp, resume=True, throttle=throttle, descending=True)
+	assert seen == [[4, 3, 2], [1]]
+	assert _values(engine)[0] == 1
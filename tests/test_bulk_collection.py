@@ -0,0 +1,46 @@
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel, select
+
+from app.models import Order, OrderPayment, Payment
+from app.services import finance
+
+
+def _session():
+	engine = create_engine("sqlite://")
+	SQLModel.metadata.create_all(engine, tables=[Order.__table__, Payment.__table__, OrderPayment.__table__])
+	return Session(engine)
+
+
+def test_plan_and_mark_collected_set_based():
+	with _session() as s:
+		s.add_all(
+			[
+				Order(id=1, client_id=1, source="instagram", total_amount=500.0, shipping_fee=50.0),
+				Order(id=2, client_id=1, source="instagram", total_amount=300.0, shipping_fee=None),
+				Order(id=3, client_id=1, source="instagram", total_amount=40.0, shipping_fee=60.0),
+				Order(id=4, client_id=1, source="instagram", total_amount=200.0, shipping_fee=0.0),
+				Payment(client_id=1, order_id=1, amount=0.0, fee_komisyon=10.0, fee_kargo=5.0),
+				Payment(client_id=1, order_id=1, amount=0.0, fee_hizmet=2.5, fee_iade=None),
+				OrderPayment(income_id=9, order_id=4, expected_amount=200.0, collected_amount=200.0),
+			]
+		)
+		s.commit()
+
+		assert finance.expected_payments(s, [1, 2, 3, 99]) == {1: 432.5, 2: 300.0, 3: 0.0}
+		assert finance.calculate_expected_payment(s, 1) == 432.5
+
+		plan = finance.plan_collection(s, [1, 2, 2, 4, 99], {2: 290.0}, amount=730.0)
+		assert [r["order_id"] for r in plan["rows"]] == [1, 2]
+		assert plan["rows"][1]["diff"] == -10.0
+		assert plan["already_collected"] == [4] and plan["missing"] == [99]
+		assert plan["expected_total"] == 732.5 and plan["collected_total"] == 722.5
+		assert plan["unallocated"] == 7.5
+
+		assert finance.mark_orders_collected(s, [1, 2, 4], income_id=10, collected_amounts={2: 290.0}) == 2
+		s.commit()
+		rows = s.exec(select(OrderPayment).where(OrderPayment.income_id == 10).order_by(OrderPayment.order_id)).all()
+		assert [(r.order_id, r.expected_amount, r.collected_amount) for r in rows] == [(1, 432.5, 432.5), (2, 300.0, 290.0)]
+
+		# collected orders drop out of the unpaid list and are not collected twice
+		assert [o.id for o in finance.get_unpaid_orders(s)] == [3]
+		assert finance.mark_orders_collected(s, [1, 2], income_id=11) == 0
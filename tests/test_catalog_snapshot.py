@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+from app.services import ai_ig
+from app.services.catalog_snapshot import Catalog, ItemRecord, ProductRecord
+
+
+def _product(pid, name, slug, price=None):
+	return ProductRecord(
+		SimpleNamespace(
+			id=pid,
+			name=name,
+			slug=slug,
+			default_price=price,
+			default_color=None,
+			ai_system_msg=None,
+			ai_prompt_msg=None,
+			ai_variant_exclusions=None,
+			ai_tags='["Keten"]',
+		)
+	)
+
+
+def _item(iid, pid, sku, price=None):
+	return ItemRecord(SimpleNamespace(id=iid, product_id=pid, sku=sku, name=sku, color="siyah", size="M", price=price))
+
+
+def test_catalog_reindexes_moved_items_and_renamed_products(monkeypatch):
+	cat = Catalog()
+	cat._put_product(_product(1, "Keten Gömlek", "keten-gomlek", 799.0), 1)
+	cat._put_product(_product(2, "Pantolon", "pantolon"), 2)
+	cat._put_item(_item(10, 1, "KG-M"), 10)
+	cat._put_item(_item(11, 2, "P-32", price=450.0), 11)
+
+	assert cat.product(1).ai_tags == ("keten",)
+	assert [i.sku for i in cat.product_items(1)] == ["KG-M"]
+
+	cat._put_item(_item(10, 2, "KG-M"), 10)
+	cat._put_product(_product(1, "Keten Gömlek V2", "keten-gomlek-v2", 799.0), 1)
+	assert cat.product_items(1) == []
+	assert [i.id for i in cat.product_items(2)] == [10, 11]
+	assert cat.find_product("keten-gomlek") is None
+	assert cat.find_product("Keten Gömlek V2").id == 1
+
+	monkeypatch.setattr(ai_ig, "get_catalog", lambda: cat)
+	assert ai_ig.lookup_price("keten-gomlek-v2") == 799.0
+	assert ai_ig.lookup_price("P-32") == 450.0
+
+
+def test_change_keys_published_with_the_version_in_one_script_call(monkeypatch):
+	from app.services import catalog_snapshot
+
+	calls = []
+
+	class _Redis:
+		def register_script(self, source):
+			def _run(keys, args):
+				calls.append((keys, args))
+				return 7
+
+			assert "INCR" in source and "ZADD" in source
+			return _run
+
+		def incr(self, key):
+			raise AssertionError("version must not be bumped outside the script")
+
+	monkeypatch.setattr(catalog_snapshot, "_redis", lambda: _Redis())
+	catalog_snapshot.note_catalog_changed(["p:1", "s:10", "", "p:1"])
+	assert calls == [(["catalog:version", "catalog:changes", "catalog:changes:floor"], [5000, "p:1", "s:10"])]
+	catalog_snapshot._local_changes.clear()
@@ -0,0 +1,169 @@
+from collections import OrderedDict
+
+from app.services import conversation_snapshot as cs
+
+
+def _snap(**kw):
+	base = dict(
+		conversation_id=7,
+		ig_user_id="123",
+		is_mock=False,
+		customer_info={"username": "ali"},
+		has_human_agent_outbound=False,
+		has_ai_sent_outbound=False,
+		history_rows=[{"id": 1, "dir": "in", "text": "merhaba", "timestamp_ms": 1000}],
+		max_message_id=1,
+	)
+	base.update(kw)
+	return cs.ConversationSnapshot(**base)
+
+
+def test_snapshot_applies_inserted_messages_incrementally(monkeypatch):
+	monkeypatch.setattr(cs, "_cache", OrderedDict())
+	monkeypatch.setenv("AI_CONTEXT_SNAPSHOT_RECHECK_MS", "0")
+	builds = []
+
+	def fake_build(cid):
+		builds.append(cid)
+		return _snap()
+
+	def fake_apply(snap):
+		snap.history_rows.append({"id": 2, "dir": "out", "text": "selam", "timestamp_ms": 2000})
+		snap.has_ai_sent_outbound = True
+		snap.max_message_id = 2
+
+	versions = {"conv": ("0", "0"), "user": "0"}
+	monkeypatch.setattr(cs, "_build", fake_build)
+	monkeypatch.setattr(cs, "_apply_new_messages", fake_apply)
+	monkeypatch.setattr(cs, "_read_versions", lambda cid, uid: (versions["conv"], versions["user"]))
+
+	first = cs.get_conversation_snapshot(7)
+	versions["conv"] = ("1", "0")
+	second = cs.get_conversation_snapshot(7)
+	assert builds == [7]
+	assert second is first
+	assert [r["text"] for r in second.history_rows] == ["merhaba", "selam"]
+	assert second.has_ai_sent_outbound is True
+
+	# An edited/deleted message forces a full rebuild
+	versions["conv"] = ("1", "1")
+	cs.get_conversation_snapshot(7)
+	assert builds == [7, 7]
+
+
+class _FakeRedis:
+	def __init__(self):
+		self.data = {}
+
+	def pipeline(self):
+		return _FakePipe(self)
+
+
+class _FakePipe:
+	def __init__(self, r):
+		self.r = r
+		self.ops = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def hincrby(self, key, field, n):
+		self.ops.append(("hincrby", key, field, n))
+
+	def incr(self, key):
+		self.ops.append(("incr", key))
+
+	def expire(self, key, ttl):
+		self.ops.append(("expire", key))
+
+	def hmget(self, key, *fields):
+		self.ops.append(("hmget", key, fields))
+
+	def get(self, key):
+		self.ops.append(("get", key))
+
+	def execute(self):
+		out = []
+		for op in self.ops:
+			if op[0] == "hincrby":
+				h = self.r.data.setdefault(op[1], {})
+				h[op[2]] = h.get(op[2], 0) + op[3]
+				out.append(h[op[2]])
+			elif op[0] == "incr":
+				self.r.data[op[1]] = self.r.data.get(op[1], 0) + 1
+				out.append(self.r.data[op[1]])
+			elif op[0] == "hmget":
+				h = self.r.data.get(op[1]) or {}
+				out.append([h.get(f) for f in op[2]])
+			elif op[0] == "get":
+				out.append(self.r.data.get(op[1]))
+			else:
+				out.append(True)
+		self.ops = []
+		return out
+
+
+def test_raw_insert_message_refreshes_snapshot_after_commit(monkeypatch):
+	from contextlib import contextmanager
+
+	from sqlalchemy import create_engine, event
+	from sqlalchemy.pool import StaticPool
+	from sqlmodel import Session, SQLModel
+
+	from app.models import Conversation, IGUser, Message
+	from app.services import ingest
+
+	engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+	# MySQL spellings used by the raw writer
+	@event.listens_for(engine, "connect")
+	def _fns(dbapi_conn, rec):
+		dbapi_conn.create_function("NOW", 0, lambda: "2026-01-01 00:00:00")
+
+	@event.listens_for(engine, "before_cursor_execute", retval=True)
+	def _ignore(conn, cursor, statement, params, context, executemany):
+		return statement.replace("INSERT IGNORE", "INSERT OR IGNORE"), params
+
+	SQLModel.metadata.create_all(engine, tables=[Message.__table__, Conversation.__table__, IGUser.__table__])
+
+	@contextmanager
+	def _get_session():
+		with Session(engine) as session:
+			yield session
+			session.commit()
+
+	redis = _FakeRedis()
+	monkeypatch.setattr(cs, "_cache", OrderedDict())
+	monkeypatch.setattr(cs, "get_session", _get_session)
+	monkeypatch.setattr(cs, "_redis", lambda: redis)
+	monkeypatch.setenv("AI_CONTEXT_SNAPSHOT_RECHECK_MS", "0")
+	monkeypatch.setattr(ingest, "_get_or_create_conversation_id", lambda session, page, user, platform="instagram": 7)
+	monkeypatch.setattr(ingest, "store_raw", lambda session, mid, raw: None)
+	monkeypatch.setattr(ingest, "_update_conversation_summary_from_message", lambda *a, **kw: None)
+
+	with Session(engine) as session:
+		session.add(Conversation(id=7, igba_id="page", ig_user_id="123"))
+		session.add(Message(id=1, ig_message_id="m1", text="merhaba", timestamp_ms=1000, conversation_id=7, direction="in"))
+		session.commit()
+
+	first = cs.get_conversation_snapshot(7)
+	assert [r["text"] for r in first.history_rows] == ["merhaba"]
+
+	event_obj = {
+		"sender": {"id": "123"},
+		"recipient": {"id": "page"},
+		"timestamp": 2000,
+		"message": {"mid": "m2", "text": "kargo ne zaman"},
+	}
+	with Session(engine) as session:
+		assert ingest._insert_message(session, event_obj, "page") is not None
+		# published on commit, not while the row is still invisible to other sessions
+		assert redis.data == {"ctxsnap:conv:7": {"ins": 1}}
+		session.commit()
+
+	second = cs.get_conversation_snapshot(7)
+	assert [r["text"] for r in second.history_rows] == ["merhaba", "kargo ne zaman"]
+	assert second.max_message_id == 2
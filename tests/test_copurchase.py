@@ -0,0 +1,64 @@
+import datetime as dt
+
+from app.services import ai_reply, copurchase
+
+
+def test_order_weight_halves_per_half_life(monkeypatch):
+	monkeypatch.setenv("UPSELL_COPURCHASE_HALF_LIFE_DAYS", "30")
+	today = dt.date(2026, 1, 31)
+	recent = copurchase.order_weight(today)
+	old = copurchase.order_weight(today - dt.timedelta(days=30))
+	assert abs(old / recent - 0.5) < 1e-9
+	assert abs(copurchase._score_now(recent, today) - 1.0) < 1e-9
+
+
+def test_upsell_falls_back_to_scan_until_matrix_is_built(monkeypatch):
+	calls = []
+	monkeypatch.setattr(ai_reply, "get_copurchase", lambda pid, **kw: None)
+	monkeypatch.setattr(
+		ai_reply,
+		"_scan_upsell_cooccurrence",
+		lambda pid, limit_orders=100, min_cooccurrence=2: calls.append(pid) or {},
+	)
+	assert ai_reply._calculate_upsell_recommendations(5) == {}
+	assert calls == [5]
+
+
+def test_short_half_life_does_not_overflow_and_epoch_rolls(monkeypatch):
+	from contextlib import contextmanager
+
+	from sqlalchemy import create_engine
+	from sqlmodel import Session, SQLModel, select
+
+	from app.models import ProductCopurchase, SystemSetting
+
+	monkeypatch.setenv("UPSELL_COPURCHASE_HALF_LIFE_DAYS", "1")
+	today = dt.date(2026, 10, 18)
+	# ~2480 half-lives past the default epoch: clamped instead of OverflowError
+	assert copurchase.order_weight(today) == 2.0 ** 1000
+	assert copurchase.order_weight(today - dt.timedelta(days=1), epoch=today) == 0.5
+
+	engine = create_engine("sqlite://")
+	SQLModel.metadata.create_all(engine, tables=[ProductCopurchase.__table__, SystemSetting.__table__])
+
+	@contextmanager
+	def _get_session():
+		with Session(engine, expire_on_commit=False) as session:
+			yield session
+			session.commit()
+
+	monkeypatch.setattr(copurchase, "get_session", _get_session)
+	epoch = today - dt.timedelta(days=100)
+	with _get_session() as s:
+		s.add(SystemSetting(key=copurchase.EPOCH_SETTING_KEY, value=epoch.isoformat()))
+		score = copurchase.order_weight(today - dt.timedelta(days=2), epoch) + copurchase.order_weight(today, epoch)
+		s.add(ProductCopurchase(product_id=1, other_product_id=2, order_count=2, weighted_score=score))
+
+	assert copurchase.renormalize_scores(today) is True
+	assert copurchase.renormalize_scores(today) is False
+	with _get_session() as s:
+		assert copurchase._load_epoch(s) == today
+		moved = s.exec(select(ProductCopurchase)).one().weighted_score
+	# same value "as of today" before and after the move
+	assert abs(moved - 1.25) < 1e-9
+	assert abs(copurchase._score_now(moved, today, today) - copurchase._score_now(score, today, epoch)) < 1e-9
@@ -0,0 +1,85 @@
+from PIL import Image
+
+from app.services import derivatives
+
+
+def test_render_downscales_jpeg_and_webp(tmp_path):
+	src = tmp_path / "big.jpg"
+	Image.new("RGB", (3000, 2000), (200, 30, 30)).save(src, format="JPEG", quality=90)
+
+	for fmt in derivatives.FORMATS:
+		dst = tmp_path / f"out_preview.{fmt}"
+		assert derivatives.render(str(src), str(dst), 512, 512, fmt, 80)
+		with Image.open(dst) as im:
+			assert max(im.size) == 512
+			assert im.format == ("WEBP" if fmt == "webp" else "JPEG")
+	assert not derivatives.render(str(tmp_path / "missing.jpg"), str(tmp_path / "x.jpg"), 96, 96, "jpg", 80)
+	assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_format_negotiation_and_cache_key(monkeypatch, tmp_path):
+	monkeypatch.setenv("THUMBS_ROOT", str(tmp_path))
+	assert derivatives.negotiate_format("image/avif,image/webp,*/*") == "webp"
+	assert derivatives.negotiate_format(None) == "jpg"
+	p = derivatives.derivative_path("ab" * 32, "avatar", "webp")
+	assert p == tmp_path / "derived" / "ab" / f"{'ab' * 32}_avatar.webp"
+
+
+def test_schedule_reports_only_successful_renders(monkeypatch, tmp_path):
+	import concurrent.futures
+
+	done = []
+
+	def _submit(src, dst, spec, fmt):
+		fut = concurrent.futures.Future()
+		fut.set_result(dst.name == "ok.jpg")
+		return fut
+
+	monkeypatch.setattr(derivatives, "submit", _submit)
+	derivatives.schedule(tmp_path / "a.jpg", tmp_path / "ok.jpg", on_done=done.append)
+	derivatives.schedule(tmp_path / "b.jpg", tmp_path / "broken.jpg", on_done=done.append)
+	existing = tmp_path / "cached.jpg"
+	existing.write_bytes(b"x")
+	derivatives.schedule(tmp_path / "c.jpg", existing, on_done=done.append)
+	assert done == [tmp_path / "ok.jpg", existing]
+
+
+def test_story_thumb_recorded_only_after_render(monkeypatch, tmp_path):
+	import concurrent.futures
+
+	from app.services import ingest
+
+	monkeypatch.setenv("MEDIA_ROOT", str(tmp_path / "media"))
+	monkeypatch.setenv("THUMBS_ROOT", str(tmp_path / "thumbs"))
+	monkeypatch.setattr(ingest, "_PIL_STORY_AVAILABLE", True)
+	monkeypatch.setattr(ingest, "_download_story_media_bytes", lambda url: (b"jpeg", "image/jpeg"))
+	recorded = []
+	monkeypatch.setattr(ingest, "_record_story_thumb", lambda sid, src, thumb: recorded.append((sid, thumb)))
+	render_ok = {"ok": False}
+
+	def _submit(src, dst, spec, fmt):
+		fut = concurrent.futures.Future()
+		if render_ok["ok"]:
+			dst.parent.mkdir(parents=True, exist_ok=True)
+			dst.write_bytes(b"thumb")
+		fut.set_result(render_ok["ok"])
+		return fut
+
+	monkeypatch.setattr(derivatives, "submit", _submit)
+
+	class _Session:
+		def __init__(self):
+			self.params = []
+
+		def exec(self, stmt):
+			self.params.append(stmt.compile().params)
+
+	session = _Session()
+	res = ingest._ensure_story_media_cached(session, "s1", "https://cdn.example/s1.jpg", None)
+	assert res.thumb_path is None and session.params[0]["thumb"] is None
+	assert recorded == []
+
+	render_ok["ok"] = True
+	res = ingest._ensure_story_media_cached(_Session(), "s2", "https://cdn.example/s2.jpg", None)
+	assert res.thumb_path is None
+	assert len(recorded) == 1 and recorded[0][0] == "s2" and recorded[0][1].exists()
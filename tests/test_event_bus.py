@@ -0,0 +1,72 @@
+import asyncio
+
+from app.services import event_bus
+
+
+class _WS:
+	def __init__(self, block=False):
+		self.sent = []
+		self.closed = None
+		self.block = block
+
+	async def send_json(self, data):
+		if self.block:
+			await asyncio.sleep(3600)
+		self.sent.append(data)
+
+	async def close(self, code=1000):
+		self.closed = code
+
+
+def test_compact_event_drops_unknown_keys_and_trims_text():
+	ev = event_bus.compact_event({"type": "ig_message", "conversation_pk": 5, "text": "x" * 1000, "raw": {"big": 1}})
+	assert set(ev) == {"type", "conversation_pk", "text"}
+	assert len(ev["text"]) == 280
+
+
+def test_fanout_filters_subscriptions_and_drops_slow_clients(monkeypatch):
+	monkeypatch.setenv("WS_SEND_QUEUE_MAX", "2")
+
+	async def scenario():
+		hub = event_bus.InboxHub()
+		monkeypatch.setattr(hub, "_ensure_listener", lambda: None)
+		inbox, thread, slow = _WS(), _WS(), _WS(block=True)
+		await hub.register(inbox)
+		await hub.register(thread, ["7"])
+		slow_client = await hub.register(slow)
+
+		for i in range(4):
+			hub.dispatch({"type": "ig_message", "conversation_pk": 7 if i % 2 else 8, "text": str(i)})
+			if i == 1:
+				await asyncio.sleep(0.01)
+		await asyncio.sleep(0.05)
+
+		assert [e["text"] for e in inbox.sent] == ["0", "1", "2", "3"]
+		assert [e["text"] for e in thread.sent] == ["1", "3"]
+		# the blocked socket overflowed its queue and was dropped without stalling the others
+		assert slow_client not in hub.clients and slow.closed == 1013
+		assert hub.get_stats()["dropped_clients"] == 1
+		for c in list(hub.clients):
+			await hub.unregister(c)
+
+	asyncio.run(scenario())
+
+
+def test_publish_falls_back_to_local_sockets_without_redis(monkeypatch):
+	class _Down:
+		def publish(self, *a, **kw):
+			raise ConnectionError("down")
+
+	monkeypatch.setattr("app.services.monitoring._get_redis", lambda: _Down())
+
+	async def scenario():
+		hub = event_bus.InboxHub()
+		monkeypatch.setattr(hub, "_ensure_listener", lambda: None)
+		monkeypatch.setattr(event_bus, "hub", hub)
+		ws = _WS()
+		await hub.register(ws)
+		assert event_bus.publish_message(3, text="selam", source="ingest") is False
+		await asyncio.sleep(0.01)
+		assert ws.sent == [{"type": "ig_message", "conversation_pk": 3, "text": "selam", "source": "ingest"}]
+
+	asyncio.run(scenario())
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services import graph_client, instagram_api
+
+
+def test_usage_headers_slow_down_then_pause():
+	lim = graph_client.GraphRateLimiter(rate_per_sec=10, burst=5, soft_pct=75, hard_pct=95, pause_seconds=30)
+	lim.update_from_headers({"x-app-usage": json.dumps({"call_count": 10, "total_cputime": 2, "total_time": 4})})
+	assert lim.rate == 10
+
+	buc = {"123": [{"type": "instagram", "call_count": 90, "total_cputime": 5, "total_time": 5, "estimated_time_to_regain_access": 0}]}
+	lim.update_from_headers({"x-business-use-case-usage": json.dumps(buc)})
+	assert lim.usage_pct == 90 and 1 < lim.rate < 10
+	assert lim.reserve() == 0
+
+	buc["123"][0]["estimated_time_to_regain_access"] = 2
+	lim.update_from_headers({"x-business-use-case-usage": json.dumps(buc)})
+	assert lim.reserve() > 100
+	with pytest.raises(graph_client.GraphRateLimited):
+		lim.acquire_sync(max_wait=1)
+
+
+def test_identical_gets_share_one_request(monkeypatch):
+	calls = []
+
+	async def handler(request):
+		calls.append(str(request.url))
+		await asyncio.sleep(0.05)
+		return httpx.Response(200, json={"id": "1", "username": "u"}, headers={"x-app-usage": '{"call_count": 5}'})
+
+	monkeypatch.setattr(graph_client, "limiter", graph_client.GraphRateLimiter(rate_per_sec=100, burst=100))
+	monkeypatch.setattr(instagram_api, "limiter", graph_client.limiter)
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+			return await asyncio.gather(*(
+				instagram_api._get(client, "https://graph.test/1", {"fields": "username", "access_token": "t"}) for _ in range(5)
+			))
+
+	results = asyncio.run(run())
+	assert len(calls) == 1 and all(r["username"] == "u" for r in results)
+	assert graph_client.limiter.usage_pct == 5
+
+
+def test_throttled_response_pauses_limiter(monkeypatch):
+	async def handler(request):
+		return httpx.Response(400, json={"error": {"code": 4, "message": "Application request limit reached"}})
+
+	lim = graph_client.GraphRateLimiter(rate_per_sec=100, burst=100, pause_seconds=120)
+	monkeypatch.setattr(instagram_api, "limiter", lim)
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+			await instagram_api._get(client, "https://graph.test/me", {})
+
+	# first attempt is throttled; the retry would wait 120s, over GRAPH_MAX_WAIT_SEC, so it fails fast
+	with pytest.raises(graph_client.GraphRateLimited):
+		asyncio.run(run())
+	assert lim.throttled == 1
+
+
+def test_batch_lookup_splits_found_and_errors(monkeypatch):
+	seen = []
+
+	def handler(request):
+		form = dict(httpx.QueryParams(request.content.decode()))
+		batch = json.loads(form["batch"])
+		seen.append(len(batch))
+		out = []
+		for item in batch:
+			uid = item["relative_url"].split("/")[1].split("?")[0]
+			if uid == "bad":
+				out.append({"code": 400, "body": json.dumps({"error": {"code": 100, "message": "nope"}})})
+			else:
+				out.append({"code": 200, "body": json.dumps({"id": uid, "username": "user" + uid})})
+		return httpx.Response(200, json=out)
+
+	monkeypatch.setattr(graph_client, "limiter", graph_client.GraphRateLimiter(rate_per_sec=1000, burst=1000))
+
+	async def run():
+		async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+			monkeypatch.setattr(graph_client, "get_graph_client", lambda: client)
+			ids = [str(i) for i in range(60)] + ["bad", "1"]
+			return await graph_client.fetch_users_batch(ids, "tok", "v21.0")
+
+	found, errors = asyncio.run(run())
+	assert seen == [50, 11]
+	assert len(found) == 60 and found["7"]["username"] == "user7"
+	assert list(errors) == ["bad"] and "HTTP 400" in errors["bad"]
+
+
+def test_one_client_per_loop_closed_by_closing():
+	async def grab():
+		return graph_client.get_graph_client()
+
+	async def job():
+		c = graph_client.get_graph_client()
+		assert graph_client.get_graph_client() is c
+		return c
+
+	first = asyncio.run(graph_client.closing(job()))
+	assert first.is_closed and len(graph_client._clients) == 0
+
+	# a loop that ended without closing its client is dropped when the next loop asks
+	leaked = asyncio.run(grab())
+	second = asyncio.run(graph_client.closing(grab()))
+	assert leaked is not second and second.is_closed
+	assert len(graph_client._clients) == 0
@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from app.services import item_stock
+
+
+def test_movement_effect_tracks_order_sales():
+	assert item_stock._movement_effect("in", 5, None) == (5, 0)
+	assert item_stock._movement_effect("out", 2, 7) == (-2, 2)
+	# order return movement reverses the sale
+	assert item_stock._movement_effect("in", 1, 7) == (1, -1)
+
+
+def test_apply_deleted_movements_reverses_in_item_order(monkeypatch):
+	applied = []
+	monkeypatch.setattr(item_stock, "_apply", lambda conn, deltas: applied.append(sorted(deltas.items())))
+	session = SimpleNamespace(connection=lambda: None)
+	item_stock.apply_deleted_movements(
+		session,
+		[
+			SimpleNamespace(item_id=9, direction="out", quantity=2, related_order_id=3),
+			SimpleNamespace(item_id=4, direction="in", quantity=1, related_order_id=None),
+			SimpleNamespace(item_id=9, direction="out", quantity=1, related_order_id=3),
+		],
+	)
+	assert applied == [[(4, [-1, 0, None]), (9, [3, -3, None])]]
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils.lazy import LazyRouterRoute, include_lazy_router
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_app_main_does_not_import_heavy_optional_modules():
+    code = (
+        "import sys, app.main\n"
+        "print('loaded=' + ','.join(m for m in ('openai._client', 'openpyxl.workbook', 'app.routers.ig_ai', 'app.routers.importer') if m in sys.modules))\n"
+    )
+    env = dict(os.environ, LAZY_ROUTERS="1")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=_ROOT, env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip().splitlines()[-1] == "loaded="
+
+
+def test_lazy_router_loads_on_first_request_and_keeps_order(tmp_path, monkeypatch):
+    (tmp_path / "lazy_demo_router.py").write_text(textwrap.dedent(
+        """
+        from fastapi import APIRouter
+        router = APIRouter()
+
+        @router.get("/ping")
+        def ping():
+            return {"ok": True}
+
+        @router.get("/{item}")
+        def item(item: str):
+            return {"item": item}
+        """
+    ))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv("LAZY_ROUTERS", "1")
+    sys.modules.pop("lazy_demo_router", None)
+
+    app = FastAPI()
+    placeholder = include_lazy_router(app, "lazy_demo_router", ["/demo"], prefix="/demo")
+
+    @app.get("/demo/fallback-after")
+    def after():
+        return {"after": True}
+
+    assert isinstance(placeholder, LazyRouterRoute)
+    assert "lazy_demo_router" not in sys.modules
+
+    client = TestClient(app)
+    assert client.get("/demo/ping").json() == {"ok": True}
+    assert "lazy_demo_router" in sys.modules and placeholder.loaded
+    assert placeholder not in app.router.routes
+    # spliced in at the placeholder position: the router's catch-all wins over the later route
+    assert client.get("/demo/fallback-after").json() == {"item": "fallback-after"}
+    assert client.get("/other").status_code == 404
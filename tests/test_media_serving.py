@@ -0,0 +1,44 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.services import media_serving
+
+
+def _app(path):
+	app = FastAPI()
+
+	@app.get("/f")
+	def f(request: Request):
+		return media_serving.serve_file(request, path, "video/mp4", etag=media_serving.file_etag(path, "abc123"))
+
+	return TestClient(app)
+
+
+def test_etag_304_and_byte_ranges(tmp_path):
+	path = tmp_path / "v.mp4"
+	path.write_bytes(bytes(range(256)) * 4)
+	client = _app(path)
+
+	full = client.get("/f")
+	assert full.status_code == 200 and full.headers["etag"] == '"abc123"' and len(full.content) == 1024
+	assert client.get("/f", headers={"If-None-Match": '"abc123"'}).status_code == 304
+
+	part = client.get("/f", headers={"Range": "bytes=10-19"})
+	assert part.status_code == 206
+	assert part.headers["content-range"] == "bytes 10-19/1024"
+	assert part.content == bytes(range(10, 20))
+	assert client.get("/f", headers={"Range": "bytes=-4"}).content == bytes(range(252, 256))
+	assert client.get("/f", headers={"Range": "bytes=5000-"}).status_code == 416
+	# stale If-Range falls back to the full body
+	assert client.get("/f", headers={"Range": "bytes=0-1", "If-Range": '"old"'}).status_code == 200
+
+
+def test_attachment_cache_skips_loader_until_ttl():
+	calls = []
+	cache = media_serving.AttachmentPathCache(max_entries=2, ttl_seconds=60)
+	loader = lambda aid: calls.append(aid) or (f"/m/{aid}", "image/jpeg", "h")
+	for aid in (1, 1, 2, 3, 1):
+		cache.get(aid, loader)
+	# 1 was evicted by 3 (LRU, max 2 entries) and loaded again
+	assert calls == [1, 2, 3, 1]
+	assert cache.get(99, lambda aid: None) is None and cache.stats()["entries"] == 2
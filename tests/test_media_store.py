@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+
+from app.services import media_store
+
+
+def _client(body: bytes) -> httpx.AsyncClient:
+	return httpx.AsyncClient(transport=httpx.MockTransport(lambda req: httpx.Response(200, content=body, headers={"content-type": "image/jpeg"})))
+
+
+def test_download_streams_to_temp_and_hashes(monkeypatch, tmp_path):
+	monkeypatch.setenv("MEDIA_ROOT", str(tmp_path / "media"))
+	monkeypatch.setenv("THUMBS_ROOT", str(tmp_path / "thumbs"))
+	body = b"x" * 200_000
+
+	async def run():
+		async with _client(body) as c:
+			return await media_store.download_to_temp("https://cdn.example/a.jpg", client=c)
+
+	tmp, sha, size, ctype = asyncio.run(run())
+	assert sha == hashlib.sha256(body).hexdigest() and size == len(body) and ctype == "image/jpeg"
+	assert tmp.read_bytes() == body
+	final, thumb = media_store.blob_paths(sha, "image/jpeg; charset=binary")
+	assert final.name == f"{sha}.jpg" and final.parent.name == sha[2:4]
+	assert thumb.name == f"{sha}_thumb.jpg"
+
+
+def test_download_over_limit_leaves_no_temp_file(monkeypatch, tmp_path):
+	monkeypatch.setenv("MEDIA_ROOT", str(tmp_path))
+	monkeypatch.setenv("MEDIA_MAX_BYTES", "1000")
+
+	async def run():
+		async with _client(b"y" * 5000) as c:
+			await media_store.download_to_temp("https://cdn.example/v.mp4", client=c)
+
+	with pytest.raises(media_store.MediaTooLarge):
+		asyncio.run(run())
+	assert list((tmp_path / "blobs" / ".tmp").iterdir()) == []
+
+
+class _BlobDb:
+	"""Just enough of media_blobs for the GC / commit ordering (statements matched by prefix)."""
+
+	def __init__(self, rows):
+		self.rows = rows  # sha -> dict(id, storage_path, thumb_path, size, ref_count, last_ref_at)
+		self.log = []
+
+	def session(self):
+		from contextlib import contextmanager
+
+		db = self
+
+		class _Result:
+			def __init__(self, rows):
+				self._rows = rows
+
+			def all(self):
+				return self._rows
+
+			def first(self):
+				return self._rows[0] if self._rows else None
+
+		class _Session:
+			def exec(self, stmt):
+				sql = " ".join(str(stmt).split())
+				params = stmt.compile().params
+				by_id = {r["id"]: (sha, r) for sha, r in db.rows.items()}
+				if sql.startswith("SELECT id, sha256"):
+					return _Result([(r["id"], sha, r["storage_path"], r["thumb_path"], r["size"]) for sha, r in db.rows.items() if r["ref_count"] == 0])
+				if sql.startswith("SELECT ref_count"):
+					_sha, r = by_id[params["id"]]
+					return _Result([(r["ref_count"], r["last_ref_at"])])
+				if sql.startswith("DELETE"):
+					sha, _r = by_id[params["id"]]
+					db.pending_delete.append(sha)
+					return _Result([])
+				if sql.startswith("SELECT id FROM media_blobs WHERE sha256"):
+					r = db.rows.get(params["sha"])
+					return _Result([(r["id"],)] if r else [])
+				raise AssertionError(sql)
+
+		@contextmanager
+		def _ctx():
+			db.pending_delete = []
+			yield _Session()
+			for sha in db.pending_delete:
+				db.rows.pop(sha)
+				db.log.append(("commit_delete", sha))
+
+		return _ctx()
+
+
+def test_gc_unlinks_only_after_delete_commits_and_skips_recreated_rows(monkeypatch, tmp_path):
+	import datetime as dt
+
+	old = dt.datetime.utcnow() - dt.timedelta(days=3)
+	files = {}
+	for name in ("a", "b"):
+		files[name] = tmp_path / f"{name}.jpg"
+		files[name].write_bytes(b"x")
+	db = _BlobDb({
+		"a": {"id": 1, "storage_path": str(files["a"]), "thumb_path": None, "size": 10, "ref_count": 0, "last_ref_at": old},
+		"b": {"id": 2, "storage_path": str(files["b"]), "thumb_path": None, "size": 20, "ref_count": 0, "last_ref_at": old},
+	})
+	monkeypatch.setattr(media_store, "get_session", db.session)
+
+	real_unlink = media_store.Path.unlink
+
+	def _unlink(self, *a, **kw):
+		# the rows are deleted and committed before any file is touched
+		assert "a" not in db.rows
+		db.log.append(("unlink", self.name))
+		if self.name == "a.jpg":
+			# a download of "b" lands right after the GC commit and re-creates its row
+			db.rows["b"] = {"id": 3, "storage_path": str(files["b"]), "thumb_path": None, "size": 20, "ref_count": 0, "last_ref_at": dt.datetime.utcnow()}
+		return real_unlink(self, *a, **kw)
+
+	monkeypatch.setattr(media_store.Path, "unlink", _unlink)
+	res = media_store.gc_unreferenced_blobs(grace_hours=24)
+
+	assert db.log[:3] == [("commit_delete", "a"), ("commit_delete", "b"), ("unlink", "a.jpg")]
+	assert not files["a"].exists() and files["b"].exists()
+	assert res == {"removed": 1, "bytes_freed": 10}
+
+
+def test_instagram_reset_releases_blob_refs_before_deleting_attachments(monkeypatch):
+	from contextlib import contextmanager
+
+	from app.routers import admin_handlers
+
+	statements = []
+
+	class _Session:
+		def exec(self, stmt):
+			statements.append(" ".join(str(stmt).split()))
+
+			class _Res:
+				rowcount = 0
+
+			return _Res()
+
+	@contextmanager
+	def _get_session():
+		yield _Session()
+
+	def _no_redis():
+		raise RuntimeError("no redis")
+
+	monkeypatch.setattr(admin_handlers, "get_session", _get_session)
+	monkeypatch.setattr(admin_handlers, "_get_redis", _no_redis)
+	admin_handlers.reset_instagram_data()
+
+	release = next(i for i, s in enumerate(statements) if s.startswith("UPDATE media_blobs"))
+	assert "ref_count - a.n" in statements[release]
+	assert release < statements.index("DELETE FROM attachments")
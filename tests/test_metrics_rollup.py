@@ -0,0 +1,97 @@
+import datetime as dt
+
+from app.services import monitoring
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.h = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return _FakePipe(self)
+
+    def _hash(self, key):
+        return self.h.setdefault(key, {})
+
+    def hincrby(self, key, field, n):
+        d = self._hash(key)
+        d[field] = int(d.get(field, 0)) + int(n)
+
+    def hincrbyfloat(self, key, field, n):
+        d = self._hash(key)
+        d[field] = float(d.get(field, 0)) + float(n)
+
+    def expire(self, key, ttl):
+        pass
+
+    def hmget(self, key, fields):
+        d = self.h.get(key, {})
+        return [None if d.get(f) is None else str(d[f]) for f in fields]
+
+    def hgetall(self, key):
+        return {k: str(v) for k, v in self.h.get(key, {}).items()}
+
+
+class _FakePipe:
+    def __init__(self, r):
+        self.r = r
+        self.ops = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        def _queue(*args, **kwargs):
+            self.ops.append((name, args))
+        return _queue
+
+    def execute(self, raise_on_error=True):
+        self.r.round_trips += 1
+        return [getattr(self.r, name)(*args) for name, args in self.ops]
+
+
+def test_window_slots_use_coarsest_level():
+    now = dt.datetime(2024, 5, 10, 14, 37, 20)
+    plan = monitoring._window_slots(24 * 60, now=now)
+    # leading minutes of 13:38.., whole hours of yesterday and today, current hour minutes
+    assert len(plan) == 4
+    levels = {(lv, c): len(slots) for lv, c, slots in plan}
+    assert levels[("m", "2024050914")] == 22
+    assert levels[("h", "20240509")] == 9
+    assert levels[("h", "20240510")] == 14
+    assert levels[("m", "2024051014")] == 38
+    assert sum(levels.values()) == 22 + 9 + 14 + 38
+
+    plan = monitoring._window_slots(30 * 24 * 60, now=now)
+    assert any(lv == "d" for lv, _c, _s in plan)
+    assert len(plan) <= 6
+
+
+def test_counters_and_histograms_roundtrip(monkeypatch):
+    r = _FakeRedis()
+    monkeypatch.setattr(monitoring, "_get_redis", lambda: r)
+    monitoring.increment_counter("messages", 3)
+    monitoring.increment_counter("messages", 2)
+    for v in (4, 40, 40, 400, 4000):
+        monitoring.observe("http_request_ms", v)
+
+    r.round_trips = 0
+    assert monitoring.sum_counters_many(["messages", "media_fetch"], 24 * 60) == {"messages": 5, "media_fetch": 0}
+    assert r.round_trips == 1
+    assert monitoring.sum_counters("messages", 30 * 24 * 60) == 5
+
+    summary = monitoring.histogram_summary_many(["http_request_ms"], 60)["http_request_ms"]
+    assert summary["count"] == 5
+    assert summary["avg_ms"] == 896.8
+    assert 25 < summary["p50_ms"] <= 50
+    assert summary["p99_ms"] > 2500
+
+    text = monitoring.render_prometheus()
+    assert "hm_messages_total 5" in text
+    assert 'hm_http_request_ms_bucket{le="50"} 3' in text
+    assert 'hm_http_request_ms_bucket{le="+Inf"} 5' in text
+    assert "hm_http_request_ms_count 5" in text
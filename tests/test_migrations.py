@@ -0,0 +1,28 @@
+from app import migrations
+
+
+def test_steps_are_ordered_and_unique():
+	versions = [v for v, _name, _step in migrations.MIGRATIONS]
+	assert versions == sorted(set(versions)) and versions[0] == 1
+	assert migrations.LATEST_VERSION == versions[-1]
+	assert [v for v, _n, _s in migrations.pending(1)] == versions[1:]
+	assert migrations.pending(migrations.LATEST_VERSION) == []
+	assert [v for v, _n, _s in migrations.pending(0, target=1)] == [1]
+
+
+def test_startup_fast_path_does_not_migrate(monkeypatch):
+	calls = []
+	monkeypatch.setattr(migrations, "current_version", lambda conn=None: migrations.LATEST_VERSION)
+	monkeypatch.setattr(migrations, "migrate", lambda *a, **k: calls.append(1) or [])
+	assert migrations.ensure_schema() == migrations.LATEST_VERSION
+	assert calls == []
+
+	# behind + DB_MIGRATE_ON_STARTUP=0: warn only
+	monkeypatch.setattr(migrations, "current_version", lambda conn=None: 0)
+	monkeypatch.setenv("DB_MIGRATE_ON_STARTUP", "0")
+	assert migrations.ensure_schema() == 0
+	assert calls == []
+
+	monkeypatch.setenv("DB_MIGRATE_ON_STARTUP", "1")
+	migrations.ensure_schema()
+	assert calls == [1]
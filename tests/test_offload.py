@@ -0,0 +1,25 @@
+import asyncio
+import time
+
+from app.services import offload
+
+
+def test_hot_async_routes_do_not_open_sessions_on_the_loop():
+	for path in ("app/routers/inbox_handlers.py", "app/routers/instagram.py", "app/routers/whatsapp.py"):
+		assert offload.find_blocking_async_routes(path) == [], path
+
+
+def test_watchdog_reports_blocking_call_with_route():
+	wd = offload.LoopWatchdog(threshold_ms=50, interval_ms=10)
+
+	async def main():
+		wd.start()
+		await asyncio.sleep(0.05)
+		wd.inflight[1] = ("GET", "/inbox", time.monotonic())
+		time.sleep(0.3)  # blocks the loop
+		await asyncio.sleep(0.05)
+		return await offload.run_db(lambda a, b=0: a + b, 2, b=3)
+
+	assert asyncio.run(main()) == 5
+	assert wd.events and wd.events[0]["routes"][0].startswith("GET /inbox")
+	assert "test_watchdog_reports_blocking_call_with_route" in wd.events[0]["stack"]
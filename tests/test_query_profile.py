@@ -0,0 +1,58 @@
+from sqlalchemy import create_engine, text
+
+from app.services import query_profile
+
+
+def test_normalize_statement_folds_literals():
+	a = query_profile.normalize_statement("SELECT * FROM message WHERE id = 12 AND name = 'x''y'")
+	b = query_profile.normalize_statement("SELECT *  FROM message\n\tWHERE id = 9 AND name = 'z'")
+	assert a == "SELECT * FROM message WHERE id = ? AND name = ?"
+	assert a == b
+	assert query_profile.normalize_statement("SELECT id FROM t WHERE id IN (%s, %s, %s)") == "SELECT id FROM t WHERE id IN (...)"
+	assert query_profile.normalize_statement("INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)") == "INSERT INTO t (a, b) VALUES (?, ?), ..."
+	assert query_profile.normalize_statement("SELECT col1 FROM t2 WHERE x = :x_1") == "SELECT col1 FROM t2 WHERE x = ?"
+
+
+def test_profile_counts_and_flags_n_plus_one(monkeypatch):
+	monkeypatch.setenv("QUERY_N1_THRESHOLD", "3")
+	engine = create_engine("sqlite://")
+	query_profile.install(engine)
+	with engine.begin() as conn:
+		conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"))
+		conn.execute(text("INSERT INTO t (id, v) VALUES (1, 'a'), (2, 'b')"))
+
+	# outside a profile nothing is collected
+	assert query_profile.current() is None
+
+	with query_profile.profile("GET /x") as stats:
+		with engine.connect() as conn:
+			conn.execute(text("SELECT * FROM t")).all()
+			for i in range(5):
+				conn.execute(text("SELECT v FROM t WHERE id = :id"), {"id": i}).all()
+	assert stats.count == 6
+	assert stats.db_ms >= 0
+	summary = stats.summary()
+	assert summary["shapes"] == 2
+	assert summary["n_plus_one"] == [{"sql": "SELECT v FROM t WHERE id = ?", "count": 5, "ms": summary["n_plus_one"][0]["ms"]}]
+
+	query_profile.reset_routes()
+	query_profile.record_route("GET /x", stats, 20.0)
+	query_profile.record_route("GET /x", stats, 40.0)
+	row = query_profile.top_routes()[0]
+	assert row["route"] == "GET /x" and row["requests"] == 2
+	assert row["avg_queries"] == 6 and row["n_plus_one"] == 2 and row["avg_wall_ms"] == 30.0
+
+
+def test_start_finish_job_reports(monkeypatch):
+	engine = create_engine("sqlite://")
+	query_profile.install(engine)
+	reported = []
+	monkeypatch.setattr(query_profile, "record_job", lambda kind, stats, wall_ms: reported.append((kind, stats.count)))
+	query_profile.start_job("ingest")
+	with engine.connect() as conn:
+		conn.execute(text("SELECT 1")).all()
+	query_profile.start_job("ingest")  # finishes the previous job
+	query_profile.finish_job()  # nothing executed -> nothing reported
+	query_profile.finish_job()
+	assert reported == [("ingest", 1)]
+	assert query_profile.current() is None
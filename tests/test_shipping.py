@@ -24,3 +24,90 @@ def test_shipping_fee_over_5000():
 	assert compute_shipping_fee(amt) == expected
 
 
+
+
+def _rates_session():
+	from sqlalchemy import create_engine
+	from sqlmodel import Session, SQLModel
+	from app.models import ShippingCompanyRate
+
+	engine = create_engine("sqlite://")
+	SQLModel.metadata.create_all(engine, tables=[ShippingCompanyRate.__table__])
+	return Session(engine)
+
+
+def test_rate_tables_batch_and_invalidation():
+	import json
+	from app.models import ShippingCompanyRate
+	from app.services import shipping
+
+	shipping.invalidate_rate_tables()
+	with _rates_session() as s:
+		s.add(ShippingCompanyRate(
+			company_code="dhl",
+			company_name="DHL",
+			base_fee=100.0,
+			# unsorted on purpose: tiers are matched by threshold, not list order
+			rates_json=json.dumps([{"max": None, "fee_percent": 2}, {"max": 1000, "fee": 20.0}, {"max": 500, "fee": 10.0}]),
+		))
+		s.add(ShippingCompanyRate(company_code="ptt", company_name="PTT", base_fee=70.0, rates_json="not json"))
+		s.commit()
+
+		fees = shipping.compute_shipping_fees(
+			[(500, "dhl", False), (500.01, "dhl", False), (2000, "dhl", False), (0, "dhl", False), (999, "dhl", True),
+			 (600, "ptt", False), (600, "ptt", True), (600, "unknown", True), (600, None, False)],
+			session=s,
+		)
+		assert fees == [110.0, 120.0, 140.0, 100.0, 100.0, 120.46, 70.0, 89.0, 120.46]
+		assert shipping.compute_shipping_fee(2000, company_code="dhl", session=s) == 140.0
+
+		# cached: a pending edit is not seen before commit ...
+		dhl = s.get(ShippingCompanyRate, 1)
+		dhl.base_fee = 50.0
+		s.add(dhl)
+		s.flush()
+		assert shipping.compute_shipping_fee(2000, company_code="dhl", session=s) == 140.0
+		# ... which an ORM edit does on commit
+		s.commit()
+		assert shipping.compute_shipping_fee(2000, company_code="dhl", session=s) == 90.0
+	shipping.invalidate_rate_tables()
+
+
+def test_malformed_tier_falls_back_for_that_company_only():
+	import json
+	from app.models import ShippingCompanyRate
+	from app.services import shipping
+
+	shipping.invalidate_rate_tables()
+	with _rates_session() as s:
+		s.add(ShippingCompanyRate(company_code="bad", company_name="Bad", base_fee=70.0, rates_json=json.dumps([{"max": None, "fee_percent": "1.5"}])))
+		s.add(ShippingCompanyRate(company_code="ok", company_name="OK", base_fee=50.0, rates_json=json.dumps([{"max": None, "fee": 5.0}])))
+		s.commit()
+
+		tables = shipping.get_rate_tables(s)
+		assert tables["bad"].compiled is False and tables["ok"].compiled is True
+		fees = shipping.compute_shipping_fees([(600, "bad", False), (600, "bad", True), (600, "ok", False)], session=s)
+		assert fees == [shipping.DEFAULT_RATES.fee(600), 70.0, 55.0]
+	shipping.invalidate_rate_tables()
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+	from app.models import ShippingCompanyRate
+	from app.services import shipping
+
+	shipping.invalidate_rate_tables()
+	with _rates_session() as s:
+		s.add(ShippingCompanyRate(company_code="dhl", company_name="DHL", base_fee=100.0, rates_json="[]"))
+		s.commit()
+
+		class _Racing:
+			# a rate edit commits (and invalidates) while the tables are being read
+			def exec(self, stmt):
+				shipping.invalidate_rate_tables()
+				return s.exec(stmt)
+
+		assert "dhl" in shipping.get_rate_tables(_Racing())
+		assert shipping._tables is None
+		shipping.get_rate_tables(s)
+		assert shipping._tables is not None
+	shipping.invalidate_rate_tables()
@@ -0,0 +1,71 @@
+import datetime as dt
+from pathlib import Path
+
+from fastapi.templating import Jinja2Templates
+from sqlalchemy.dialects import mysql
+
+from app.models import Message
+from app.routers import thread_handlers as th
+
+
+class _Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+
+class _Session:
+    def __init__(self, rows):
+        self.rows = rows
+        self.stmts = []
+
+    def exec(self, stmt):
+        self.stmts.append(stmt)
+        return _Result(self.rows)
+
+
+def _msg(i, ts):
+    return Message(id=i, conversation_id=7, ig_message_id=f"m{i}", direction="in", text=f"t{i}", timestamp_ms=ts)
+
+
+def test_window_uses_composite_cursor_and_reports_more():
+    rows = [_msg(5, 500), _msg(4, 400), _msg(3, 400)]  # newest first, one extra row
+    session = _Session(rows)
+    msgs, has_more = th._thread_window(session, 7, 2, before_ts=600, before_id=9)
+    assert [m.id for m in msgs] == [4, 5] and has_more
+    sql = str(session.stmts[0].compile(dialect=mysql.dialect()))
+    assert "message.timestamp_ms <" in sql and "message.id <" in sql and "LIMIT" in sql
+    assert th._thread_cursor(msgs, has_more) == {"before_ts": 400, "before_id": 4, "has_more": True}
+
+
+def test_watermark_roundtrip_and_draft_window():
+    assert th._parse_watermark("12.3.1700000000000") == (12, 3, 1700000000000)
+    assert th._parse_watermark("garbage") is None
+    rows = [(1, "merhaba\nfiyat 500", "m", 0.9, "r", dt.datetime(2024, 1, 1), "suggested", None, None, None)]
+    vms = th._draft_virtual_messages(rows)
+    assert [v["text"] for v in vms] == ["merhaba", "fiyat 500"]
+    ts = vms[0]["timestamp_ms"]
+    assert th._drafts_in_window(vms, ts + 1, None) == []
+    assert len(th._drafts_in_window(vms, ts, ts + 1)) == 2
+
+
+def test_fragment_renders_keyed_bubbles():
+    templates = Jinja2Templates(directory=str(Path(__file__).resolve().parents[1] / "templates"))
+    draft = th._draft_virtual_messages([(9, "ok", "m", None, None, None, "sent", None, None, None)])
+    html = templates.get_template("_thread_messages.html").render(
+        messages=[_msg(4, 400)] + draft,
+        conv_platform="instagram",
+        focus_product=None,
+        escalation_map={},
+        usernames={},
+        ads_cache={},
+        ad_products={},
+        att_map={},
+        att_ids_map={},
+        att_sha_map={},
+        template_cards={},
+    )
+    assert 'data-mid="4"' in html and 'data-ts="400"' in html
+    assert 'data-draft="9"' in html
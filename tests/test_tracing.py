@@ -0,0 +1,132 @@
+import json
+
+from app.services import monitoring, tracing
+
+
+class _FakeRedis:
+	def __init__(self):
+		self.lists = {}
+		self.zsets = {}
+		self.observed = []
+
+	def pipeline(self, transaction=True):
+		return _FakePipe(self)
+
+	def rpush(self, key, *values):
+		self.lists.setdefault(key, []).extend(values)
+
+	def ltrim(self, key, start, end):
+		pass
+
+	def expire(self, key, ttl):
+		pass
+
+	def lrange(self, key, start, end):
+		return list(self.lists.get(key, []))
+
+	def zadd(self, key, mapping):
+		self.zsets.setdefault(key, {}).update(mapping)
+
+	def zremrangebyrank(self, key, start, end):
+		pass
+
+	def zrevrange(self, key, start, end, withscores=False):
+		items = sorted(self.zsets.get(key, {}).items(), key=lambda kv: kv[1], reverse=True)
+		return items[start : end + 1]
+
+
+class _FakePipe:
+	def __init__(self, r):
+		self.r = r
+		self.ops = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def __getattr__(self, name):
+		def _queue(*args, **kwargs):
+			self.ops.append((name, args))
+		return _queue
+
+	def execute(self):
+		return [getattr(self.r, name)(*args) for name, args in self.ops]
+
+
+def _setup(monkeypatch):
+	r = _FakeRedis()
+	monkeypatch.setattr(monitoring, "_get_redis", lambda: r)
+	monkeypatch.setattr(monitoring, "safe_observe_many", lambda samples: r.observed.extend(samples))
+	# flushed explicitly below instead of by the background thread
+	monkeypatch.setattr(tracing, "_flusher_started", True)
+	monkeypatch.setattr(tracing, "_pending", [])
+	monkeypatch.setenv("TRACE_SAMPLE_RATE", "1")
+	monkeypatch.delenv("OTEL_EXPORTER_OTLP_ENDPOINT", raising=False)
+	return r
+
+
+def test_context_roundtrip_and_noop_without_trace(monkeypatch):
+	r = _setup(monkeypatch)
+	with tracing.span("ignored"):
+		pass
+	assert r.lists == {}
+
+	root = tracing.start_trace()
+	wire = tracing.inject(root)
+	ctx = tracing.extract(wire)
+	assert ctx.trace_id == root.trace_id and ctx.span_id is None
+	assert ctx.start_ms == root.start_ms and ctx.handoff_ms >= root.start_ms
+	assert tracing.extract("garbage") is None
+
+	monkeypatch.setenv("TRACE_SAMPLE_RATE", "0")
+	assert tracing.start_trace() is None
+
+
+def test_spans_across_hops_and_waterfall(monkeypatch):
+	r = _setup(monkeypatch)
+	root = tracing.start_trace()
+	wire = tracing.inject(root)
+
+	# next process picks the job up
+	with tracing.activate(tracing.extract(wire)):
+		tracing.record_wait("ingest.queue_wait")
+		with tracing.span("ingest.handle", stage=True, raw_event_id=7):
+			with tracing.span("db", statement="SELECT 1"):
+				pass
+			tracing.link_conversation(42)
+			handed = tracing.inject()
+	with tracing.activate(tracing.extract(handed)):
+		tracing.record_total(conversation_id=42)
+	assert tracing.current() is None
+	# nothing is written on the caller's path; one flush writes every buffered span
+	assert tracing.get_trace(root.trace_id) == []
+	assert tracing.flush() == 4
+
+	spans = tracing.get_trace(root.trace_id)
+	names = [s["name"] for s in spans]
+	assert set(names) == {"ingest.queue_wait", "ingest.handle", "db", "pipeline.total"}
+	handle = next(s for s in spans if s["name"] == "ingest.handle")
+	db = next(s for s in spans if s["name"] == "db")
+	assert db["parent_id"] == handle["span_id"]
+	assert handle["attrs"] == {"raw_event_id": 7}
+	assert {n for n, _v in r.observed} == {"stage:ingest.queue_wait", "stage:ingest.handle", "stage:pipeline.total"}
+
+	assert tracing.list_traces(42)[0]["trace_id"] == root.trace_id
+	assert tracing.list_traces()[0]["conversation_id"] == 42
+
+	view = tracing.waterfall(spans)
+	depth = {row["name"]: row["depth"] for row in view["rows"]}
+	assert depth["db"] == depth["ingest.handle"] + 1
+	assert all(0 <= row["offset_pct"] <= 100 for row in view["rows"])
+
+
+def test_otlp_payload_shape():
+	rec = {"trace_id": "a" * 32, "span_id": "b" * 16, "parent_id": "c" * 16, "name": "llm", "start_ms": 1000.0, "dur_ms": 2.5, "attrs": {"model": "m", "calls": 2}}
+	body = tracing.otlp_payload([rec], "hm")
+	span = body["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+	assert span["parentSpanId"] == "c" * 16
+	assert span["startTimeUnixNano"] == "1000000000" and span["endTimeUnixNano"] == "1002500000"
+	assert {"key": "calls", "value": {"intValue": "2"}} in span["attributes"]
+	json.dumps(body)
@@ -0,0 +1,84 @@
+import asyncio
+from contextlib import contextmanager
+
+from app.services import graph_client, user_enrich_batch
+
+
+class _Session:
+	def __init__(self):
+		self.statements = []
+
+	def exec(self, stmt):
+		self.statements.append(stmt)
+		return None
+
+
+def test_batch_dedupes_skips_negative_and_upserts_once(monkeypatch):
+	session = _Session()
+
+	@contextmanager
+	def fake_session():
+		yield session
+
+	fetched = []
+
+	async def fake_fetch(ids, token, version, fields="username,name"):
+		fetched.append(list(ids))
+		return {"1": {"username": "ayse", "name": "Ayse"}}, {"2": "HTTP 400: {}"}
+
+	monkeypatch.setattr(user_enrich_batch, "get_session", fake_session)
+	monkeypatch.setattr(user_enrich_batch, "select_due", lambda ids: list(ids))
+	monkeypatch.setattr(graph_client, "fetch_users_batch", fake_fetch)
+	monkeypatch.setattr("app.services.conversation_snapshot.note_ig_user_changed", lambda uid, session=None: None)
+	monkeypatch.setenv("IG_USER_ID", "page")
+	monkeypatch.setenv("IG_ACCESS_TOKEN", "tok")
+	user_enrich_batch._negative.clear()
+	user_enrich_batch.note_failed(["3"])
+
+	res = asyncio.run(user_enrich_batch.enrich_batch(["1", "2", "1", "3"]))
+
+	assert fetched == [["1", "2"]]
+	assert res == {"fetched": 2, "ok": 1, "error": 1}
+	# one multi-row upsert for both the profile and the error
+	assert len(session.statements) == 1
+	sql = str(session.statements[0])
+	assert "ON DUPLICATE KEY UPDATE" in sql and ":id0" in sql and ":id1" in sql
+	assert user_enrich_batch.recently_failed("2") and not user_enrich_batch.recently_failed("1")
+
+	# the failed id is skipped on the next window
+	asyncio.run(user_enrich_batch.enrich_batch(["2"]))
+	assert fetched == [["1", "2"]]
+
+
+def test_oauth_failure_is_recorded_per_user_not_requeued(monkeypatch):
+	import httpx
+
+	session = _Session()
+
+	@contextmanager
+	def fake_session():
+		yield session
+
+	body = '{"error": {"message": "Error validating access token", "type": "OAuthException", "code": 190}}'
+
+	async def fake_fetch(ids, token, version, fields="username,name"):
+		req = httpx.Request("POST", "https://graph.facebook.com/v18.0/")
+		resp = httpx.Response(400, text=body, request=req)
+		raise httpx.HTTPStatusError("400", request=req, response=resp)
+
+	requeued = []
+	monkeypatch.setattr(user_enrich_batch, "get_session", fake_session)
+	monkeypatch.setattr(user_enrich_batch, "select_due", lambda ids: list(ids))
+	monkeypatch.setattr(user_enrich_batch, "mark_needs_enrichment", lambda ids: requeued.extend(ids))
+	monkeypatch.setattr(graph_client, "fetch_users_batch", fake_fetch)
+	monkeypatch.setenv("IG_USER_ID", "page")
+	monkeypatch.setenv("IG_ACCESS_TOKEN", "tok")
+	user_enrich_batch._negative.clear()
+
+	res = asyncio.run(user_enrich_batch.enrich_batch(["7", "8"]))
+
+	assert res == {"fetched": 2, "ok": 0, "error": 2}
+	assert len(session.statements) == 1 and ":id1" in str(session.statements[0])
+	assert user_enrich_batch.recently_failed("7") and user_enrich_batch.recently_failed("8")
+	assert requeued == []
+	assert not graph_client.is_oauth_error(400, '{"error": {"type": "OAuthException", "code": 4}}')
@@ -0,0 +1,101 @@
+from app.services import queue, webhook_buffer
+
+
+class _FakePipe:
+	def __init__(self, r):
+		self.r = r
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def xack(self, stream, group, *ids):
+		self.r.acked.extend(ids)
+
+	def xdel(self, stream, *ids):
+		pass
+
+	def xadd(self, stream, fields, **kw):
+		self.r.dead.append((stream, fields))
+
+	def execute(self):
+		pass
+
+
+class _FakeRedis:
+	def __init__(self, entries):
+		self.entries = entries
+		self.acked = []
+		self.dead = []
+		self.deliveries = {}
+
+	def xgroup_create(self, *a, **kw):
+		pass
+
+	def xautoclaim(self, *a, **kw):
+		return ["0-0", [], []]
+
+	def xreadgroup(self, group, consumer, streams, count=None, block=None):
+		items, self.entries = self.entries[:count], self.entries[count:]
+		return [(webhook_buffer.STREAM_KEY, items)] if items else []
+
+	def xpending_range(self, stream, group, min, max, count):
+		return [{"message_id": min, "times_delivered": self.deliveries.get(min, 1)}]
+
+	def pipeline(self):
+		return _FakePipe(self)
+
+
+def test_flush_group_commits_and_acks_after_enqueue(monkeypatch):
+	r = _FakeRedis([("1-0", {"body": '{"a":1}'}), ("2-0", {"body": '{"a":1}'}), ("3-0", {"body": '{"b":2}'})])
+	order = []
+	monkeypatch.setattr(webhook_buffer, "_group_ready", False)
+	monkeypatch.setattr(queue, "_get_redis", lambda: r)
+	monkeypatch.setattr(
+		webhook_buffer,
+		"store_raw_events",
+		lambda events: order.append(("store", len(events))) or {"h1": 11, "h2": 12},
+	)
+	monkeypatch.setattr(queue, "enqueue_many", lambda kind, jobs: order.append((kind, [k for k, _ in jobs])) or [])
+
+	assert webhook_buffer.flush_raw_events(max_batch=10, block_ms=1) == 3
+	assert order == [("store", 3), ("ingest", ["11", "12"])]
+	assert r.acked == ["1-0", "2-0", "3-0"]
+	assert webhook_buffer.flush_raw_events(max_batch=10, block_ms=1) == 0
+
+
+def test_flush_isolates_poison_entry_and_dead_letters_it(monkeypatch):
+	entries = [("1-0", {"body": "ok1"}), ("2-0", {"body": "bad"}), ("3-0", {"body": "ok2"})]
+	r = _FakeRedis(list(entries))
+	enqueued = []
+	monkeypatch.setattr(webhook_buffer, "_group_ready", False)
+	monkeypatch.setattr(queue, "_get_redis", lambda: r)
+
+	def _store(events):
+		if any(e["body"] == "bad" for e in events):
+			raise ValueError("Incorrect string value")
+		return {e["body"]: int(e["body"][-1]) for e in events}
+
+	monkeypatch.setattr(webhook_buffer, "store_raw_events", _store)
+	monkeypatch.setattr(queue, "enqueue_many", lambda kind, jobs: enqueued.extend(k for k, _ in jobs) or [])
+
+	# the good entries go through, the bad one stays pending for a retry
+	assert webhook_buffer.flush_raw_events(max_batch=10, block_ms=1) == 2
+	assert r.acked == ["1-0", "3-0"] and enqueued == ["1", "2"] and r.dead == []
+
+	# once its delivery count reaches the cap it is moved to the dead-letter stream and acked
+	r.entries = [entries[1]]
+	r.deliveries["2-0"] = 5
+	assert webhook_buffer.flush_raw_events(max_batch=10, block_ms=1) == 1
+	assert r.acked[-1] == "2-0"
+	assert r.dead[0][0] == webhook_buffer.DEAD_STREAM_KEY and r.dead[0][1]["src_id"] == "2-0"
+
+	# a failure of every entry below the cap (database down) is raised so the flusher backs off
+	r.entries = [("4-0", {"body": "bad"})]
+	try:
+		webhook_buffer.flush_raw_events(max_batch=10, block_ms=1)
+		raise AssertionError("expected the insert error")
+	except ValueError:
+		pass